@@ -1,7 +1,5 @@
-import threading
 import os
 import json
-import requests
 import pyotp
 import bcrypt
 import uuid
@@ -13,174 +11,117 @@ from django.utils import timezone
 from django.conf import settings
 from ..models import Admins, AdminInvitation, AuditLogs, EmailLog
 from ..serializers import AdminSerializer
+from ..utils.jobs import enqueue
 from ..utils.security import log_action, get_client_ip
+from ..utils.sms import send_brevo_email
 
-def send_verification_email_async(full_name, email, verification_code):
-    try:
-        sender_name = os.getenv("SENDER_NAME", "Azariah Credit Ltd")
-        from_email = os.getenv("FROM_EMAIL")
-        brevo_api_key = os.getenv("BREVO_API_KEY")
 
-        if not brevo_api_key or not from_email:
-            print(
-                f"[ERROR] Email setup missing: BREVO_API_KEY={bool(brevo_api_key)}, FROM_EMAIL={bool(from_email)}"
-            )
-            return
-
-        url = "https://api.brevo.com/v3/smtp/email"
-        headers = {
-            "accept": "application/json",
-            "api-key": brevo_api_key,
-            "content-type": "application/json",
-        }
-
-        payload = {
-            "sender": {"name": sender_name, "email": from_email},
-            "to": [{"email": email}],
-            "subject": f"Your Email Verification Code - {sender_name}",
-            "htmlContent": f"""
-                <html>
-                <body style="font-family: Arial, sans-serif;">
-                <h2>Email Verification</h2>
-                <p>Hello {full_name},</p>
-                <p>Welcome to {sender_name}!</p>
-                <p>Your verification code is:</p>
-                <h1 style="background-color: #f0f0f0; padding: 10px; text-align: center; letter-spacing: 5px;">{verification_code}</h1>
-                <p>This code will expire in 15 minutes.</p>
-                <p>If you didn't register for this account, please ignore this email.</p>
-                <p>Best regards,<br/>{sender_name} Team</p>
-                </body>
-                </html>
-            """,
-        }
-
-        requests.post(url, json=payload, headers=headers)
-
-    except Exception:
-        pass
-
-def send_password_reset_email_async(full_name, email, reset_code):
-    try:
-        sender_name = os.getenv("SENDER_NAME", "Azariah Credit Ltd")
-        from_email = os.getenv("FROM_EMAIL")
-        brevo_api_key = os.getenv("BREVO_API_KEY")
-
-        if not brevo_api_key or not from_email:
-            print(
-                f"[ERROR] Email setup missing for Password Reset: BREVO_API_KEY={bool(brevo_api_key)}, FROM_EMAIL={bool(from_email)}"
-            )
-            return
-
-        url = "https://api.brevo.com/v3/smtp/email"
-        headers = {
-            "accept": "application/json",
-            "api-key": brevo_api_key,
-            "content-type": "application/json",
-        }
-
-        payload = {
-            "sender": {"name": sender_name, "email": from_email},
-            "to": [{"email": email}],
-            "subject": f"Password Reset Code - {sender_name}",
-            "htmlContent": f"""
-                <html>
-                <body style="font-family: Arial, sans-serif;">
-                <h2>Password Reset</h2>
-                <p>Hello {full_name},</p>
-                <p>You requested to reset your password for <strong>{sender_name}</strong>.</p>
-                <p>Your 6-digit reset code is:</p>
-                <h1 style="background-color: #f8f8f8; padding: 15px; text-align: center; letter-spacing: 5px; border: 1px solid #ddd;">{reset_code}</h1>
-                <p>This code will expire in 15 minutes.</p>
-                <p>If you didn't request this, please ignore this email and ensure your account is secure.</p>
-                <p>Best regards,<br/>{sender_name} Team</p>
-                </body>
-                </html>
-            """,
-        }
-        try:
-            res = requests.post(url, json=payload, headers=headers)
-            from ..models import EmailLog
-            EmailLog.objects.create(
-                recipient_email=email,
-                subject=payload["subject"],
-                message=payload["htmlContent"],
-                status="SENT" if res.status_code in [200, 201, 202] else "FAILED",
-                error_details=res.text if res.status_code not in [200, 201, 202] else None
-            )
-        except Exception as e:
-            from ..models import EmailLog
-            EmailLog.objects.create(
-                recipient_email=email,
-                subject=payload["subject"],
-                message=payload["htmlContent"],
-                status="FAILED",
-                error_details=str(e)
-            )
-    except Exception:
-        pass
-
-def send_new_device_login_alert_async(full_name, email, context):
-    try:
-        sender_name = os.getenv("SENDER_NAME", "Azariah Credit Ltd")
-        from_email = os.getenv("FROM_EMAIL")
-        brevo_api_key = os.getenv("BREVO_API_KEY")
-
-        if not brevo_api_key or not from_email:
-            return
-
-        login_time = context.get('login_time', timezone.now().strftime('%Y-%m-%d %H:%M:%S'))
-        ip_address = context.get('ip_address', 'Unknown')
-        user_agent = context.get('user_agent', 'Unknown')
-
-        url = "https://api.brevo.com/v3/smtp/email"
-        headers = {
-            "accept": "application/json",
-            "api-key": brevo_api_key,
-            "content-type": "application/json",
-        }
-
-        payload = {
-            "sender": {"name": sender_name, "email": from_email},
-            "to": [{"email": email}],
-            "subject": f"New login detected — {sender_name}",
-            "htmlContent": f"""
-                <html>
-                <body style="font-family: Arial, sans-serif;">
-                <h2>New Login Detected</h2>
-                <p>Hello {full_name},</p>
-                <p>A new login was detected for your account on <strong>{sender_name}</strong>.</p>
-                <ul>
-                    <li><strong>Time:</strong> {login_time}</li>
-                    <li><strong>IP Address:</strong> {ip_address}</li>
-                    <li><strong>User Agent:</strong> {user_agent}</li>
-                </ul>
-                <p>If this was not you, please reset your password immediately or contact your administrator.</p>
-                <p>Best regards,<br/>{sender_name} Team</p>
-                </body>
-                </html>
-            """,
-        }
-        try:
-            res = requests.post(url, json=payload, headers=headers)
-            from ..models import EmailLog
-            EmailLog.objects.create(
-                recipient_email=email,
-                subject=payload["subject"],
-                message=payload["htmlContent"],
-                status="SENT" if res.status_code in [200, 201, 202] else "FAILED",
-                error_details=res.text if res.status_code not in [200, 201, 202] else None
-            )
-        except Exception as e:
-            from ..models import EmailLog
-            EmailLog.objects.create(
-                recipient_email=email,
-                subject=payload["subject"],
-                message=payload["htmlContent"],
-                status="FAILED",
-                error_details=str(e)
-            )
-    except Exception as e:
-        print(f"Error sending login alert: {e}")
+def _brevo_sender():
+    """(sender name, from address), or None when Brevo is not configured."""
+    sender_name = os.getenv("SENDER_NAME", "Azariah Credit Ltd")
+    from_email = os.getenv("FROM_EMAIL")
+    if not os.getenv("BREVO_API_KEY") or not from_email:
+        return None
+    return sender_name, from_email
+
+
+def send_verification_email(full_name, email, verification_code):
+    """Background job "email.verification"."""
+    sender = _brevo_sender()
+    if sender is None:
+        print(
+            f"[ERROR] Email setup missing: BREVO_API_KEY={bool(os.getenv('BREVO_API_KEY'))}, FROM_EMAIL={bool(os.getenv('FROM_EMAIL'))}"
+        )
+        return
+    sender_name, from_email = sender
+
+    payload = {
+        "sender": {"name": sender_name, "email": from_email},
+        "to": [{"email": email}],
+        "subject": f"Your Email Verification Code - {sender_name}",
+        "htmlContent": f"""
+            <html>
+            <body style="font-family: Arial, sans-serif;">
+            <h2>Email Verification</h2>
+            <p>Hello {full_name},</p>
+            <p>Welcome to {sender_name}!</p>
+            <p>Your verification code is:</p>
+            <h1 style="background-color: #f0f0f0; padding: 10px; text-align: center; letter-spacing: 5px;">{verification_code}</h1>
+            <p>This code will expire in 15 minutes.</p>
+            <p>If you didn't register for this account, please ignore this email.</p>
+            <p>Best regards,<br/>{sender_name} Team</p>
+            </body>
+            </html>
+        """,
+    }
+    send_brevo_email(payload, log=False)
+
+
+def send_password_reset_email(full_name, email, reset_code):
+    """Background job "email.password_reset"."""
+    sender = _brevo_sender()
+    if sender is None:
+        print(
+            f"[ERROR] Email setup missing for Password Reset: BREVO_API_KEY={bool(os.getenv('BREVO_API_KEY'))}, FROM_EMAIL={bool(os.getenv('FROM_EMAIL'))}"
+        )
+        return
+    sender_name, from_email = sender
+
+    payload = {
+        "sender": {"name": sender_name, "email": from_email},
+        "to": [{"email": email}],
+        "subject": f"Password Reset Code - {sender_name}",
+        "htmlContent": f"""
+            <html>
+            <body style="font-family: Arial, sans-serif;">
+            <h2>Password Reset</h2>
+            <p>Hello {full_name},</p>
+            <p>You requested to reset your password for <strong>{sender_name}</strong>.</p>
+            <p>Your 6-digit reset code is:</p>
+            <h1 style="background-color: #f8f8f8; padding: 15px; text-align: center; letter-spacing: 5px; border: 1px solid #ddd;">{reset_code}</h1>
+            <p>This code will expire in 15 minutes.</p>
+            <p>If you didn't request this, please ignore this email and ensure your account is secure.</p>
+            <p>Best regards,<br/>{sender_name} Team</p>
+            </body>
+            </html>
+        """,
+    }
+    send_brevo_email(payload)
+
+
+def send_new_device_login_alert(full_name, email, context):
+    """Background job "email.new_device_login"."""
+    sender = _brevo_sender()
+    if sender is None:
+        return
+    sender_name, from_email = sender
+
+    login_time = context.get('login_time', timezone.now().strftime('%Y-%m-%d %H:%M:%S'))
+    ip_address = context.get('ip_address', 'Unknown')
+    user_agent = context.get('user_agent', 'Unknown')
+
+    payload = {
+        "sender": {"name": sender_name, "email": from_email},
+        "to": [{"email": email}],
+        "subject": f"New login detected — {sender_name}",
+        "htmlContent": f"""
+            <html>
+            <body style="font-family: Arial, sans-serif;">
+            <h2>New Login Detected</h2>
+            <p>Hello {full_name},</p>
+            <p>A new login was detected for your account on <strong>{sender_name}</strong>.</p>
+            <ul>
+                <li><strong>Time:</strong> {login_time}</li>
+                <li><strong>IP Address:</strong> {ip_address}</li>
+                <li><strong>User Agent:</strong> {user_agent}</li>
+            </ul>
+            <p>If this was not you, please reset your password immediately or contact your administrator.</p>
+            <p>Best regards,<br/>{sender_name} Team</p>
+            </body>
+            </html>
+        """,
+    }
+    send_brevo_email(payload)
 
 class LoginView(views.APIView):
     permission_classes = [permissions.AllowAny]
@@ -254,14 +195,15 @@ class LoginView(views.APIView):
                 password.encode("utf-8"), admin.password_hash.encode("utf-8")
             ):
                 if admin.last_login_ip and admin.last_login_ip != client_ip:
-                    threading.Thread(
-                        target=send_new_device_login_alert_async,
-                        args=(admin.full_name, admin.email, {
+                    enqueue("email.new_device_login", {
+                        "full_name": admin.full_name,
+                        "email": admin.email,
+                        "context": {
                             "login_time": timezone.now().strftime('%Y-%m-%d %H:%M:%S'),
                             "ip_address": client_ip,
                             "user_agent": request.META.get('HTTP_USER_AGENT', 'Unknown')
-                        }),
-                    ).start()
+                        },
+                    })
                     
                     log_action(
                         admin,
@@ -573,12 +515,9 @@ class RegisterAdminView(views.APIView):
             from ..services import notify_staff_joined
             notify_staff_joined(admin)
 
-        email_thread = threading.Thread(
-            target=send_verification_email_async,
-            args=(full_name, email.lower(), verification_code),
-        )
-        email_thread.daemon = True
-        email_thread.start()
+        enqueue("email.verification", {
+            "full_name": full_name, "email": email.lower(), "verification_code": verification_code,
+        })
 
         return Response(
             {
@@ -654,10 +593,9 @@ class RequestPasswordResetView(views.APIView):
                 ip_address=get_client_ip(request),
             )
 
-            threading.Thread(
-                target=send_password_reset_email_async,
-                args=(admin.full_name, admin.email, reset_code),
-            ).start()
+            enqueue("email.password_reset", {
+                "full_name": admin.full_name, "email": admin.email, "reset_code": reset_code,
+            })
 
             return Response({"message": "Reset code sent to your email. Check your inbox."})
         except Admins.DoesNotExist:
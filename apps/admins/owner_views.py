@@ -7,7 +7,9 @@ from django.conf import settings
 from django.db import models
 from ..models import Admins, AuditLogs, SystemSettings
 from ..serializers import AdminSerializer, AuditLogSerializer
+from ..utils.audit import record_audit
 from ..utils.security import log_action, get_client_ip
+from ..utils.partitions import retention_floor
 
 class OwnerExistsView(views.APIView):
     permission_classes = [permissions.AllowAny]
@@ -48,7 +50,7 @@ class ClaimOwnershipView(views.APIView):
         )
 
         client_ip = get_client_ip(request)
-        AuditLogs.objects.create(
+        record_audit(
             admin=owner,
             action=f"System ownership claimed from IP {client_ip}",
             log_type="SECURITY",
@@ -117,7 +119,7 @@ class GodModeToggleView(views.APIView):
         target.save()
 
         # Log using ONLY email — never name or role
-        AuditLogs.objects.create(
+        record_audit(
             admin=None,  # Never link to owner account
             action=f"God Mode {'granted to' if enabled else 'revoked from'} {target.email}",
             log_type="SECURITY",
@@ -181,7 +183,8 @@ class OwnerNotificationsView(views.APIView):
             last_read = timezone.make_aware(last_read)
         except:
             last_read = time_threshold
-        unread_count = AuditLogs.objects.filter(is_owner_log=True, created_at__gt=last_read).count()
+        # Older rows have been retired; the floor keeps the count to the live partitions
+        unread_count = AuditLogs.objects.filter(is_owner_log=True, created_at__gt=max(last_read, retention_floor())).count()
         serializer = AuditLogSerializer(logs, many=True)
         return Response({"notifications": serializer.data, "unread_count": unread_count})
 
@@ -265,7 +268,7 @@ class OwnershipGrantView(views.APIView):
                     }
                     requests.post("https://api.brevo.com/v3/smtp/email", json=payload, headers={"api-key": brevo_api_key, "content-type": "application/json"})
                 except: pass
-        AuditLogs.objects.create(
+        record_audit(
             admin=request.user, action=f"Ownership granted to {target.full_name} ({target.email}) by {request.user.full_name}",
             log_type="SECURITY", table_name="admins", record_id=target.id, is_owner_log=True, ip_address=ip,
             old_data={"is_owner": False}, new_data={"is_owner": True, "granted_by": str(request.user.id)}
@@ -313,7 +316,7 @@ class OwnershipRelinquishView(views.APIView):
                     "htmlContent": f"<html><body><p>You have successfully relinquished your ownership status.</p></body></html>"
                 }, headers={"api-key": brevo_api_key, "content-type": "application/json"})
             except: pass
-        AuditLogs.objects.create(admin=admin, action=f"Ownership relinquished by {admin.full_name}", log_type="SECURITY", table_name="admins", record_id=admin.id, is_owner_log=True, ip_address=ip, old_data={"is_owner": True}, new_data={"is_owner": False})
+        record_audit(admin=admin, action=f"Ownership relinquished by {admin.full_name}", log_type="SECURITY", table_name="admins", record_id=admin.id, is_owner_log=True, ip_address=ip, old_data={"is_owner": True}, new_data={"is_owner": False})
         return Response({"message": "Ownership successfully relinquished."})
 
 class OwnershipHandoverView(views.APIView):
@@ -361,8 +364,8 @@ class OwnershipHandoverView(views.APIView):
         old_owner.ownership_relinquished_at = timezone.now()
         old_owner.save()
         ip = get_client_ip(request)
-        AuditLogs.objects.create(admin=old_owner, action=f"Ownership granted to {target.full_name} via handover", log_type="SECURITY", table_name="admins", record_id=target.id, is_owner_log=True, ip_address=ip)
-        AuditLogs.objects.create(admin=old_owner, action=f"Ownership relinquished by {old_owner.full_name} via handover", log_type="SECURITY", table_name="admins", record_id=old_owner.id, is_owner_log=True, ip_address=ip)
+        record_audit(admin=old_owner, action=f"Ownership granted to {target.full_name} via handover", log_type="SECURITY", table_name="admins", record_id=target.id, is_owner_log=True, ip_address=ip)
+        record_audit(admin=old_owner, action=f"Ownership relinquished by {old_owner.full_name} via handover", log_type="SECURITY", table_name="admins", record_id=old_owner.id, is_owner_log=True, ip_address=ip)
         all_owners = Admins.objects.filter(is_owner=True)
         subject = "Full ownership handover completed"
         message = f"Full ownership handover completed. {old_owner.full_name} has transferred ownership to {target.full_name}.\n\nDate: {timezone.now().strftime('%Y-%m-%d %H:%M:%S')}"
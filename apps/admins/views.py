@@ -16,6 +16,7 @@ from ..serializers import (
     BranchSerializer,
     DeactivationRequestSerializer
 )
+from ..utils.audit import record_audit
 from ..utils.security import log_action, get_client_ip
 from ..permissions import IsAdminUser, IsSuperAdmin
 
@@ -111,7 +112,7 @@ class AdminSuspendView(views.APIView):
             target.suspended_by = user
             target.suspension_reason = reason
             target.save()
-            AuditLogs.objects.create(
+            record_audit(
                 admin=user, action=f"Suspended admin {target.full_name}. Reason: {reason}",
                 log_type="SECURITY", table_name="admins", record_id=target.id,
                 is_owner_log=user.is_owner or user.is_super_admin, ip_address=get_client_ip(request)
@@ -140,7 +141,7 @@ class AdminUnsuspendView(views.APIView):
             target.suspended_by = None
             target.suspension_reason = None
             target.save()
-            AuditLogs.objects.create(
+            record_audit(
                 admin=user, action=f"Unsuspended admin {target.full_name}",
                 log_type="SECURITY", table_name="admins", record_id=target.id,
                 is_owner_log=user.is_owner or user.is_super_admin, ip_address=get_client_ip(request)
@@ -173,7 +174,7 @@ class AdminRevokeView(views.APIView):
             old_role = target.role
             target.role = new_role
             target.save()
-            AuditLogs.objects.create(
+            record_audit(
                 admin=user, action=f"Revoked roles for {target.full_name}. Downgraded from {old_role} to {new_role}. Reason: {reason}",
                 log_type="SECURITY", table_name="admins", record_id=target.id,
                 is_owner_log=user.is_owner or user.is_super_admin, ip_address=get_client_ip(request)
@@ -240,7 +241,7 @@ class DeactivationRequestListCreateView(generics.ListCreateAPIView):
         req_obj = serializer.save(requested_by=user, status="PENDING")
         from ..services import notify_deactivation_request
         notify_deactivation_request(req_obj)
-        AuditLogs.objects.create(
+        record_audit(
             admin=user, action=f"Requested deactivation for officer {serializer.validated_data['officer'].full_name}",
             log_type="MANAGEMENT", table_name="deactivation_requests", record_id=None
         )
@@ -260,9 +261,9 @@ class DeactivationRequestDetailView(generics.RetrieveUpdateAPIView):
             officer = instance.officer
             officer.is_blocked = True
             officer.save()
-            AuditLogs.objects.create(admin=user, action=f"Approved deactivation for officer {officer.full_name}", log_type="MANAGEMENT", table_name="admins", record_id=officer.id)
+            record_audit(admin=user, action=f"Approved deactivation for officer {officer.full_name}", log_type="MANAGEMENT", table_name="admins", record_id=officer.id)
         elif instance.status == "REJECTED":
-            AuditLogs.objects.create(admin=user, action=f"Rejected deactivation for officer {instance.officer.full_name}", log_type="MANAGEMENT", table_name="admins", record_id=instance.officer.id)
+            record_audit(admin=user, action=f"Rejected deactivation for officer {instance.officer.full_name}", log_type="MANAGEMENT", table_name="admins", record_id=instance.officer.id)
 
 class AdminInviteView(views.APIView):
     permission_classes = [permissions.IsAuthenticated]
@@ -305,7 +306,10 @@ class AdminInviteView(views.APIView):
                 branch_fk = Branch.objects.get(id=branch_id)
             except: return Response({"error": "Invalid branch ID."}, status=400)
 
-        import secrets, threading
+        if not os.getenv("BREVO_API_KEY") or not os.getenv("FROM_EMAIL"):
+            return Response({"error": "Email service not configured."}, status=500)
+
+        import secrets
         from django.utils import timezone
         from datetime import timedelta
         from ..models import AdminInvitation, Admins
@@ -325,17 +329,16 @@ class AdminInviteView(views.APIView):
                 "branch_fk": branch_fk, "expires_at": timezone.now() + timedelta(minutes=30), "is_used": False
             })
 
-            from ..utils.sms import send_invite_email_sync
-            success, err = send_invite_email_sync(email_addr, token, role, inviter.full_name, inviter)
-            
-            if success:
-                sent_emails.append(email_addr)
-            else:
-                errors.append(f"Failed to send email to {email_addr}: {err}")
-        
+            from ..utils.jobs import enqueue
+            enqueue("email.invite", {
+                "email": email_addr, "token": token, "role": role,
+                "invited_by_name": inviter.full_name, "sender_id": str(inviter.id),
+            })
+            sent_emails.append(email_addr)
+
         status_code = 200 if sent_emails else 400
         return Response({
-            "message": f"Sent {len(sent_emails)} invitations." if sent_emails else "Failed to send invitations.", 
+            "message": f"Queued {len(sent_emails)} invitations." if sent_emails else "Failed to send invitations.", 
             "sent": sent_emails, 
             "errors": errors
         }, status=status_code)
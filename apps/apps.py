@@ -1,4 +1,9 @@
+import logging
+
 from django.apps import AppConfig
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
 
 
 class AppsConfig(AppConfig):
@@ -6,3 +11,10 @@ class AppsConfig(AppConfig):
 
     def ready(self):
         import apps.signals
+        from .utils.cache import cache_is_shared
+
+        if settings.WEB_CONCURRENCY > 1 and not cache_is_shared():
+            logger.warning(
+                f"{settings.WEB_CONCURRENCY} gunicorn workers are running on the per-process cache, so "
+                "analytics cache invalidation is not shared between them. Set REDIS_URL."
+            )
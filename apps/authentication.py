@@ -1,24 +1,91 @@
 from rest_framework_simplejwt.authentication import JWTAuthentication
 from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
 from django.utils import timezone
-from .models import Admins, AuditLogs
+from django.utils.dateparse import parse_datetime
+from .models import Admins
+from .utils.audit import record_audit
+from .utils.cache import MAINTENANCE_KEY, PRINCIPAL_KEY, cache_is_shared
 from .utils.security import get_client_ip
 from rest_framework_simplejwt.settings import api_settings
 
+# Secrets never go into the shared cache; they stay deferred on a cached
+# principal and are loaded from the database only if a view touches them.
+PRINCIPAL_EXCLUDED_FIELDS = (
+    "password_hash", "verification_token", "password_reset_code",
+    "password_reset_expires", "two_factor_secret",
+)
+PRINCIPAL_FIELDS = [
+    f.attname for f in Admins._meta.concrete_fields if f.name not in PRINCIPAL_EXCLUDED_FIELDS
+]
+
+
+def principals_cached():
+    """
+    Whether CustomJWTAuthentication caches principals. Admins saves only
+    invalidate the cache of the process that made them, so with a
+    per-process cache a blocked admin would stay cached in other workers.
+    """
+    mode = str(settings.AUTH_CACHE_PRINCIPALS).lower()
+    if mode == "auto":
+        return cache_is_shared()
+    return mode in ("true", "1", "yes")
+
+
+def get_maintenance_state():
+    """
+    (active, scheduled_at) for maintenance mode, with the schedule already
+    parsed. Cached for AUTH_CACHE_TIMEOUT; SecureSettings saves invalidate it.
+    """
+    state = cache.get(MAINTENANCE_KEY)
+    if state is None:
+        from .utils.encryption import get_setting
+        active = get_setting("maintenance_mode_active", "false") == "true"
+        scheduled_at = None
+        if active:
+            try:
+                scheduled_at = parse_datetime(get_setting("maintenance_schedule_time") or "")
+            except ValueError:
+                scheduled_at = None
+            if scheduled_at and timezone.is_naive(scheduled_at):
+                scheduled_at = timezone.make_aware(scheduled_at)
+        state = (active, scheduled_at)
+        cache.set(MAINTENANCE_KEY, state, settings.AUTH_CACHE_TIMEOUT)
+    return state
+
+
 class CustomJWTAuthentication(JWTAuthentication):
     def get_user(self, validated_token):
         """
         Since Admins is not the default AUTH_USER_MODEL, we must explicitly fetch from Admins
         and map the 'user_id' claim to UUID.
+
+        With a shared cache (see principals_cached()) the row is cached for
+        AUTH_CACHE_TIMEOUT seconds and rebuilt from the cache without a
+        query; Admins saves (suspend, revoke, block, logout, ...) drop the
+        entry, see apps.signals. Otherwise it is read on every request, so
+        is_blocked, lockout_until and sessions are always current.
         """
         user_id = validated_token.get(api_settings.USER_ID_CLAIM)
         if not user_id:
             return None
-            
-        try:
-            return Admins.objects.get(id=user_id)
-        except (Admins.DoesNotExist, ValueError):
-            return None
+
+        use_cache = principals_cached()
+        key = PRINCIPAL_KEY.format(user_id)
+        values = cache.get(key) if use_cache else None
+        if values is None:
+            try:
+                values = list(
+                    Admins.objects.filter(id=user_id).values_list(*PRINCIPAL_FIELDS).get()
+                )
+            except (Admins.DoesNotExist, ValueError, ValidationError):
+                return None
+            if use_cache:
+                cache.set(key, values, settings.AUTH_CACHE_TIMEOUT)
+        # Saving this instance only writes the loaded (non-secret) fields
+        return Admins.from_db(Admins.objects.db, PRINCIPAL_FIELDS, values)
 
     def authenticate(self, request):
         result = super().authenticate(request)
@@ -63,22 +130,13 @@ class CustomJWTAuthentication(JWTAuthentication):
                 raise AuthenticationFailed("Session invalid. Please log in again.")
 
         # 6. Maintenance Mode Check
-        from .utils.encryption import get_setting
-        maintenance_active = get_setting("maintenance_mode_active", "false") == "true"
-        if maintenance_active:
-            # Check if scheduled time has passed
-            maintenance_time_str = get_setting("maintenance_schedule_time")
-            if maintenance_time_str:
-                try:
-                    from dateutil import parser
-                    scheduled_time = parser.isoparse(maintenance_time_str)
-                    if timezone.now() >= scheduled_time:
-                        # Allow owner to bypass maintenance mode if they have god_mode or similar?
-                        # Usually maintenance locks everyone out.
-                        if not getattr(user, 'is_owner', False):
-                            raise AuthenticationFailed("System is currently under scheduled maintenance. Please try again later.")
-                except (ValueError, TypeError, ImportError):
-                    pass
+        maintenance_active, scheduled_time = get_maintenance_state()
+        # Check if scheduled time has passed
+        if maintenance_active and scheduled_time and timezone.now() >= scheduled_time:
+            # Allow owner to bypass maintenance mode if they have god_mode or similar?
+            # Usually maintenance locks everyone out.
+            if not getattr(user, 'is_owner', False):
+                raise AuthenticationFailed("System is currently under scheduled maintenance. Please try again later.")
 
         return user, validated_token
 
@@ -86,7 +144,9 @@ class CustomJWTAuthentication(JWTAuthentication):
         try:
             x_forwarded = request.META.get('HTTP_X_FORWARDED_FOR')
             ip = x_forwarded.split(',')[0].strip() if x_forwarded else request.META.get('REMOTE_ADDR')
-            AuditLogs.objects.create(
+            # AUDIT_LOG_MODE decides: SECURITY entries are only buffered in
+            # ASYNC mode with an outbox to survive a crash
+            record_audit(
                 admin=user if isinstance(user, Admins) else None,
                 action=f"SECURITY THREAT: {message}",
                 log_type="SECURITY",
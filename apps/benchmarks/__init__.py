@@ -0,0 +1,14 @@
+"""
+Micro-benchmarks run through `python manage.py benchmark <name>`.
+
+Each module exposes `add_arguments(parser)` and `run(**options)` returning a
+JSON-serialisable dict. Benchmarks that write data do so inside a
+transaction that is rolled back, but should still be pointed at a
+disposable database.
+"""
+
+BENCHMARKS = {
+    "schedule": "apps.benchmarks.schedule",
+    "capital": "apps.benchmarks.capital",
+    "api": "apps.benchmarks.api",
+}
@@ -0,0 +1,148 @@
+"""
+Query count and latency of the main REST endpoints over a seeded portfolio.
+
+Seeds a synthetic dataset with apps.benchmarks.seed.seed_synthetic(), then
+requests each endpoint as the owner: one cold request (empty cache) and
+--iterations warm ones. Reports per endpoint the queries issued, p50/p95
+latency and rows returned per second. Everything runs in a transaction that
+is rolled back. With --baseline, endpoints whose query count grew against a
+previous run's JSON are listed under "regressions". Latencies vary between
+runs; query and row counts should not, so the JSON diffs cleanly.
+"""
+import json
+import time
+
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+
+from .utils import summarize
+
+ENDPOINTS = {
+    "loans": ("get", "/api/loans/", None),
+    "loans_keyset": ("get", "/api/loans/?cursor=", None),
+    "repayments": ("get", "/api/repayments/", None),
+    "loan_analytics": ("get", "/api/loans/analytics/", None),
+    "owner_analytics": ("get", "/api/owner/analytics/", None),
+    "audit_logs": ("get", "/api/audit-logs/", None),
+    "c2b_callback": ("post", "/api/payments/callback/", "c2b"),
+}
+
+
+def add_arguments(parser):
+    parser.add_argument("--branches", type=int, default=3)
+    parser.add_argument("--officers-per-branch", type=int, default=2)
+    parser.add_argument("--customers", type=int, default=300)
+    parser.add_argument("--loans-per-customer", type=int, default=1)
+    parser.add_argument("--repayments-per-loan", type=int, default=3)
+    parser.add_argument("--audit-logs", type=int, default=1000)
+    parser.add_argument("--iterations", type=int, default=20, help="Warm requests per endpoint")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--endpoints", default=",".join(ENDPOINTS), help="Comma-separated subset of endpoints")
+    parser.add_argument("--baseline", help="JSON from a previous run to compare query counts against")
+
+
+def _rows(response):
+    data = getattr(response, "data", None)
+    if isinstance(data, dict) and isinstance(data.get("results"), list):
+        return len(data["results"])
+    if isinstance(data, list):
+        return len(data)
+    return 1
+
+
+def _c2b_payloads(prefix):
+    """An endless supply of distinct paybill callbacks against seeded customers."""
+    from apps.models import Loans
+
+    loans = list(
+        Loans.objects.filter(status__in=["ACTIVE", "OVERDUE"], user__full_name__startswith=prefix)
+        .values_list("user__profile__national_id", "user__phone")[:200]
+    )
+    n = 0
+    while True:
+        national_id, phone = loans[n % len(loans)] if loans else ("UNKNOWN", "0700000000")
+        n += 1
+        yield {
+            "TransID": f"BENCH{n:08d}", "BillRefNumber": national_id, "TransAmount": "100",
+            "MSISDN": phone, "TransTime": "20260101120000",
+        }
+
+
+def _measure(client, method, path, body):
+    # The savepoint keeps a failing request from breaking the outer transaction
+    with transaction.atomic(), CaptureQueriesContext(connection) as ctx:
+        started = time.perf_counter()
+        if method == "post":
+            response = client.post(path, body, format="json")
+        else:
+            response = client.get(path)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+    return response, elapsed_ms, len(ctx.captured_queries)
+
+
+def run(branches=3, officers_per_branch=2, customers=300, loans_per_customer=1, repayments_per_loan=3,
+        audit_logs=1000, iterations=20, seed=42, endpoints=None, baseline=None, **options):
+    from rest_framework.test import APIClient
+    from .seed import seed_synthetic
+
+    names = [n.strip() for n in (endpoints or ",".join(ENDPOINTS)).split(",") if n.strip()]
+    unknown = sorted(set(names) - set(ENDPOINTS))
+    if unknown:
+        raise ValueError(f"Unknown endpoints: {', '.join(unknown)}")
+
+    prefix = "bench"
+    results = {}
+    # Callbacks are applied inline; anything they queue (receipt SMS) is left
+    # for a worker that never sees it because the transaction is rolled back
+    with override_settings(MPESA_CALLBACK_PROCESSING="INLINE", BACKGROUND_JOB_PROCESSING="WORKER"), \
+            transaction.atomic():
+        dataset = seed_synthetic(
+            branches=branches, officers_per_branch=officers_per_branch, customers=customers,
+            loans_per_customer=loans_per_customer, repayments_per_loan=repayments_per_loan,
+            audit_logs=audit_logs, seed=seed, prefix=prefix,
+        )
+        client = APIClient()
+        client.force_authenticate(user=dataset.pop("owner"))
+        payloads = _c2b_payloads(prefix)
+
+        for name in names:
+            method, path, body = ENDPOINTS[name]
+            cache.clear()
+            try:
+                response, cold_ms, cold_queries = _measure(client, method, path, next(payloads) if body else None)
+                samples, queries = [], []
+                for _ in range(iterations):
+                    response, elapsed_ms, count = _measure(client, method, path, next(payloads) if body else None)
+                    samples.append(elapsed_ms)
+                    queries.append(count)
+            except Exception as e:
+                # A broken endpoint is a result too; keep measuring the rest
+                results[name] = {"path": path, "method": method.upper(), "error": f"{type(e).__name__}: {e}"}
+                continue
+            latency = summarize(samples)
+            rows = _rows(response)
+            results[name] = {
+                "path": path,
+                "method": method.upper(),
+                "status": response.status_code,
+                "rows": rows,
+                "queries_cold": cold_queries,
+                "queries": max(queries) if queries else cold_queries,
+                "cold_ms": round(cold_ms, 3),
+                "latency": latency,
+                "rows_per_sec": round(rows * 1000 / latency["p50_ms"], 1) if latency.get("p50_ms") else None,
+            }
+        transaction.set_rollback(True)
+
+    report = {"dataset": dataset, "iterations": iterations, "seed": seed, "endpoints": results}
+    if baseline:
+        with open(baseline, encoding="utf-8") as fh:
+            previous = json.load(fh)
+        previous = previous.get("results", previous).get("endpoints", {})
+        report["regressions"] = sorted(
+            name for name, result in results.items()
+            if name in previous and result["queries"] > previous[name].get("queries", result["queries"])
+        )
+    return report
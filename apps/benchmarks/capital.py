@@ -0,0 +1,174 @@
+"""
+C2B callback throughput under parallel load in each capital ledger mode.
+
+Fires paybill callbacks at /api/payments/callback/ from several threads and
+reports callbacks/second and latency per CAPITAL_LEDGER_MODE. Callbacks are
+applied inside the request (MPESA_CALLBACK_PROCESSING=INLINE), so the
+timings include the capital ledger write rather than just storing and
+acking the payload; side effects they queue are left for a worker and
+removed afterwards (BACKGROUND_JOB_PROCESSING=WORKER). The threads
+need committed rows, so unlike `benchmark api` this cannot run inside a
+rolled-back transaction: it creates, commits and then deletes its own
+customers and loans, and restores the capital balance only approximately if
+interrupted. It refuses to run without --allow-writes; point DATABASE_URL at
+a disposable PostgreSQL database first (SQLite serializes all writers, so it
+cannot show the difference).
+"""
+import json
+import threading
+import time
+import uuid
+from decimal import Decimal
+
+from django.db import connection, connections
+from django.test import Client, override_settings
+from django.utils import timezone
+
+from .utils import summarize
+
+CALLBACK_URL = "/api/payments/callback/"
+
+
+def add_arguments(parser):
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--callbacks", type=int, default=400, help="Callbacks per mode")
+    parser.add_argument("--loans", type=int, default=50, help="Distinct loans the callbacks spread over")
+    parser.add_argument("--modes", default="LOCKED,APPEND_ONLY")
+    parser.add_argument(
+        "--allow-writes", action="store_true",
+        help="Confirm the configured database is disposable (rows are committed, then deleted)",
+    )
+
+
+def _setup(run_id, loan_count):
+    from apps.models import LoanProducts, Loans, Users, UserProfiles
+
+    product = LoanProducts.objects.create(
+        name=f"Benchmark {run_id}", min_amount=1, max_amount=10000000, interest_rate=25, duration_weeks=52
+    )
+    loans = []
+    for i in range(loan_count):
+        user = Users.objects.create(full_name=f"Bench Customer {i}", phone=f"b{run_id}{i:05d}")
+        UserProfiles.objects.create(user=user, national_id=f"BN{run_id}{i:05d}")
+        loans.append(Loans.objects.create(
+            user=user, loan_product=product, principal_amount=Decimal("1000000"), interest_rate=25,
+            duration_weeks=52, status="ACTIVE", disbursed_at=timezone.now(),
+        ))
+    return product, loans
+
+
+def _cleanup(run_id, product, loans, started_at):
+    from apps.models import (
+        BackgroundJob, LedgerEntry, LoanActivity, Loans, MpesaCallback, Notifications, PaybillTransaction,
+        Repayments, RepaymentSchedule, Transactions, UserProfiles, Users,
+    )
+    # Queryset deletes: the model-level delete() guards are for app code paths
+    loan_ids = [l.id for l in loans]
+    user_ids = [l.user_id for l in loans]
+    LedgerEntry.objects.filter(loan_id__in=loan_ids).delete()
+    LoanActivity.objects.filter(loan_id__in=loan_ids).delete()
+    Repayments.objects.filter(loan_id__in=loan_ids).delete()
+    RepaymentSchedule.objects.filter(loan_id__in=loan_ids).delete()
+    PaybillTransaction.objects.filter(receipt_number__startswith=f"BN{run_id}").delete()
+    MpesaCallback.objects.filter(idempotency_key__startswith=f"C2B:BN{run_id}").delete()
+    BackgroundJob.objects.filter(status="QUEUED", created_at__gte=started_at).delete()
+    Transactions.objects.filter(user_id__in=user_ids).delete()
+    Notifications.objects.filter(user_id__in=user_ids).delete()
+    Loans.objects.filter(id__in=loan_ids).delete()
+    UserProfiles.objects.filter(user_id__in=user_ids).delete()
+    Users.objects.filter(id__in=user_ids).delete()
+    product.delete()
+
+
+def _fire(run_id, loans, total, threads):
+    per_thread = [list(range(t, total, threads)) for t in range(threads)]
+    latencies, errors = [], []
+    lock = threading.Lock()
+
+    def worker(indexes):
+        client = Client()
+        try:
+            for n in indexes:
+                loan = loans[n % len(loans)]
+                payload = {
+                    "TransID": f"BN{run_id}{n:07d}",
+                    "TransAmount": "100.00",
+                    "BillRefNumber": loan.user.profile.national_id,
+                    "MSISDN": "254700000000",
+                    "TransTime": timezone.now().strftime("%Y%m%d%H%M%S"),
+                }
+                started = time.perf_counter()
+                response = client.post(CALLBACK_URL, data=json.dumps(payload), content_type="application/json")
+                elapsed = (time.perf_counter() - started) * 1000
+                with lock:
+                    latencies.append(elapsed)
+                    if response.status_code != 200:
+                        errors.append(response.status_code)
+        finally:
+            connection.close()
+
+    workers = [threading.Thread(target=worker, args=(chunk,)) for chunk in per_thread]
+    started = time.perf_counter()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    return time.perf_counter() - started, latencies, errors
+
+
+def run(threads=8, callbacks=400, loans=50, modes="LOCKED,APPEND_ONLY", allow_writes=False, **options):
+    from apps.models import Repayments
+    from apps.services import CapitalLedgerService
+
+    if not allow_writes:
+        return {"error": "This benchmark commits to and deletes from the configured database; "
+                         "rerun with --allow-writes against a disposable database."}
+
+    account = CapitalLedgerService.get_account()
+    if not account:
+        return {"error": "No capital account; run migrations first."}
+
+    results = {"threads": threads, "callbacks": callbacks, "loans": loans, "vendor": connection.vendor}
+    for mode in [m.strip().upper() for m in modes.split(",") if m.strip()]:
+        run_id = uuid.uuid4().hex[:6].upper()
+        product, fixture = _setup(run_id, loans)
+        for loan in fixture:
+            loan.user.profile  # resolve before the threads start
+        balance_before = CapitalLedgerService.available_balance()
+        started_at = timezone.now()
+        try:
+            with override_settings(
+                CAPITAL_LEDGER_MODE=mode, MPESA_CALLBACK_PROCESSING="INLINE", BACKGROUND_JOB_PROCESSING="WORKER"
+            ):
+                elapsed, latencies, errors = _fire(run_id, fixture, callbacks, threads)
+                compact_started = time.perf_counter()
+                compacted, _ = CapitalLedgerService.compact()
+                compact_ms = (time.perf_counter() - compact_started) * 1000
+
+            recorded = Repayments.objects.filter(loan__in=fixture).count()
+            balance_after = CapitalLedgerService.available_balance()
+            results[mode] = {
+                "elapsed_s": round(elapsed, 3),
+                "callbacks_per_s": round(callbacks / elapsed, 1) if elapsed else 0,
+                "latency": summarize(latencies),
+                "http_errors": len(errors),
+                "repayments_recorded": recorded,
+                "balance_delta": float(balance_after - balance_before),
+                "balance_consistent": balance_after - balance_before == Decimal("100.00") * recorded,
+                "compacted_entries": compacted,
+                "compact_ms": round(compact_ms, 3),
+            }
+        finally:
+            # Take the benchmark money back out again
+            CapitalLedgerService.compact()
+            delta = CapitalLedgerService.available_balance() - balance_before
+            if delta:
+                account.refresh_from_db()
+                type(account).objects.filter(pk=account.pk).update(balance=account.balance - delta)
+            _cleanup(run_id, product, fixture, started_at)
+            connections.close_all()
+
+    if "LOCKED" in results and "APPEND_ONLY" in results:
+        locked, append = results["LOCKED"]["callbacks_per_s"], results["APPEND_ONLY"]["callbacks_per_s"]
+        results["throughput_gain_pct"] = round((append / locked - 1) * 100, 1) if locked else 0
+    return results
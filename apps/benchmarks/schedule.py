@@ -0,0 +1,69 @@
+"""
+Lock hold time of repayment schedule generation: the old per-row
+objects.create() loop against the shared bulk_create builder, each timed
+from taking the SystemCapital row lock to the last schedule write.
+"""
+import time
+from decimal import Decimal
+
+from django.db import transaction
+from django.utils import timezone
+
+from .utils import summarize
+
+
+def add_arguments(parser):
+    parser.add_argument("--weeks", type=int, default=52, help="Loan tenure (installments)")
+    parser.add_argument("--iterations", type=int, default=20)
+
+
+def _scratch_loan(weeks):
+    from apps.models import LoanProducts, Loans, Users
+
+    product = LoanProducts.objects.create(
+        name="Benchmark Loan", min_amount=1, max_amount=1000000, interest_rate=25, duration_weeks=weeks
+    )
+    user = Users.objects.create(full_name="Benchmark Customer", phone=f"bench-{timezone.now().timestamp()}")
+    return Loans.objects.create(
+        user=user, loan_product=product, principal_amount=Decimal("52000"), interest_rate=25,
+        duration_weeks=weeks, status="ACTIVE", disbursed_at=timezone.now(),
+    )
+
+
+def _write_per_row(loan):
+    from apps.services import build_repayment_schedule
+    for installment in build_repayment_schedule(loan, loan.disbursed_at.date()):
+        installment.save(force_insert=True)
+
+
+def _write_bulk(loan):
+    from apps.services import generate_repayment_schedule
+    generate_repayment_schedule(loan, replace=False)
+
+
+def run(weeks=52, iterations=20, **options):
+    from apps.models import RepaymentSchedule, SystemCapital
+
+    results = {"weeks": weeks, "iterations": iterations}
+    with transaction.atomic():
+        capital, _ = SystemCapital.objects.get_or_create(
+            name="Simulation Capital", defaults={"balance": Decimal("0")}
+        )
+        loan = _scratch_loan(weeks)
+
+        for label, writer in (("per_row", _write_per_row), ("bulk_create", _write_bulk)):
+            samples = []
+            for _ in range(iterations):
+                with transaction.atomic():
+                    started = time.perf_counter()
+                    SystemCapital.objects.select_for_update().get(pk=capital.pk)
+                    writer(loan)
+                    samples.append((time.perf_counter() - started) * 1000)
+                RepaymentSchedule.objects.filter(loan=loan).delete()
+            results[label] = summarize(samples)
+
+        transaction.set_rollback(True)
+
+    before, after = results["per_row"]["p50_ms"], results["bulk_create"]["p50_ms"]
+    results["lock_hold_reduction_pct"] = round((1 - after / before) * 100, 1) if before else 0
+    return results
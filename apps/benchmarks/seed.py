@@ -0,0 +1,252 @@
+"""
+Seed data shared by the seed_db.py / seed_test_data.py scripts and the
+benchmarks.
+
+The ensure_* helpers are idempotent and create the fixed demo accounts.
+seed_synthetic() bulk-inserts a deterministic portfolio of arbitrary size
+(same ``seed``, same rows apart from ids and timestamps) for load tests.
+"""
+import random
+import uuid
+from datetime import timedelta
+from decimal import Decimal
+
+import bcrypt
+from django.utils import timezone
+
+CAPITAL_ACCOUNT_NAME = "Simulation Capital"
+
+DEMO_PRODUCTS = [
+    {"name": "M-Pawa Kirinyaga", "min": 2000, "max": 10000, "rate": 5, "weeks": 5},
+    {"name": "Standard Business", "min": 10000, "max": 50000, "rate": 7, "weeks": 8},
+    {"name": "Emergency Relief", "min": 500, "max": 2000, "rate": 10, "weeks": 4},
+]
+
+DEMO_CUSTOMERS = [
+    {"name": "John Doe", "phone": "0711111111", "email": "john@gmail.com"},
+    {"name": "Alice Smith", "phone": "0722222222", "email": "alice@gmail.com"},
+    {"name": "Robert Maina", "phone": "0733333333", "email": "robert@gmail.com"},
+]
+
+# Loan status mix of a synthetic portfolio, as weights
+LOAN_STATUS_MIX = {
+    "ACTIVE": 40, "DISBURSED": 10, "OVERDUE": 15, "REPAID": 20,
+    "UNVERIFIED": 5, "VERIFIED": 3, "APPROVED": 4, "REJECTED": 3,
+}
+DISBURSED_STATUSES = ("ACTIVE", "DISBURSED", "OVERDUE", "REPAID")
+
+
+def hash_password(password):
+    return bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt()).decode("utf-8")
+
+
+def ensure_capital(balance=Decimal("500000.00"), minimum=Decimal("10000")):
+    from ..models import SystemCapital
+
+    capital, _ = SystemCapital.objects.get_or_create(
+        name=CAPITAL_ACCOUNT_NAME, defaults={"id": uuid.uuid4(), "balance": balance}
+    )
+    if capital.balance < minimum:
+        capital.balance = balance
+        capital.save()
+    return capital
+
+
+def ensure_branch(name):
+    from ..models import Branch
+
+    branch, _ = Branch.objects.get_or_create(name=name, defaults={"is_active": True})
+    return branch
+
+
+def ensure_staff(accounts, password):
+    """
+    get_or_create for each {"full_name", "email", "role", ["branch_fk"]};
+    returns [(admin, created)].
+    """
+    from ..models import Admins
+
+    password_hash = hash_password(password)
+    results = []
+    for acc in accounts:
+        branch = acc.get("branch_fk")
+        results.append(Admins.objects.get_or_create(
+            email=acc["email"],
+            defaults={
+                "id": uuid.uuid4(),
+                "full_name": acc["full_name"],
+                "role": acc["role"],
+                "password_hash": password_hash,
+                "is_verified": True,
+                "is_blocked": False,
+                "branch_fk": branch,
+                "branch": branch.name if branch else None,
+            },
+        ))
+    return results
+
+
+def ensure_demo_products():
+    from ..models import LoanProducts
+
+    products = []
+    for data in DEMO_PRODUCTS:
+        product, _ = LoanProducts.objects.get_or_create(
+            name=data["name"],
+            defaults={
+                "id": uuid.uuid4(),
+                "min_amount": data["min"],
+                "max_amount": data["max"],
+                "interest_rate": data["rate"],
+                "duration_weeks": data["weeks"],
+            },
+        )
+        products.append(product)
+    return products
+
+
+def ensure_demo_customers():
+    from ..models import Users
+
+    return [
+        Users.objects.get_or_create(
+            phone=data["phone"],
+            defaults={"id": uuid.uuid4(), "full_name": data["name"], "email": data["email"], "is_verified": True},
+        )[0]
+        for data in DEMO_CUSTOMERS
+    ]
+
+
+def ensure_demo_loans(products, customers):
+    from ..models import Loans
+
+    loan_data = [
+        (customers[0], products[0], 5000, "APPROVED"),
+        (customers[1], products[1], 100000, "PENDING"),
+        (customers[2], products[2], 2000, "REPAID"),
+    ]
+    return [
+        Loans.objects.get_or_create(
+            user=user, loan_product=product, principal_amount=amount,
+            defaults={
+                "id": uuid.uuid4(),
+                "interest_rate": product.interest_rate,
+                "duration_weeks": product.duration_weeks,
+                "status": status,
+            },
+        )[0]
+        for user, product, amount, status in loan_data
+    ]
+
+
+def seed_synthetic(branches=3, officers_per_branch=2, customers=300, loans_per_customer=1,
+                   repayments_per_loan=3, audit_logs=1000, seed=42, prefix="bench", batch_size=1000):
+    """
+    Bulk-inserts a branch / staff / customer / loan / schedule / repayment /
+    audit log portfolio and returns the row counts. ``prefix`` namespaces
+    the unique fields (emails, phones, national ids, references) so several
+    datasets can coexist. Returns the owner account as ``owner`` alongside
+    the counts.
+    """
+    from ..models import (
+        Admins, AuditLogs, Branch, LoanProducts, Loans, RepaymentSchedule, Repayments, UserProfiles, Users,
+    )
+    from ..services import build_repayment_schedule
+    from ..utils.cache import bump_analytics_generation
+
+    rng = random.Random(seed)
+    now = timezone.now()
+    password_hash = hash_password(f"{prefix}-password")
+
+    owner = Admins.objects.create(
+        full_name=f"{prefix} Owner", email=f"{prefix}-owner@bench.local", role="ADMIN",
+        password_hash=password_hash, is_verified=True, is_owner=True, is_super_admin=True,
+    )
+    product = LoanProducts.objects.create(
+        name=f"{prefix} Product", min_amount=1000, max_amount=100000, interest_rate=25, duration_weeks=8
+    )
+    branch_rows = Branch.objects.bulk_create([Branch(name=f"{prefix} Branch {b}") for b in range(branches)])
+
+    staff = []
+    for b, branch in enumerate(branch_rows):
+        staff.append(Admins(
+            full_name=f"{prefix} Manager {b}", email=f"{prefix}-mgr-{b}@bench.local", role="MANAGER",
+            password_hash=password_hash, is_verified=True, branch_fk=branch, branch=branch.name, invited_by=owner,
+        ))
+        for o in range(officers_per_branch):
+            staff.append(Admins(
+                full_name=f"{prefix} Officer {b}-{o}", email=f"{prefix}-off-{b}-{o}@bench.local",
+                role="FIELD_OFFICER", password_hash=password_hash, is_verified=True,
+                branch_fk=branch, branch=branch.name, invited_by=owner,
+            ))
+    Admins.objects.bulk_create(staff, batch_size=batch_size)
+    officers = [a for a in staff if a.role == "FIELD_OFFICER"] or [owner]
+
+    users, profiles = [], []
+    for c in range(customers):
+        officer = officers[c % len(officers)]
+        user = Users(
+            full_name=f"{prefix} Customer {c}", phone=f"{prefix[:6]}{c:09d}", created_by=officer,
+            is_verified=True, created_at=now - timedelta(days=rng.randint(30, 400)),
+        )
+        users.append(user)
+        profiles.append(UserProfiles(
+            user=user, national_id=f"{prefix[:6].upper()}{c:08d}", branch_fk=officer.branch_fk,
+            branch=officer.branch, monthly_income=Decimal(rng.randrange(10000, 200000, 500)),
+        ))
+    Users.objects.bulk_create(users, batch_size=batch_size)
+    UserProfiles.objects.bulk_create(profiles, batch_size=batch_size)
+
+    statuses, weights = zip(*LOAN_STATUS_MIX.items())
+    loans, schedules, repayments = [], [], []
+    for user in users:
+        for _ in range(loans_per_customer):
+            status = rng.choices(statuses, weights)[0]
+            created_at = now - timedelta(days=rng.randint(1, 180))
+            loan = Loans(
+                user=user, loan_product=product, principal_amount=Decimal(rng.randrange(1000, 100000, 500)),
+                interest_rate=product.interest_rate, duration_weeks=product.duration_weeks, status=status,
+                branch=user.created_by.branch_fk, created_by=user.created_by, created_at=created_at,
+                disbursed_at=created_at + timedelta(days=1) if status in DISBURSED_STATUSES else None,
+            )
+            loans.append(loan)
+            if loan.disbursed_at is None:
+                continue
+            schedules.extend(build_repayment_schedule(loan, loan.disbursed_at.date()))
+            installment = Decimal(str(round(loan.total_repayable_amount / loan.duration_weeks, 2)))
+            paid = Decimal("0")
+            for r in range(repayments_per_loan if status != "OVERDUE" else max(repayments_per_loan - 2, 0)):
+                paid += installment
+                repayments.append(Repayments(
+                    loan=loan, amount_paid=installment, payment_method=rng.choice(["MPESA", "CASH"]),
+                    payment_date=loan.disbursed_at + timedelta(weeks=r + 1),
+                    reference_code=f"{prefix.upper()}{len(repayments):010d}",
+                ))
+            loan.amount_paid = paid
+    Loans.objects.bulk_create(loans, batch_size=batch_size)
+    RepaymentSchedule.objects.bulk_create(schedules, batch_size=batch_size)
+    Repayments.objects.bulk_create(repayments, batch_size=batch_size)
+
+    actors = [owner] + staff
+    log_types = ["GENERAL", "STATUS", "SECURITY", "COMMUNICATION"]
+    AuditLogs.objects.bulk_create([
+        AuditLogs(
+            admin=actors[i % len(actors)], action=f"{prefix} benchmark action {i}", log_type=rng.choice(log_types),
+            table_name="loans", record_id=loans[i % len(loans)].id if loans else None,
+            created_at=now - timedelta(minutes=rng.randint(0, 60 * 24 * 30)),
+        )
+        for i in range(audit_logs)
+    ], batch_size=batch_size)
+
+    # bulk_create skips Loans.save(), which normally does this
+    bump_analytics_generation()
+    return {
+        "owner": owner,
+        "branches": len(branch_rows),
+        "staff": len(staff) + 1,
+        "customers": len(users),
+        "loans": len(loans),
+        "schedules": len(schedules),
+        "repayments": len(repayments),
+        "audit_logs": audit_logs,
+    }
@@ -0,0 +1,16 @@
+import statistics
+
+
+def summarize(samples_ms):
+    """Median / p95 / mean of a list of millisecond timings."""
+    ordered = sorted(samples_ms)
+    if not ordered:
+        return {"count": 0}
+    p95_index = max(0, int(round(len(ordered) * 0.95)) - 1)
+    return {
+        "count": len(ordered),
+        "p50_ms": round(statistics.median(ordered), 3),
+        "p95_ms": round(ordered[p95_index], 3),
+        "mean_ms": round(statistics.fmean(ordered), 3),
+        "max_ms": round(ordered[-1], 3),
+    }
@@ -5,3 +5,9 @@ class InsufficientCapitalError(APIException):
     status_code = 400
     default_detail = "Insufficient system capital to complete this disbursement."
     default_code = "insufficient_capital"
+
+
+class DisbursementOutcomeUnknownError(APIException):
+    status_code = 504
+    default_detail = "The M-Pesa payout may have been sent; confirm it on M-Pesa before retrying."
+    default_code = "disbursement_outcome_unknown"
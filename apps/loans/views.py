@@ -25,8 +25,11 @@ from ..serializers import (
     LoanActivitySerializer,
     LoanDocumentSerializer
 )
+from ..utils.audit import record_audit
 from ..utils.security import log_action, get_client_ip, get_filtered_queryset
 from ..utils.sms import send_sms_async
+from ..utils.cache import cached_analytics
+from ..pagination import CursorResultsSetPagination
 
 def create_loan_activity(loan, admin, action, note=""):
     LoanActivity.objects.create(loan=loan, admin=admin, action=action, note=note)
@@ -37,9 +40,10 @@ def create_notification(user, message):
 class LoanListCreateView(generics.ListCreateAPIView):
     serializer_class = LoanSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = CursorResultsSetPagination
 
     def get_queryset(self):
-        qs = get_filtered_queryset(self.request.user, Loans.objects.select_related("user", "user__profile", "loan_product"), 'user__profile__branch_fk', request=self.request)
+        qs = get_filtered_queryset(self.request.user, LoanSerializer.setup_eager_loading(Loans.objects.all()), 'user__profile__branch_fk', request=self.request)
         
         # Additional Filters
         search = self.request.query_params.get('search')
@@ -191,7 +195,7 @@ class LoanDetailView(generics.RetrieveUpdateAPIView):
                 if new_status == "APPROVED" and was_registered_by_user and was_applied_by_user:
                     is_manager_bypass = True
                     # Log to security logs as requested
-                    AuditLogs.objects.create(
+                    record_audit(
                         admin=user, 
                         action=f"MANAGER BYPASS: {user.full_name} completed full loan cycle (Register -> Apply -> Verify -> Approve) for customer {customer.full_name}", 
                         log_type="SECURITY", 
@@ -270,7 +274,7 @@ class LoanDetailView(generics.RetrieveUpdateAPIView):
             if instance.status == "REJECTED":
                 from apps.services import notify_loan_rejected
                 notify_loan_rejected(instance)
-            AuditLogs.objects.create(
+            record_audit(
                 admin=user, 
                 action=f"LOAN_{instance.status}", 
                 log_type="STATUS", 
@@ -303,11 +307,12 @@ class LoanProductDetailView(generics.RetrieveUpdateDestroyAPIView):
         product = serializer.save()
         new_rate = product.interest_rate
         if old_rate != new_rate:
-            AuditLogs.objects.create(admin=user if user.is_authenticated else None, action="UPDATE_LOAN_PRODUCT_RATE", log_type="MANAGEMENT", table_name="loan_products", record_id=product.id, old_data={"interest_rate": float(old_rate) if old_rate else None}, new_data={"interest_rate": float(new_rate), "name": product.name}, ip_address=ip)
+            record_audit(admin=user if user.is_authenticated else None, action="UPDATE_LOAN_PRODUCT_RATE", log_type="MANAGEMENT", table_name="loan_products", record_id=product.id, old_data={"interest_rate": float(old_rate) if old_rate else None}, new_data={"interest_rate": float(new_rate), "name": product.name}, ip_address=ip)
 
 class LoanStatsView(views.APIView):
     permission_classes = [permissions.IsAuthenticated]
 
+    @cached_analytics("loan-stats")
     def get(self, request):
         user = request.user
         base_qs = get_filtered_queryset(user, Loans.objects.all(), 'user__profile__branch_fk', request=request)
@@ -322,6 +327,9 @@ class LoanStatsView(views.APIView):
         }
         return Response(counts)
 
+DISBURSEMENT_ROLES = ["ADMIN", "MANAGER", "FINANCE_OFFICER", "FINANCIAL_OFFICER"]
+
+
 class MpesaDisbursementView(views.APIView):
     permission_classes = [permissions.IsAuthenticated]
 
@@ -329,19 +337,15 @@ class MpesaDisbursementView(views.APIView):
         user = request.user
         role = getattr(user, "role", None)
         ip = get_client_ip(request)
-        if role not in ["ADMIN", "MANAGER", "FINANCE_OFFICER", "FINANCIAL_OFFICER"]:
+        if role not in DISBURSEMENT_ROLES:
             return Response({"error": "Unauthorized to trigger disbursements"}, status=403)
         mode = request.data.get("mode", "single")
         confirmed = request.data.get("confirmed", True)
         reason = request.data.get("reason", "Standard Disbursement")
         if not confirmed: return Response({"error": "Two-step confirmation required."}, status=400)
-        try:
-            limit_setting = SystemSettings.objects.get(key="DAILY_OFFICER_DISBURSEMENT_LIMIT")
-            daily_limit = float(limit_setting.value)
-        except: daily_limit = 500000.0
-        today_start = timezone.now().astimezone(timezone.get_current_timezone()).replace(hour=0, minute=0, second=0, microsecond=0)
-        today_disbursements = AuditLogs.objects.filter(admin=user, action="LOAN_DISBURSED", created_at__gte=today_start)
-        total_today = sum([float(log.new_data.get("amount", 0)) for log in today_disbursements if log.new_data])
+        from ..services import DisbursementService
+        daily_limit = DisbursementService.daily_limit()
+        total_today = DisbursementService.disbursed_today(user)
         if mode == "single":
             loan_id = request.data.get("loan_id")
             mpesa_phone = request.data.get("mpesa_phone")
@@ -355,20 +359,25 @@ class MpesaDisbursementView(views.APIView):
                     user_to_update.phone = mpesa_phone
                     user_to_update.save()
 
-                capital = SystemCapital.objects.first()
-                if capital and capital.balance < 50000:
+                from ..services import CapitalLedgerService
+                capital = CapitalLedgerService.get_account()
+                capital_balance = CapitalLedgerService.available_balance(capital) if capital else 0
+                if capital and capital_balance < 50000:
                     super_admins = Admins.objects.filter(is_super_admin=True)
-                    for sa in super_admins: create_notification(sa, f"URGENT: System Capital is low! Current Balance: {capital.balance}")
+                    for sa in super_admins: create_notification(sa, f"URGENT: System Capital is low! Current Balance: {capital_balance}")
                 if total_today + float(loan.principal_amount) > daily_limit:
                     return Response({"error": f"Daily disbursement limit exceeded. Current total: KES {total_today:,}"}, status=403)
                 if loan.status != "APPROVED": return Response({"error": f"Only APPROVED loans can be disbursed. Current status: {loan.status}"}, status=400)
-                
-                from ..services import DisbursementService
-                from ..exceptions import InsufficientCapitalError
+                if loan.mpesa_disbursement_status == "QUEUED":
+                    return Response({"error": "This loan is already queued in a disbursement batch."}, status=409)
+
+                from ..exceptions import DisbursementOutcomeUnknownError, InsufficientCapitalError
 
                 try:
                     DisbursementService.disburse_loan(loan, user)
-                    AuditLogs.objects.create(
+                    # Inline, not buffered: the daily limit is computed from these entries
+                    record_audit(
+                        sync=True,
                         admin=user, 
                         action="LOAN_DISBURSED", 
                         log_type="MANAGEMENT", 
@@ -381,6 +390,8 @@ class MpesaDisbursementView(views.APIView):
                     return Response({'message': 'Disbursement initiated successfully. Awaiting M-Pesa confirmation.'})
                 except InsufficientCapitalError as e:
                     return Response({'error': str(e)}, status=400)
+                except DisbursementOutcomeUnknownError as e:
+                    return Response({'error': str(e.detail)}, status=e.status_code)
                 except Exception as e:
                     logger.error(f"Disbursement error for loan {loan.id}: {e}")
                     return Response({'error': f'Disbursement failed: {str(e)}'}, status=500)
@@ -388,24 +399,72 @@ class MpesaDisbursementView(views.APIView):
             except Loans.DoesNotExist: return Response({"error": "Loan not found"}, status=404)
             except Exception as e: return Response({"error": str(e)}, status=500)
         elif mode == "bulk":
-            loans_to_disburse = Loans.objects.filter(status="APPROVED").order_by("created_at")[:10]
-            results = []
-            current_batch_total = total_today
-            from ..services import DisbursementService
-            for loan in loans_to_disburse:
-                amt = float(loan.principal_amount)
-                if current_batch_total + amt > daily_limit:
-                    results.append({"loan_id": str(loan.id), "status": "failed", "error": "Daily limit reached during bulk process"})
-                    continue
-                try:
-                    DisbursementService.disburse_loan(loan, user)
-                    current_batch_total += amt
-                    results.append({"loan_id": str(loan.id), "status": "success"})
-                    AuditLogs.objects.create(admin=user, action="LOAN_DISBURSED", log_type="MANAGEMENT", table_name="loans", record_id=loan.id, old_data={"status": "APPROVED"}, new_data={"status": "DISBURSED", "amount": amt, "reason": "Bulk Disbursement"}, ip_address=ip)
-                except Exception as e: results.append({"loan_id": str(loan.id), "status": "failed", "error": str(e)})
-            return Response({"message": "Bulk disbursement completed", "results": results})
+            from django.conf import settings
+            from ..services import CapitalLedgerService, DisbursementBatchService
+            candidates = Loans.objects.filter(status="APPROVED").exclude(mpesa_disbursement_status="QUEUED").select_related("user")
+            loan_ids = request.data.get("loan_ids")
+            if loan_ids:
+                candidates = candidates.filter(id__in=loan_ids)
+            try:
+                size = min(int(request.data.get("limit", 10)), settings.DISBURSEMENT_BATCH_MAX_SIZE)
+            except (TypeError, ValueError):
+                return Response({"error": "limit must be a number"}, status=400)
+            loans_to_disburse = list(candidates.order_by("created_at")[:size])
+            if not loans_to_disburse:
+                return Response({"error": "No approved loans to disburse"}, status=400)
+            batch = DisbursementBatchService.create(
+                user, loans_to_disburse, reason=request.data.get("reason", "Bulk Disbursement"), ip_address=ip
+            )
+            DisbursementBatchService.start(batch)
+            capital_balance = CapitalLedgerService.available_balance()
+            if capital_balance < 50000:
+                for sa in Admins.objects.filter(is_super_admin=True): create_notification(sa, f"URGENT: System Capital is low! Current Balance: {capital_balance}")
+            return Response({"message": "Bulk disbursement queued", **_disbursement_batch_payload(batch)}, status=202)
         return Response({"error": "Invalid mode or missing loan_id"}, status=400)
 
+def _disbursement_batch_payload(batch, items=False):
+    payload = {
+        "batch_id": str(batch.id),
+        "status": batch.status,
+        "progress": batch.progress,
+        "total_loans": batch.total_loans,
+        "reserved_amount": float(batch.reserved_amount),
+        "succeeded": batch.succeeded,
+        "failed": batch.failed,
+        "skipped": batch.skipped,
+        "created_at": batch.created_at,
+        "started_at": batch.started_at,
+        "finished_at": batch.finished_at,
+    }
+    if items:
+        payload["results"] = [
+            {
+                "loan_id": str(item.loan_id),
+                "amount": float(item.amount),
+                "status": item.status.lower(),
+                "error": item.error,
+                "originator_id": item.originator_id,
+            }
+            for item in batch.items.order_by("loan__created_at")
+        ]
+    return payload
+
+
+class DisbursementBatchStatusView(views.APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, pk):
+        from ..models import DisbursementBatch
+        user = request.user
+        try:
+            batch = DisbursementBatch.objects.get(pk=pk)
+        except Exception:
+            return Response({"error": "Batch not found"}, status=404)
+        if batch.created_by_id != user.id and getattr(user, "role", None) not in DISBURSEMENT_ROLES and not getattr(user, "is_owner", False):
+            return Response({"error": "Unauthorized"}, status=403)
+        return Response(_disbursement_batch_payload(batch, items=True))
+
+
 class LoanDocumentCreateView(generics.CreateAPIView):
     serializer_class = LoanDocumentSerializer
     permission_classes = [permissions.IsAuthenticated]
@@ -1,10 +1,13 @@
 from rest_framework import views, permissions, status
 from rest_framework.response import Response
+from django.conf import settings
 from django.utils import timezone
 from django.db.models import Count, Sum, Q, F
 from django.db.models.functions import TruncMonth, TruncDate, TruncWeek
 from datetime import timedelta
+import datetime
 from ..models import (
+    PortfolioDailySnapshot,
     Loans,
     SystemCapital,
     Repayments,
@@ -12,10 +15,28 @@ from ..models import (
     RepaymentSchedule,
     Branch,
 )
+from ..services import DISBURSED_STATUSES, CapitalLedgerService, PortfolioSnapshotService, disbursed_on
+from ..utils.cache import cached_analytics, analytics_cache_stats
+from ..utils.profiling import endpoint_stats
+
+
+def _merge_totals(rows, key, total="total", count="count"):
+    """Sums snapshot and live grouped rows that share the same key."""
+    merged = {}
+    for row in rows:
+        k = row[key]
+        if isinstance(k, datetime.datetime):
+            k = k.date()
+        entry = merged.setdefault(k, {"total": 0, "count": 0})
+        entry["total"] += float(row[total] or 0)
+        entry["count"] += int(row[count] or 0)
+    return merged
+
 
 class LoanAnalyticsView(views.APIView):
     permission_classes = [permissions.IsAuthenticated]
 
+    @cached_analytics("loan")
     def get(self, request):
         user = request.user
         branch = request.query_params.get("branch") or request.query_params.get(
@@ -23,28 +44,58 @@ class LoanAnalyticsView(views.APIView):
         )
         
         loans = Loans.objects.all()
+        snapshots = PortfolioDailySnapshot.objects.all()
 
         if hasattr(user, "role") and user.role == "MANAGER":
             loans = loans.filter(user__profile__branch_fk=user.branch_fk)
+            snapshots = snapshots.filter(branch=user.branch_fk)
         elif branch:
-            loans = loans.filter(user__profile__branch=branch) # fallback for text search
-
+            # Snapshot rows are keyed on the customer's branch_fk, so the
+            # live half filters on the same key
+            loans = loans.filter(user__profile__branch_fk__name=branch)
+            snapshots = snapshots.filter(branch__name=branch)
+
+        # Completed days come from the portfolio snapshot; only days after
+        # its last build (normally just today) are aggregated live. The
+        # snapshot has no officer dimension, so officers stay fully live.
+        cutoff = PortfolioSnapshotService.cutoff()
         if hasattr(user, "role") and user.role == "FIELD_OFFICER":
             loans = loans.filter(created_by=user)
+            snapshots = snapshots.none()
+            cutoff = datetime.date.min
+
+        snapshots = snapshots.filter(date__lt=cutoff)
+        live_loans = loans.filter(created_at__date__gte=cutoff)
 
-        monthly_stats = (
-            loans.annotate(month=TruncMonth("created_at"))
-            .values("month")
-            .annotate(total=Sum("principal_amount"), count=Count("id"))
-            .order_by("month")
+        monthly_stats = _merge_totals(
+            list(
+                snapshots.annotate(month=TruncMonth("date"))
+                .values("month")
+                .annotate(total=Sum("applied_amount"), count=Sum("applied_count"))
+            )
+            + list(
+                live_loans.annotate(month=TruncMonth("created_at"))
+                .values("month")
+                .annotate(total=Sum("principal_amount"), count=Count("id"))
+            ),
+            "month",
         )
 
-        daily_disbursements = (
-            loans.filter(status="DISBURSED")
-            .annotate(date=TruncDate("created_at"))
-            .values("date")
-            .annotate(total=Sum("principal_amount"), count=Count("id"))
-            .order_by("-date")[:30]
+        daily_disbursements = _merge_totals(
+            list(
+                snapshots.filter(disbursed_count__gt=0)
+                .values("date")
+                .annotate(total=Sum("disbursed_amount"), count=Sum("disbursed_count"))
+                .order_by("-date")[:30]
+            )
+            + list(
+                loans.filter(status__in=DISBURSED_STATUSES)
+                .annotate(date=TruncDate(disbursed_on()))
+                .filter(date__gte=cutoff)
+                .values("date")
+                .annotate(total=Sum("principal_amount"), count=Count("id"))
+            ),
+            "date",
         )
 
         status_stats = loans.values("status").annotate(count=Count("id"))
@@ -52,19 +103,19 @@ class LoanAnalyticsView(views.APIView):
         data = {
             "monthly_disbursements": [
                 {
-                    "month": stat["month"].strftime("%b"),
-                    "amount": float(stat["total"] or 0),
+                    "month": month.strftime("%b"),
+                    "amount": stat["total"],
                     "count": stat["count"],
                 }
-                for stat in monthly_stats
+                for month, stat in sorted(monthly_stats.items())
             ],
             "daily_disbursements": [
                 {
-                    "date": stat["date"].strftime("%Y-%m-%d"),
-                    "amount": float(stat["total"] or 0),
+                    "date": date.strftime("%Y-%m-%d"),
+                    "amount": stat["total"],
                     "count": stat["count"],
                 }
-                for stat in daily_disbursements
+                for date, stat in sorted(daily_disbursements.items(), reverse=True)[:30]
             ],
             "status_breakdown": [
                 {"name": stat["status"], "value": stat["count"]}
@@ -77,57 +128,63 @@ class LoanAnalyticsView(views.APIView):
 class FinanceAnalyticsView(views.APIView):
     permission_classes = [permissions.IsAuthenticated]
 
+    @cached_analytics("finance")
     def get(self, request):
         today = timezone.now().date()
 
         # Get Capital Balance
-        capital = SystemCapital.objects.filter(name="Simulation Capital").first()
-        balance = float(capital.balance) if capital else 0.0
+        balance = float(CapitalLedgerService.available_balance())
 
         # Last 60 days range
         sixty_days_ago = timezone.now() - timedelta(days=60)
 
+        # Completed days are read from the portfolio snapshot; anything from
+        # its last build onwards (normally just today) is aggregated live.
+        cutoff = PortfolioSnapshotService.cutoff()
+        snapshots = PortfolioDailySnapshot.objects.filter(date__lt=cutoff)
+        live_disbursed = (
+            Loans.objects.filter(status__in=DISBURSED_STATUSES)
+            .annotate(disbursed_on=disbursed_on())
+            .filter(disbursed_on__date__gte=cutoff)
+        )
+        live_repayments = Repayments.objects.filter(payment_date__date__gte=cutoff)
+
         # Money Out (Total Principal of Disbursed Loans - ONLY DISBURSED)
         # We include all statuses that represent funds already given to customers
-        disbursed_statuses = ["DISBURSED", "ACTIVE", "OVERDUE", "CLOSED", "REPAID"]
-        money_out_query = Loans.objects.filter(status__in=disbursed_statuses)
         money_out = (
-            money_out_query.aggregate(total=Sum("principal_amount"))["total"] or 0
+            (snapshots.aggregate(total=Sum("disbursed_amount"))["total"] or 0)
+            + (live_disbursed.aggregate(total=Sum("principal_amount"))["total"] or 0)
         )
 
         # Money In (Total amount repaid)
-        money_in = Repayments.objects.aggregate(total=Sum("amount_paid"))["total"] or 0
-
-        # Aging Report Analysis
-        # 1-30 days, 31-60 days, 61-90 days, 90+ days overdue
-        aging_30 = (
-            Loans.objects.filter(
-                status="OVERDUE",
-                repaymentschedule__due_date__lt=today,
-                repaymentschedule__due_date__gte=today - timedelta(days=30),
-            )
-            .distinct()
-            .aggregate(total=Sum("principal_amount"))["total"]
-            or 0
+        money_in = (
+            (snapshots.aggregate(total=Sum("repaid_amount"))["total"] or 0)
+            + (live_repayments.aggregate(total=Sum("amount_paid"))["total"] or 0)
         )
-        aging_60 = (
-            Loans.objects.filter(
-                status="OVERDUE",
-                repaymentschedule__due_date__lt=today - timedelta(days=30),
-                repaymentschedule__due_date__gte=today - timedelta(days=60),
+
+        # Aging Report Analysis: unpaid installment amounts of OVERDUE loans
+        # by how long ago they fell due (1-30 days, 31-60 days, 61+ days)
+        def aging(queryset, date_field, amount_field):
+            return queryset.aggregate(
+                days_30=Sum(amount_field, filter=Q(**{f"{date_field}__gte": today - timedelta(days=30)})),
+                days_60=Sum(amount_field, filter=Q(**{
+                    f"{date_field}__lt": today - timedelta(days=30),
+                    f"{date_field}__gte": today - timedelta(days=60),
+                })),
+                days_90=Sum(amount_field, filter=Q(**{f"{date_field}__lt": today - timedelta(days=60)})),
             )
-            .distinct()
-            .aggregate(total=Sum("principal_amount"))["total"]
-            or 0
+
+        snapshot_aging = aging(snapshots, "date", "overdue_amount")
+        live_aging = aging(
+            RepaymentSchedule.objects.filter(
+                is_paid=False, loan__status="OVERDUE", due_date__gte=cutoff, due_date__lt=today
+            ),
+            "due_date",
+            "amount_due",
         )
-        aging_90 = (
-            Loans.objects.filter(
-                status="OVERDUE",
-                repaymentschedule__due_date__lt=today - timedelta(days=60),
-            )
-            .distinct()
-            .aggregate(total=Sum("principal_amount"))["total"]
-            or 0
+        aging_30, aging_60, aging_90 = (
+            (snapshot_aging[k] or 0) + (live_aging[k] or 0)
+            for k in ("days_30", "days_60", "days_90")
         )
 
         # Rolling 15-day window for Line Charts (7 days history, Today, 7 days future)
@@ -135,19 +192,23 @@ class FinanceAnalyticsView(views.APIView):
         seven_days_future = today + timedelta(days=7)
 
         # Actuals (History)
+        snapshot_history = (
+            snapshots.filter(date__gte=seven_days_ago)
+            .values("date")
+            .annotate(disbursed=Sum("disbursed_amount"), repaid=Sum("repaid_amount"))
+        )
         actual_disbursements = (
-            Loans.objects.filter(
-                status__in=disbursed_statuses,
-                created_at__date__gte=seven_days_ago,
-                created_at__date__lte=today,
+            live_disbursed.filter(
+                disbursed_on__date__gte=seven_days_ago,
+                disbursed_on__date__lte=today,
             )
-            .annotate(date=TruncDate("created_at"))
+            .annotate(date=TruncDate("disbursed_on"))
             .values("date")
             .annotate(amount=Sum("principal_amount"))
         )
 
         actual_repayments = (
-            Repayments.objects.filter(
+            live_repayments.filter(
                 payment_date__date__gte=seven_days_ago, payment_date__date__lte=today
             )
             .annotate(date=TruncDate("payment_date"))
@@ -178,15 +239,21 @@ class FinanceAnalyticsView(views.APIView):
             }
             curr += timedelta(days=1)
 
+        for item in snapshot_history:
+            d_str = str(item["date"])[:10]
+            if d_str in timeline_map:
+                timeline_map[d_str]["disbursement"] += float(item["disbursed"] or 0)
+                timeline_map[d_str]["repayment"] += float(item["repaid"] or 0)
+
         for item in actual_disbursements:
             d_str = str(item["date"])[:10]
             if d_str in timeline_map:
-                timeline_map[d_str]["disbursement"] = float(item["amount"] or 0)
+                timeline_map[d_str]["disbursement"] += float(item["amount"] or 0)
 
         for item in actual_repayments:
             d_str = str(item["date"])[:10]
             if d_str in timeline_map:
-                timeline_map[d_str]["repayment"] = float(item["amount"] or 0)
+                timeline_map[d_str]["repayment"] += float(item["amount"] or 0)
 
         for item in scheduled_repayments:
             # schedule due_date is a date object
@@ -197,18 +264,23 @@ class FinanceAnalyticsView(views.APIView):
         # Weekly History for BarCharts (Last 10 weeks)
         ten_weeks_ago = today - timedelta(weeks=10)
 
+        snapshot_weekly = (
+            snapshots.filter(date__gte=ten_weeks_ago)
+            .annotate(week=TruncWeek("date"))
+            .values("week")
+            .annotate(disbursed=Sum("disbursed_amount"), repaid=Sum("repaid_amount"))
+        )
+
         weekly_disbursed_query = (
-            Loans.objects.filter(
-                status__in=disbursed_statuses, created_at__date__gte=ten_weeks_ago
-            )
-            .annotate(week=TruncWeek("created_at"))
+            live_disbursed.filter(disbursed_on__date__gte=ten_weeks_ago)
+            .annotate(week=TruncWeek("disbursed_on"))
             .values("week")
             .annotate(amount=Sum("principal_amount"))
             .order_by("week")
         )
 
         weekly_repaid_query = (
-            Repayments.objects.filter(payment_date__date__gte=ten_weeks_ago)
+            live_repayments.filter(payment_date__date__gte=ten_weeks_ago)
             .annotate(week=TruncWeek("payment_date"))
             .values("week")
             .annotate(amount=Sum("amount_paid"))
@@ -220,12 +292,17 @@ class FinanceAnalyticsView(views.APIView):
         weekly_repaid = []
 
         # Create a map of existing data for quick lookup
-        disp_map = {
-            str(x["week"])[:10]: float(x["amount"]) for x in weekly_disbursed_query
-        }
-        repay_map = {
-            str(x["week"])[:10]: float(x["amount"]) for x in weekly_repaid_query
-        }
+        disp_map, repay_map = {}, {}
+        for x in snapshot_weekly:
+            w_key = str(x["week"])[:10]
+            disp_map[w_key] = disp_map.get(w_key, 0.0) + float(x["disbursed"] or 0)
+            repay_map[w_key] = repay_map.get(w_key, 0.0) + float(x["repaid"] or 0)
+        for x in weekly_disbursed_query:
+            w_key = str(x["week"])[:10]
+            disp_map[w_key] = disp_map.get(w_key, 0.0) + float(x["amount"] or 0)
+        for x in weekly_repaid_query:
+            w_key = str(x["week"])[:10]
+            repay_map[w_key] = repay_map.get(w_key, 0.0) + float(x["amount"] or 0)
 
         for i in range(9, -1, -1):  # Last 10 weeks
             target_date = today - timedelta(weeks=i)
@@ -295,24 +372,32 @@ class FinanceAnalyticsView(views.APIView):
             for entry in ledger_entries
         ]
 
-        from ..models import LoanProducts, Users
-        product_dist = (
-            Loans.objects.filter(status__in=disbursed_statuses)
-            .values('loan_product__name')
-            .annotate(
-                value=Sum('principal_amount'),
-                count=Count('id')
+        from ..models import Users
+        product_dist = _merge_totals(
+            list(
+                snapshots.filter(disbursed_count__gt=0)
+                .values('loan_product__name')
+                .annotate(value=Sum('disbursed_amount'), count=Sum('disbursed_count'))
             )
-            .order_by('-value')
+            + list(
+                live_disbursed.values('loan_product__name')
+                .annotate(value=Sum('principal_amount'), count=Count('id'))
+            ),
+            'loan_product__name',
+            total='value',
+        )
+        product_distribution = sorted(
+            (
+                {
+                    'name': name or 'Unknown',
+                    'value': p['total'],
+                    'count': p['count']
+                }
+                for name, p in product_dist.items()
+            ),
+            key=lambda p: p['value'],
+            reverse=True,
         )
-        product_distribution = [
-            {
-                'name': p['loan_product__name'] or 'Unknown',
-                'value': float(p['value'] or 0),
-                'count': p['count']
-            }
-            for p in product_dist
-        ]
 
         total_customers = Users.objects.count()
         active_loans = Loans.objects.filter(
@@ -345,11 +430,11 @@ class FinanceAnalyticsView(views.APIView):
 class OwnerAnalyticsView(views.APIView):
     permission_classes = [permissions.IsAuthenticated]
 
+    @cached_analytics("owner")
     def get(self, request):
         if not getattr(request.user, 'is_owner', False):
             return Response({"error": "Owner only."}, status=403)
 
-        from django.db.models.functions import TruncMonth, TruncDate
         today = timezone.now().date()
         thirty_days_ago = today - timedelta(days=30)
         disbursed_statuses = [
@@ -360,31 +445,50 @@ class OwnerAnalyticsView(views.APIView):
             Loans, Repayments, Users, Admins, Branch, SystemCapital, RepaymentSchedule
         )
 
+        # Every section below runs a fixed number of grouped queries, however
+        # many branches and staff exist.
+        from django.db.models import OuterRef, Subquery, FloatField
+        from django.db.models.functions import Cast
+        from ..models import AuditLogs
+
+        recently_updated = Q(updated_at__date__gte=thirty_days_ago)
+        portfolio_statuses = ['DISBURSED', 'ACTIVE', 'OVERDUE']
+
         # --- BRANCH PERFORMANCE ---
-        branches = Branch.objects.all()
-        branch_performance = []
-        for branch in branches:
-            branch_loans = Loans.objects.filter(
-                branch=branch,
-                status__in=disbursed_statuses
-            )
-            branch_overdue = branch_loans.filter(
-                status='OVERDUE')
-            branch_repayments = Repayments.objects.filter(
-                loan__branch=branch
+        branch_loan_totals = {
+            row['branch_id']: row
+            for row in Loans.objects.filter(branch__isnull=False)
+            .values('branch_id')
+            .annotate(
+                total_loans=Count('id', filter=Q(status__in=disbursed_statuses)),
+                principal=Sum('principal_amount', filter=Q(status__in=disbursed_statuses)),
+                overdue_count=Count('id', filter=Q(status='OVERDUE')),
+                overdue_amount=Sum('principal_amount', filter=Q(status='OVERDUE')),
+                loans_approved=Count('id', filter=Q(
+                    status__in=['APPROVED', 'DISBURSED', 'ACTIVE', 'OVERDUE', 'CLOSED']
+                ) & recently_updated),
+                loans_rejected=Count('id', filter=Q(status='REJECTED') & recently_updated),
+                portfolio=Sum('principal_amount', filter=Q(status__in=portfolio_statuses)),
             )
-            principal = branch_loans.aggregate(
-                t=Sum('principal_amount'))['t'] or 0
-            collected = branch_repayments.aggregate(
-                t=Sum('amount_paid'))['t'] or 0
-            overdue_amt = branch_overdue.aggregate(
-                t=Sum('principal_amount'))['t'] or 0
+        }
+        branch_collected = dict(
+            Repayments.objects.filter(loan__branch__isnull=False)
+            .values('loan__branch_id')
+            .annotate(t=Sum('amount_paid'))
+            .values_list('loan__branch_id', 't')
+        )
+
+        branch_performance = []
+        for branch in Branch.objects.all():
+            totals = branch_loan_totals.get(branch.id, {})
+            principal = totals.get('principal') or 0
+            overdue_amt = totals.get('overdue_amount') or 0
             branch_performance.append({
                 'branch': branch.name,
-                'total_loans': branch_loans.count(),
+                'total_loans': totals.get('total_loans', 0),
                 'principal_disbursed': float(principal),
-                'total_collected': float(collected),
-                'overdue_count': branch_overdue.count(),
+                'total_collected': float(branch_collected.get(branch.id) or 0),
+                'overdue_count': totals.get('overdue_count', 0),
                 'overdue_amount': float(overdue_amt),
                 'overdue_rate': round(
                     (float(overdue_amt) / float(principal) * 100)
@@ -392,136 +496,126 @@ class OwnerAnalyticsView(views.APIView):
             })
 
         # --- STAFF PERFORMANCE DATA ---
-        
+
         # --- FIELD OFFICER PERFORMANCE ---
-        field_officers = Admins.objects.filter(role='FIELD_OFFICER')
-        field_officer_stats = []
-        for officer in field_officers:
-            loans_submitted = Loans.objects.filter(
-                created_by=officer,
-                created_at__date__gte=thirty_days_ago
-            ).count()
-            loans_verified = Loans.objects.filter(
-                created_by=officer,
-                status__in=['VERIFIED','APPROVED','DISBURSED',
-                            'ACTIVE','OVERDUE','CLOSED'],
-                updated_at__date__gte=thirty_days_ago
-            ).count()
-            customers_registered = Users.objects.filter(
-                created_by=officer,
+        officer_loan_totals = {
+            row['created_by_id']: row
+            for row in Loans.objects.filter(created_by__role='FIELD_OFFICER')
+            .values('created_by_id')
+            .annotate(
+                loans_submitted=Count('id', filter=Q(created_at__date__gte=thirty_days_ago)),
+                loans_verified=Count('id', filter=Q(
+                    status__in=['VERIFIED', 'APPROVED', 'DISBURSED', 'ACTIVE', 'OVERDUE', 'CLOSED']
+                ) & recently_updated),
+                overdue_count=Count('id', filter=Q(status='OVERDUE')),
+                total_portfolio=Sum('principal_amount', filter=Q(status__in=portfolio_statuses)),
+            )
+        }
+        customers_registered = dict(
+            Users.objects.filter(
+                created_by__role='FIELD_OFFICER',
                 created_at__date__gte=thirty_days_ago
-            ).count()
-            overdue_count = Loans.objects.filter(
-                created_by=officer, status='OVERDUE'
-            ).count()
-            total_portfolio = Loans.objects.filter(
-                created_by=officer,
-                status__in=['DISBURSED','ACTIVE','OVERDUE']
-            ).aggregate(t=Sum('principal_amount'))['t'] or 0
+            )
+            .values('created_by_id')
+            .annotate(c=Count('id'))
+            .values_list('created_by_id', 'c')
+        )
+
+        field_officer_stats = []
+        for officer in Admins.objects.filter(role='FIELD_OFFICER').select_related('branch_fk'):
+            totals = officer_loan_totals.get(officer.id, {})
             field_officer_stats.append({
                 'name': officer.full_name,
                 'email': officer.email,
                 'branch': officer.branch_fk.name
                     if officer.branch_fk else 'N/A',
-                'customers_registered': customers_registered,
-                'loans_submitted': loans_submitted,
-                'loans_verified': loans_verified,
-                'overdue_loans': overdue_count,
-                'total_portfolio': float(total_portfolio),
+                'customers_registered': customers_registered.get(officer.id, 0),
+                'loans_submitted': totals.get('loans_submitted', 0),
+                'loans_verified': totals.get('loans_verified', 0),
+                'overdue_loans': totals.get('overdue_count', 0),
+                'total_portfolio': float(totals.get('total_portfolio') or 0),
                 'last_active': 'N/A',
             })
 
         # --- MANAGER PERFORMANCE ---
-        managers = Admins.objects.filter(role='MANAGER')
+        officers_per_branch = dict(
+            Admins.objects.filter(role='FIELD_OFFICER', branch_fk__isnull=False)
+            .values('branch_fk_id')
+            .annotate(c=Count('id'))
+            .values_list('branch_fk_id', 'c')
+        )
+
         manager_stats = []
-        for manager in managers:
+        for manager in Admins.objects.filter(role='MANAGER').select_related('branch_fk'):
             branch = manager.branch_fk
-            branch_loans = Loans.objects.filter(
-                branch=branch) if branch else Loans.objects.none()
-            loans_approved = branch_loans.filter(
-                status__in=['APPROVED','DISBURSED','ACTIVE',
-                            'OVERDUE','CLOSED'],
-                updated_at__date__gte=thirty_days_ago
-            ).count()
-            loans_rejected = Loans.objects.filter(
-                status='REJECTED',
-                updated_at__date__gte=thirty_days_ago,
-                branch=branch
-            ).count() if branch else 0
-            overdue_in_branch = branch_loans.filter(
-                status='OVERDUE').count()
-            officers_under = Admins.objects.filter(
-                role='FIELD_OFFICER',
-                branch_fk=branch
-            ).count() if branch else 0
-            total_branch_portfolio = branch_loans.filter(
-                status__in=['DISBURSED','ACTIVE','OVERDUE']
-            ).aggregate(t=Sum('principal_amount'))['t'] or 0
+            totals = branch_loan_totals.get(branch.id, {}) if branch else {}
             manager_stats.append({
                 'name': manager.full_name,
                 'email': manager.email,
                 'branch': branch.name if branch else 'N/A',
-                'loans_approved': loans_approved,
-                'loans_rejected': loans_rejected,
-                'overdue_in_branch': overdue_in_branch,
-                'field_officers_count': officers_under,
-                'branch_portfolio': float(total_branch_portfolio),
+                'loans_approved': totals.get('loans_approved', 0),
+                'loans_rejected': totals.get('loans_rejected', 0),
+                'overdue_in_branch': totals.get('overdue_count', 0),
+                'field_officers_count': officers_per_branch.get(branch.id, 0) if branch else 0,
+                'branch_portfolio': float(totals.get('portfolio') or 0),
                 'last_active': 'N/A',
             })
 
-        from django.db.models.functions import Cast
-        from django.db.models import FloatField
         # --- FINANCE OFFICER PERFORMANCE ---
-        finance_officers = Admins.objects.filter(
-            role='FINANCIAL_OFFICER')
-        finance_stats = []
-        for fo in finance_officers:
-            from ..models import AuditLogs
-            loans_disbursed = AuditLogs.objects.filter(
-                admin=fo,
-                action='LOAN_DISBURSED',
+        disbursed_action = Q(action='LOAN_DISBURSED')
+        assigned_action = Q(log_type='MANAGEMENT', action__icontains='assigned')
+        finance_totals = {
+            row['admin_id']: row
+            for row in AuditLogs.objects.filter(
+                admin__role='FINANCIAL_OFFICER',
                 created_at__date__gte=thirty_days_ago
-            ).count()
-            total_disbursed_amt = AuditLogs.objects.filter(
-                admin=fo,
-                action='LOAN_DISBURSED',
-                created_at__date__gte=thirty_days_ago
-            ).annotate(
-                amt=Cast(F('new_data__amount'), FloatField())
-            ).aggregate(
-                t=Sum('amt')
-            )['t'] or 0
-            unmatched_resolved = AuditLogs.objects.filter(
-                admin=fo,
-                log_type='MANAGEMENT',
-                action__icontains='assigned',
-                created_at__date__gte=thirty_days_ago
-            ).count()
+            )
+            .filter(disbursed_action | assigned_action)
+            .values('admin_id')
+            .annotate(
+                loans_disbursed=Count('id', filter=disbursed_action),
+                total_disbursed_amount=Sum(
+                    Cast(F('new_data__amount'), FloatField()), filter=disbursed_action
+                ),
+                unmatched_resolved=Count('id', filter=assigned_action),
+            )
+        }
+
+        finance_stats = []
+        for fo in Admins.objects.filter(role='FINANCIAL_OFFICER'):
+            totals = finance_totals.get(fo.id, {})
             finance_stats.append({
                 'name': fo.full_name,
                 'email': fo.email,
-                'loans_disbursed': loans_disbursed,
+                'loans_disbursed': totals.get('loans_disbursed', 0),
                 'total_disbursed_amount': float(
-                    total_disbursed_amt),
-                'unmatched_resolved': unmatched_resolved,
+                    totals.get('total_disbursed_amount') or 0),
+                'unmatched_resolved': totals.get('unmatched_resolved', 0),
                 'last_active': 'N/A',
             })
 
         # --- ADMIN PERFORMANCE ---
-        admins_list = Admins.objects.filter(role='ADMIN')
+        invite_totals = {
+            row['invited_by_id']: row
+            for row in Admins.objects.filter(
+                invited_by__role='ADMIN',
+                role__in=['MANAGER', 'FIELD_OFFICER']
+            )
+            .values('invited_by_id')
+            .annotate(
+                managers_invited=Count('id', filter=Q(role='MANAGER')),
+                officers_invited=Count('id', filter=Q(role='FIELD_OFFICER')),
+            )
+        }
+
         admin_stats = []
-        for admin in admins_list:
-            managers_invited = Admins.objects.filter(
-                invited_by=admin, role='MANAGER'
-            ).count()
-            officers_invited = Admins.objects.filter(
-                invited_by=admin, role='FIELD_OFFICER'
-            ).count()
+        for admin in Admins.objects.filter(role='ADMIN'):
+            totals = invite_totals.get(admin.id, {})
             admin_stats.append({
                 'name': admin.full_name,
                 'email': admin.email,
-                'managers_invited': managers_invited,
-                'officers_invited': officers_invited,
+                'managers_invited': totals.get('managers_invited', 0),
+                'officers_invited': totals.get('officers_invited', 0),
                 'last_active': 'N/A',
             })
 
@@ -529,10 +623,16 @@ class OwnerAnalyticsView(views.APIView):
         staff_activity = field_officer_stats
 
         # --- OVERDUE TRACKER ---
+        last_repayment = Repayments.objects.filter(
+            loan=OuterRef('pk')
+        ).order_by('-payment_date')
         overdue_loans_qs = Loans.objects.filter(
             status='OVERDUE'
         ).select_related(
             'user', 'branch', 'created_by'
+        ).annotate(
+            last_payment_date=Subquery(last_repayment.values('payment_date')[:1]),
+            last_payment_amount=Subquery(last_repayment.values('amount_paid')[:1]),
         ).order_by('updated_at')
 
         overdue_tracker = []
@@ -542,10 +642,6 @@ class OwnerAnalyticsView(views.APIView):
             except (AttributeError, TypeError):
                 days_overdue = 0
 
-            last_repayment = Repayments.objects.filter(
-                loan=loan
-            ).order_by('-payment_date').first()
-
             overdue_tracker.append({
                 'loan_id': str(loan.id) if loan.id else "N/A",
                 'customer': loan.user.full_name
@@ -558,12 +654,11 @@ class OwnerAnalyticsView(views.APIView):
                     if loan.created_by else 'N/A',
                 'principal': float(loan.principal_amount or 0),
                 'days_overdue': days_overdue,
-                'last_payment_date': last_repayment.payment_date
+                'last_payment_date': loan.last_payment_date
                     .strftime('%Y-%m-%d')
-                    if (last_repayment and last_repayment.payment_date) else 'Never',
+                    if loan.last_payment_date else 'Never',
                 'last_payment_amount': float(
-                    last_repayment.amount_paid or 0)
-                    if last_repayment else 0,
+                    loan.last_payment_amount or 0),
             })
 
         # --- CUSTOMER GROWTH (last 12 months) ---
@@ -615,8 +710,8 @@ class OwnerAnalyticsView(views.APIView):
                 due_date__gte=today,
                 due_date__lte=thirty_days_future
             )
-            .annotate(day=TruncDate('due_date'))
-            .values('day')
+            # due_date is already a date; TruncDate on it fails on SQLite
+            .values(day=F('due_date'))
             .annotate(expected=Sum('amount_due'))
             .order_by('day')
         )
@@ -631,13 +726,13 @@ class OwnerAnalyticsView(views.APIView):
         # --- ALERTS ---
         alerts = []
         try:
-            capital = SystemCapital.objects.filter(
-                name='Simulation Capital').first()
-            if capital and float(capital.balance) < 50000:
+            capital = CapitalLedgerService.get_account()
+            capital_balance = float(CapitalLedgerService.available_balance(capital)) if capital else 0
+            if capital and capital_balance < 50000:
                 alerts.append({
                     'type': 'warning',
                     'message': f'Capital balance is low: '
-                        f'KES {float(capital.balance):,.0f}',
+                        f'KES {capital_balance:,.0f}',
                     'category': 'capital'
                 })
         except Exception:
@@ -678,3 +773,26 @@ class OwnerAnalyticsView(views.APIView):
             'cashflow_projection': cashflow_projection,
             'alerts': alerts,
         })
+
+
+class AnalyticsCacheStatsView(views.APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        if not (getattr(request.user, 'is_owner', False) or getattr(request.user, 'is_super_admin', False)):
+            return Response({"error": "Owner or Super Admin only."}, status=403)
+        return Response(analytics_cache_stats())
+
+
+class RequestProfileStatsView(views.APIView):
+    """Per-endpoint latency histograms from RequestProfilingMiddleware; ?windows=N limits the look-back."""
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        if not (getattr(request.user, 'is_owner', False) or getattr(request.user, 'is_super_admin', False)):
+            return Response({"error": "Owner or Super Admin only."}, status=403)
+        try:
+            windows = int(request.query_params.get('windows', 0)) or None
+        except ValueError:
+            return Response({"error": "windows must be an integer."}, status=400)
+        return Response({"enabled": settings.REQUEST_PROFILING, **endpoint_stats(windows)})
@@ -0,0 +1,24 @@
+import importlib
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from apps.benchmarks import BENCHMARKS
+
+
+class Command(BaseCommand):
+    help = 'Runs a named micro-benchmark and prints its results as JSON'
+
+    def add_arguments(self, parser):
+        subparsers = parser.add_subparsers(dest='benchmark', required=True)
+        for name, module_path in BENCHMARKS.items():
+            module = importlib.import_module(module_path)
+            sub = subparsers.add_parser(name, help=(module.__doc__ or '').strip().splitlines()[0])
+            module.add_arguments(sub)
+
+    def handle(self, *args, **options):
+        name = options.pop('benchmark')
+        if name not in BENCHMARKS:
+            raise CommandError(f'Unknown benchmark: {name}')
+        module = importlib.import_module(BENCHMARKS[name])
+        results = module.run(**options)
+        self.stdout.write(json.dumps({'benchmark': name, 'results': results}, indent=2, sort_keys=True, default=str))
@@ -0,0 +1,19 @@
+import time
+
+from django.core.management.base import BaseCommand
+from apps.services import PortfolioSnapshotService
+
+
+class Command(BaseCommand):
+    help = 'Incrementally rebuilds the portfolio_daily_snapshot table used by the analytics dashboards'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Rebuild every day instead of only touched days')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        days, rows = PortfolioSnapshotService.build(full=options['full'])
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Portfolio snapshot: {days} days rebuilt ({rows} rows) in {elapsed:.2f}s'
+        ))
@@ -1,11 +1,63 @@
+import time
+from datetime import timedelta
+from decimal import Decimal, InvalidOperation
+
 from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import (
+    DateTimeField, DurationField, Exists, ExpressionWrapper, F, OuterRef, Q, Value,
+)
+from django.db.models.functions import Coalesce
 from django.utils import timezone
-from apps.models import Loans, AuditLogs
+from apps.models import Loans, AuditLogs, RepaymentSchedule, StaffNotification, SystemSettings
+
+
+def overdue_loan_ids(today):
+    """
+    IDs of ACTIVE/DISBURSED loans that Loans.is_overdue would flag, found in a
+    single query: an unpaid installment past due, or disbursed_at + tenure
+    (weeks, else months * 30 days) already behind us.
+    """
+    duration = DurationField()
+    tenure = Coalesce(
+        ExpressionWrapper(F('duration_weeks') * Value(timedelta(weeks=1)), output_field=duration),
+        ExpressionWrapper(F('duration_months') * Value(timedelta(days=30)), output_field=duration),
+        Value(timedelta(0)),
+        output_field=duration,
+    )
+    unpaid_past_due = RepaymentSchedule.objects.filter(
+        loan=OuterRef('pk'), due_date__lt=today, is_paid=False
+    )
+    return list(
+        Loans.objects.filter(status__in=['ACTIVE', 'DISBURSED'])
+        .annotate(
+            tenure_end=ExpressionWrapper(F('disbursed_at') + tenure, output_field=DateTimeField())
+        )
+        .filter(
+            Q(Exists(unpaid_past_due))
+            | Q(disbursed_at__isnull=False, tenure_end__date__lt=today)
+        )
+        .values_list('id', flat=True)
+    )
+
 
 class Command(BaseCommand):
     help = 'Mark overdue loans automatically'
 
-    def handle(self, *args, **kwargs):
+    def add_arguments(self, parser):
+        parser.add_argument('--bulk', action='store_true', help='Set-based mode for large portfolios')
+        parser.add_argument('--chunk-size', type=int, default=500, help='Loans per transaction in --bulk mode')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        if options['bulk']:
+            count = self.mark_overdue_bulk(options['chunk_size'])
+        else:
+            count = self.mark_overdue()
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(f'{count} loans marked overdue in {elapsed:.2f}s'))
+
+    def mark_overdue(self):
         active_loans = Loans.objects.filter(status__in=['ACTIVE', 'DISBURSED'])
         count = 0
         for loan in active_loans:
@@ -24,4 +76,83 @@ class Command(BaseCommand):
                     new_data={"status": "OVERDUE"}
                 )
                 count += 1
-        self.stdout.write(self.style.SUCCESS(f'{count} loans marked overdue'))
+        return count
+
+    def mark_overdue_bulk(self, chunk_size):
+        from apps.services import customer_overdue_message
+
+        now = timezone.now()
+        loan_ids = overdue_loan_ids(now.date())
+
+        penalty_rate = None
+        setting = SystemSettings.objects.filter(key="OVERDUE_PENALTY_RATE").first()
+        if setting is not None:
+            try:
+                penalty_rate = Decimal(str(setting.value))
+            except (InvalidOperation, ValueError, TypeError):
+                pass
+
+        # Same dedupe window as create_staff_notification: one unread alert per
+        # officer per hour.
+        notified = set(
+            StaffNotification.objects.filter(
+                notification_type='CUSTOMER_OVERDUE',
+                is_read=False,
+                created_at__gte=now - timedelta(hours=1),
+            ).values_list('recipient_id', flat=True)
+        )
+
+        count = 0
+        for start in range(0, len(loan_ids), chunk_size):
+            chunk = loan_ids[start:start + chunk_size]
+            with transaction.atomic():
+                # Re-check the status under the lock; a repayment may have landed
+                # since the candidate query ran.
+                loans = list(
+                    Loans.objects.select_for_update(of=('self',))
+                    .select_related('user')
+                    .filter(id__in=chunk, status__in=['ACTIVE', 'DISBURSED'])
+                )
+                audit_rows, notifications = [], []
+                for loan in loans:
+                    old_status = loan.status
+                    loan.status = 'OVERDUE'
+                    if not loan.base_interest_rate and loan.interest_rate:
+                        loan.base_interest_rate = loan.interest_rate
+                    if penalty_rate is not None:
+                        loan.interest_rate = (loan.base_interest_rate or loan.interest_rate or 0) + penalty_rate
+                    loan.updated_at = now
+                    audit_rows.append(AuditLogs(
+                        action=f"Loan {loan.id.hex[:8]} automatically marked OVERDUE",
+                        log_type="STATUS",
+                        table_name="loans",
+                        record_id=loan.id,
+                        old_data={"status": old_status},
+                        new_data={"status": "OVERDUE"},
+                        created_at=now,
+                    ))
+                    if loan.created_by_id and loan.created_by_id not in notified:
+                        notified.add(loan.created_by_id)
+                        title, message = customer_overdue_message(loan)
+                        notifications.append(StaffNotification(
+                            recipient_id=loan.created_by_id,
+                            notification_type='CUSTOMER_OVERDUE',
+                            priority='HIGH',
+                            title=title,
+                            message=message,
+                            created_at=now,
+                        ))
+
+                Loans.objects.bulk_update(
+                    loans, ['status', 'interest_rate', 'base_interest_rate', 'updated_at'], batch_size=chunk_size
+                )
+                AuditLogs.objects.bulk_create(audit_rows, batch_size=chunk_size)
+                StaffNotification.objects.bulk_create(notifications, batch_size=chunk_size)
+            count += len(loans)
+            self.stdout.write(f'  {count}/{len(loan_ids)} processed')
+
+        if count:
+            # bulk_update bypasses Loans.save(), which normally does this
+            from apps.utils.cache import bump_analytics_generation
+            bump_analytics_generation()
+        return count
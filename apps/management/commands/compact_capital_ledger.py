@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from apps.services import CapitalLedgerService
+
+
+class Command(BaseCommand):
+    help = 'Folds pending capital ledger entries (APPEND_ONLY mode) into the capital balance'
+
+    def handle(self, *args, **options):
+        count, total = CapitalLedgerService.compact()
+        balance = CapitalLedgerService.available_balance()
+        self.stdout.write(self.style.SUCCESS(
+            f'Compacted {count} ledger entries (KES {float(total):,.2f}). Balance: KES {float(balance):,.2f}'
+        ))
@@ -1,27 +1,39 @@
+from collections import defaultdict
+
 from django.core.management.base import BaseCommand
+from django.db.models import Count, Max
 from django.utils import timezone
 from datetime import timedelta
 from apps.models import (
-    Admins, Loans, SystemCapital, SystemSettings, 
-    StaffNotification, PaybillTransaction
+    Admins, Loans, SystemSettings,
+    PaybillTransaction
 )
-from apps.services import create_staff_notification
+from apps.services import StaffNotificationBatch
 
 class Command(BaseCommand):
     help = 'Generate periodic staff notifications for queues and thresholds'
 
     def handle(self, *args, **kwargs):
+        # Every check adds to one batch: one dedupe query, one bulk insert
+        self.batch = StaffNotificationBatch()
+        self.managers = list(
+            Admins.objects.filter(role='MANAGER', is_blocked=False).only('id', 'branch_fk')
+        )
+        self.finance = list(
+            Admins.objects.filter(role='FINANCIAL_OFFICER', is_blocked=False).values_list('id', flat=True)
+        )
         self.check_capital()
-        self.check_verification_backlog()
+        self.check_branch_queues()
         self.check_loans_stuck()
-        self.check_overdue_spike()
         self.check_unmatched_repayments()
         self.check_disbursement_queue()
         self.check_officer_inactivity()
-        self.stdout.write(self.style.SUCCESS('Notification sweep complete'))
+        created = self.batch.save()
+        self.stdout.write(self.style.SUCCESS(f'Notification sweep complete ({created} created)'))
 
     def check_capital(self):
-        capital = SystemCapital.objects.first()
+        from apps.services import CapitalLedgerService
+        capital = CapitalLedgerService.get_account()
         if not capital:
             return
         try:
@@ -33,26 +45,36 @@ class Command(BaseCommand):
         except:
             critical_threshold = 10000
 
-        balance = float(capital.balance)
+        balance = float(CapitalLedgerService.available_balance(capital))
         if balance <= low_threshold:
             from apps.services import notify_capital_low
-            notify_capital_low(balance, low_threshold, critical_threshold)
+            notify_capital_low(balance, low_threshold, critical_threshold, batch=self.batch)
 
-    def check_verification_backlog(self):
-        # Notify managers when they have >10 UNVERIFIED loans in their branch
-        managers = Admins.objects.filter(role='MANAGER', is_blocked=False)
-        for manager in managers:
-            count = Loans.objects.filter(
-                status='UNVERIFIED',
-                created_by__branch_fk=manager.branch_fk
-            ).count()
+    def check_branch_queues(self):
+        # Per-branch UNVERIFIED and OVERDUE counts in one grouped query:
+        # managers hear about >10 loans awaiting verification and >=5 overdue
+        counts = {
+            (row['created_by__branch_fk'], row['status']): row['n']
+            for row in Loans.objects.filter(status__in=['UNVERIFIED', 'OVERDUE'])
+            .values('created_by__branch_fk', 'status').annotate(n=Count('id')).order_by()
+        }
+        for manager in self.managers:
+            count = counts.get((manager.branch_fk_id, 'UNVERIFIED'), 0)
             if count > 10:
-                create_staff_notification(
+                self.batch.add(
                     manager, 'VERIFICATION_BACKLOG',
                     f'Verification Queue Backlog — {count} Loans Pending',
                     f'You have {count} loans awaiting verification in your branch. Please review them to avoid delays.',
                     priority='HIGH'
                 )
+            count = counts.get((manager.branch_fk_id, 'OVERDUE'), 0)
+            if count >= 5:
+                self.batch.add(
+                    manager, 'OVERDUE_SPIKE',
+                    f'Overdue Alert — {count} Overdue Loans in Your Branch',
+                    f'Your branch currently has {count} overdue loans. Please coordinate with your field officers to follow up with customers.',
+                    priority='HIGH'
+                )
 
     def check_loans_stuck(self):
         # Notify admins when loans are stuck UNVERIFIED or VERIFIED for >48 hours
@@ -62,32 +84,16 @@ class Command(BaseCommand):
             created_at__lte=threshold
         ).count()
         if stuck > 0:
-            admins = Admins.objects.filter(role__in=['ADMIN', 'SUPER_ADMIN'], is_blocked=False)
-            owners = Admins.objects.filter(is_owner=True, is_blocked=False)
+            admins = Admins.objects.filter(role__in=['ADMIN', 'SUPER_ADMIN'], is_blocked=False).values_list('id', flat=True)
+            owners = Admins.objects.filter(is_owner=True, is_blocked=False).values_list('id', flat=True)
             for r in list(admins) + list(owners):
-                create_staff_notification(
+                self.batch.add(
                     r, 'LOANS_STUCK',
                     f'{stuck} Loan(s) Stuck in Pipeline (>48hrs)',
                     f'{stuck} loan(s) have been sitting in UNVERIFIED or VERIFIED status for more than 48 hours. Investigate immediately.',
                     priority='HIGH'
                 )
 
-    def check_overdue_spike(self):
-        # Notify managers and admins when overdue loans exceed 5 in their branch
-        managers = Admins.objects.filter(role='MANAGER', is_blocked=False)
-        for manager in managers:
-            count = Loans.objects.filter(
-                status='OVERDUE',
-                created_by__branch_fk=manager.branch_fk
-            ).count()
-            if count >= 5:
-                create_staff_notification(
-                    manager, 'OVERDUE_SPIKE',
-                    f'Overdue Alert — {count} Overdue Loans in Your Branch',
-                    f'Your branch currently has {count} overdue loans. Please coordinate with your field officers to follow up with customers.',
-                    priority='HIGH'
-                )
-
     def check_unmatched_repayments(self):
         # Notify finance officers when unmatched repayments sit >24 hours
         threshold = timezone.now() - timedelta(hours=24)
@@ -99,9 +105,8 @@ class Command(BaseCommand):
         except:
             return
         if count > 0:
-            finance = Admins.objects.filter(role='FINANCIAL_OFFICER', is_blocked=False)
-            for r in finance:
-                create_staff_notification(
+            for r in self.finance:
+                self.batch.add(
                     r, 'UNMATCHED_REPAYMENTS',
                     f'{count} Unmatched Repayment(s) Sitting >24hrs',
                     f'{count} M-Pesa transaction(s) have not been matched to any loan for over 24 hours. Please review the unmatched queue.',
@@ -112,9 +117,8 @@ class Command(BaseCommand):
         # Notify finance officers when approved loans are waiting disbursement
         count = Loans.objects.filter(status='APPROVED').count()
         if count > 0:
-            finance = Admins.objects.filter(role='FINANCIAL_OFFICER', is_blocked=False)
-            for r in finance:
-                create_staff_notification(
+            for r in self.finance:
+                self.batch.add(
                     r, 'DISBURSEMENT_QUEUE',
                     f'{count} Loan(s) Awaiting Disbursement',
                     f'There are {count} approved loan(s) in the disbursement queue waiting to be processed.',
@@ -122,24 +126,24 @@ class Command(BaseCommand):
                 )
 
     def check_officer_inactivity(self):
-        # Notify managers when a field officer hasn't submitted any loan in 7 days
+        # Notify managers when a field officer hasn't submitted any loan in 7 days;
+        # each officer's latest loan comes from a single Max annotation
         threshold = timezone.now() - timedelta(days=7)
-        managers = Admins.objects.filter(role='MANAGER', is_blocked=False)
-        for manager in managers:
-            officers = Admins.objects.filter(
-                role='FIELD_OFFICER',
-                branch_fk=manager.branch_fk,
-                is_blocked=False
-            )
-            for officer in officers:
-                recent_activity = Loans.objects.filter(
-                    created_by=officer,
-                    created_at__gte=threshold
-                ).exists()
-                if not recent_activity:
-                    create_staff_notification(
-                        manager, 'OFFICER_INACTIVE',
-                        f'Field Officer Inactive — {officer.full_name}',
-                        f'{officer.full_name} has not submitted any loans in the last 7 days. Please check in with them.',
-                        priority='LOW'
-                    )
+        inactive = defaultdict(list)
+        officers = (
+            Admins.objects.filter(role='FIELD_OFFICER', is_blocked=False)
+            .annotate(last_loan_at=Max('processed_loans__created_at'))
+            .values_list('branch_fk', 'full_name', 'last_loan_at')
+            .order_by('full_name')
+        )
+        for branch_id, full_name, last_loan_at in officers:
+            if last_loan_at is None or last_loan_at < threshold:
+                inactive[branch_id].append(full_name)
+        for manager in self.managers:
+            for full_name in inactive.get(manager.branch_fk_id, []):
+                self.batch.add(
+                    manager, 'OFFICER_INACTIVE',
+                    f'Field Officer Inactive — {full_name}',
+                    f'{full_name} has not submitted any loans in the last 7 days. Please check in with them.',
+                    priority='LOW'
+                )
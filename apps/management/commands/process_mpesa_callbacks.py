@@ -0,0 +1,31 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from apps.services import MpesaCallbackService
+
+
+class Command(BaseCommand):
+    help = 'Applies stored M-Pesa callbacks that are still pending or failed (see MpesaCallbackService)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=settings.MPESA_CALLBACK_WORKERS, help='Callbacks applied concurrently')
+        parser.add_argument('--batch-size', type=int, default=500, help='Callbacks picked up per pass')
+        parser.add_argument('--loop', action='store_true', help='Keep polling instead of exiting once the queue is empty')
+        parser.add_argument('--interval', type=float, default=2.0, help='Seconds to sleep between passes with --loop')
+
+    def handle(self, *args, **options):
+        total_processed = total_failed = 0
+        while True:
+            processed, failed = MpesaCallbackService.drain(
+                workers=options['workers'], batch_size=options['batch_size']
+            )
+            total_processed += processed
+            total_failed += failed
+            if processed or failed:
+                self.stdout.write(f'Applied {processed} callbacks, {failed} failed.')
+            if not options['loop']:
+                break
+            if not (processed or failed):
+                time.sleep(options['interval'])
+        self.stdout.write(self.style.SUCCESS(f'Done: {total_processed} applied, {total_failed} failed.'))
@@ -1,25 +1,77 @@
+from django.conf import settings
 from django.core.management.base import BaseCommand
 from django.utils import timezone
 from datetime import timedelta
-from apps.models import AuditLogs
+from apps.models import AuditLogs, BackgroundJob, BackgroundJobRun, DataExport, EmailLog, SMSLog
+from apps.utils.partitions import (
+    PARTITIONED_TABLES, ensure_partitions, is_partitioned, purge_default_partition, retire_partitions,
+)
+
+LOG_MODELS = {model._meta.db_table: model for model in (AuditLogs, SMSLog, EmailLog)}
+
+
+def delete_in_batches(queryset, batch_size):
+    """Deletes by primary key in short transactions instead of one huge DELETE."""
+    total = 0
+    while True:
+        ids = list(queryset.values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            return total
+        count, _ = queryset.model.objects.filter(pk__in=ids).delete()
+        total += count
+
 
 class Command(BaseCommand):
-    help = 'Purges old audit logs to keep the database size manageable'
+    help = 'Applies log retention: drops whole monthly partitions on PostgreSQL, batched deletes elsewhere'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.AUDIT_RETENTION_DAYS, help='Retention window in days')
+        parser.add_argument('--archive', action='store_true', help='Detach expired partitions but keep them as standalone tables')
+        parser.add_argument('--months-ahead', type=int, default=3, help='Monthly partitions to keep created ahead of time')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Rows per DELETE on unpartitioned tables')
 
     def handle(self, *args, **options):
+        now = timezone.now()
+
         # 1. Purge generic system logs older than 30 days
-        thirty_days_ago = timezone.now() - timedelta(days=30)
         system_logs = AuditLogs.objects.filter(
-            action_type__in=['SYSTEM_START', 'SYSTEM_CLEANUP', 'TASK_COMPLETED'],
-            created_at__lt=thirty_days_ago
+            action__in=['SYSTEM_START', 'SYSTEM_CLEANUP', 'TASK_COMPLETED'],
+            created_at__lt=now - timedelta(days=30),
         )
-        count, _ = system_logs.delete()
+        count = delete_in_batches(system_logs, options['batch_size'])
         self.stdout.write(self.style.SUCCESS(f'Purged {count} system logs older than 30 days.'))
 
-        # 2. Purge all logs older than 90 days (Retention policy)
-        ninety_days_ago = timezone.now() - timedelta(days=90)
-        old_logs = AuditLogs.objects.filter(created_at__lt=ninety_days_ago)
-        count, _ = old_logs.delete()
-        self.stdout.write(self.style.SUCCESS(f'Purged {count} general audit logs older than 90 days.'))
+        # 2. Retention policy for every log table
+        cutoff = now - timedelta(days=options['days'])
+        for table in PARTITIONED_TABLES:
+            if is_partitioned(table):
+                created = ensure_partitions(table, months_ahead=options['months_ahead'])
+                retired = retire_partitions(table, cutoff, archive=options['archive'])
+                # Archiving keeps expired data around, so stragglers in the
+                # default partition are only deleted when dropping
+                stragglers = 0 if options['archive'] else purge_default_partition(table, cutoff)
+                verb = 'Archived' if options['archive'] else 'Dropped'
+                self.stdout.write(self.style.SUCCESS(
+                    f'{table}: {verb} {len(retired)} partitions ending before {cutoff:%Y-%m}; created {len(created)} ahead; '
+                    f'purged {stragglers} rows from the default partition.'
+                ))
+            else:
+                model = LOG_MODELS[table]
+                count = delete_in_batches(model.objects.filter(created_at__lt=cutoff), options['batch_size'])
+                self.stdout.write(self.style.SUCCESS(f'{table}: Purged {count} rows older than {options["days"]} days.'))
+
+        # 3. Finished background jobs and their run history
+        runs = delete_in_batches(BackgroundJobRun.objects.filter(started_at__lt=cutoff), options['batch_size'])
+        finished = delete_in_batches(
+            BackgroundJob.objects.filter(status='SUCCEEDED', finished_at__lt=cutoff), options['batch_size']
+        )
+        self.stdout.write(self.style.SUCCESS(f'background_jobs: Purged {finished} finished jobs and {runs} job runs.'))
+
+        # 4. Background export files past EXPORT_RETENTION_DAYS
+        expired = DataExport.objects.filter(created_at__lt=now - timedelta(days=settings.EXPORT_RETENTION_DAYS))
+        for export in expired.exclude(file='').iterator():
+            export.file.delete(save=False)
+        count = delete_in_batches(expired, options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'data_exports: Purged {count} exports older than {settings.EXPORT_RETENTION_DAYS} days.'))
 
-        self.stdout.write(self.style.SUCCESS('Audit log maintenance completed.'))
+        self.stdout.write(self.style.SUCCESS('Log maintenance completed.'))
@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand
+from django.db import models, transaction
+from django.db.models import F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from apps.models import Loans, Repayments
+
+
+class Command(BaseCommand):
+    help = 'Checks stored Loans.amount_paid totals against the Repayments aggregates'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true', help='Rewrite mismatched totals from the Repayments table')
+
+    def handle(self, *args, **options):
+        money = models.DecimalField(max_digits=12, decimal_places=2)
+        paid = (
+            Repayments.objects.filter(loan=OuterRef('pk'))
+            .values('loan')
+            .annotate(total=Sum('amount_paid'))
+            .values('total')
+        )
+        mismatched = (
+            Loans.objects.annotate(
+                actual_paid=Coalesce(Subquery(paid, output_field=money), Value(0, output_field=money))
+            )
+            .exclude(amount_paid=F('actual_paid'))
+            .values_list('id', 'amount_paid', 'actual_paid')
+        )
+
+        count = 0
+        for loan_id, stored, actual in mismatched.iterator():
+            count += 1
+            self.stdout.write(f'Loan {loan_id.hex[:8]}: stored {stored}, repayments {actual}')
+            if options['fix']:
+                with transaction.atomic():
+                    # Recompute under the row lock so a concurrent repayment isn't lost
+                    loan = Loans.objects.select_for_update().get(pk=loan_id)
+                    total = loan.repayments_set.aggregate(t=Sum('amount_paid'))['t'] or 0
+                    Loans.objects.filter(pk=loan_id).update(amount_paid=total)
+
+        if count == 0:
+            self.stdout.write(self.style.SUCCESS('All loan balances match their repayments'))
+        elif options['fix']:
+            self.stdout.write(self.style.SUCCESS(f'{count} loan balances corrected'))
+        else:
+            self.stdout.write(self.style.WARNING(f'{count} loan balances out of sync (run with --fix to correct)'))
@@ -0,0 +1,46 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from apps.models import DisbursementBatch
+from apps.services import DisbursementBatchService
+from apps.utils.jobs import enqueue
+
+
+class Command(BaseCommand):
+    help = (
+        'Recovers disbursement batches whose background job is gone: resumes them, or with --release '
+        'credits back the reserved capital and frees their loans'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than', type=int, default=30, help='Minutes a PENDING/RUNNING batch must have been idle')
+        parser.add_argument('--batch', action='append', default=[], help='Batch id to recover regardless of age or status')
+        parser.add_argument('--release', action='store_true', help='Release the reservations instead of resuming the batch')
+        parser.add_argument(
+            '--include-unconfirmed', action='store_true',
+            help='With --release, also release SENDING items (only after confirming on M-Pesa that they were not paid)',
+        )
+
+    def handle(self, *args, **options):
+        if options['batch']:
+            batches = list(DisbursementBatch.objects.filter(pk__in=options['batch']))
+            if len(batches) != len(set(options['batch'])):
+                raise CommandError('Unknown batch id.')
+        else:
+            batches = DisbursementBatchService.orphaned(timedelta(minutes=options['older_than']))
+
+        for batch in batches:
+            unconfirmed = batch.items.filter(status='SENDING').count()
+            if options['release']:
+                released = DisbursementBatchService.release_batch(batch, options['include_unconfirmed'])
+                self.stdout.write(f'Batch {batch.pk}: released {released} reservations.')
+            else:
+                DisbursementBatch.objects.filter(pk=batch.pk, status__in=['PENDING', 'RUNNING', 'FAILED']).update(status='RUNNING')
+                enqueue('disbursement.batch', {'batch_id': str(batch.pk)})
+                self.stdout.write(f'Batch {batch.pk}: resumed.')
+            if unconfirmed and not options['include_unconfirmed']:
+                self.stdout.write(self.style.WARNING(
+                    f'Batch {batch.pk}: {unconfirmed} loans were being submitted when the worker stopped. '
+                    'Check them on M-Pesa, then rerun with --batch --release --include-unconfirmed.'
+                ))
+        self.stdout.write(self.style.SUCCESS(f'Done: {len(batches)} batches recovered.'))
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from apps.utils.audit import replay_outbox
+
+
+class Command(BaseCommand):
+    help = 'Inserts audit log entries left in AUDIT_OUTBOX_DIR by failed flushes or exited workers'
+
+    def handle(self, *args, **options):
+        files, entries = replay_outbox()
+        self.stdout.write(self.style.SUCCESS(f'Replayed {entries} audit entries from {files} outbox files'))
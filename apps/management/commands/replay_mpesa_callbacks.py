@@ -0,0 +1,61 @@
+import uuid
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from apps.models import MpesaCallback
+from apps.services import MpesaCallbackService
+
+
+def _uuids(values):
+    for value in values:
+        try:
+            yield uuid.UUID(value)
+        except ValueError:
+            pass
+
+
+class Command(BaseCommand):
+    help = 'Re-applies stored M-Pesa callbacks, e.g. FAILED ones after a fix has been deployed'
+
+    def add_arguments(self, parser):
+        parser.add_argument('ids', nargs='*', help='Callback ids or idempotency keys (e.g. C2B:QGH123ABC)')
+        parser.add_argument('--status', default='FAILED', choices=['RECEIVED', 'FAILED', 'PROCESSED'], help='Which callbacks to replay when no ids are given')
+        parser.add_argument('--since', help='Only callbacks received at or after this ISO date/datetime')
+        parser.add_argument('--force', action='store_true', help='Allow replaying PROCESSED callbacks (repayments stay deduplicated by receipt)')
+        parser.add_argument('--dry-run', action='store_true', help='List what would be replayed')
+
+    def handle(self, *args, **options):
+        callbacks = MpesaCallback.objects.order_by('received_at')
+        if options['ids']:
+            keys = options['ids']
+            callbacks = callbacks.filter(Q(idempotency_key__in=keys) | Q(pk__in=list(_uuids(keys))))
+        else:
+            callbacks = callbacks.filter(status=options['status'])
+        if options['since']:
+            day = parse_date(options['since']) if 'T' not in options['since'] else None
+            since = datetime.combine(day, datetime.min.time()) if day else parse_datetime(options['since'])
+            if since is None:
+                raise CommandError('--since must be an ISO date or datetime')
+            if timezone.is_naive(since):
+                since = timezone.make_aware(since)
+            callbacks = callbacks.filter(received_at__gte=since)
+        if not options['force'] and callbacks.filter(status='PROCESSED').exists():
+            raise CommandError('Selection includes PROCESSED callbacks; pass --force to re-apply them')
+
+        replayed = failed = 0
+        for callback in callbacks.iterator():
+            if options['dry_run']:
+                self.stdout.write(f'{callback.idempotency_key} [{callback.status}, {callback.attempts} attempts]')
+                continue
+            result = MpesaCallbackService.process(callback.pk, statuses=('RECEIVED', 'FAILED', 'PROCESSED'))
+            if result is None:
+                continue
+            if result.status == 'FAILED':
+                failed += 1
+                self.stdout.write(self.style.ERROR(f'{result.idempotency_key}: {result.last_error}'))
+            else:
+                replayed += 1
+        self.stdout.write(self.style.SUCCESS(f'Replayed {replayed} callbacks, {failed} failed.'))
@@ -0,0 +1,72 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import Avg, Count, Max, Q
+from django.utils import timezone
+from apps.models import BackgroundJob, BackgroundJobRun
+from apps.utils import jobs
+
+
+class Command(BaseCommand):
+    help = 'Runs queued background jobs (SMS, emails) with retries; see apps.utils.jobs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=settings.BACKGROUND_JOB_WORKERS, help='Jobs run concurrently')
+        parser.add_argument('--batch-size', type=int, default=200, help='Jobs picked up per pass')
+        parser.add_argument('--loop', action='store_true', help='Keep polling instead of exiting once nothing is due')
+        parser.add_argument('--interval', type=float, default=2.0, help='Seconds to sleep between passes with --loop')
+        parser.add_argument('--retry-dead', action='store_true', help='Requeue DEAD jobs (optionally only --task) and exit')
+        parser.add_argument('--task', help='Limit --retry-dead to one task name')
+        parser.add_argument('--stats', action='store_true', help='Print per-task outcomes and latency for the last --hours and exit')
+        parser.add_argument('--hours', type=int, default=24, help='Window for --stats')
+
+    def handle(self, *args, **options):
+        if options['retry_dead']:
+            dead = BackgroundJob.objects.filter(status='DEAD')
+            if options['task']:
+                dead = dead.filter(task=options['task'])
+            count = dead.update(status='RETRY', attempts=0, run_at=timezone.now(), finished_at=None)
+            self.stdout.write(self.style.SUCCESS(f'Requeued {count} dead jobs.'))
+            return
+        if options['stats']:
+            self.print_stats(options['hours'])
+            return
+
+        total_succeeded = total_failed = 0
+        while True:
+            succeeded, failed = jobs.drain(workers=options['workers'], batch_size=options['batch_size'])
+            total_succeeded += succeeded
+            total_failed += failed
+            if succeeded or failed:
+                self.stdout.write(f'Ran {succeeded} jobs, {failed} failed.')
+            if not options['loop']:
+                break
+            if not (succeeded or failed):
+                time.sleep(options['interval'])
+        self.stdout.write(self.style.SUCCESS(f'Done: {total_succeeded} succeeded, {total_failed} failed.'))
+
+    def print_stats(self, hours):
+        since = timezone.now() - timedelta(hours=hours)
+        rows = (
+            BackgroundJobRun.objects.filter(started_at__gte=since)
+            .values('task')
+            .annotate(
+                runs=Count('id'),
+                failed=Count('id', filter=~Q(outcome='SUCCEEDED')),
+                avg_latency=Avg('queue_latency_ms'),
+                avg_duration=Avg('duration_ms'),
+                max_duration=Max('duration_ms'),
+            )
+            .order_by('task')
+        )
+        for row in rows:
+            self.stdout.write(
+                f"{row['task']}: {row['runs']} runs, {row['failed']} failed, "
+                f"latency {row['avg_latency'] or 0:.0f} ms avg, "
+                f"duration {row['avg_duration'] or 0:.0f} ms avg / {row['max_duration'] or 0} ms max"
+            )
+        backlog = BackgroundJob.objects.filter(status__in=('QUEUED', 'RETRY')).count()
+        dead = BackgroundJob.objects.filter(status='DEAD').count()
+        self.stdout.write(self.style.SUCCESS(f'{backlog} jobs waiting, {dead} dead.'))
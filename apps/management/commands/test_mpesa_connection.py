@@ -24,7 +24,7 @@ class Command(BaseCommand):
 
             # 2. Test Connection (Auth Token)
             self.stdout.write(self.style.WARNING('\n[2] Testing Connection to Safaricom (Get Auth Token)...'))
-            token = handler.get_access_token()
+            token = handler.get_access_token(force_refresh=True)
             
             if token:
                 self.stdout.write(self.style.SUCCESS(f'✅ SUCCESS! Connection Established.'))
@@ -18,10 +18,14 @@ from ..serializers import (
     AuditLogSerializer,
     EmailLogSerializer
 )
+from ..utils.audit import record_audit
+from ..utils.cache import bump_settings_version
 from ..utils.security import log_action, get_client_ip
 from ..utils.encryption import decrypt_value, get_setting
 from ..utils.sms import send_sms_async
 from ..permissions import IsAdminUser, IsOwnerOrCoOwner
+from ..pagination import CursorResultsSetPagination
+from ..utils.partitions import within_retention
 import threading
 
 class SystemHealthView(views.APIView):
@@ -192,8 +196,7 @@ class SecureSettingsView(views.APIView):
         serializer = SecureSettingsSerializer(setting, data=request.data, partial=True, context={'request': request})
         if serializer.is_valid():
             serializer.save()
-            from django.core.cache import cache
-            cache.delete(f"secure_setting_{key}")
+            bump_settings_version()
             log_action(request.user, f"Updated setting: {key}", "secure_settings", setting.id, log_type="MANAGEMENT", ip_address=get_client_ip(request))
             return Response(serializer.data)
         return Response(serializer.errors, status=400)
@@ -242,7 +245,7 @@ class TestMpesaConnectionView(views.APIView):
             }
 
             # 2. Test Connection
-            token = handler.get_access_token()
+            token = handler.get_access_token(force_refresh=True)
             if token: 
                 return Response({
                     "status": "success", 
@@ -303,36 +306,45 @@ class BulkSMSView(views.APIView):
         if user_role not in ["ADMIN", "MANAGER", "FINANCIAL_OFFICER"]: return Response({"error": "Unauthorized"}, status=403)
         sms_type = request.data.get("type", "DEFAULTERS")
         custom_message = request.data.get("message")
-        def get_t(key, default):
-            try: return SystemSettings.objects.get(key=key).value
-            except: return default
-        count = 0
-        if sms_type == "DEFAULTERS":
-            overdue_loans = Loans.objects.filter(status="OVERDUE")
-            template = get_t("MSG_TEMPLATE_DEFAULTER", "Hello {name}, your loan of KES {principal:,.2f} is OVERDUE.")
-            for loan in overdue_loans:
-                phone = loan.user.phone
-                if phone:
-                    try:
-                        msg = template.format(name=loan.user.full_name, principal=float(loan.principal_amount), interest=float(loan.total_repayable_amount) - float(loan.principal_amount), balance=float(loan.remaining_balance))
-                        send_sms_async([phone], msg)
-                        SMSLog.objects.create(sender=user, recipient_phone=phone, recipient_name=loan.user.full_name, message=msg, type="DEFAULTER")
-                        count += 1
-                        from ..loans.views import create_notification
-                        create_notification(loan.user, f"Defaulter SMS sent to {phone}.")
-                    except: pass
-        elif sms_type == "NOTICE":
-            if not custom_message: return Response({"error": "Message is required"}, status=400)
-            all_users = Users.objects.all()
-            for u in all_users:
-                if u.phone:
-                    try:
-                        send_sms_async([u.phone], custom_message)
-                        SMSLog.objects.create(sender=user, recipient_phone=u.phone, recipient_name=u.full_name, message=custom_message, type="NOTICE")
-                        count += 1
-                    except: pass
-        AuditLogs.objects.create(admin=user, action=f"Sent {count} bulk SMS notifications of type {sms_type}.", log_type="COMMUNICATION")
-        return Response({"status": "success", "message": f"Bulk SMS sequence started for {count} recipients."})
+        if sms_type not in ("DEFAULTERS", "NOTICE"): return Response({"error": f"Unsupported SMS type: {sms_type}"}, status=400)
+        if sms_type == "NOTICE" and not custom_message: return Response({"error": "Message is required"}, status=400)
+        from ..services import SMSBroadcastService
+        broadcast = SMSBroadcastService.create(user, sms_type, custom_message)
+        record_audit(admin=user, action=f"Started bulk SMS broadcast of type {sms_type} to {broadcast.total_recipients} recipients.", log_type="COMMUNICATION")
+        return Response({
+            "status": "success",
+            "message": f"Bulk SMS sequence started for {broadcast.total_recipients} recipients.",
+            **_sms_broadcast_payload(broadcast),
+        }, status=202)
+
+def _sms_broadcast_payload(broadcast):
+    return {
+        "broadcast_id": str(broadcast.id),
+        "type": broadcast.sms_type,
+        "broadcast_status": broadcast.status,
+        "progress": broadcast.progress,
+        "total_recipients": broadcast.total_recipients,
+        "sent": broadcast.sent,
+        "failed": broadcast.failed,
+        "batches": broadcast.batches,
+        "error": broadcast.error,
+        "created_at": broadcast.created_at,
+        "started_at": broadcast.started_at,
+        "finished_at": broadcast.finished_at,
+    }
+
+class SMSBroadcastStatusView(views.APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, pk):
+        from ..models import SMSBroadcast
+        user = request.user
+        if getattr(user, "role", None) not in ["ADMIN", "MANAGER", "FINANCIAL_OFFICER"]: return Response({"error": "Unauthorized"}, status=403)
+        try:
+            broadcast = SMSBroadcast.objects.get(pk=pk)
+        except Exception:
+            return Response({"error": "Broadcast not found"}, status=404)
+        return Response(_sms_broadcast_payload(broadcast))
 
 class SystemCapitalBalanceView(views.APIView):
     permission_classes = [permissions.IsAuthenticated]
@@ -349,8 +361,10 @@ class SystemCapitalBalanceView(views.APIView):
                 {"error": "You do not have permission to view the capital balance."},
                 status=403
             )
-        from ..models import SystemCapital, LedgerEntry
-        capital = SystemCapital.objects.filter(name="Simulation Capital").first()
+        from ..models import LedgerEntry
+        from ..services import CapitalLedgerService
+        capital = CapitalLedgerService.get_account()
+        balance = float(CapitalLedgerService.available_balance(capital)) if capital else 0
         total_disbursed = LedgerEntry.objects.filter(
             entry_type="DISBURSEMENT"
         ).aggregate(total=models.Sum('amount'))['total'] or 0
@@ -361,12 +375,12 @@ class SystemCapitalBalanceView(views.APIView):
         # Finance Officer gets available balance only
         if getattr(user, 'role', '') == 'FINANCIAL_OFFICER':
             return Response({
-                "balance": float(capital.balance) if capital else 0,
+                "balance": balance,
             })
 
         # Owner and Super Admin get the full breakdown
         return Response({
-            "balance": float(capital.balance) if capital else 0,
+            "balance": balance,
             "total_disbursed": float(total_disbursed),
             "total_repaid": float(total_repaid),
             "account_name": capital.name if capital else "Simulation Capital"
@@ -381,6 +395,7 @@ class AuditLogListView(generics.ListAPIView):
     """
     serializer_class = AuditLogSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = CursorResultsSetPagination
 
     def get_queryset(self):
         user = self.request.user
@@ -403,7 +418,7 @@ class AuditLogListView(generics.ListAPIView):
         else:
             queryset = AuditLogs.objects.filter(admin=user)
 
-        queryset = queryset.order_by("-created_at")
+        queryset = within_retention(queryset, self.request).order_by("-created_at")
 
         # Filters
         log_type = self.request.query_params.get("type")
@@ -411,7 +426,8 @@ class AuditLogListView(generics.ListAPIView):
             queryset = queryset.filter(log_type=log_type)
             
         limit = self.request.query_params.get("limit")
-        if limit:
+        # A sliced queryset cannot be filtered by the keyset cursor
+        if limit and "cursor" not in self.request.query_params:
             try: queryset = queryset[: int(limit)]
             except: pass
             
@@ -464,7 +480,7 @@ class SecurityLogsView(views.APIView):
 
     def get(self, request):
         if not (request.user.is_owner or request.user.is_super_admin): return Response({"error": "Unauthorized access to security logs."}, status=403)
-        logs = AuditLogs.objects.filter(log_type="SECURITY").order_by("-created_at")
+        logs = within_retention(AuditLogs.objects.filter(log_type="SECURITY"), request).order_by("-created_at")
         serializer = AuditLogSerializer(logs, many=True)
         return Response(serializer.data)
 
@@ -472,6 +488,7 @@ class SMSLogListView(generics.ListAPIView):
     queryset = SMSLog.objects.all().order_by("-created_at")
     serializer_class = SMSLogSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = CursorResultsSetPagination
 
     def get_queryset(self):
         user = self.request.user
@@ -518,7 +535,7 @@ class DirectSMSView(views.APIView):
                 status="SENT",
             )
 
-            AuditLogs.objects.create(
+            record_audit(
                 admin=user,
                 action="SENT_DIRECT_SMS",
                 log_type="COMMUNICATION",
@@ -534,6 +551,7 @@ class DirectSMSView(views.APIView):
 class ListEmailLogsView(generics.ListAPIView):
     permission_classes = [permissions.IsAuthenticated]
     serializer_class = EmailLogSerializer
+    pagination_class = CursorResultsSetPagination
 
     def get_queryset(self):
         from django.db.models import Q
@@ -561,7 +579,7 @@ class SendEmailNotificationView(views.APIView):
         if not message:
             return Response({"error": "Message is required."}, status=400)
 
-        from ..models import Admins, Notifications, EmailLog
+        from ..models import Admins
         if target_group == "STAFF":
             targets = Admins.objects.filter(is_active=True)
         else:
@@ -570,107 +588,119 @@ class SendEmailNotificationView(views.APIView):
         if not targets.exists():
             return Response({"error": "No valid targets found."}, status=400)
 
-        import os, requests, threading
-        from_email = os.getenv("FROM_EMAIL")
-        brevo_api_key = os.getenv("BREVO_API_KEY")
-        sender_name = os.getenv("SENDER_NAME", "Azariah Credit Ltd")
-
-        if not brevo_api_key or not from_email:
+        import os
+        from ..utils.jobs import enqueue
+        if not os.getenv("BREVO_API_KEY") or not os.getenv("FROM_EMAIL"):
             return Response({"error": "Email service not configured."}, status=500)
 
-        def send_email_async(admin, subject, message, from_email, sender_name, brevo_api_key, sender_user):
-            try:
-                url = "https://api.brevo.com/v3/smtp/email"
-                headers = {"accept": "application/json", "api-key": brevo_api_key, "content-type": "application/json"}
-                payload = {
-                    "sender": {"name": sender_name, "email": from_email},
-                    "to": [{"email": admin.email}],
-                    "subject": subject,
-                    "htmlContent": f"<html><body>{message.replace('\n', '<br>')}</body></html>"
-                }
-                requests.post(url, json=payload, headers=headers)
-                Notifications.objects.create(user=admin, message=f"Email: {subject}")
-                EmailLog.objects.create(sender=sender_user, recipient_email=admin.email, recipient_name=admin.full_name, subject=subject, message=message)
-            except: pass
-
-        for admin in targets:
-            threading.Thread(target=send_email_async, args=(admin, subject, message, from_email, sender_name, brevo_api_key, request.user)).start()
+        for admin_id in targets.values_list("id", flat=True):
+            enqueue("email.notification", {
+                "admin_id": str(admin_id), "subject": subject, "message": message, "sender_id": str(request.user.id),
+            })
 
         return Response({"message": f"Successfully queued {targets.count()} emails."})
 
-import csv
-from django.http import HttpResponse
-import json
+from django.http import FileResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.utils.dateparse import parse_date
+
+def _export_params(params):
+    """(resource, date_from, date_to) from query params or request data, or an error Response."""
+    from ..services import DataExportService
+    resource = params.get('resource', 'loans')
+    if resource not in DataExportService.RESOURCES:
+        return None, Response({"error": "Invalid resource"}, status=400)
+    if params.get('format', 'csv') != 'csv':
+        return None, Response({"error": "Only csv exports are supported."}, status=400)
+    dates = []
+    for key in ('date_from', 'date_to'):
+        raw = params.get(key)
+        try:
+            value = parse_date(raw) if raw else None
+        except ValueError:
+            value = None
+        if raw and value is None:
+            return None, Response({"error": f"{key} must be a YYYY-MM-DD date."}, status=400)
+        dates.append(value)
+    return (resource, *dates), None
+
+def _data_export_payload(request, export):
+    payload = {
+        "export_id": str(export.id),
+        "resource": export.resource,
+        "date_from": export.date_from,
+        "date_to": export.date_to,
+        "export_status": export.status,
+        "rows": export.rows,
+        "size": export.size,
+        "error": export.error,
+        "created_at": export.created_at,
+        "started_at": export.started_at,
+        "finished_at": export.finished_at,
+        "download_url": None,
+    }
+    if export.status == 'COMPLETED':
+        payload["download_url"] = request.build_absolute_uri(reverse('owner-export-download', args=[export.id]))
+    return payload
 
 class OwnerExportView(views.APIView):
     """
     Centralized export view for Owners to download system data.
     Supports: loans, customers, repayments, audit_logs, security_logs.
     Formats: csv (default).
+
+    GET streams the CSV as it is read from the database. POST queues the
+    same export as a background job (for large exports) and returns its
+    id; DataExportStatusView reports progress and the download link.
     """
     permission_classes = [permissions.IsAuthenticated, IsOwnerOrCoOwner]
 
     def get(self, request):
-        resource = request.query_params.get('resource', 'loans')
-        format_type = request.query_params.get('format', 'csv')
-        date_from = request.query_params.get('date_from')
-        date_to = request.query_params.get('date_to')
-
-        # Logic for date filtering
-        filters = {}
-        if date_from:
-            filters['created_at__gte'] = date_from
-        if date_to:
-            filters['created_at__lte'] = f"{date_to} 23:59:59"
-
-        if resource == 'loans':
-            queryset = Loans.objects.filter(**filters).order_by('-created_at')
-            filename = f"loans_export_{timezone.now().strftime('%Y%m%d')}.csv"
-            headers = ['ID', 'Customer', 'Amount', 'Status', 'Product', 'Created At']
-            data_rows = [[l.id, l.user.full_name, l.principal_amount, l.status, l.loan_product.name, l.created_at] for l in queryset]
-
-        elif resource == 'customers':
-            queryset = Users.objects.filter(**filters).order_by('-created_at')
-            filename = f"customers_export_{timezone.now().strftime('%Y%m%d')}.csv"
-            headers = ['ID', 'Full Name', 'Phone', 'National ID', 'Created At']
-            data_rows = [[u.id, u.full_name, u.phone, getattr(u.profile, 'national_id', 'N/A'), u.created_at] for u in queryset]
-
-        elif resource == 'repayments':
-            from ..models import PaybillTransaction
-            queryset = PaybillTransaction.objects.filter(**filters).order_by('-created_at')
-            filename = f"repayments_export_{timezone.now().strftime('%Y%m%d')}.csv"
-            headers = ['ID', 'Reference', 'Phone', 'Amount', 'Status', 'Date']
-            data_rows = [[r.id, r.receipt_number, r.sender_phone, r.amount, r.status, r.created_at] for r in queryset]
-
-        elif resource == 'audit_logs':
-            queryset = AuditLogs.objects.filter(**filters).order_by('-created_at')
-            filename = f"audit_logs_export_{timezone.now().strftime('%Y%m%d')}.csv"
-            headers = ['ID', 'User', 'Action', 'IP Address', 'Timestamp']
-            data_rows = [[log.id, log.admin.full_name if log.admin else 'System', log.action, log.ip_address, log.created_at] for log in queryset]
-
-        elif resource == 'security_logs':
-            # Detailed security logs for exports
-            queryset = AuditLogs.objects.filter(
-                models.Q(action__icontains='failed') | 
-                models.Q(action__icontains='login') | 
-                models.Q(action__icontains='security') |
-                models.Q(action__icontains='unauthorized'),
-                **filters
-            ).order_by('-created_at')
-            filename = f"security_logs_export_{timezone.now().strftime('%Y%m%d')}.csv"
-            headers = ['ID', 'User', 'Action', 'IP Address', 'Timestamp']
-            data_rows = [[log.id, log.admin.full_name if log.admin else 'System', log.action, log.ip_address, log.created_at] for log in queryset]
-
-        else:
-            return Response({"error": "Invalid resource"}, status=400)
-
-        # Generate CSV
-        response = HttpResponse(content_type='text/csv')
+        from ..services import DataExportService
+        params, error = _export_params(request.query_params)
+        if error:
+            return error
+        resource, date_from, date_to = params
+        filename = f"{resource}_export_{timezone.now().strftime('%Y%m%d')}.csv"
+        response = StreamingHttpResponse(
+            DataExportService.stream_csv(DataExportService.rows(resource, date_from, date_to)),
+            content_type='text/csv',
+        )
         response['Content-Disposition'] = f'attachment; filename="{filename}"'
-        
-        writer = csv.writer(response)
-        writer.writerow(headers)
-        for row in data_rows:
-            writer.writerow(row)
-            
         return response
+
+    def post(self, request):
+        from ..services import DataExportService
+        params, error = _export_params(request.data)
+        if error:
+            return error
+        export = DataExportService.create(request.user, *params)
+        record_audit(admin=request.user, action=f"Requested background export of {export.resource}.", log_type="GENERAL")
+        return Response(_data_export_payload(request, export), status=202)
+
+class DataExportStatusView(views.APIView):
+    permission_classes = [permissions.IsAuthenticated, IsOwnerOrCoOwner]
+
+    def get(self, request, pk):
+        from ..models import DataExport
+        try:
+            export = DataExport.objects.get(pk=pk)
+        except Exception:
+            return Response({"error": "Export not found"}, status=404)
+        return Response(_data_export_payload(request, export))
+
+class DataExportDownloadView(views.APIView):
+    permission_classes = [permissions.IsAuthenticated, IsOwnerOrCoOwner]
+
+    def get(self, request, pk):
+        from ..models import DataExport
+        try:
+            export = DataExport.objects.get(pk=pk, status='COMPLETED')
+        except Exception:
+            return Response({"error": "Export not found"}, status=404)
+        if not export.file or not export.file.storage.exists(export.file.name):
+            return Response({"error": "Export file has expired"}, status=410)
+        return FileResponse(
+            export.file.open('rb'), as_attachment=True, content_type='application/gzip',
+            filename=f"{export.resource}_export_{export.created_at:%Y%m%d}.csv.gz",
+        )
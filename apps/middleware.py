@@ -1,6 +1,16 @@
+import logging
+import random
+import time
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
 from django.http import HttpResponseForbidden
 from .utils.encryption import get_setting
 
+logger = logging.getLogger(__name__)
+
+
 class IPWhitelistMiddleware:
     """
     Middleware to restrict access to the loan system by IP address.
@@ -40,3 +50,56 @@ class IPWhitelistMiddleware:
             return HttpResponseForbidden(f"Access Denied: IP {ip} is not whitelisted.")
 
         return self.get_response(request)
+
+
+class RequestProfilingMiddleware:
+    """
+    Opt-in (REQUEST_PROFILING) sampled request profiler. For a fraction
+    REQUEST_PROFILING_SAMPLE_RATE of requests it records DB time and query
+    count, repeated statements (N+1 loops), serializer time and response
+    size per endpoint, and returns them in a Server-Timing header so they
+    show up in the browser's network panel. Owners read the rolling
+    per-endpoint histograms from /api/analytics/request-profile/.
+    """
+    def __init__(self, get_response):
+        if not settings.REQUEST_PROFILING:
+            raise MiddlewareNotUsed
+        from .utils.profiling import install_serializer_timing
+        install_serializer_timing()
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if random.random() >= settings.REQUEST_PROFILING_SAMPLE_RATE:
+            return self.get_response(request)
+
+        from .utils import profiling
+        profile = profiling.start_profile()
+        started = time.perf_counter()
+        try:
+            with connection.execute_wrapper(profile):
+                response = self.get_response(request)
+        finally:
+            profiling.stop_profile()
+        total = time.perf_counter() - started
+
+        size = 0 if response.streaming else len(response.content)
+        response['Server-Timing'] = (
+            f'db;dur={profile.db_time * 1000:.1f};desc="{profile.queries} queries", '
+            f'ser;dur={profile.serializer_time * 1000:.1f}, '
+            f'app;dur={(total - profile.db_time - profile.serializer_time) * 1000:.1f}, '
+            f'total;dur={total * 1000:.1f}'
+        )
+        # Lets the frontend's origin read the timings from JS as well
+        origin = request.headers.get('Origin')
+        if origin and origin in settings.CORS_ALLOWED_ORIGINS:
+            response['Timing-Allow-Origin'] = origin
+
+        match = request.resolver_match
+        if match is not None:
+            endpoint = f'{request.method} /{match.route}'
+            try:
+                profiling.record(endpoint, match._func_path, profile, total, size)
+            except Exception:
+                # Profiling must never fail the request it measured
+                logger.exception('Request profile for %s not recorded', endpoint)
+        return response
@@ -0,0 +1,36 @@
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def backfill_amount_paid(apps, schema_editor):
+    Loans = apps.get_model('apps', 'Loans')
+    Repayments = apps.get_model('apps', 'Repayments')
+    paid = (
+        Repayments.objects.filter(loan=OuterRef('pk'))
+        .values('loan')
+        .annotate(total=Sum('amount_paid'))
+        .values('total')
+    )
+    Loans.objects.update(
+        amount_paid=Coalesce(
+            Subquery(paid, output_field=models.DecimalField(max_digits=12, decimal_places=2)),
+            Value(0, output_field=models.DecimalField(max_digits=12, decimal_places=2)),
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('apps', '0047_loans_mpesa_disbursement_status_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='loans',
+            name='amount_paid',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12),
+        ),
+        migrations.RunPython(backfill_amount_paid, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 6.1.2 on 2026-10-18 00:44
+
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('apps', '0048_loans_amount_paid'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PortfolioDailySnapshot',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('date', models.DateField(db_index=True)),
+                ('applied_count', models.IntegerField(default=0)),
+                ('applied_amount', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('disbursed_count', models.IntegerField(default=0)),
+                ('disbursed_amount', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('repaid_count', models.IntegerField(default=0)),
+                ('repaid_amount', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('scheduled_count', models.IntegerField(default=0)),
+                ('scheduled_amount', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('overdue_count', models.IntegerField(default=0)),
+                ('overdue_amount', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('branch', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='apps.branch')),
+                ('loan_product', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='apps.loanproducts')),
+            ],
+            options={
+                'db_table': 'portfolio_daily_snapshot',
+                'managed': True,
+                'indexes': [models.Index(fields=['date', 'branch'], name='portfolio_snap_date_branch')],
+            },
+        ),
+    ]
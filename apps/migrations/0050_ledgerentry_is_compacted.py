@@ -0,0 +1,22 @@
+# Generated by Django 6.1.2 on 2026-10-18 00:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('apps', '0049_portfolio_daily_snapshot'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ledgerentry',
+            name='is_compacted',
+            field=models.BooleanField(default=True),
+        ),
+        migrations.AddIndex(
+            model_name='ledgerentry',
+            index=models.Index(fields=['capital_account', 'is_compacted'], name='ledger_pending_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 6.1.2 on 2026-10-18 00:55
+
+import django.db.models.functions.text
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('apps', '0051_statement_import'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='statementimport',
+            name='matched_loan_id',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='userprofiles',
+            index=models.Index(django.db.models.functions.text.Upper('national_id'), name='profile_national_id_upper'),
+        ),
+    ]
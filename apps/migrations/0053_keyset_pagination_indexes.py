@@ -0,0 +1,33 @@
+# Generated by Django 6.1.2 on 2026-10-18 00:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('apps', '0052_payment_match_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='auditlogs',
+            index=models.Index(fields=['created_at', 'id'], name='audit_created_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='emaillog',
+            index=models.Index(fields=['created_at', 'id'], name='email_created_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='loans',
+            index=models.Index(fields=['created_at', 'id'], name='loans_created_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='repayments',
+            index=models.Index(fields=['payment_date', 'id'], name='repay_paydate_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='smslog',
+            index=models.Index(fields=['created_at', 'id'], name='sms_created_id_idx'),
+        ),
+    ]
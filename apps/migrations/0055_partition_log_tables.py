@@ -0,0 +1,35 @@
+from django.db import migrations, models
+import django.utils.timezone
+
+
+def backfill_created_at(apps, schema_editor):
+    AuditLogs = apps.get_model("apps", "AuditLogs")
+    AuditLogs.objects.filter(created_at__isnull=True).update(created_at=django.utils.timezone.now())
+
+
+def partition_log_tables(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    from apps.utils.partitions import PARTITIONED_TABLES, partition_existing_table
+    with schema_editor.connection.cursor() as cursor:
+        for table in PARTITIONED_TABLES:
+            partition_existing_table(cursor, table)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('apps', '0054_audit_log_json_encoder'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_created_at, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='auditlogs',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        # The partitioned tables keep the same columns and indexes, so the
+        # earlier model state still works against them; nothing to undo.
+        migrations.RunPython(partition_log_tables, migrations.RunPython.noop),
+    ]
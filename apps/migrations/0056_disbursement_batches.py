@@ -0,0 +1,62 @@
+# Generated by Django 6.1.2 on 2026-10-18 01:09
+
+import django.db.models.deletion
+import django.utils.timezone
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('apps', '0055_partition_log_tables'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='loans',
+            name='mpesa_disbursement_status',
+            field=models.CharField(blank=True, choices=[('QUEUED', 'Queued'), ('PENDING', 'Pending'), ('SUCCESS', 'Success'), ('FAILED', 'Failed'), ('TIMEOUT', 'Timeout')], max_length=20, null=True),
+        ),
+        migrations.CreateModel(
+            name='DisbursementBatch',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('status', models.CharField(choices=[('PENDING', 'Pending'), ('RUNNING', 'Running'), ('COMPLETED', 'Completed'), ('FAILED', 'Failed')], default='PENDING', max_length=20)),
+                ('reason', models.TextField(blank=True, null=True)),
+                ('ip_address', models.GenericIPAddressField(blank=True, null=True)),
+                ('total_loans', models.IntegerField(default=0)),
+                ('reserved_amount', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('succeeded', models.IntegerField(default=0)),
+                ('failed', models.IntegerField(default=0)),
+                ('skipped', models.IntegerField(default=0)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='apps.admins')),
+            ],
+            options={
+                'db_table': 'disbursement_batches',
+                'ordering': ['-created_at'],
+                'managed': True,
+            },
+        ),
+        migrations.CreateModel(
+            name='DisbursementBatchItem',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('status', models.CharField(choices=[('RESERVED', 'Reserved'), ('SUCCESS', 'Success'), ('FAILED', 'Failed'), ('SKIPPED', 'Skipped')], default='RESERVED', max_length=20)),
+                ('originator_id', models.CharField(blank=True, max_length=100, null=True)),
+                ('error', models.TextField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('batch', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='items', to='apps.disbursementbatch')),
+                ('loan', models.ForeignKey(on_delete=django.db.models.deletion.DO_NOTHING, related_name='batch_items', to='apps.loans')),
+            ],
+            options={
+                'db_table': 'disbursement_batch_items',
+                'managed': True,
+                'constraints': [models.UniqueConstraint(fields=('batch', 'loan'), name='unique_batch_loan')],
+            },
+        ),
+    ]
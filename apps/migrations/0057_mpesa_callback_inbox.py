@@ -0,0 +1,34 @@
+# Generated by Django 6.1.2 on 2026-10-18 01:12
+
+import django.utils.timezone
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('apps', '0056_disbursement_batches'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MpesaCallback',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('idempotency_key', models.CharField(max_length=150, unique=True)),
+                ('kind', models.CharField(choices=[('C2B', 'C2B payment'), ('B2C', 'B2C result'), ('STK', 'STK push result'), ('UNKNOWN', 'Unknown')], max_length=10)),
+                ('payload', models.JSONField()),
+                ('status', models.CharField(choices=[('RECEIVED', 'Received'), ('PROCESSED', 'Processed'), ('FAILED', 'Failed')], default='RECEIVED', max_length=20)),
+                ('attempts', models.IntegerField(default=0)),
+                ('last_error', models.TextField(blank=True, null=True)),
+                ('received_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('processed_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'db_table': 'mpesa_callbacks',
+                'managed': True,
+                'indexes': [models.Index(fields=['status', 'received_at'], name='mpesa_cb_status_idx')],
+            },
+        ),
+    ]
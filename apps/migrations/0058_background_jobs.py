@@ -0,0 +1,57 @@
+# Generated by Django 6.1.2 on 2026-10-18 01:15
+
+import django.core.serializers.json
+import django.db.models.deletion
+import django.utils.timezone
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('apps', '0057_mpesa_callback_inbox'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BackgroundJob',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('task', models.CharField(max_length=100)),
+                ('payload', models.JSONField(default=dict, encoder=django.core.serializers.json.DjangoJSONEncoder)),
+                ('status', models.CharField(choices=[('QUEUED', 'Queued'), ('RUNNING', 'Running'), ('RETRY', 'Waiting to retry'), ('SUCCEEDED', 'Succeeded'), ('DEAD', 'Dead')], default='QUEUED', max_length=20)),
+                ('attempts', models.IntegerField(default=0)),
+                ('max_attempts', models.IntegerField(default=5)),
+                ('run_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('locked_at', models.DateTimeField(blank=True, null=True)),
+                ('last_error', models.TextField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'db_table': 'background_jobs',
+                'managed': True,
+                'indexes': [models.Index(fields=['status', 'run_at'], name='bg_job_status_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='BackgroundJobRun',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('task', models.CharField(max_length=100)),
+                ('attempt', models.IntegerField()),
+                ('outcome', models.CharField(choices=[('SUCCEEDED', 'Succeeded'), ('FAILED', 'Failed'), ('DEAD', 'Dead')], max_length=20)),
+                ('queue_latency_ms', models.IntegerField()),
+                ('duration_ms', models.IntegerField()),
+                ('error', models.TextField(blank=True, null=True)),
+                ('started_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('job', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='runs', to='apps.backgroundjob')),
+            ],
+            options={
+                'db_table': 'background_job_runs',
+                'managed': True,
+                'indexes': [models.Index(fields=['task', 'started_at'], name='bg_job_run_task_idx')],
+            },
+        ),
+    ]
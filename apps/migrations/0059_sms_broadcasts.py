@@ -0,0 +1,39 @@
+# Generated by Django 6.1.2 on 2026-10-18 01:19
+
+import django.db.models.deletion
+import django.utils.timezone
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('apps', '0058_background_jobs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SMSBroadcast',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('sms_type', models.CharField(choices=[('DEFAULTERS', 'Defaulters'), ('NOTICE', 'Notice')], max_length=20)),
+                ('message', models.TextField(blank=True, null=True)),
+                ('status', models.CharField(choices=[('PENDING', 'Pending'), ('RUNNING', 'Running'), ('COMPLETED', 'Completed'), ('FAILED', 'Failed')], default='PENDING', max_length=20)),
+                ('total_recipients', models.IntegerField(default=0)),
+                ('sent', models.IntegerField(default=0)),
+                ('failed', models.IntegerField(default=0)),
+                ('batches', models.IntegerField(default=0)),
+                ('error', models.TextField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='apps.admins')),
+            ],
+            options={
+                'db_table': 'sms_broadcasts',
+                'ordering': ['-created_at'],
+                'managed': True,
+            },
+        ),
+    ]
@@ -0,0 +1,56 @@
+import logging
+
+from django.db import DatabaseError, migrations, transaction
+
+logger = logging.getLogger(__name__)
+
+# (index, table, column) served to icontains lookups, which PostgreSQL runs
+# as UPPER(column::text) LIKE UPPER(%s)
+TRIGRAM_INDEXES = [
+    ("users_full_name_trgm", "users", "full_name"),
+    ("users_phone_trgm", "users", "phone"),
+    ("profile_national_id_trgm", "user_profiles", "national_id"),
+    ("email_recipient_email_trgm", "email_logs", "recipient_email"),
+    ("email_recipient_name_trgm", "email_logs", "recipient_name"),
+    ("email_subject_trgm", "email_logs", "subject"),
+    ("email_message_trgm", "email_logs", "message"),
+    ("sms_recipient_phone_trgm", "sms_logs", "recipient_phone"),
+    ("sms_recipient_name_trgm", "sms_logs", "recipient_name"),
+]
+
+
+def create_trigram_indexes(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor != "postgresql":
+        return
+    try:
+        with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+            cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    except DatabaseError:
+        # Search still works without the extension, as sequential scans
+        logger.warning("pg_trgm is not available; search indexes were not created")
+        return
+    with connection.cursor() as cursor:
+        for name, table, column in TRIGRAM_INDEXES:
+            cursor.execute(
+                f'CREATE INDEX IF NOT EXISTS {name} ON {table} USING gin (UPPER("{column}"::text) gin_trgm_ops)'
+            )
+
+
+def drop_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    with schema_editor.connection.cursor() as cursor:
+        for name, _, _ in TRIGRAM_INDEXES:
+            cursor.execute(f"DROP INDEX IF EXISTS {name}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('apps', '0060_data_exports'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_trigram_indexes, drop_trigram_indexes),
+    ]
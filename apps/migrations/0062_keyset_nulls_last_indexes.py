@@ -0,0 +1,55 @@
+# Generated by Django 6.1.2 on 2026-10-18 01:38
+
+from django.db import migrations, models
+
+# (index, table, column) for the nullable keyset columns
+KEYSET_INDEXES = [
+    ("loans_created_id_idx", "loans", "created_at"),
+    ("repay_paydate_id_idx", "repayments", "payment_date"),
+]
+
+
+def create_keyset_indexes(apps, schema_editor):
+    # SQLite rejects NULLS LAST in an index but already sorts NULLs last
+    # under DESC, which is the order the index has to match
+    nulls = " NULLS LAST" if schema_editor.connection.vendor == "postgresql" else ""
+    for name, table, column in KEYSET_INDEXES:
+        schema_editor.execute(f'CREATE INDEX "{name}" ON "{table}" ("{column}" DESC{nulls}, "id" DESC)')
+
+
+def drop_keyset_indexes(apps, schema_editor):
+    for name, _, _ in KEYSET_INDEXES:
+        schema_editor.execute(f'DROP INDEX IF EXISTS "{name}"')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('apps', '0061_search_trigram_indexes'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='loans',
+            name='loans_created_id_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='repayments',
+            name='repay_paydate_id_idx',
+        ),
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunPython(create_keyset_indexes, drop_keyset_indexes),
+            ],
+            state_operations=[
+                migrations.AddIndex(
+                    model_name='loans',
+                    index=models.Index(models.OrderBy(models.F('created_at'), descending=True, nulls_last=True), models.OrderBy(models.F('id'), descending=True), name='loans_created_id_idx'),
+                ),
+                migrations.AddIndex(
+                    model_name='repayments',
+                    index=models.Index(models.OrderBy(models.F('payment_date'), descending=True, nulls_last=True), models.OrderBy(models.F('id'), descending=True), name='repay_paydate_id_idx'),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 6.1.2 on 2026-10-18 01:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('apps', '0062_keyset_nulls_last_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='disbursementbatchitem',
+            name='status',
+            field=models.CharField(choices=[('RESERVED', 'Reserved'), ('SENDING', 'Sending'), ('SUCCESS', 'Success'), ('FAILED', 'Failed'), ('SKIPPED', 'Skipped')], default='RESERVED', max_length=20),
+        ),
+    ]
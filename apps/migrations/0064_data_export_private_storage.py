@@ -0,0 +1,19 @@
+# Generated by Django 6.1.2 on 2026-10-18 01:45
+
+import apps.utils.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('apps', '0063_disbursement_item_sending'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='dataexport',
+            name='file',
+            field=models.FileField(blank=True, storage=apps.utils.storage.PrivateExportStorage(), upload_to='exports/'),
+        ),
+    ]
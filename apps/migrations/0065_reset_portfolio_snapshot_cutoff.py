@@ -0,0 +1,21 @@
+from django.db import migrations
+
+
+def reset_snapshot_cutoff(apps, schema_editor):
+    # Snapshot rows built before this migration key disbursements on the
+    # creation day and count unpaid installments of every loan. Dropping the
+    # build marker makes the analytics views aggregate live until the next
+    # build_portfolio_snapshots run, which then rebuilds every day.
+    SystemSettings = apps.get_model("apps", "SystemSettings")
+    SystemSettings.objects.filter(key="PORTFOLIO_SNAPSHOT_BUILT_AT").delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('apps', '0064_data_export_private_storage'),
+    ]
+
+    operations = [
+        migrations.RunPython(reset_snapshot_cutoff, migrations.RunPython.noop),
+    ]
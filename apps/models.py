@@ -1,5 +1,8 @@
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
+from django.db.models.functions import Upper
 from django.utils import timezone
+from .utils.storage import PrivateExportStorage
 import uuid
 
 
@@ -136,14 +139,16 @@ class AuditLogs(models.Model):
     is_owner_log = models.BooleanField(default=False)
     table_name = models.TextField()
     record_id = models.UUIDField(blank=True, null=True)
-    old_data = models.JSONField(blank=True, null=True)
-    new_data = models.JSONField(blank=True, null=True)
+    old_data = models.JSONField(blank=True, null=True, encoder=DjangoJSONEncoder)
+    new_data = models.JSONField(blank=True, null=True, encoder=DjangoJSONEncoder)
     ip_address = models.GenericIPAddressField(null=True, blank=True)
-    created_at = models.DateTimeField(default=timezone.now, null=True)
+    # Partition key on PostgreSQL (see utils/partitions.py), so never null
+    created_at = models.DateTimeField(default=timezone.now)
 
     class Meta:
         managed = True
         db_table = "audit_logs"
+        indexes = [models.Index(fields=["created_at", "id"], name="audit_created_id_idx")]
 
 
 class PaybillTransaction(models.Model):
@@ -242,23 +247,40 @@ class Loans(models.Model):
     mpesa_receipt_number = models.CharField(max_length=50, blank=True, null=True)
     mpesa_disbursement_status = models.CharField(
         max_length=20,
-        choices=[('PENDING', 'Pending'), ('SUCCESS', 'Success'), ('FAILED', 'Failed'), ('TIMEOUT', 'Timeout')],
+        choices=[
+            ('QUEUED', 'Queued'), ('PENDING', 'Pending'), ('SUCCESS', 'Success'),
+            ('FAILED', 'Failed'), ('TIMEOUT', 'Timeout'),
+        ],
         blank=True, null=True
     )
+    # Running total of Repayments.amount_paid. Only ever moved through
+    # apply_repayment() so it stays consistent with the repayments table;
+    # see the reconcile_loan_balances command.
+    amount_paid = models.DecimalField(max_digits=12, decimal_places=2, default=0)
     created_at = models.DateTimeField(default=timezone.now, null=True, db_index=True)
     updated_at = models.DateTimeField(auto_now=True, null=True)
 
     class Meta:
         managed = True
         db_table = "loans"
+        # Matches the nullable keyset order of CursorResultsSetPagination
+        indexes = [
+            models.Index(
+                models.F("created_at").desc(nulls_last=True), models.F("id").desc(), name="loans_created_id_idx"
+            )
+        ]
 
     def save(self, *args, **kwargs):
         # Check if this is an update by looking up the existing record safely
         is_update = False
+        old_instance = None
         if self.pk:
             old_instance = Loans.objects.filter(pk=self.pk).first()
             if old_instance:
                 is_update = True
+                # amount_paid is owned by apply_repayment(); never write back
+                # a stale in-memory copy over a concurrent repayment.
+                self.amount_paid = old_instance.amount_paid
                 # Prevent tampering after verification
                 if old_instance.status in ["VERIFIED", "ACTIVE", "OVERDUE", "CLOSED"]:
                     # (Note: This is a low-level check, better enforced in views)
@@ -268,6 +290,13 @@ class Loans(models.Model):
             self.base_interest_rate = self.interest_rate
         super().save(*args, **kwargs)
 
+        if old_instance is None or old_instance.status != self.status:
+            from django.db import transaction
+            from .utils.cache import bump_analytics_generation, record_match_index_change
+            transaction.on_commit(bump_analytics_generation)
+            user_id = self.user_id
+            transaction.on_commit(lambda: record_match_index_change(user_id))
+
     def delete(self, *args, **kwargs):
         raise PermissionError("Financial records cannot be deleted.")
 
@@ -280,27 +309,41 @@ class Loans(models.Model):
         # for the entire loan duration.
         return principal + (principal * (rate / 100))
 
-    @property
-    def amount_paid(self):
-        return float(
-            self.repayments_set.aggregate(models.Sum("amount_paid"))["amount_paid__sum"]
-            or 0
+    def apply_repayment(self, amount):
+        """
+        Adds a repayment to the stored running total. Must be called inside the
+        same transaction.atomic() block that creates the Repayments row.
+        """
+        Loans.objects.filter(pk=self.pk).update(
+            amount_paid=models.F("amount_paid") + amount, updated_at=timezone.now()
         )
+        self.refresh_from_db(fields=["amount_paid", "updated_at"])
 
     @property
     def remaining_balance(self):
-        return self.total_repayable_amount - self.amount_paid
+        return self.total_repayable_amount - float(self.amount_paid or 0)
+
+    def oldest_overdue_installment_date(self):
+        """
+        Due date of the oldest unpaid installment already past due, or None.
+        List querysets provide it as the ``oldest_overdue_due_date``
+        annotation (see LoanSerializer.setup_eager_loading).
+        """
+        if "oldest_overdue_due_date" in self.__dict__:
+            return self.oldest_overdue_due_date
+        return (
+            self.repaymentschedule_set.filter(due_date__lt=timezone.now().date(), is_paid=False)
+            .order_by("due_date")
+            .values_list("due_date", flat=True)
+            .first()
+        )
 
     @property
     def is_overdue(self):
         today = timezone.now().date()
 
         # Priority 1: Check Repayment Schedule
-        schedule_overdue = self.repaymentschedule_set.filter(
-            due_date__lt=today, is_paid=False
-        ).exists()
-
-        if schedule_overdue:
+        if self.oldest_overdue_installment_date():
             return True
 
         # Priority 2: Check Tenure from Disbursement Date
@@ -326,14 +369,10 @@ class Loans(models.Model):
         due_date = None
 
         # Check schedule first
-        oldest_unpaid = (
-            self.repaymentschedule_set.filter(due_date__lt=today, is_paid=False)
-            .order_by("due_date")
-            .first()
-        )
+        oldest_unpaid = self.oldest_overdue_installment_date()
 
         if oldest_unpaid:
-            due_date = oldest_unpaid.due_date
+            due_date = oldest_unpaid
         elif self.disbursed_at:
             due_date = self.disbursed_at.date()
             if self.duration_weeks:
@@ -470,6 +509,12 @@ class Repayments(models.Model):
     class Meta:
         managed = True
         db_table = "repayments"
+        # Matches the nullable keyset order of CursorResultsSetPagination
+        indexes = [
+            models.Index(
+                models.F("payment_date").desc(nulls_last=True), models.F("id").desc(), name="repay_paydate_id_idx"
+            )
+        ]
 
     def delete(self, *args, **kwargs):
         raise PermissionError("Repayment records cannot be deleted.")
@@ -503,6 +548,7 @@ class SMSLog(models.Model):
     class Meta:
         managed = True
         db_table = "sms_logs"
+        indexes = [models.Index(fields=["created_at", "id"], name="sms_created_id_idx")]
 
 
 class EmailLog(models.Model):
@@ -520,6 +566,7 @@ class EmailLog(models.Model):
     class Meta:
         managed = True
         db_table = "email_logs"
+        indexes = [models.Index(fields=["created_at", "id"], name="email_created_id_idx")]
 
 
 class UserProfiles(models.Model):
@@ -566,6 +613,10 @@ class UserProfiles(models.Model):
     class Meta:
         managed = True
         db_table = "user_profiles"
+        indexes = [
+            # Case-insensitive national ID lookups from paybill matching
+            models.Index(Upper("national_id"), name="profile_national_id_upper"),
+        ]
 
 
 class Users(models.Model):
@@ -732,11 +783,17 @@ class LedgerEntry(models.Model):
     loan = models.ForeignKey(Loans, on_delete=models.SET_NULL, null=True, blank=True)
     reference_id = models.CharField(max_length=100, blank=True, null=True)
     note = models.TextField(blank=True, null=True)
+    # False while the amount is not yet reflected in capital_account.balance
+    # (APPEND_ONLY capital ledger mode, see CapitalLedgerService)
+    is_compacted = models.BooleanField(default=True)
     created_at = models.DateTimeField(default=timezone.now)
 
     class Meta:
         managed = True
         db_table = "ledger_entries"
+        indexes = [
+            models.Index(fields=["capital_account", "is_compacted"], name="ledger_pending_idx"),
+        ]
 
 class CustomerDraft(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
@@ -750,3 +807,304 @@ class CustomerDraft(models.Model):
 
     class Meta:
         db_table = 'customer_drafts'
+
+
+class PortfolioDailySnapshot(models.Model):
+    """
+    Per day / branch / product portfolio totals, rebuilt by the
+    build_portfolio_snapshots command. Only completed days are stored; the
+    analytics views read today (and anything after the last build) live.
+    Branch is the customer's profile branch, matching manager scoping.
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    date = models.DateField(db_index=True)
+    branch = models.ForeignKey(Branch, on_delete=models.CASCADE, null=True, blank=True)
+    loan_product = models.ForeignKey(LoanProducts, on_delete=models.CASCADE, null=True, blank=True)
+    # Every loan created that day, whatever its status
+    applied_count = models.IntegerField(default=0)
+    applied_amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    # Loans disbursed that day (see services.disbursed_on) that are in a
+    # disbursed status
+    disbursed_count = models.IntegerField(default=0)
+    disbursed_amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    repaid_count = models.IntegerField(default=0)
+    repaid_amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    scheduled_count = models.IntegerField(default=0)
+    scheduled_amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    # Installments due that day that are still unpaid, on OVERDUE loans
+    overdue_count = models.IntegerField(default=0)
+    overdue_amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        managed = True
+        db_table = "portfolio_daily_snapshot"
+        indexes = [models.Index(fields=["date", "branch"], name="portfolio_snap_date_branch")]
+
+
+class StatementImport(models.Model):
+    """
+    One uploaded M-Pesa statement. The file is stored on upload and processed
+    in chunks by StatementImportService, which updates the counters below so
+    the Finance dashboard can poll progress.
+    """
+    STATUS_CHOICES = [
+        ('PENDING', 'Pending'),
+        ('RUNNING', 'Running'),
+        ('COMPLETED', 'Completed'),
+        ('FAILED', 'Failed'),
+    ]
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    file = models.FileField(upload_to="statement_imports/")
+    file_name = models.CharField(max_length=255, blank=True)
+    uploaded_by = models.ForeignKey(Admins, on_delete=models.SET_NULL, null=True, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='PENDING')
+    total_rows = models.IntegerField(default=0)
+    processed_rows = models.IntegerField(default=0)
+    matched_national_id = models.IntegerField(default=0)
+    matched_phone = models.IntegerField(default=0)
+    matched_loan_id = models.IntegerField(default=0)
+    unmatched = models.IntegerField(default=0)
+    duplicates = models.IntegerField(default=0)
+    errors = models.JSONField(default=list, blank=True)
+    error_count = models.IntegerField(default=0)
+    created_at = models.DateTimeField(default=timezone.now)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        managed = True
+        db_table = "statement_imports"
+        ordering = ['-created_at']
+
+    @property
+    def progress(self):
+        if not self.total_rows:
+            return 100 if self.status == 'COMPLETED' else 0
+        return min(100, int(self.processed_rows * 100 / self.total_rows))
+
+
+class DisbursementBatch(models.Model):
+    """
+    A bulk B2C run. Capital for every included loan is reserved when the
+    batch is created; DisbursementBatchService then submits the loans
+    concurrently and records each outcome on a DisbursementBatchItem.
+    """
+    STATUS_CHOICES = [
+        ('PENDING', 'Pending'),
+        ('RUNNING', 'Running'),
+        ('COMPLETED', 'Completed'),
+        ('FAILED', 'Failed'),
+    ]
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    created_by = models.ForeignKey(Admins, on_delete=models.SET_NULL, null=True, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='PENDING')
+    reason = models.TextField(blank=True, null=True)
+    ip_address = models.GenericIPAddressField(null=True, blank=True)
+    total_loans = models.IntegerField(default=0)
+    reserved_amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    succeeded = models.IntegerField(default=0)
+    failed = models.IntegerField(default=0)
+    skipped = models.IntegerField(default=0)
+    created_at = models.DateTimeField(default=timezone.now)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        managed = True
+        db_table = "disbursement_batches"
+        ordering = ['-created_at']
+
+    @property
+    def progress(self):
+        if not self.total_loans:
+            return 100 if self.status == 'COMPLETED' else 0
+        return min(100, int((self.succeeded + self.failed + self.skipped) * 100 / self.total_loans))
+
+
+class SMSBroadcast(models.Model):
+    """
+    A BulkSMSView send. SMSBroadcastService streams the recipients, groups
+    identical texts into provider-sized batches and updates the counters as
+    each batch is answered.
+    """
+    TYPE_CHOICES = [
+        ('DEFAULTERS', 'Defaulters'),
+        ('NOTICE', 'Notice'),
+    ]
+    STATUS_CHOICES = [
+        ('PENDING', 'Pending'),
+        ('RUNNING', 'Running'),
+        ('COMPLETED', 'Completed'),
+        ('FAILED', 'Failed'),
+    ]
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    created_by = models.ForeignKey(Admins, on_delete=models.SET_NULL, null=True, blank=True)
+    sms_type = models.CharField(max_length=20, choices=TYPE_CHOICES)
+    message = models.TextField(blank=True, null=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='PENDING')
+    total_recipients = models.IntegerField(default=0)
+    sent = models.IntegerField(default=0)
+    failed = models.IntegerField(default=0)
+    batches = models.IntegerField(default=0)
+    error = models.TextField(blank=True, null=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        managed = True
+        db_table = "sms_broadcasts"
+        ordering = ['-created_at']
+
+    @property
+    def progress(self):
+        if not self.total_recipients:
+            return 100 if self.status == 'COMPLETED' else 0
+        return min(100, int((self.sent + self.failed) * 100 / self.total_recipients))
+
+
+class DataExport(models.Model):
+    """
+    An owner export run as a background job by DataExportService. The
+    gzipped CSV is stored under EXPORT_ROOT (not MEDIA_ROOT, which is
+    served publicly) with a random suffix and is only handed out through
+    DataExportDownloadView.
+    """
+    STATUS_CHOICES = [
+        ('PENDING', 'Pending'),
+        ('RUNNING', 'Running'),
+        ('COMPLETED', 'Completed'),
+        ('FAILED', 'Failed'),
+    ]
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    requested_by = models.ForeignKey(Admins, on_delete=models.SET_NULL, null=True, blank=True)
+    resource = models.CharField(max_length=30)
+    date_from = models.DateField(null=True, blank=True)
+    date_to = models.DateField(null=True, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='PENDING')
+    rows = models.IntegerField(default=0)
+    file = models.FileField(upload_to="exports/", storage=PrivateExportStorage(), blank=True)
+    size = models.BigIntegerField(default=0)
+    error = models.TextField(blank=True, null=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        managed = True
+        db_table = "data_exports"
+        ordering = ['-created_at']
+
+
+class DisbursementBatchItem(models.Model):
+    STATUS_CHOICES = [
+        ('RESERVED', 'Reserved'),
+        ('SENDING', 'Sending'),
+        ('SUCCESS', 'Success'),
+        ('FAILED', 'Failed'),
+        ('SKIPPED', 'Skipped'),
+    ]
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    batch = models.ForeignKey(DisbursementBatch, on_delete=models.CASCADE, related_name="items")
+    loan = models.ForeignKey(Loans, on_delete=models.DO_NOTHING, related_name="batch_items")
+    amount = models.DecimalField(max_digits=12, decimal_places=2)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='RESERVED')
+    originator_id = models.CharField(max_length=100, blank=True, null=True)
+    error = models.TextField(blank=True, null=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        managed = True
+        db_table = "disbursement_batch_items"
+        constraints = [
+            models.UniqueConstraint(fields=["batch", "loan"], name="unique_batch_loan"),
+        ]
+
+
+class MpesaCallback(models.Model):
+    """
+    Raw Daraja callback payload, stored before Safaricom is acknowledged.
+    idempotency_key (TransID, OriginatorConversationID or CheckoutRequestID)
+    makes redelivered callbacks collapse into one row; MpesaCallbackService
+    applies each row exactly once.
+    """
+    KIND_CHOICES = [
+        ('C2B', 'C2B payment'),
+        ('B2C', 'B2C result'),
+        ('STK', 'STK push result'),
+        ('UNKNOWN', 'Unknown'),
+    ]
+    STATUS_CHOICES = [
+        ('RECEIVED', 'Received'),
+        ('PROCESSED', 'Processed'),
+        ('FAILED', 'Failed'),
+    ]
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    idempotency_key = models.CharField(max_length=150, unique=True)
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    payload = models.JSONField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='RECEIVED')
+    attempts = models.IntegerField(default=0)
+    last_error = models.TextField(blank=True, null=True)
+    received_at = models.DateTimeField(default=timezone.now)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        managed = True
+        db_table = "mpesa_callbacks"
+        indexes = [models.Index(fields=["status", "received_at"], name="mpesa_cb_status_idx")]
+
+
+class BackgroundJob(models.Model):
+    """
+    A queued side effect (SMS, email, ...) run by apps.utils.jobs. Failed
+    attempts are retried with exponential backoff until max_attempts, then
+    the job is parked as DEAD for inspection or `run_jobs --retry-dead`.
+    """
+    STATUS_CHOICES = [
+        ('QUEUED', 'Queued'),
+        ('RUNNING', 'Running'),
+        ('RETRY', 'Waiting to retry'),
+        ('SUCCEEDED', 'Succeeded'),
+        ('DEAD', 'Dead'),
+    ]
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    task = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict, encoder=DjangoJSONEncoder)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='QUEUED')
+    attempts = models.IntegerField(default=0)
+    max_attempts = models.IntegerField(default=5)
+    run_at = models.DateTimeField(default=timezone.now)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True, null=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        managed = True
+        db_table = "background_jobs"
+        indexes = [models.Index(fields=["status", "run_at"], name="bg_job_status_idx")]
+
+
+class BackgroundJobRun(models.Model):
+    """One attempt at a BackgroundJob: how long it waited, how long it ran and how it ended."""
+    OUTCOME_CHOICES = [
+        ('SUCCEEDED', 'Succeeded'),
+        ('FAILED', 'Failed'),
+        ('DEAD', 'Dead'),
+    ]
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    job = models.ForeignKey(BackgroundJob, on_delete=models.CASCADE, related_name='runs')
+    task = models.CharField(max_length=100)
+    attempt = models.IntegerField()
+    outcome = models.CharField(max_length=20, choices=OUTCOME_CHOICES)
+    queue_latency_ms = models.IntegerField()
+    duration_ms = models.IntegerField()
+    error = models.TextField(blank=True, null=True)
+    started_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        managed = True
+        db_table = "background_job_runs"
+        indexes = [models.Index(fields=["task", "started_at"], name="bg_job_run_task_idx")]
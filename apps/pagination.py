@@ -1,5 +1,14 @@
+import base64
+import json
+import uuid
+
+from django.db import connections
+from django.db.models import F, Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
 from rest_framework.pagination import PageNumberPagination
 from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
 
 
 class StandardResultsSetPagination(PageNumberPagination):
@@ -20,3 +29,138 @@ class StandardResultsSetPagination(PageNumberPagination):
                 "results": data,
             }
         )
+
+
+def estimated_count(queryset):
+    """
+    Row estimate from pg_class.reltuples for an unfiltered queryset on
+    PostgreSQL; None when no cheap estimate is available.
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != "postgresql" or queryset.query.where:
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass",
+            [queryset.model._meta.db_table],
+        )
+        row = cursor.fetchone()
+    # reltuples is -1 until the table has been vacuumed/analyzed
+    return int(row[0]) if row and row[0] >= 0 else None
+
+
+class CursorResultsSetPagination(StandardResultsSetPagination):
+    """
+    StandardResultsSetPagination with an opt-in keyset mode for large tables.
+
+    Passing ``?cursor=`` (empty for the first page) switches to keyset
+    pagination on ``view.cursor_fields`` (default ``(created_at, id)``),
+    newest first. Pages are fetched with a WHERE on the last row seen instead
+    of OFFSET, so deep pages cost the same as the first one. No COUNT(*) is
+    run unless ``?count=exact`` is passed; otherwise ``count`` is the
+    PostgreSQL estimate for unfiltered lists and null for filtered ones.
+    """
+    cursor_query_param = "cursor"
+    count_query_param = "count"
+    cursor_fields = ("created_at", "id")
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.cursor_query_param not in request.query_params:
+            self.keyset = False
+            return super().paginate_queryset(queryset, request, view)
+
+        self.keyset = True
+        self.request = request
+        self.field, self.tiebreak = getattr(view, "cursor_fields", self.cursor_fields)
+        self.nullable = queryset.model._meta.get_field(self.field).null
+        self.size = self.get_page_size(request)
+        position, reverse = self.decode_cursor(request.query_params[self.cursor_query_param])
+
+        if request.query_params.get(self.count_query_param) == "exact":
+            self.count, self.count_is_estimate = queryset.count(), False
+        else:
+            self.count, self.count_is_estimate = estimated_count(queryset), True
+
+        queryset = queryset.order_by(*self._ordering(reverse))
+        if position is not None:
+            queryset = queryset.filter(self._after(position, reverse))
+        rows = list(queryset[: self.size + 1])
+        has_more = len(rows) > self.size
+        rows = rows[: self.size]
+        if reverse:
+            rows.reverse()
+
+        self.next_position = self._position(rows[-1]) if rows and (has_more or reverse) else None
+        self.previous_position = self._position(rows[0]) if rows and (position is not None and (has_more or not reverse)) else None
+        return rows
+
+    def _ordering(self, reverse):
+        # Newest first; reverse walks back towards newer rows. NOT NULL
+        # columns use plain ASC/DESC so a (field, id) index serves the sort;
+        # nullable ones keep NULLs last and have matching DESC NULLS LAST
+        # expression indexes.
+        if not self.nullable:
+            if reverse:
+                return [F(self.field).asc(), F(self.tiebreak).asc()]
+            return [F(self.field).desc(), F(self.tiebreak).desc()]
+        if reverse:
+            return [F(self.field).asc(nulls_first=True), F(self.tiebreak).asc()]
+        return [F(self.field).desc(nulls_last=True), F(self.tiebreak).desc()]
+
+    def _after(self, position, reverse):
+        # The redundant field <= value / >= value bound gives the planner an
+        # index range to start from instead of filtering from the top
+        value, tiebreak = position
+        if reverse:
+            if value is None:
+                return Q(**{f"{self.field}__isnull": False}) | Q(**{f"{self.field}__isnull": True, f"{self.tiebreak}__gt": tiebreak})
+            return Q(**{f"{self.field}__gte": value}) & (
+                Q(**{f"{self.field}__gt": value}) | Q(**{f"{self.tiebreak}__gt": tiebreak})
+            )
+        if value is None:
+            return Q(**{f"{self.field}__isnull": True, f"{self.tiebreak}__lt": tiebreak})
+        after = Q(**{f"{self.field}__lte": value}) & (
+            Q(**{f"{self.field}__lt": value}) | Q(**{f"{self.tiebreak}__lt": tiebreak})
+        )
+        if self.nullable:
+            after |= Q(**{f"{self.field}__isnull": True})
+        return after
+
+    def _position(self, obj):
+        value = getattr(obj, self.field)
+        return (value.isoformat() if value is not None else None, str(getattr(obj, self.tiebreak)))
+
+    def decode_cursor(self, token):
+        if not token:
+            return None, False
+        try:
+            data = json.loads(base64.urlsafe_b64decode(token.encode()).decode())
+            value = data["v"]
+            if value is not None:
+                value = parse_datetime(value)
+                if value is None:
+                    raise ValueError
+            return (value, str(uuid.UUID(str(data["id"])))), bool(data.get("r"))
+        except (TypeError, ValueError, KeyError, AttributeError):
+            raise NotFound("Invalid cursor.")
+
+    def encode_cursor(self, position, reverse):
+        value, tiebreak = position
+        payload = json.dumps({"v": value, "id": tiebreak, "r": int(reverse)})
+        token = base64.urlsafe_b64encode(payload.encode()).decode()
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, token)
+
+    def get_paginated_response(self, data):
+        if not self.keyset:
+            return super().get_paginated_response(data)
+        return Response(
+            {
+                "links": {
+                    "next": self.encode_cursor(self.next_position, False) if self.next_position else None,
+                    "previous": self.encode_cursor(self.previous_position, True) if self.previous_position else None,
+                },
+                "count": self.count,
+                "count_is_estimate": self.count_is_estimate,
+                "results": data,
+            }
+        )
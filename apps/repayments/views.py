@@ -18,8 +18,11 @@ from ..models import (
     UserProfiles # Added
 )
 from ..serializers import RepaymentSerializer
+from ..services import CapitalLedgerService, MpesaCallbackService, PaymentMatchResolver, normalize_phone
+from ..utils.audit import record_audit
 from ..utils.security import log_action, get_client_ip, get_filtered_queryset
 from ..permissions import IsAdminUser
+from ..pagination import CursorResultsSetPagination
 from ..utils.mpesa import MpesaHandler
 import json
 
@@ -29,6 +32,9 @@ logger = logging.getLogger(__name__)  # Added
 class RepaymentListCreateView(generics.ListCreateAPIView):
     serializer_class = RepaymentSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = CursorResultsSetPagination
+    # Repayments carry no created_at; payment_date is the list order
+    cursor_fields = ("payment_date", "id")
 
     def get_queryset(self):
         return get_filtered_queryset(self.request.user, Repayments.objects.all(), 'loan__user__profile__branch_fk', request=self.request).order_by("-payment_date")
@@ -38,11 +44,8 @@ class RepaymentListCreateView(generics.ListCreateAPIView):
         with transaction.atomic():
             repayment = serializer.save(id=uuid.uuid4())
             loan = repayment.loan
-            capital = SystemCapital.objects.select_for_update().filter(name="Simulation Capital").first()
-            if capital:
-                capital.balance += repayment.amount_paid
-                capital.save()
-                LedgerEntry.objects.create(capital_account=capital, amount=repayment.amount_paid, entry_type="REPAYMENT", loan=loan, reference_id=repayment.reference_code, note=f"Repayment of KES {repayment.amount_paid} for Loan {loan.id.hex[:8]}")
+            loan.apply_repayment(repayment.amount_paid)
+            CapitalLedgerService.record_inflow(repayment.amount_paid, "REPAYMENT", loan=loan, reference_id=repayment.reference_code, note=f"Repayment of KES {repayment.amount_paid} for Loan {loan.id.hex[:8]}")
             amount_remaining = float(repayment.amount_paid)
             for installment in RepaymentSchedule.objects.filter(loan=loan, is_paid=False).order_by('due_date'):
                 if amount_remaining <= 0: break
@@ -55,22 +58,13 @@ class RepaymentListCreateView(generics.ListCreateAPIView):
             from ..loans.views import create_loan_activity, create_notification
             create_loan_activity(loan, admin, "REPAYMENT", f"Repayment of KES {repayment.amount_paid} recorded.")
             Transactions.objects.create(id=uuid.uuid4(), user=loan.user, type="REPAYMENT", amount=repayment.amount_paid)
-            s_schedules = RepaymentSchedule.objects.filter(loan=loan, status='PENDING').order_by('due_date')
-            am_to_apply = repayment.amount_paid
-            for schedule in s_schedules:
-                if am_to_apply <= 0: break
-                if am_to_apply >= schedule.amount_due:
-                    am_to_apply -= schedule.amount_due
-                    schedule.status = 'PAID'
-                    schedule.save()
-                else: break
             if loan.remaining_balance <= 0:
                 old_status = loan.status
                 loan.status = "CLOSED"
                 loan.save()
                 create_notification(loan.user, f"Congratulations! Your loan of KES {loan.principal_amount} has been fully repaid.")
                 create_loan_activity(loan, admin, "STATUS_CHANGE", "Loan closed - fully repaid.")
-                AuditLogs.objects.create(admin=admin, action=f"Loan {loan.id} fully repaid and closed.", log_type="STATUS", table_name="loans", record_id=loan.id, old_data={"status": old_status}, new_data={"status": "CLOSED"})
+                record_audit(admin=admin, action=f"Loan {loan.id} fully repaid and closed.", log_type="STATUS", table_name="loans", record_id=loan.id, old_data={"status": old_status}, new_data={"status": "CLOSED"})
             else: loan.update_status_and_rates()
 
 class MpesaRepaymentView(views.APIView):
@@ -97,286 +91,209 @@ class MpesaRepaymentView(views.APIView):
 class MpesaCallbackView(views.APIView):
     permission_classes = [permissions.AllowAny]
     authentication_classes = []
+    # Safaricom posts every callback from a handful of IPs; the anon rate
+    # limit would start rejecting payments after 100 a day.
+    throttle_classes = []
 
     def post(self, request):
-        data = request.data
+        """
+        Stores the payload and acknowledges straight away; the matching,
+        ledger and schedule work happens in MpesaCallbackService.
+        """
+        data = request.data.dict() if hasattr(request.data, 'dict') else request.data
         logger.info(f"[M-Pesa Callback] Received: {json.dumps(data)}")
-
-        # ── B2C CALLBACK (Disbursement result from Safaricom) ──
-        if 'Result' in data:
-            return self._handle_b2c_callback(data)
-
-        # ── C2B CALLBACK (Customer paying to Paybill) ──
-        if 'TransID' in data or 'Body' in data:
-            return self._handle_c2b_callback(data)
-
-        logger.warning(f"[M-Pesa Callback] Unrecognised payload structure: {list(data.keys())}")
+        callback, created = MpesaCallbackService.enqueue(data)
+        if created:
+            MpesaCallbackService.dispatch(callback)
+        else:
+            logger.info(f"[M-Pesa Callback] Duplicate delivery of {callback.idempotency_key} ignored")
         return Response({'ResultCode': 0, 'ResultDesc': 'Accepted'})
 
-    def _handle_b2c_callback(self, data):
-        from ..models import Loans, LoanActivity, RepaymentSchedule, AuditLogs
-        result = data.get('Result', {})
-        result_code = result.get('ResultCode')
-        originator_id = result.get('OriginatorConversationID', '')
-        conversation_id = result.get('ConversationID', '')
-        trans_id = result.get('TransactionID', '')
-
-        receipt_number = trans_id
-        amount_disbursed = None
-        receiver_phone = None
-
-        params = result.get('ResultParameters', {}).get('ResultParameter', [])
-        for p in params:
-            key = p.get('Key', '')
-            val = p.get('Value')
-            if key == 'ReceiptNo': receipt_number = val
-            if key == 'TransactionAmount': amount_disbursed = val
-            if key == 'ReceiverPartyPublicName': receiver_phone = val
-
-        logger.info(f"[B2C] ResultCode={result_code}, OriginatorID={originator_id}, Receipt={receipt_number}")
-
-        # Find the loan by originator ID
-        loan = Loans.objects.filter(
-            mpesa_originator_id__in=[originator_id, conversation_id]
-        ).first()
-
-        if not loan:
-            logger.error(f"[B2C] No loan found for OriginatorID: {originator_id}")
-            return Response({'ResultCode': 0, 'ResultDesc': 'Accepted'})
-
-        if result_code == 0:
-            # SUCCESS — activate loan, generate schedule
-            with transaction.atomic():
-                loan.status = 'ACTIVE'
-                loan.mpesa_disbursement_status = 'SUCCESS'
-                loan.mpesa_receipt_number = receipt_number
-                loan.save()
 
-                # Generate repayment schedule if not already generated
-                if not RepaymentSchedule.objects.filter(loan=loan).exists():
-                    total_repayable = float(loan.total_repayable_amount)
-                    disbursed_date = loan.disbursed_at.date() if loan.disbursed_at else timezone.now().date()
-                    num_installments = loan.duration_weeks or (loan.duration_months * 4 if loan.duration_months else 4)
-                    installment_amount = round(total_repayable / num_installments, 2)
-
-                    for i in range(1, num_installments + 1):
-                        if loan.duration_weeks:
-                            due_date = disbursed_date + timezone.timedelta(weeks=i)
-                        else:
-                            due_date = disbursed_date + timezone.timedelta(days=i * 30)
-                        amt = installment_amount
-                        if i == num_installments:
-                            amt = round(total_repayable - (installment_amount * (num_installments - 1)), 2)
-                        RepaymentSchedule.objects.create(
-                            loan=loan, installment_number=i,
-                            due_date=due_date, amount_due=amt, is_paid=False
-                        )
-
-                LoanActivity.objects.create(
-                    loan=loan,
-                    action='DISBURSEMENT_CONFIRMED',
-                    note=f'M-Pesa B2C confirmed. Receipt: {receipt_number}. Loan is now ACTIVE.'
-                )
+def apply_b2c_result(data):
+    """Applies a B2C disbursement result stored by MpesaCallbackView."""
+    from ..models import Loans, LoanActivity, RepaymentSchedule, AuditLogs
+    result = data.get('Result', {})
+    result_code = result.get('ResultCode')
+    originator_id = result.get('OriginatorConversationID', '')
+    conversation_id = result.get('ConversationID', '')
+    trans_id = result.get('TransactionID', '')
+
+    receipt_number = trans_id
+    amount_disbursed = None
+    receiver_phone = None
+
+    params = result.get('ResultParameters', {}).get('ResultParameter', [])
+    for p in params:
+        key = p.get('Key', '')
+        val = p.get('Value')
+        if key == 'ReceiptNo': receipt_number = val
+        if key == 'TransactionAmount': amount_disbursed = val
+        if key == 'ReceiverPartyPublicName': receiver_phone = val
+
+    logger.info(f"[B2C] ResultCode={result_code}, OriginatorID={originator_id}, Receipt={receipt_number}")
+
+    # Find the loan by originator ID
+    loan = Loans.objects.filter(
+        mpesa_originator_id__in=[originator_id, conversation_id]
+    ).first()
+
+    if not loan:
+        logger.error(f"[B2C] No loan found for OriginatorID: {originator_id}")
+        return
+
+    if result_code == 0:
+        if loan.mpesa_disbursement_status == 'SUCCESS':
+            logger.info(f"[B2C] Loan {loan.id.hex[:8]} already confirmed; result ignored")
+            return
+        # SUCCESS — activate loan, generate schedule
+        with transaction.atomic():
+            loan.status = 'ACTIVE'
+            loan.mpesa_disbursement_status = 'SUCCESS'
+            loan.mpesa_receipt_number = receipt_number
+            loan.save()
 
-                AuditLogs.objects.create(
-                    action=f'Loan {loan.id.hex[:8]} disbursement confirmed by M-Pesa. Receipt: {receipt_number}',
-                    log_type='STATUS',
-                    table_name='loans',
-                    record_id=loan.id,
-                    old_data={'status': 'DISBURSED'},
-                    new_data={'status': 'ACTIVE', 'receipt': receipt_number}
-                )
+            # Generate repayment schedule if not already generated
+            from ..services import generate_repayment_schedule
+            generate_repayment_schedule(loan, replace=False)
 
-                # Send SMS to customer
-                try:
-                    from ..utils.sms import send_sms_async
-                    msg = (
-                        f"Dear {loan.user.full_name}, your loan of KES {int(loan.principal_amount):,} "
-                        f"has been disbursed to your M-Pesa. Receipt: {receipt_number}. "
-                        f"Total repayable: KES {int(loan.total_repayable_amount):,}. "
-                        f"Repay via Paybill using your National ID as account number. - Azariah Credit"
-                    )
-                    send_sms_async([loan.user.phone], msg)
-                except Exception as sms_err:
-                    logger.warning(f"[B2C] SMS send failed after disbursement: {sms_err}")
-
-            logger.info(f"[B2C] Loan {loan.id.hex[:8]} successfully activated. Receipt: {receipt_number}")
+            LoanActivity.objects.create(
+                loan=loan,
+                action='DISBURSEMENT_CONFIRMED',
+                note=f'M-Pesa B2C confirmed. Receipt: {receipt_number}. Loan is now ACTIVE.'
+            )
 
-        else:
-            # FAILED — revert loan to APPROVED so Finance Officer can retry
-            error_desc = result.get('ResultDesc', 'Unknown M-Pesa error')
-            with transaction.atomic():
-                loan.status = 'APPROVED'
-                loan.mpesa_disbursement_status = 'FAILED'
-                loan.mpesa_originator_id = None
-                loan.save()
+            record_audit(
+                action=f'Loan {loan.id.hex[:8]} disbursement confirmed by M-Pesa. Receipt: {receipt_number}',
+                log_type='STATUS',
+                table_name='loans',
+                record_id=loan.id,
+                old_data={'status': 'DISBURSED'},
+                new_data={'status': 'ACTIVE', 'receipt': receipt_number}
+            )
 
-                # Reverse the capital deduction
-                from ..models import SystemCapital, LedgerEntry
-                capital = SystemCapital.objects.select_for_update().first()
-                if capital:
-                    capital.balance += loan.principal_amount
-                    capital.save()
-                    LedgerEntry.objects.create(
-                        capital_account=capital,
-                        amount=loan.principal_amount,
-                        entry_type='CAPITAL_INJECTION',
-                        loan=loan,
-                        note=f'Capital reversed — B2C disbursement failed. Reason: {error_desc}'
-                    )
-
-                LoanActivity.objects.create(
-                    loan=loan,
-                    action='DISBURSEMENT_FAILED',
-                    note=f'M-Pesa B2C FAILED. Reason: {error_desc}. Loan reverted to APPROVED for retry.'
+            # Send SMS to customer
+            try:
+                from ..utils.sms import send_sms_async
+                msg = (
+                    f"Dear {loan.user.full_name}, your loan of KES {int(loan.principal_amount):,} "
+                    f"has been disbursed to your M-Pesa. Receipt: {receipt_number}. "
+                    f"Total repayable: KES {int(loan.total_repayable_amount):,}. "
+                    f"Repay via Paybill using your National ID as account number. - Azariah Credit"
                 )
+                send_sms_async([loan.user.phone], msg)
+            except Exception as sms_err:
+                logger.warning(f"[B2C] SMS send failed after disbursement: {sms_err}")
 
-            logger.error(f"[B2C] Disbursement FAILED for loan {loan.id.hex[:8]}: {error_desc}")
+        logger.info(f"[B2C] Loan {loan.id.hex[:8]} successfully activated. Receipt: {receipt_number}")
 
-        return Response({'ResultCode': 0, 'ResultDesc': 'Accepted'})
-
-    def _handle_c2b_callback(self, data):
-        """Handle real-time C2B payment notification from Safaricom."""
-        from ..models import PaybillTransaction, Users, UserProfiles
-
-        # Support both direct C2B and wrapped Body format
-        body = data.get('Body', data)
-        stkCallback = body.get('stkCallback', {})
-        if stkCallback:
-            # STK Push callback — not used for repayments in this system
-            logger.info(f"[C2B] STK Push callback received — ignored (repayments via CSV)")
-            return Response({'ResultCode': 0, 'ResultDesc': 'Accepted'})
-
-        trans_id = data.get('TransID', '')
-        bill_ref = str(data.get('BillRefNumber', '')).strip()
-        amount_str = str(data.get('TransAmount', '0')).replace(',', '')
-        msisdn = str(data.get('MSISDN', ''))
-        first_name = data.get('FirstName', '')
-        last_name = data.get('LastName', '')
-        sender_name = f"{first_name} {last_name}".strip()
-        trans_time = data.get('TransTime', '')
-
-        if not trans_id:
-            return Response({'ResultCode': 0, 'ResultDesc': 'Accepted'})
-
-        # Avoid duplicates
-        if PaybillTransaction.objects.filter(receipt_number=trans_id).exists():
-            logger.info(f"[C2B] Duplicate callback ignored: {trans_id}")
-            return Response({'ResultCode': 0, 'ResultDesc': 'Accepted'})
-
-        try:
-            amount = float(amount_str)
-        except ValueError:
-            amount = 0
+    else:
+        # FAILED — revert loan to APPROVED so Finance Officer can retry
+        error_desc = result.get('ResultDesc', 'Unknown M-Pesa error')
+        with transaction.atomic():
+            loan = Loans.objects.select_for_update().get(pk=loan.pk)
+            if loan.mpesa_disbursement_status == 'FAILED':
+                # Replayed result: the capital was already credited back
+                logger.info(f"[B2C] Loan {loan.id.hex[:8]} failure already applied; result ignored")
+                return
+            loan.status = 'APPROVED'
+            loan.mpesa_disbursement_status = 'FAILED'
+            loan.mpesa_originator_id = None
+            loan.save()
 
-        # Normalise phone
-        search_phone = msisdn
-        if msisdn.startswith('254') and len(msisdn) > 3:
-            search_phone = '0' + msisdn[3:]
-        elif not msisdn.startswith('0') and len(msisdn) == 9:
-            search_phone = '0' + msisdn
+            # Reverse the capital deduction
+            CapitalLedgerService.record_inflow(
+                loan.principal_amount,
+                'CAPITAL_INJECTION',
+                loan=loan,
+                note=f'Capital reversed — B2C disbursement failed. Reason: {error_desc}'
+            )
 
-        try:
-            from datetime import datetime
-            try:
-                transaction_date = timezone.make_aware(datetime.strptime(trans_time, '%Y%m%d%H%M%S'))
-            except Exception:
-                transaction_date = timezone.now()
-
-            # Create PaybillTransaction so it appears in Finance Officer unmatched queue
-            txn = PaybillTransaction.objects.create(
-                receipt_number=trans_id,
-                sender_phone=search_phone,
-                sender_name=sender_name,
-                account_ref=bill_ref,
-                amount=amount,
-                transaction_date=transaction_date,
-                status='UNMATCHED'
+            LoanActivity.objects.create(
+                loan=loan,
+                action='DISBURSEMENT_FAILED',
+                note=f'M-Pesa B2C FAILED. Reason: {error_desc}. Loan reverted to APPROVED for retry.'
             )
 
-            # Attempt auto-matching: 
-            # 1. Direct Loan ID (Full or Short)
-            # 2. National ID
-            # 3. Phone Number
-            matched = False
-            
-            # Clean input ref
-            bill_ref_clean = str(bill_ref).strip() if bill_ref else ""
-
-            # 1. Try matching by Loan ID (Full UUID or Short 8-char hex)
-            if not matched and len(bill_ref_clean) >= 8:
-                try:
-                    import re as re_module
-                    import uuid as uuid_module
-                    try:
-                        loan_uuid = uuid_module.UUID(bill_ref_clean)
-                        loan = Loans.objects.filter(id=loan_uuid, status__in=['ACTIVE', 'OVERDUE']).first()
-                    except ValueError:
-                        if re_module.fullmatch(r'[0-9a-fA-F]{8,}', bill_ref_clean):
-                            loan = Loans.objects.filter(
-                                id__istartswith=bill_ref_clean,
-                                status__in=['ACTIVE', 'OVERDUE']
-                            ).first()
-                        else:
-                            loan = None
-                    if loan:
-                        _record_repayment(txn, loan, loan.user, 'LOAN_ID', None)
-                        matched = True
-                        logger.info(f"[C2B] Matched by Loan ID: {bill_ref_clean} → Loan {loan.id}")
-                except Exception as e:
-                    logger.error(f"[C2B] Error matching by Loan ID: {e}")
-
-            # 2. Try matching by National ID (Case-insensitive, stripped)
-            if not matched:
-                try:
-                    # Remove spaces for National ID just in case
-                    clean_nid = bill_ref_clean.replace(" ", "")
-                    # Use filter().first() instead of get() to avoid crashes on duplicates/missing
-                    profile = UserProfiles.objects.filter(national_id__iexact=clean_nid).first()
-                    
-                    if profile:
-                        loan = Loans.objects.filter(
-                            user=profile.user, status__in=['ACTIVE', 'OVERDUE']
-                        ).order_by('created_at').first()
-                        if loan:
-                            _record_repayment(txn, loan, profile.user, 'NATIONAL_ID', None)
-                            matched = True
-                            logger.info(f"[C2B] Matched by National ID: {clean_nid} → Loan {loan.id}")
-                except Exception as e:
-                     logger.error(f"[C2B] Error matching by National ID: {e}")
-
-            # 3. Try matching by Phone
-            if not matched:
-                try:
-                    customer = Users.objects.filter(phone=search_phone).first()
-                    if customer:
-                        loan = Loans.objects.filter(
-                            user=customer, status__in=['ACTIVE', 'OVERDUE']
-                        ).order_by('created_at').first()
-                        if loan:
-                            _record_repayment(txn, loan, customer, 'PHONE', None)
-                            matched = True
-                            logger.info(f"[C2B] Matched by phone: {search_phone} → Loan {loan.id.hex[:8]}")
-                except Exception:
-                    pass
-
-            if not matched:
-                logger.info(f"[C2B] Unmatched transaction {trans_id} — added to queue for Finance Officer review")
-                logger.warning(
-                    f"[C2B] UNMATCHED — TransID: {trans_id}, BillRef: '{bill_ref}', "
-                    f"Phone: {search_phone}, Amount: {amount}. "
-                    f"Ensure BillRefNumber matches a customer National ID registered in the system."
-                )
+        logger.error(f"[B2C] Disbursement FAILED for loan {loan.id.hex[:8]}: {error_desc}")
 
-        except Exception as e:
-            logger.error(f"[C2B] Error processing callback: {e}")
 
-        return Response({'ResultCode': 0, 'ResultDesc': 'Accepted'})
+def apply_c2b_payment(data):
+    """
+    Handle real-time C2B payment notification from Safaricom. Errors are
+    left to propagate so MpesaCallbackService can mark the callback FAILED
+    and retry it.
+    """
+    from ..models import PaybillTransaction
+
+    # Support both direct C2B and wrapped Body format
+    body = data.get('Body', data)
+    stkCallback = body.get('stkCallback', {})
+    if stkCallback:
+        # STK Push callback — not used for repayments in this system
+        logger.info(f"[C2B] STK Push callback received — ignored (repayments via CSV)")
+        return
+
+    trans_id = data.get('TransID', '')
+    bill_ref = str(data.get('BillRefNumber', '')).strip()
+    amount_str = str(data.get('TransAmount', '0')).replace(',', '')
+    msisdn = str(data.get('MSISDN', ''))
+    first_name = data.get('FirstName', '')
+    last_name = data.get('LastName', '')
+    sender_name = f"{first_name} {last_name}".strip()
+    trans_time = data.get('TransTime', '')
+
+    if not trans_id:
+        return
+
+    # Avoid duplicates
+    if PaybillTransaction.objects.filter(receipt_number=trans_id).exists():
+        logger.info(f"[C2B] Duplicate callback ignored: {trans_id}")
+        return
+
+    try:
+        amount = float(amount_str)
+    except ValueError:
+        amount = 0
+
+    search_phone = normalize_phone(msisdn)
+
+    from datetime import datetime
+    try:
+        transaction_date = timezone.make_aware(datetime.strptime(trans_time, '%Y%m%d%H%M%S'))
+    except Exception:
+        transaction_date = timezone.now()
+
+    # Create PaybillTransaction so it appears in Finance Officer unmatched queue
+    txn = PaybillTransaction.objects.create(
+        receipt_number=trans_id,
+        sender_phone=search_phone,
+        sender_name=sender_name,
+        account_ref=bill_ref,
+        amount=amount,
+        transaction_date=transaction_date,
+        status='UNMATCHED'
+    )
+
+    # Attempt auto-matching by Loan ID (full or short), National ID,
+    # then phone — see PaymentMatchResolver.
+    loan, match_method = PaymentMatchResolver.match_loan(bill_ref, search_phone)
+    if loan:
+        _record_repayment(txn, loan, loan.user, match_method, None)
+        logger.info(f"[C2B] Matched by {match_method}: {bill_ref or search_phone} → Loan {loan.id.hex[:8]}")
+    else:
+        logger.info(f"[C2B] Unmatched transaction {trans_id} — added to queue for Finance Officer review")
+        logger.warning(
+            f"[C2B] UNMATCHED — TransID: {trans_id}, BillRef: '{bill_ref}', "
+            f"Phone: {search_phone}, Amount: {amount}. "
+            f"Ensure BillRefNumber matches a customer National ID registered in the system."
+        )
+
 
 def _record_repayment(txn, loan, customer, match_method, processed_by):
     from django.db import transaction as db_transaction
     from django.utils import timezone
-    from ..models import Repayments, SystemCapital, LedgerEntry, RepaymentSchedule, Transactions
+    from ..models import Repayments, RepaymentSchedule, Transactions
     from ..loans.views import create_loan_activity, create_notification
     import uuid
 
@@ -396,19 +313,15 @@ def _record_repayment(txn, loan, customer, match_method, processed_by):
             payment_method='MPESA_PAYBILL',
             reference_code=txn.receipt_number,
         )
+        loan.apply_repayment(repayment.amount_paid)
 
-        capital = SystemCapital.objects.select_for_update().filter(name="Simulation Capital").first()
-        if capital:
-            capital.balance += txn.amount
-            capital.save()
-            LedgerEntry.objects.create(
-                capital_account=capital,
-                amount=txn.amount,
-                entry_type="REPAYMENT",
-                loan=loan,
-                reference_id=txn.receipt_number,
-                note=f"Paybill repayment of KES {txn.amount} matched by {match_method}"
-            )
+        CapitalLedgerService.record_inflow(
+            txn.amount,
+            "REPAYMENT",
+            loan=loan,
+            reference_id=txn.receipt_number,
+            note=f"Paybill repayment of KES {txn.amount} matched by {match_method}"
+        )
 
         amount_remaining = float(txn.amount)
         for installment in RepaymentSchedule.objects.filter(loan=loan, is_paid=False).order_by('due_date'):
@@ -443,65 +356,75 @@ def _record_repayment(txn, loan, customer, match_method, processed_by):
             loan.update_status_and_rates()
             create_notification(loan.user, f"Payment of KES {txn.amount} received. Thank you! Ref: {txn.receipt_number}.")
 
+STATEMENT_IMPORT_ROLES = ['FINANCIAL_OFFICER', 'ADMIN']
+
+
+def _can_import_statements(user):
+    return getattr(user, 'role', None) in STATEMENT_IMPORT_ROLES or getattr(user, 'is_owner', False) or getattr(user, 'is_super_admin', False)
+
+
+def _statement_import_payload(job):
+    return {
+        "id": str(job.id),
+        "file_name": job.file_name,
+        "status": job.status,
+        "progress": job.progress,
+        "total_rows": job.total_rows,
+        "processed_rows": job.processed_rows,
+        "results": {
+            "matched_national_id": job.matched_national_id,
+            "matched_phone": job.matched_phone,
+            "matched_loan_id": job.matched_loan_id,
+            "matched": job.matched_national_id + job.matched_phone + job.matched_loan_id,
+            "unmatched": job.unmatched,
+            "duplicates": job.duplicates,
+            "error_count": job.error_count,
+            "errors": job.errors,
+        },
+        "created_at": job.created_at,
+        "started_at": job.started_at,
+        "finished_at": job.finished_at,
+    }
+
+
 class StatementUploadView(views.APIView):
+    """
+    Stores the uploaded statement and queues it for StatementImportService.
+    Returns 202 with the import id; poll StatementImportStatusView for progress.
+    """
     permission_classes = [permissions.IsAuthenticated]
 
     def post(self, request):
         user = request.user
-        if getattr(user, 'role', None) not in ['FINANCIAL_OFFICER', 'ADMIN'] and not getattr(user, 'is_owner', False) and not getattr(user, 'is_super_admin', False):
+        if not _can_import_statements(user):
             return Response({"error": "Unauthorized"}, status=403)
-        file = request.FILES.get('statement')
+        file = request.FILES.get('statement') or request.FILES.get('file')
         if not file: return Response({"error": "No file uploaded"}, status=400)
-        import csv, io
-        from datetime import datetime
-        from ..models import PaybillTransaction, UserProfiles, Users
-        decoded = file.read().decode('utf-8')
-        reader = csv.DictReader(io.StringIO(decoded))
-        results = {'matched_national_id': 0, 'matched_phone': 0, 'unmatched': 0, 'duplicates': 0, 'errors': []}
-        for row in reader:
-            try:
-                receipt = (row.get('Receipt No') or row.get('TransID') or row.get('receipt_number') or '').strip()
-                sender_phone = (row.get('Sender Phone') or row.get('MSISDN') or row.get('sender_phone') or '').strip()
-                account_ref = (row.get('Account Number') or row.get('BillRefNumber') or row.get('account_ref') or '').strip()
-                amount = float((row.get('Amount') or row.get('TransAmount') or '0').strip().replace(',', ''))
-                sender_name = (row.get('Sender Name') or row.get('FirstName') or '').strip()
-                date_str = (row.get('Date') or row.get('TransTime') or '').strip()
-                if not receipt or PaybillTransaction.objects.filter(receipt_number=receipt).exists():
-                    if receipt: results['duplicates'] += 1
-                    continue
-                try: transaction_date = datetime.strptime(date_str, '%Y%m%d%H%M%S')
-                except:
-                    try: transaction_date = datetime.strptime(date_str, '%d/%m/%Y %H:%M:%S')
-                    except: transaction_date = timezone.now()
-                txn = PaybillTransaction.objects.create(
-                    receipt_number=receipt, sender_phone=sender_phone, sender_name=sender_name,
-                    account_ref=account_ref, amount=amount,
-                    transaction_date=timezone.make_aware(transaction_date) if transaction_date.tzinfo is None else transaction_date,
-                    status='UNMATCHED'
-                )
-                matched = False
-                try:
-                    profile = UserProfiles.objects.get(national_id=account_ref)
-                    loan = Loans.objects.filter(user=profile.user, status__in=['ACTIVE', 'OVERDUE']).order_by('created_at').first()
-                    if loan:
-                        _record_repayment(txn, loan, profile.user, 'NATIONAL_ID', user)
-                        results['matched_national_id'] += 1
-                        matched = True
-                except: pass
-                if not matched and sender_phone:
-                    norm = sender_phone.replace('+', '').strip()
-                    if norm.startswith('254'): norm = '0' + norm[3:]
-                    try:
-                        customer = Users.objects.get(phone=norm)
-                        loan = Loans.objects.filter(user=customer, status__in=['ACTIVE', 'OVERDUE']).order_by('created_at').first()
-                        if loan:
-                            _record_repayment(txn, loan, customer, 'PHONE', user)
-                            results['matched_phone'] += 1
-                            matched = True
-                    except: pass
-                if not matched: results['unmatched'] += 1
-            except Exception as e: results['errors'].append(str(e))
-        return Response({"message": "Statement processed", "results": results})
+        from ..models import StatementImport
+        from ..services import StatementImportService
+        with transaction.atomic():
+            job = StatementImport.objects.create(
+                file=file,
+                file_name=file.name[:255],
+                uploaded_by=user,
+            )
+            StatementImportService.start(job)
+        log_action(user, f"Uploaded M-Pesa statement {job.file_name} for import", 'statement_imports', job.id, ip_address=get_client_ip(request))
+        return Response({"message": "Statement queued for processing", **_statement_import_payload(job)}, status=202)
+
+
+class StatementImportStatusView(views.APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, pk):
+        if not _can_import_statements(request.user):
+            return Response({"error": "Unauthorized"}, status=403)
+        from ..models import StatementImport
+        try:
+            job = StatementImport.objects.get(pk=pk)
+        except Exception:
+            return Response({"error": "Import not found"}, status=404)
+        return Response(_statement_import_payload(job))
 
 class AssignTransactionView(views.APIView):
     permission_classes = [permissions.IsAuthenticated]
@@ -580,8 +580,33 @@ class LoanSerializer(serializers.ModelSerializer):
         model = Loans
         fields = "__all__"
 
+    @staticmethod
+    def setup_eager_loading(queryset):
+        """
+        Loads everything a LoanSerializer list needs in a fixed number of
+        queries: related rows via select_related/prefetch_related and the
+        oldest overdue installment as an annotation.
+        """
+        from django.db.models import OuterRef, Prefetch, Subquery
+        from django.utils import timezone
+        from .models import RepaymentSchedule
+
+        oldest_overdue = RepaymentSchedule.objects.filter(
+            loan=OuterRef("pk"), is_paid=False, due_date__lt=timezone.now().date()
+        ).order_by("due_date").values("due_date")[:1]
+        return queryset.select_related(
+            "user", "user__profile", "user__profile__branch_fk", "loan_product"
+        ).prefetch_related(
+            "documents",
+            Prefetch("activities", queryset=LoanActivity.objects.select_related("admin")),
+            Prefetch("user__guarantors", queryset=Guarantors.objects.order_by("pk")),
+        ).annotate(oldest_overdue_due_date=Subquery(oldest_overdue))
+
     def get_guarantor_phone(self, obj):
-        guarantor = obj.user.guarantors.first()
+        if "guarantors" in getattr(obj.user, "_prefetched_objects_cache", {}):
+            guarantor = next(iter(obj.user.guarantors.all()), None)
+        else:
+            guarantor = obj.user.guarantors.first()
         return guarantor.phone if guarantor else "No Guarantor"
 
     def validate(self, data):
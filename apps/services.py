@@ -2,23 +2,189 @@ from django.db import transaction
 from django.conf import settings
 from django.utils import timezone
 from .models import SystemCapital, LedgerEntry, Loans, LoanActivity
-from .exceptions import InsufficientCapitalError
+from .exceptions import DisbursementOutcomeUnknownError, InsufficientCapitalError
+from datetime import timedelta
+from decimal import Decimal
 import logging
+import threading
 
 logger = logging.getLogger(__name__)
 
 
+CAPITAL_ACCOUNT_NAME = "Simulation Capital"
+
+
+class CapitalLedgerService:
+    """
+    All movements of the capital account go through here.
+
+    LOCKED mode (default) locks the SystemCapital row for every movement and
+    updates the balance in place. APPEND_ONLY mode (CAPITAL_LEDGER_MODE)
+    lets inflows such as repayments just insert a pending LedgerEntry, so
+    paybill bursts don't serialize on the row lock; the available balance is
+    the compacted balance plus pending entries, and compact() (the
+    compact_capital_ledger command) folds them in. Disbursements always take
+    the lock and are only funded from the compacted (settled) balance, so a
+    payout never spends an inflow that compaction has not folded in yet.
+    """
+
+    @staticmethod
+    def mode():
+        return str(getattr(settings, 'CAPITAL_LEDGER_MODE', 'LOCKED')).upper()
+
+    @staticmethod
+    def get_account(lock=False):
+        qs = SystemCapital.objects.select_for_update() if lock else SystemCapital.objects.all()
+        return qs.filter(name=CAPITAL_ACCOUNT_NAME).first()
+
+    @staticmethod
+    def pending_total(account):
+        """Signed total of ledger entries not yet folded into account.balance."""
+        return CapitalLedgerService._signed_total(
+            LedgerEntry.objects.filter(capital_account=account, is_compacted=False)
+        )
+
+    @staticmethod
+    def _signed_total(entries):
+        from django.db.models import Case, When, F, Sum, DecimalField
+        total = entries.aggregate(
+            total=Sum(
+                Case(
+                    When(entry_type="DISBURSEMENT", then=-F("amount")),
+                    default=F("amount"),
+                    output_field=DecimalField(max_digits=15, decimal_places=2),
+                )
+            )
+        )["total"]
+        return total or 0
+
+    @staticmethod
+    def available_balance(account=None):
+        account = account or CapitalLedgerService.get_account()
+        if not account:
+            return 0
+        return account.balance + CapitalLedgerService.pending_total(account)
+
+    @staticmethod
+    def record_inflow(amount, entry_type, loan=None, reference_id=None, note=None):
+        """
+        Credits the capital account (repayments, reversals, injections).
+        Returns the LedgerEntry, or None when no capital account exists.
+        """
+        # Callers pass floats (e.g. PaybillTransaction.amount before a reload)
+        amount = Decimal(str(amount))
+        if CapitalLedgerService.mode() == 'APPEND_ONLY':
+            account = CapitalLedgerService.get_account()
+            if not account:
+                return None
+            return LedgerEntry.objects.create(
+                capital_account=account, amount=amount, entry_type=entry_type,
+                loan=loan, reference_id=reference_id, note=note, is_compacted=False,
+            )
+
+        with transaction.atomic():
+            account = CapitalLedgerService.get_account(lock=True)
+            if not account:
+                return None
+            account.balance += amount
+            account.save()
+            return LedgerEntry.objects.create(
+                capital_account=account, amount=amount, entry_type=entry_type,
+                loan=loan, reference_id=reference_id, note=note,
+            )
+
+    @staticmethod
+    def debit(amount, loan=None, note=None, require_funds=True):
+        """
+        Deducts a disbursement under the row lock. With require_funds the
+        settled balance must cover it; pending inflows don't count until
+        compacted. Returns the available balance after the debit, or None
+        without an account.
+        """
+        amount = Decimal(str(amount))
+        with transaction.atomic():
+            account = CapitalLedgerService.get_account(lock=True)
+            if not account:
+                if require_funds:
+                    raise SystemCapital.DoesNotExist(f"{CAPITAL_ACCOUNT_NAME} account is missing.")
+                return None
+            available = CapitalLedgerService.available_balance(account)
+            if require_funds and account.balance < amount:
+                raise InsufficientCapitalError(
+                    f"Insufficient capital. Available: KES {account.balance:,.2f}, Required: KES {amount:,.2f}"
+                )
+            account.balance -= amount
+            account.save()
+            LedgerEntry.objects.create(
+                capital_account=account, amount=amount, entry_type="DISBURSEMENT",
+                loan=loan, note=note,
+            )
+            return available - amount
+
+    @staticmethod
+    def compact():
+        """Folds pending ledger entries into the stored balance. Returns (entries, total)."""
+        with transaction.atomic():
+            account = CapitalLedgerService.get_account(lock=True)
+            if not account:
+                return 0, 0
+            # Entries committed after this point stay pending for the next run
+            ids = list(
+                LedgerEntry.objects.filter(capital_account=account, is_compacted=False)
+                .values_list('id', flat=True)
+            )
+            if not ids:
+                return 0, 0
+            batch = LedgerEntry.objects.filter(id__in=ids)
+            total = CapitalLedgerService._signed_total(batch)
+            batch.update(is_compacted=True)
+            account.balance += total
+            account.save()
+            return len(ids), total
+
+
 class DisbursementService:
     @staticmethod
-    def disburse_loan(loan, admin):
+    def disburse_loan(loan, admin, reserved=False):
+        """
+        ``reserved`` means the capital was already debited for this loan
+        (by a DisbursementBatch), so it is not deducted again.
+        """
         mode = getattr(settings, 'DISBURSEMENT_MODE', 'SIMULATION')
         if mode == 'SIMULATION':
-            return DisbursementService._simulate_disbursement(loan, admin)
+            return DisbursementService._simulate_disbursement(loan, admin, reserved)
         else:
-            return DisbursementService._live_disbursement(loan, admin)
+            return DisbursementService._live_disbursement(loan, admin, reserved)
 
     @staticmethod
-    def _live_disbursement(loan, admin):
+    def daily_limit():
+        from .models import SystemSettings
+        try:
+            return float(SystemSettings.objects.get(key="DAILY_OFFICER_DISBURSEMENT_LIMIT").value)
+        except Exception:
+            return 500000.0
+
+    @staticmethod
+    def disbursed_today(admin):
+        """
+        What ``admin`` has disbursed today against DAILY_OFFICER_DISBURSEMENT_LIMIT:
+        LOAN_DISBURSED audit entries plus loans still reserved in their batches.
+        """
+        from django.db.models import Sum
+        from .models import AuditLogs, DisbursementBatchItem
+
+        today_start = timezone.now().astimezone(timezone.get_current_timezone()).replace(hour=0, minute=0, second=0, microsecond=0)
+        today_disbursements = AuditLogs.objects.filter(admin=admin, action="LOAN_DISBURSED", created_at__gte=today_start)
+        total = sum([float(log.new_data.get("amount", 0)) for log in today_disbursements if log.new_data])
+        # Only today's batches: a stuck batch from an earlier day is not
+        # today's spending (release_disbursement_batches frees it)
+        reserved = DisbursementBatchItem.objects.filter(
+            batch__created_by=admin, batch__created_at__gte=today_start, status__in=['RESERVED', 'SENDING']
+        ).aggregate(total=Sum('amount'))['total']
+        return total + float(reserved or 0)
+
+    @staticmethod
+    def _live_disbursement(loan, admin, reserved=False):
         """
         Live B2C disbursement via Safaricom Daraja API.
         Does NOT immediately set loan to ACTIVE — waits for B2C callback confirmation.
@@ -26,7 +192,7 @@ class DisbursementService:
         """
         from .utils.mpesa import MpesaHandler
         from .utils.security import log_action
-        from .models import LoanActivity, AuditLogs, SystemCapital, LedgerEntry
+        from .models import LoanActivity, AuditLogs
 
         handler = MpesaHandler()
 
@@ -36,12 +202,22 @@ class DisbursementService:
 
         amount = float(loan.principal_amount)
 
-        result = handler.b2c_disburse(
-            phone_number=phone,
-            amount=amount,
-            CommandID='BusinessPayment',
-            Remarks=f'Loan disbursement - {loan.id.hex[:8]}'
-        )
+        import requests
+        try:
+            result = handler.b2c_disburse(
+                phone_number=phone,
+                amount=amount,
+                CommandID='BusinessPayment',
+                Remarks=f'Loan disbursement - {loan.id.hex[:8]}'
+            )
+        except (requests.Timeout, requests.ConnectionError) as e:
+            logger.error(f"[B2C] No answer for loan {loan.id.hex[:8]}; the payout may have been sent: {e}")
+            LoanActivity.objects.create(
+                loan=loan, admin=admin,
+                action='DISBURSEMENT_FAILED',
+                note=f'Live B2C request got no answer ({type(e).__name__}). Confirm on M-Pesa before retrying.'
+            )
+            raise DisbursementOutcomeUnknownError() from e
 
         logger.info(f"[B2C] Disbursement initiated for loan {loan.id.hex[:8]}: {result}")
 
@@ -61,16 +237,12 @@ class DisbursementService:
                 loan.save()
 
                 # Deduct from capital immediately — money has left the system
-                capital = SystemCapital.objects.select_for_update().first()
-                if capital:
-                    capital.balance -= loan.principal_amount
-                    capital.save()
-                    LedgerEntry.objects.create(
-                        capital_account=capital,
-                        amount=loan.principal_amount,
-                        entry_type='DISBURSEMENT',
+                if not reserved:
+                    CapitalLedgerService.debit(
+                        loan.principal_amount,
                         loan=loan,
-                        note=f'Live B2C disbursement to {loan.user.full_name} ({phone}). OriginatorID: {originator_id}'
+                        note=f'Live B2C disbursement to {loan.user.full_name} ({phone}). OriginatorID: {originator_id}',
+                        require_funds=False,
                     )
 
                 LoanActivity.objects.create(
@@ -104,28 +276,18 @@ class DisbursementService:
             raise Exception(f'M-Pesa disbursement failed: {error_desc}')
 
     @staticmethod
-    def _simulate_disbursement(loan, admin):
+    def _simulate_disbursement(loan, admin, reserved=False):
         with transaction.atomic():
-            # 1. Lock and check capital
-            capital = SystemCapital.objects.select_for_update().get(name="Simulation Capital")
-            if capital.balance < loan.principal_amount:
-                raise InsufficientCapitalError(
-                    f"Insufficient capital. Available: KES {capital.balance:,.2f}, Required: KES {loan.principal_amount:,.2f}"
+            # 1-3. Lock and check capital, deduct it and write the DEBIT ledger entry
+            if reserved:
+                capital_remaining = CapitalLedgerService.available_balance()
+            else:
+                capital_remaining = CapitalLedgerService.debit(
+                    loan.principal_amount,
+                    loan=loan,
+                    note=f"Disbursement for Loan {loan.id.hex[:8]} to {loan.user.full_name}",
                 )
 
-            # 2. Deduct capital
-            capital.balance -= loan.principal_amount
-            capital.save()
-
-            # 3. Create ledger entry (DEBIT)
-            LedgerEntry.objects.create(
-                capital_account=capital,
-                amount=loan.principal_amount,
-                entry_type="DISBURSEMENT",
-                loan=loan,
-                note=f"Disbursement for Loan {loan.id.hex[:8]} to {loan.user.full_name}"
-            )
-
             # 4. Update loan status in ONE save
             loan.status = "ACTIVE"
             loan.disbursed_at = timezone.now()
@@ -133,37 +295,13 @@ class DisbursementService:
             loan.save()
 
             # 5. Generate repayment schedule
-            from .models import RepaymentSchedule
-            RepaymentSchedule.objects.filter(loan=loan).delete()
-            total_repayable = float(loan.total_repayable_amount)
-            disbursed_date = loan.disbursed_at.date()
-
-            num_installments = loan.duration_weeks or (loan.duration_months * 4 if loan.duration_months else 4)
-            installment_amount = round(total_repayable / num_installments, 2)
-
-            for i in range(1, num_installments + 1):
-                if loan.duration_weeks:
-                    due_date = disbursed_date + timezone.timedelta(weeks=i)
-                else:
-                    due_date = disbursed_date + timezone.timedelta(days=i * 30)
-
-                amt = installment_amount
-                if i == num_installments:
-                    amt = round(total_repayable - (installment_amount * (num_installments - 1)), 2)
-
-                RepaymentSchedule.objects.create(
-                    loan=loan,
-                    installment_number=i,
-                    due_date=due_date,
-                    amount_due=amt,
-                    is_paid=False
-                )
+            generate_repayment_schedule(loan)
 
             # 6. Log activity and audit
             LoanActivity.objects.create(
                 loan=loan, admin=admin,
                 action="DISBURSEMENT",
-                note=f"Loan disbursed via simulation. Capital remaining: KES {float(capital.balance):,.2f}"
+                note=f"Loan disbursed via simulation. Capital remaining: KES {float(capital_remaining):,.2f}"
             )
 
             from .utils.security import log_action
@@ -172,29 +310,1559 @@ class DisbursementService:
                 f"Loan {loan.id.hex[:8]} disbursed to {loan.user.full_name}. Amount: KES {float(loan.principal_amount):,.2f}",
                 "loans", loan.id,
                 old_data={"status": "APPROVED"},
-                new_data={"status": "ACTIVE", "capital_remaining": float(capital.balance)},
+                new_data={"status": "ACTIVE", "capital_remaining": float(capital_remaining)},
                 log_type="STATUS"
             )
 
             return True
-            return True
+
+class RateLimiter:
+    """Spaces calls out to at most ``rate`` per second across threads."""
+
+    def __init__(self, rate):
+        import threading
+        self.interval = 1.0 / rate if rate else 0
+        self.lock = threading.Lock()
+        self.next_at = 0.0
+
+    def wait(self):
+        import time
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            delay = self.next_at - now
+            self.next_at = max(now, self.next_at) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+class DisbursementBatchService:
+    """
+    Bulk B2C disbursement.
+
+    create() claims the loans and reserves capital for all of them in one
+    transaction under the capital row lock, honouring the officer's
+    DAILY_OFFICER_DISBURSEMENT_LIMIT; loans that do not fit are recorded as
+    SKIPPED. start() queues a "disbursement.batch" background job whose
+    run() pushes the reserved loans through DisbursementService with a
+    bounded thread pool (DISBURSEMENT_BATCH_WORKERS) at no more than
+    DISBURSEMENT_BATCH_RATE requests per second. A loan that fails gets its
+    reservation credited back and is released for another attempt.
+
+    Each item is marked SENDING before its request goes out, so a retried
+    job never submits a loan twice. An item whose request got no answer
+    stays SENDING too: only a definite rejection releases it. Batches whose job died for good are
+    resumed or released by the release_disbursement_batches command.
+    """
+    SKIP_NOT_APPROVED = "Loan is no longer APPROVED or is queued in another batch"
+    SKIP_DAILY_LIMIT = "Daily limit reached during bulk process"
+    UNCONFIRMED_STOPPED = "Worker stopped during the M-Pesa request; confirm the payout before releasing"
+    UNCONFIRMED_NO_ANSWER = "M-Pesa did not answer the request; confirm the payout before releasing"
+
+    @staticmethod
+    def create(admin, loans, reason=None, ip_address=None):
+        from .models import DisbursementBatch, DisbursementBatchItem
+
+        daily_limit = DisbursementService.daily_limit()
+        with transaction.atomic():
+            # Serializes batch reservations, and reservations against single disbursements
+            account = CapitalLedgerService.get_account(lock=True)
+            # Like debit(), reservations only spend the settled balance
+            available = account.balance if account else Decimal("0")
+            day_total = DisbursementService.disbursed_today(admin)
+            claimable = set(
+                Loans.objects.select_for_update()
+                .filter(pk__in=[loan.pk for loan in loans], status="APPROVED")
+                .exclude(mpesa_disbursement_status="QUEUED")
+                .values_list("pk", flat=True)
+            )
+
+            batch = DisbursementBatch.objects.create(
+                created_by=admin, reason=reason, ip_address=ip_address, total_loans=len(loans)
+            )
+            items, entries, reserved = [], [], Decimal("0")
+            for loan in loans:
+                amount = loan.principal_amount
+                error = None
+                if loan.pk not in claimable:
+                    error = DisbursementBatchService.SKIP_NOT_APPROVED
+                elif day_total + float(amount) > daily_limit:
+                    error = DisbursementBatchService.SKIP_DAILY_LIMIT
+                elif available - reserved < amount:
+                    error = f"Insufficient capital. Available: KES {available - reserved:,.2f}, Required: KES {amount:,.2f}"
+                else:
+                    reserved += amount
+                    day_total += float(amount)
+                    entries.append(LedgerEntry(
+                        capital_account=account, amount=amount, entry_type="DISBURSEMENT", loan=loan,
+                        note=f"Reserved for disbursement batch {batch.id.hex[:8]} - Loan {loan.id.hex[:8]}",
+                    ))
+                items.append(DisbursementBatchItem(
+                    batch=batch, loan=loan, amount=amount,
+                    status="SKIPPED" if error else "RESERVED", error=error,
+                ))
+
+            DisbursementBatchItem.objects.bulk_create(items)
+            if entries:
+                LedgerEntry.objects.bulk_create(entries)
+                account.balance -= reserved
+                account.save()
+                Loans.objects.filter(pk__in=[entry.loan_id for entry in entries]).update(mpesa_disbursement_status="QUEUED")
+            batch.reserved_amount = reserved
+            batch.skipped = len(items) - len(entries)
+            if not entries:
+                batch.status = "COMPLETED"
+                batch.finished_at = timezone.now()
+            batch.save()
+        return batch
+
+    @staticmethod
+    def start(batch):
+        """Queue the batch as a "disbursement.batch" background job with the reservation."""
+        from .utils.jobs import enqueue
+
+        if batch.status != "PENDING":
+            return
+        enqueue("disbursement.batch", {"batch_id": str(batch.pk)})
+
+    @staticmethod
+    def run(batch_id):
+        """
+        Submits the batch's RESERVED items. Safe to call again after a
+        worker was lost: a RUNNING batch is taken over and only items that
+        were never submitted are sent.
+        """
+        from concurrent.futures import ThreadPoolExecutor
+        from .models import DisbursementBatch
+
+        if not DisbursementBatch.objects.filter(pk=batch_id, status__in=["PENDING", "RUNNING"]).update(
+            status="RUNNING", started_at=timezone.now()
+        ):
+            return None
+        batch = DisbursementBatch.objects.get(pk=batch_id)
+
+        item_ids = list(batch.items.filter(status__in=["RESERVED", "SENDING"]).values_list("pk", flat=True))
+        limiter = RateLimiter(settings.DISBURSEMENT_BATCH_RATE)
+        try:
+            workers = min(settings.DISBURSEMENT_BATCH_WORKERS, len(item_ids))
+            if workers <= 1:
+                for item_id in item_ids:
+                    DisbursementBatchService.process_item(item_id, limiter)
+            else:
+                def _worker(item_id):
+                    from django.db import connection
+                    try:
+                        DisbursementBatchService.process_item(item_id, limiter)
+                    finally:
+                        connection.close()
+
+                with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="b2c-batch") as pool:
+                    list(pool.map(_worker, item_ids))
+            # Items with an unknown outcome need someone to check M-Pesa
+            status = "FAILED" if batch.items.filter(status="SENDING").exists() else "COMPLETED"
+        except Exception:
+            logger.exception(f"[DisbursementBatch] {batch.pk} failed")
+            status = "FAILED"
+        return DisbursementBatchService.finish(batch, status)
+
+    @staticmethod
+    def finish(batch, status):
+        from django.db.models import Count
+
+        counts = dict(batch.items.values_list("status").annotate(n=Count("pk")))
+        batch.status = status
+        batch.succeeded = counts.get("SUCCESS", 0)
+        batch.failed = counts.get("FAILED", 0)
+        batch.skipped = counts.get("SKIPPED", 0)
+        batch.finished_at = timezone.now()
+        batch.save()
+        return batch
+
+    @staticmethod
+    def process_item(item_id, limiter=None):
+        from .models import DisbursementBatchItem
+
+        with transaction.atomic():
+            item = (
+                DisbursementBatchItem.objects.select_for_update().select_related("batch__created_by", "loan__user")
+                .filter(pk=item_id, status__in=["RESERVED", "SENDING"]).first()
+            )
+            if item is None:
+                return None
+            batch, loan = item.batch, item.loan
+            if loan.status in DISBURSED_STATUSES:
+                # An earlier attempt disbursed it but died before recording that
+                return DisbursementBatchService._succeed(item, None)
+            if loan.status != "APPROVED":
+                DisbursementBatchService._release(item, DisbursementBatchService.SKIP_NOT_APPROVED)
+                return item
+            if item.status == "SENDING":
+                # The request went out but its answer was lost; sending again
+                # could pay twice. Leave it for release_disbursement_batches.
+                item.error = DisbursementBatchService.UNCONFIRMED_STOPPED
+                item.save(update_fields=["error", "updated_at"])
+                return item
+            item.status = "SENDING"
+            item.save(update_fields=["status", "updated_at"])
+
+        if limiter:
+            limiter.wait()
+        try:
+            result = DisbursementService.disburse_loan(loan, batch.created_by, reserved=True)
+        except DisbursementOutcomeUnknownError:
+            # Keep the reservation and the claim; release_disbursement_batches
+            # releases it once the payout is confirmed as not sent
+            item.error = DisbursementBatchService.UNCONFIRMED_NO_ANSWER
+            item.save(update_fields=["error", "updated_at"])
+            return item
+        except Exception as e:
+            logger.error(f"[DisbursementBatch] Loan {loan.id.hex[:8]} failed: {e}")
+            DisbursementBatchService._release(item, str(e))
+            return item
+        return DisbursementBatchService._succeed(item, result)
+
+    @staticmethod
+    def _succeed(item, result):
+        from .utils.audit import record_audit
+
+        batch, loan = item.batch, item.loan
+        with transaction.atomic():
+            # Simulation leaves the claim marker behind; live B2C moved it to PENDING
+            Loans.objects.filter(pk=loan.pk, mpesa_disbursement_status="QUEUED").update(mpesa_disbursement_status=None)
+            item.status = "SUCCESS"
+            item.error = None
+            item.originator_id = result.get("originator_id") if isinstance(result, dict) else loan.mpesa_originator_id
+            item.save(update_fields=["status", "error", "originator_id", "updated_at"])
+            # Inline, not buffered: disbursed_today() reads these for the daily limit
+            record_audit(
+                sync=True, admin=batch.created_by, action="LOAN_DISBURSED", log_type="MANAGEMENT",
+                table_name="loans", record_id=loan.id, old_data={"status": "APPROVED"},
+                new_data={
+                    "status": loan.status, "amount": float(item.amount),
+                    "reason": batch.reason or "Bulk Disbursement", "batch_id": str(batch.id),
+                },
+                ip_address=batch.ip_address,
+            )
+        return item
+
+    @staticmethod
+    def orphaned(older_than):
+        """PENDING/RUNNING batches older than ``older_than`` with no live job left to run them."""
+        from .models import BackgroundJob, DisbursementBatch
+
+        live = BackgroundJob.objects.filter(
+            task="disbursement.batch", status__in=["QUEUED", "RUNNING", "RETRY"]
+        ).values_list("payload__batch_id", flat=True)
+        live = {str(batch_id) for batch_id in live}
+        candidates = DisbursementBatch.objects.filter(
+            status__in=["PENDING", "RUNNING"], created_at__lt=timezone.now() - older_than
+        )
+        return [batch for batch in candidates if str(batch.pk) not in live]
+
+    @staticmethod
+    def release_batch(batch, include_unconfirmed=False):
+        """
+        Credits back the reservation of every item that was never submitted
+        (and, with ``include_unconfirmed``, of items whose M-Pesa request
+        outcome is unknown and has been confirmed as not paid), frees the
+        loans for another attempt and closes the batch. Returns the number
+        of items released.
+        """
+        statuses = ["RESERVED", "SENDING"] if include_unconfirmed else ["RESERVED"]
+        released = 0
+        for item in batch.items.select_related("loan", "batch").filter(status__in=statuses):
+            if item.loan.status in DISBURSED_STATUSES:
+                DisbursementBatchService._succeed(item, None)
+                continue
+            DisbursementBatchService._release(item, "Released: the batch worker stopped before submitting this loan")
+            released += 1
+        if not batch.items.filter(status__in=["RESERVED", "SENDING"]).exists():
+            DisbursementBatchService.finish(batch, "FAILED")
+        return released
+
+    @staticmethod
+    def _release(item, error):
+        with transaction.atomic():
+            CapitalLedgerService.record_inflow(
+                item.amount, "CAPITAL_INJECTION", loan=item.loan,
+                note=f"Capital released - disbursement batch {item.batch_id.hex[:8]} failed: {error[:200]}",
+            )
+            Loans.objects.filter(pk=item.loan_id, mpesa_disbursement_status="QUEUED").update(mpesa_disbursement_status="FAILED")
+            item.status = "FAILED"
+            item.error = error
+            item.save(update_fields=["status", "error", "updated_at"])
+
+
+class SMSBroadcastService:
+    """
+    Bulk SMS for BulkSMSView.
+
+    create() records an SMSBroadcast and queues it as an "sms.broadcast"
+    background job. run() streams the recipients with iterator(), buckets
+    identical texts into comma-separated Africa's Talking requests of up to
+    SMS_BROADCAST_BATCH_SIZE numbers, and sends them on
+    SMS_BROADCAST_WORKERS threads at no more than SMS_BROADCAST_RATE
+    requests per second. The worker threads only talk to the provider; the
+    SMSLog rows and counters for each answered batch are written from the
+    calling thread with bulk_create.
+    """
+    DEFAULTER_TEMPLATE = "Hello {name}, your loan of KES {principal:,.2f} is OVERDUE."
+    # Personalised texts rarely repeat; cap how many half-filled buckets are kept
+    MAX_OPEN_BUCKETS = 1000
+
+    @staticmethod
+    def recipients(broadcast):
+        """Yields (user_id, phone, name, text) for every message the broadcast sends."""
+        from .models import Users, SystemSettings
+
+        if broadcast.sms_type == 'DEFAULTERS':
+            setting = SystemSettings.objects.filter(key='MSG_TEMPLATE_DEFAULTER').first()
+            template = setting.value if setting else SMSBroadcastService.DEFAULTER_TEMPLATE
+            loans = (
+                Loans.objects.filter(status='OVERDUE').exclude(user__phone__isnull=True).exclude(user__phone='')
+                .select_related('user').only(
+                    'principal_amount', 'interest_rate', 'amount_paid', 'user__id', 'user__phone', 'user__full_name'
+                )
+            )
+            for loan in loans.iterator(chunk_size=2000):
+                principal = float(loan.principal_amount)
+                try:
+                    text = template.format(
+                        name=loan.user.full_name, principal=principal,
+                        interest=loan.total_repayable_amount - principal, balance=loan.remaining_balance,
+                    )
+                except (KeyError, IndexError, ValueError):
+                    continue
+                yield loan.user.id, loan.user.phone, loan.user.full_name, text
+        else:
+            users = Users.objects.exclude(phone__isnull=True).exclude(phone='').values_list('id', 'phone', 'full_name')
+            for user_id, phone, name in users.iterator(chunk_size=2000):
+                yield user_id, phone, name, broadcast.message
+
+    @staticmethod
+    def count_recipients(sms_type):
+        from .models import Users
+
+        if sms_type == 'DEFAULTERS':
+            return Loans.objects.filter(status='OVERDUE').exclude(user__phone__isnull=True).exclude(user__phone='').count()
+        return Users.objects.exclude(phone__isnull=True).exclude(phone='').count()
+
+    @staticmethod
+    def create(admin, sms_type, message=None):
+        from .models import SMSBroadcast
+        from .utils.jobs import enqueue
+
+        with transaction.atomic():
+            broadcast = SMSBroadcast.objects.create(
+                created_by=admin, sms_type=sms_type, message=message,
+                total_recipients=SMSBroadcastService.count_recipients(sms_type),
+            )
+            # Re-running a half-sent broadcast would message people twice
+            enqueue('sms.broadcast', {'broadcast_id': str(broadcast.id)}, max_attempts=1)
+        broadcast.refresh_from_db()
+        return broadcast
+
+    @staticmethod
+    def failed_numbers(result, phones):
+        """
+        The ``phones`` the provider did not accept, from an SMSHandler.send_sms()
+        result. Africa's Talking reports +2547... numbers while recipients are
+        stored as 07... or 2547..., so both sides are compared normalized.
+        """
+        if not isinstance(result, dict) or result.get('status') == 'error':
+            return set(phones)
+        reported = (result.get('SMSMessageData') or {}).get('Recipients')
+        if reported is None:
+            return set()
+        rejected = {normalize_phone(r.get('number')) for r in reported if r.get('status') != 'Success'}
+        return {phone for phone in phones if normalize_phone(phone) in rejected}
+
+    @staticmethod
+    def record(broadcast, text, batch, result):
+        """Writes the SMSLog rows (and defaulter notifications) for one answered batch."""
+        from django.db.models import F
+        from .models import Notifications, SMSBroadcast, SMSLog
+
+        failed = SMSBroadcastService.failed_numbers(result, [phone for _, phone, _ in batch])
+        log_type = 'DEFAULTER' if broadcast.sms_type == 'DEFAULTERS' else broadcast.sms_type
+        SMSLog.objects.bulk_create([
+            SMSLog(
+                sender_id=broadcast.created_by_id, recipient_phone=phone, recipient_name=name,
+                message=text, type=log_type, status='FAILED' if phone in failed else 'SENT',
+            )
+            for _, phone, name in batch
+        ], batch_size=1000)
+        if broadcast.sms_type == 'DEFAULTERS':
+            Notifications.objects.bulk_create([
+                Notifications(user_id=user_id, message=f"Defaulter SMS sent to {phone}.", is_read=False)
+                for user_id, phone, _ in batch if phone not in failed
+            ], batch_size=1000)
+        failed_count = sum(1 for _, phone, _ in batch if phone in failed)
+        SMSBroadcast.objects.filter(pk=broadcast.pk).update(
+            sent=F('sent') + len(batch) - failed_count, failed=F('failed') + failed_count, batches=F('batches') + 1,
+        )
+
+    @staticmethod
+    def run(broadcast_id, workers=None, batch_size=None):
+        from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+        from .models import SMSBroadcast
+        from .utils.sms import SMSHandler
+
+        if not SMSBroadcast.objects.filter(pk=broadcast_id, status='PENDING').update(
+            status='RUNNING', started_at=timezone.now()
+        ):
+            return None
+        broadcast = SMSBroadcast.objects.get(pk=broadcast_id)
+        workers = workers or settings.SMS_BROADCAST_WORKERS
+        batch_size = batch_size or settings.SMS_BROADCAST_BATCH_SIZE
+        handler = SMSHandler()
+        limiter = RateLimiter(settings.SMS_BROADCAST_RATE)
+
+        def _send(text, batch):
+            limiter.wait()
+            try:
+                return handler.send_sms([phone for _, phone, _ in batch], text)
+            except Exception as e:
+                return {'status': 'error', 'message': str(e)}
+
+        in_flight = {}
+
+        def _collect(done):
+            for future in done:
+                text, batch = in_flight.pop(future)
+                SMSBroadcastService.record(broadcast, text, batch, future.result())
+
+        try:
+            with ThreadPoolExecutor(max_workers=max(workers, 1), thread_name_prefix="sms-broadcast") as pool:
+                def _submit(text, batch):
+                    # Keep at most two requests per worker queued
+                    if len(in_flight) >= max(workers, 1) * 2:
+                        done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                        _collect(done)
+                    in_flight[pool.submit(_send, text, batch)] = (text, batch)
+
+                buckets, seen = {}, set()
+                for user_id, phone, name, text in SMSBroadcastService.recipients(broadcast):
+                    if (phone, text) in seen:
+                        continue
+                    seen.add((phone, text))
+                    bucket = buckets.setdefault(text, [])
+                    bucket.append((user_id, phone, name))
+                    if len(bucket) >= batch_size:
+                        _submit(text, buckets.pop(text))
+                    elif len(buckets) > SMSBroadcastService.MAX_OPEN_BUCKETS:
+                        oldest = next(iter(buckets))
+                        _submit(oldest, buckets.pop(oldest))
+                for text, bucket in buckets.items():
+                    _submit(text, bucket)
+                _collect(wait(in_flight).done)
+        except Exception as e:
+            logger.exception(f"[SMS Broadcast] {broadcast_id} failed")
+            SMSBroadcast.objects.filter(pk=broadcast_id).update(
+                status='FAILED', error=str(e), finished_at=timezone.now()
+            )
+            raise
+
+        broadcast.refresh_from_db()
+        broadcast.status = 'COMPLETED'
+        broadcast.total_recipients = broadcast.sent + broadcast.failed
+        broadcast.finished_at = timezone.now()
+        broadcast.save(update_fields=['status', 'total_recipients', 'finished_at'])
+        return broadcast
+
+
+
+class DataExportService:
+    """
+    Owner CSV exports (OwnerExportView).
+
+    Every resource is a values_list() query with its related columns joined
+    in, read with iterator(chunk_size=EXPORT_CHUNK_SIZE), so neither the
+    streamed response nor the background job holds more than a chunk of
+    rows. create() queues an "export.build" job; run() writes the CSV
+    gzipped to EXPORT_ROOT.
+    """
+    # resource -> (headers, values_list fields, {column: value used for NULL})
+    RESOURCES = {
+        'loans': (
+            ['ID', 'Customer', 'Amount', 'Status', 'Product', 'Created At'],
+            ('id', 'user__full_name', 'principal_amount', 'status', 'loan_product__name', 'created_at'),
+            {},
+        ),
+        'customers': (
+            ['ID', 'Full Name', 'Phone', 'National ID', 'Created At'],
+            ('id', 'full_name', 'phone', 'profile__national_id', 'created_at'),
+            {3: 'N/A'},
+        ),
+        'repayments': (
+            ['ID', 'Reference', 'Phone', 'Amount', 'Status', 'Date'],
+            ('id', 'receipt_number', 'sender_phone', 'amount', 'status', 'created_at'),
+            {},
+        ),
+        'audit_logs': (
+            ['ID', 'User', 'Action', 'IP Address', 'Timestamp'],
+            ('id', 'admin__full_name', 'action', 'ip_address', 'created_at'),
+            {1: 'System'},
+        ),
+        'security_logs': (
+            ['ID', 'User', 'Action', 'IP Address', 'Timestamp'],
+            ('id', 'admin__full_name', 'action', 'ip_address', 'created_at'),
+            {1: 'System'},
+        ),
+    }
+    # Bytes of CSV gathered before a streamed chunk is sent
+    STREAM_CHUNK_BYTES = 64 * 1024
+
+    @staticmethod
+    def queryset(resource, date_from=None, date_to=None):
+        from datetime import datetime, time
+        from django.db.models import Q
+        from .models import AuditLogs, PaybillTransaction, Users
+
+        filters = {}
+        if date_from:
+            filters['created_at__gte'] = timezone.make_aware(datetime.combine(date_from, time.min))
+        if date_to:
+            filters['created_at__lte'] = timezone.make_aware(datetime.combine(date_to, time.max))
+        if resource == 'loans':
+            queryset = Loans.objects.filter(**filters)
+        elif resource == 'customers':
+            queryset = Users.objects.filter(**filters)
+        elif resource == 'repayments':
+            queryset = PaybillTransaction.objects.filter(**filters)
+        elif resource == 'audit_logs':
+            queryset = AuditLogs.objects.filter(**filters)
+        else:
+            queryset = AuditLogs.objects.filter(
+                Q(action__icontains='failed') | Q(action__icontains='login') |
+                Q(action__icontains='security') | Q(action__icontains='unauthorized'),
+                **filters
+            )
+        return queryset.order_by('-created_at').values_list(*DataExportService.RESOURCES[resource][1])
+
+    @staticmethod
+    def rows(resource, date_from=None, date_to=None):
+        """Yields the header row, then one list per record."""
+        headers, _, nulls = DataExportService.RESOURCES[resource]
+        yield headers
+        for row in DataExportService.queryset(resource, date_from, date_to).iterator(chunk_size=settings.EXPORT_CHUNK_SIZE):
+            if nulls:
+                row = [nulls[i] if value is None and i in nulls else value for i, value in enumerate(row)]
+            yield row
+
+    @staticmethod
+    def stream_csv(rows):
+        """CSV text for StreamingHttpResponse, in chunks of about STREAM_CHUNK_BYTES."""
+        import csv
+        import io
+
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for row in rows:
+            writer.writerow(row)
+            if buffer.tell() >= DataExportService.STREAM_CHUNK_BYTES:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue()
+
+    @staticmethod
+    def create(admin, resource, date_from=None, date_to=None):
+        from .models import DataExport
+        from .utils.jobs import enqueue
+
+        with transaction.atomic():
+            export = DataExport.objects.create(
+                requested_by=admin, resource=resource, date_from=date_from, date_to=date_to
+            )
+            enqueue('export.build', {'export_id': str(export.id)})
+        export.refresh_from_db()
+        return export
+
+    @staticmethod
+    def run(export_id):
+        import csv
+        import gzip
+        import io
+        import secrets
+        import tempfile
+        from django.core.files import File
+        from django.db.models import Q
+        from .models import DataExport
+
+        # FAILED is claimable again so a retried job can finish the export,
+        # and so is a RUNNING one whose worker has been gone for longer than
+        # a job lock lasts
+        stale = timezone.now() - timedelta(seconds=settings.BACKGROUND_JOB_LOCK_TIMEOUT)
+        claimable = Q(status__in=['PENDING', 'FAILED']) | Q(status='RUNNING', started_at__lt=stale)
+        if not DataExport.objects.filter(claimable, pk=export_id).update(
+            status='RUNNING', started_at=timezone.now(), error=None
+        ):
+            return None
+        export = DataExport.objects.get(pk=export_id)
+        try:
+            with tempfile.TemporaryFile() as tmp:
+                rows = 0
+                with gzip.GzipFile(fileobj=tmp, mode='wb') as gz, io.TextIOWrapper(gz, encoding='utf-8', newline='') as text:
+                    writer = csv.writer(text)
+                    for row in DataExportService.rows(export.resource, export.date_from, export.date_to):
+                        writer.writerow(row)
+                        rows += 1
+                tmp.seek(0)
+                name = f"{export.resource}_export_{timezone.now():%Y%m%d}_{secrets.token_hex(8)}.csv.gz"
+                export.file.save(name, File(tmp), save=False)
+        except Exception as e:
+            logger.exception(f"[Export] {export_id} failed")
+            DataExport.objects.filter(pk=export_id).update(status='FAILED', error=str(e), finished_at=timezone.now())
+            raise
+
+        export.status = 'COMPLETED'
+        export.rows = rows - 1
+        export.size = export.file.size
+        export.finished_at = timezone.now()
+        export.save(update_fields=['status', 'rows', 'file', 'size', 'finished_at'])
+        return export
+
+def build_repayment_schedule(loan, start_date):
+    """
+    Computes a loan's installments in memory without touching the database.
+    Weekly loans fall due every week, monthly loans every 30 days; the last
+    installment absorbs the rounding remainder.
+    """
+    from .models import RepaymentSchedule
+
+    total_repayable = float(loan.total_repayable_amount)
+    num_installments = loan.duration_weeks or (loan.duration_months * 4 if loan.duration_months else 4)
+    installment_amount = round(total_repayable / num_installments, 2)
+
+    installments = []
+    for i in range(1, num_installments + 1):
+        if loan.duration_weeks:
+            due_date = start_date + timezone.timedelta(weeks=i)
+        else:
+            due_date = start_date + timezone.timedelta(days=i * 30)
+
+        amt = installment_amount
+        if i == num_installments:
+            amt = round(total_repayable - (installment_amount * (num_installments - 1)), 2)
+
+        installments.append(RepaymentSchedule(
+            loan=loan,
+            installment_number=i,
+            due_date=due_date,
+            amount_due=amt,
+            is_paid=False
+        ))
+    return installments
+
+
+def generate_repayment_schedule(loan, replace=True):
+    """
+    Writes a loan's schedule with a single bulk_create, starting from its
+    disbursement date. With replace=False an existing schedule is kept.
+    """
+    from .models import RepaymentSchedule
+
+    existing = RepaymentSchedule.objects.filter(loan=loan)
+    if replace:
+        existing.delete()
+    elif existing.exists():
+        return []
+
+    start_date = loan.disbursed_at.date() if loan.disbursed_at else timezone.now().date()
+    return RepaymentSchedule.objects.bulk_create(build_repayment_schedule(loan, start_date))
+
+
+DISBURSED_STATUSES = ["DISBURSED", "ACTIVE", "OVERDUE", "CLOSED", "REPAID"]
+
+
+def disbursed_on():
+    """
+    When a loan's principal went out, for analytics keyed by disbursement
+    day. Loans disbursed before disbursed_at was recorded fall back to
+    created_at.
+    """
+    from django.db.models.functions import Coalesce
+    return Coalesce('disbursed_at', 'created_at')
+
+# Loans that can receive a paybill repayment
+ACTIVE_LOAN_STATUSES = ["ACTIVE", "OVERDUE"]
+
+
+class PortfolioSnapshotService:
+    """
+    Maintains the portfolio_daily_snapshot table. Only completed days (before
+    the run date) are materialized; the date of the last run is the cutoff
+    the analytics views use to switch from snapshot rows to live queries.
+    """
+    SETTING_KEY = "PORTFOLIO_SNAPSHOT_BUILT_AT"
+    DAYS_PER_BATCH = 31
+
+    @staticmethod
+    def last_built_at():
+        from .models import SystemSettings
+        from django.utils.dateparse import parse_datetime
+        setting = SystemSettings.objects.filter(key=PortfolioSnapshotService.SETTING_KEY).first()
+        return parse_datetime(setting.value) if setting and setting.value else None
+
+    @staticmethod
+    def cutoff():
+        """Days before this date are served from the snapshot, the rest live."""
+        import datetime
+        built_at = PortfolioSnapshotService.last_built_at()
+        return timezone.localdate(built_at) if built_at else datetime.date.min
+
+    @staticmethod
+    def touched_days(since, until):
+        """
+        Days whose totals may have moved since the last run: every day since
+        that run, plus the creation, disbursement, payment and due dates of
+        loans updated since then (repayments and status changes all bump
+        Loans.updated_at).
+        """
+        from .models import Repayments, RepaymentSchedule
+        from django.db.models.functions import TruncDate
+        import datetime
+
+        days = set()
+        day = timezone.localdate(since)
+        while day < until:
+            days.add(day)
+            day += datetime.timedelta(days=1)
+
+        touched = Loans.objects.filter(updated_at__gte=since).values('id')
+        days.update(
+            Loans.objects.filter(id__in=touched, created_at__isnull=False)
+            .annotate(day=TruncDate('created_at')).values_list('day', flat=True).distinct()
+        )
+        days.update(
+            Loans.objects.filter(id__in=touched, disbursed_at__isnull=False)
+            .annotate(day=TruncDate('disbursed_at')).values_list('day', flat=True).distinct()
+        )
+        days.update(
+            Repayments.objects.filter(loan_id__in=touched, payment_date__isnull=False)
+            .annotate(day=TruncDate('payment_date')).values_list('day', flat=True).distinct()
+        )
+        days.update(
+            RepaymentSchedule.objects.filter(loan_id__in=touched)
+            .values_list('due_date', flat=True).distinct()
+        )
+        return sorted(d for d in days if d < until)
+
+    @staticmethod
+    def all_days(until):
+        from .models import Repayments, RepaymentSchedule
+        from django.db.models.functions import TruncDate
+        days = set(
+            Loans.objects.filter(created_at__isnull=False)
+            .annotate(day=TruncDate('created_at')).values_list('day', flat=True).distinct()
+        )
+        days.update(
+            Loans.objects.filter(disbursed_at__isnull=False)
+            .annotate(day=TruncDate('disbursed_at')).values_list('day', flat=True).distinct()
+        )
+        days.update(
+            Repayments.objects.filter(payment_date__isnull=False)
+            .annotate(day=TruncDate('payment_date')).values_list('day', flat=True).distinct()
+        )
+        days.update(RepaymentSchedule.objects.values_list('due_date', flat=True).distinct())
+        return sorted(d for d in days if d < until)
+
+    @staticmethod
+    def rebuild_days(days):
+        """Recomputes the snapshot rows for the given dates with grouped queries."""
+        from .models import PortfolioDailySnapshot, Repayments, RepaymentSchedule
+        from django.db.models import Count, Sum, Q
+        from django.db.models.functions import TruncDate
+
+        rows = {}
+
+        def row(day, branch_id, product_id):
+            key = (day, branch_id, product_id)
+            if key not in rows:
+                rows[key] = PortfolioDailySnapshot(date=day, branch_id=branch_id, loan_product_id=product_id)
+            return rows[key]
+
+        applied = (
+            Loans.objects.annotate(day=TruncDate('created_at'))
+            .filter(day__in=days)
+            .values('day', 'user__profile__branch_fk', 'loan_product')
+            .annotate(count=Count('id'), amount=Sum('principal_amount'))
+        )
+        for item in applied:
+            r = row(item['day'], item['user__profile__branch_fk'], item['loan_product'])
+            r.applied_count = item['count']
+            r.applied_amount = item['amount'] or 0
+
+        disbursed = (
+            Loans.objects.filter(status__in=DISBURSED_STATUSES)
+            .annotate(day=TruncDate(disbursed_on()))
+            .filter(day__in=days)
+            .values('day', 'user__profile__branch_fk', 'loan_product')
+            .annotate(count=Count('id'), amount=Sum('principal_amount'))
+        )
+        for item in disbursed:
+            r = row(item['day'], item['user__profile__branch_fk'], item['loan_product'])
+            r.disbursed_count = item['count']
+            r.disbursed_amount = item['amount'] or 0
+
+        repayments = (
+            Repayments.objects.annotate(day=TruncDate('payment_date'))
+            .filter(day__in=days)
+            .values('day', 'loan__user__profile__branch_fk', 'loan__loan_product')
+            .annotate(count=Count('id'), amount=Sum('amount_paid'))
+        )
+        for item in repayments:
+            r = row(item['day'], item['loan__user__profile__branch_fk'], item['loan__loan_product'])
+            r.repaid_count = item['count']
+            r.repaid_amount = item['amount'] or 0
+
+        # Aging only counts loans check_overdue has flagged OVERDUE
+        unpaid = Q(is_paid=False, loan__status='OVERDUE')
+        schedules = (
+            RepaymentSchedule.objects.filter(due_date__in=days)
+            .values('due_date', 'loan__user__profile__branch_fk', 'loan__loan_product')
+            .annotate(
+                count=Count('id'),
+                amount=Sum('amount_due'),
+                overdue_count=Count('id', filter=unpaid),
+                overdue_amount=Sum('amount_due', filter=unpaid),
+            )
+        )
+        for item in schedules:
+            r = row(item['due_date'], item['loan__user__profile__branch_fk'], item['loan__loan_product'])
+            r.scheduled_count = item['count']
+            r.scheduled_amount = item['amount'] or 0
+            r.overdue_count = item['overdue_count']
+            r.overdue_amount = item['overdue_amount'] or 0
+
+        with transaction.atomic():
+            PortfolioDailySnapshot.objects.filter(date__in=days).delete()
+            PortfolioDailySnapshot.objects.bulk_create(rows.values(), batch_size=500)
+        return len(rows)
+
+    @staticmethod
+    def build(full=False):
+        """
+        Rebuilds every day touched since the previous run (or all history with
+        full=True) and invalidates the cached analytics that read the old
+        rows. Returns (days rebuilt, rows written).
+        """
+        from .models import SystemSettings
+        from .utils.cache import bump_analytics_generation
+
+        started_at = timezone.now()
+        today = timezone.localdate(started_at)
+        last_built_at = None if full else PortfolioSnapshotService.last_built_at()
+        if last_built_at is None:
+            days = PortfolioSnapshotService.all_days(today)
+        else:
+            days = PortfolioSnapshotService.touched_days(last_built_at, today)
+
+        batch = PortfolioSnapshotService.DAYS_PER_BATCH
+        written = 0
+        for i in range(0, len(days), batch):
+            written += PortfolioSnapshotService.rebuild_days(days[i:i + batch])
+
+        # Stamp the start of the run so writes that land while it runs are
+        # picked up next time.
+        SystemSettings.objects.update_or_create(
+            key=PortfolioSnapshotService.SETTING_KEY,
+            defaults={
+                'value': started_at.isoformat(),
+                'description': 'Last portfolio_daily_snapshot build (set by build_portfolio_snapshots)',
+            },
+        )
+        bump_analytics_generation()
+        return len(days), written
+
+
+def normalize_phone(phone):
+    """Convert +2547XXXXXXXX / 2547XXXXXXXX / 7XXXXXXXX to the stored 07XXXXXXXX form."""
+    phone = str(phone or '').replace('+', '').replace(' ', '').strip()
+    if phone.startswith('254') and len(phone) > 3:
+        return '0' + phone[3:]
+    if len(phone) == 9 and not phone.startswith('0'):
+        return '0' + phone
+    return phone
+
+
+def phone_variants(value):
+    """The stored forms a typed phone number may match (as typed, 07..., 2547...); [] without digits."""
+    import re
+    digits = re.sub(r'\D', '', str(value or ''))
+    if not digits:
+        return []
+    variants = [digits]
+    if digits.startswith('254') and len(digits) > 10:
+        variants.append('0' + digits[3:])
+    elif digits.startswith('0') and len(digits) == 10:
+        variants.append('254' + digits[1:])
+    elif digits[0] in '71' and len(digits) == 9:
+        variants.append('0' + digits)
+        variants.append('254' + digits)
+    return variants
+
+def _parse_statement_date(value):
+    from datetime import datetime
+    for fmt in ('%Y%m%d%H%M%S', '%d/%m/%Y %H:%M:%S', '%Y-%m-%d %H:%M:%S'):
+        try:
+            parsed = datetime.strptime(value, fmt)
+        except (TypeError, ValueError):
+            continue
+        return timezone.make_aware(parsed) if timezone.is_naive(parsed) else parsed
+    return timezone.now()
+
+
+def normalize_national_id(value):
+    return str(value or '').replace(' ', '').strip().upper()
+
+
+class PaymentMatchResolver:
+    """
+    In-memory index from paybill account references and sender phones to the
+    oldest active loan of the matching customer, built with one query.
+
+    Lookup order matches the original callback matcher: loan ID (full UUID
+    or a hex prefix of at least 8 characters), then national ID
+    (case-insensitive, spaces ignored), then sender phone in any of its
+    07/254/+254 forms.
+
+    ``shared()`` returns a per-process instance. Loan status, customer and
+    profile changes are logged per customer in the cache (see
+    apps.utils.cache.record_match_index_change) and patched into it with
+    refresh_users(); it is only rebuilt after TTL seconds or when the log
+    has gaps. With a per-process cache other workers never see that log,
+    so their index catches up at the next rebuild; match_loan() checks
+    every hit against the database and falls back to it on a miss. The
+    statement importer builds its own instance per run and discard()s
+    loans as they close.
+    """
+    TTL = 300
+    # Changes patched in one go; a longer backlog rebuilds the index
+    MAX_PATCH = 500
+
+    _shared = None
+    _lock = threading.Lock()
+
+    def __init__(self, seq=None):
+        import time
+        from collections import defaultdict
+        self.seq = seq
+        self.built_at = time.monotonic()
+        self.by_national_id = defaultdict(list)
+        self.by_phone = defaultdict(list)
+        self.by_prefix = defaultdict(list)
+        self.active = set()
+        self._keys = defaultdict(list)
+        self._by_user = defaultdict(list)
+        self._user_of = {}
+        self._load(Loans.objects.all())
+
+    def _load(self, loans):
+        rows = loans.filter(status__in=ACTIVE_LOAN_STATUSES).order_by('created_at').values_list(
+            'id', 'user_id', 'user__phone', 'user__profile__national_id'
+        )
+        for loan_id, user_id, phone, national_id in rows:
+            self.active.add(loan_id)
+            self._by_user[str(user_id)].append(loan_id)
+            self._user_of[loan_id] = str(user_id)
+            self._add(self.by_prefix, loan_id.hex[:8], loan_id)
+            if national_id:
+                self._add(self.by_national_id, normalize_national_id(national_id), loan_id)
+            if phone:
+                self._add(self.by_phone, normalize_phone(phone), loan_id)
+
+    def _add(self, index, key, loan_id):
+        index[key].append(loan_id)
+        self._keys[loan_id].append((index, key))
+
+    def refresh_users(self, user_ids):
+        """Re-reads the active loans of the given customers with one query."""
+        user_ids = {str(user_id) for user_id in user_ids}
+        for user_id in user_ids:
+            for loan_id in self._by_user.pop(user_id, []):
+                self.discard(loan_id)
+        self._load(Loans.objects.filter(user_id__in=user_ids))
+
+    @classmethod
+    def shared(cls):
+        import time
+        from .utils.cache import get_match_index_seq, match_index_changes
+        seq = get_match_index_seq()
+        with cls._lock:
+            index = cls._shared
+            if (
+                index is None or seq < index.seq or seq - index.seq > cls.MAX_PATCH
+                or time.monotonic() - index.built_at > cls.TTL
+            ):
+                index = cls._shared = cls(seq)
+            elif seq > index.seq:
+                users = match_index_changes(index.seq, seq)
+                if users is None:
+                    index = cls._shared = cls(seq)
+                else:
+                    index.refresh_users(users)
+                    index.seq = seq
+        return index
+
+    @staticmethod
+    def _parse_loan_ref(ref):
+        """A full loan UUID, a lowercase hex prefix of at least 8 characters, or None."""
+        import re
+        import uuid as uuid_module
+        if len(ref) < 8:
+            return None
+        try:
+            return uuid_module.UUID(ref)
+        except ValueError:
+            pass
+        return ref.lower() if re.fullmatch(r'[0-9a-fA-F]{8,}', ref) else None
+
+    def _by_loan_ref(self, ref):
+        import uuid as uuid_module
+        ref = self._parse_loan_ref(ref)
+        if isinstance(ref, uuid_module.UUID):
+            return ref if ref in self.active else None
+        if ref is None:
+            return None
+        return next((i for i in self.by_prefix.get(ref[:8], []) if i.hex.startswith(ref)), None)
+
+    def resolve(self, account_ref, phone=None):
+        """Returns (loan_id, match_method), or (None, None) when nothing matches."""
+        ref = str(account_ref or '').strip()
+        keys = (
+            (self.by_national_id, normalize_national_id(ref), 'NATIONAL_ID'),
+            (self.by_phone, normalize_phone(phone), 'PHONE'),
+        )
+        # shared() patches the index under the same lock; read a snapshot so
+        # a concurrent refresh_users() cannot empty a list between the check
+        # and the lookup
+        with self._lock:
+            loan_id = self._by_loan_ref(ref)
+            if loan_id:
+                return loan_id, 'LOAN_ID'
+            for loans, key, method in keys:
+                ids = list(loans.get(key, ())) if key else []
+                if ids:
+                    return ids[0], method
+        return None, None
+
+    def discard(self, loan_id):
+        """Drops a loan that is no longer active so its customer's next loan takes over."""
+        self.active.discard(loan_id)
+        for index, key in self._keys.pop(loan_id, []):
+            index[key].remove(loan_id)
+
+    @staticmethod
+    def _match_from_db(account_ref, phone):
+        """Loan ID / national ID / phone fallback for index misses, e.g. a loan activated in another process."""
+        import uuid as uuid_module
+        from django.db.models import CharField, Value
+        from django.db.models.functions import Cast, Replace, Upper
+        from .models import UserProfiles
+        active = Loans.objects.filter(status__in=ACTIVE_LOAN_STATUSES).select_related('user').order_by('created_at')
+        loan_ref = PaymentMatchResolver._parse_loan_ref(str(account_ref or '').strip())
+        if loan_ref is not None:
+            if isinstance(loan_ref, uuid_module.UUID):
+                loan = active.filter(pk=loan_ref).first()
+            else:
+                # PostgreSQL casts a uuid to hyphenated text, so compare the
+                # prefix against the bare hex form on every backend
+                loan = active.annotate(
+                    id_hex=Replace(Cast('id', CharField()), Value('-'), Value(''))
+                ).filter(id_hex__startswith=loan_ref).first()
+            if loan:
+                return loan, 'LOAN_ID'
+        national_id = normalize_national_id(account_ref)
+        if national_id:
+            profile = UserProfiles.objects.annotate(national_id_upper=Upper('national_id')).filter(
+                national_id_upper=national_id
+            ).first()
+            loan = profile and active.filter(user_id=profile.user_id).first()
+            if loan:
+                return loan, 'NATIONAL_ID'
+        phone = normalize_phone(phone)
+        if phone:
+            loan = active.filter(user__phone__in=[phone, '254' + phone[1:], '+254' + phone[1:]]).first()
+            if loan:
+                return loan, 'PHONE'
+        return None, None
+
+    @classmethod
+    def match_loan(cls, account_ref, phone=None):
+        """
+        Resolves a live C2B payment to (loan, match_method). Costs one query
+        on a hit; a miss, or a hit the index had stale, falls back to the DB.
+        """
+        index = cls.shared()
+        loan_id, method = index.resolve(account_ref, phone)
+        if loan_id:
+            loan = Loans.objects.select_related('user').filter(pk=loan_id, status__in=ACTIVE_LOAN_STATUSES).first()
+            if loan:
+                return loan, method
+            # Closed in a process whose change log this one cannot see
+            with cls._lock:
+                index.refresh_users([index._user_of[loan_id]])
+        return cls._match_from_db(account_ref, phone)
+
+
+class StatementImportService:
+    """
+    Streams an uploaded M-Pesa statement through the matcher in chunks.
+
+    Matching uses a PaymentMatchResolver built once per run, so each chunk
+    costs one IN query for known receipts, a single bulk_create for the new
+    PaybillTransaction rows and one in_bulk fetch of the matched loans. Only
+    rows that actually match a loan go through _record_repayment.
+
+    Imports run as "statement_import.run" background jobs. Rows are
+    idempotent: a receipt that is already stored UNMATCHED (from an earlier
+    upload or an interrupted attempt) is matched again, any other stored
+    receipt is a duplicate. A retried attempt resumes after the last chunk
+    whose counters were saved.
+    """
+    CHUNK_SIZE = 1000
+    MAX_STORED_ERRORS = 100
+
+    @staticmethod
+    def start(job):
+        """Queues the import as a "statement_import.run" background job."""
+        from .utils.jobs import enqueue
+        enqueue('statement_import.run', {'import_id': str(job.pk)})
+
+    @staticmethod
+    def parse_row(row):
+        receipt = (row.get('Receipt No') or row.get('TransID') or row.get('receipt_number') or '').strip()
+        amount = (row.get('Amount') or row.get('TransAmount') or '0').strip().replace(',', '')
+        return {
+            'receipt_number': receipt,
+            'sender_phone': (row.get('Sender Phone') or row.get('MSISDN') or row.get('sender_phone') or '').strip(),
+            'account_ref': (row.get('Account Number') or row.get('BillRefNumber') or row.get('account_ref') or '').strip(),
+            'amount': Decimal(amount),
+            'sender_name': (row.get('Sender Name') or row.get('FirstName') or '').strip(),
+            'transaction_date': _parse_statement_date((row.get('Date') or row.get('TransTime') or '').strip()),
+        }
+
+    @staticmethod
+    def iter_rows(job):
+        import csv, io
+        with job.file.open('rb') as fh:
+            yield from csv.DictReader(io.TextIOWrapper(fh, encoding='utf-8-sig', newline=''))
+
+    @staticmethod
+    def run(job_id):
+        from itertools import islice
+        from django.db.models import Q
+        from .models import StatementImport
+
+        # FAILED and abandoned RUNNING imports are claimable by a retry
+        stale = timezone.now() - timedelta(seconds=settings.BACKGROUND_JOB_LOCK_TIMEOUT)
+        claimable = Q(status__in=['PENDING', 'FAILED']) | Q(status='RUNNING', started_at__lt=stale)
+        if not StatementImport.objects.filter(claimable, pk=job_id).update(
+            status='RUNNING', started_at=timezone.now(), finished_at=None
+        ):
+            return None
+        job = StatementImport.objects.get(pk=job_id)
+        if not job.total_rows:
+            job.total_rows = sum(1 for _ in StatementImportService.iter_rows(job))
+            job.save(update_fields=['total_rows'])
+
+        seen = set()
+        try:
+            resolver = PaymentMatchResolver()
+            rows = islice(StatementImportService.iter_rows(job), job.processed_rows, None)
+            while True:
+                chunk = list(islice(rows, StatementImportService.CHUNK_SIZE))
+                if not chunk:
+                    break
+                StatementImportService.process_chunk(job, chunk, seen, resolver)
+                job.save(update_fields=[
+                    'processed_rows', 'matched_national_id', 'matched_phone', 'matched_loan_id',
+                    'unmatched', 'duplicates', 'errors', 'error_count',
+                ])
+        except Exception as e:
+            logger.exception(f"[StatementImport] {job.pk} failed")
+            job.status = 'FAILED'
+            StatementImportService._add_error(job, str(e))
+            job.finished_at = timezone.now()
+            # Counters stay at the last saved chunk, where a retry resumes
+            job.save(update_fields=['status', 'errors', 'error_count', 'finished_at'])
+            raise
+        job.status = 'COMPLETED'
+        job.finished_at = timezone.now()
+        job.save()
+        return job
+
+    @staticmethod
+    def _add_error(job, message):
+        job.error_count += 1
+        if len(job.errors) < StatementImportService.MAX_STORED_ERRORS:
+            job.errors.append(message)
+
+    @staticmethod
+    def process_chunk(job, chunk, seen, resolver):
+        """Match one chunk of raw CSV rows, updating the counters on ``job``."""
+        from .models import PaybillTransaction
+        from .repayments.views import _record_repayment
+
+        job.processed_rows += len(chunk)
+        parsed = []
+        for row in chunk:
+            try:
+                data = StatementImportService.parse_row(row)
+            except Exception as e:
+                StatementImportService._add_error(job, f"{row.get('Receipt No') or row.get('TransID') or '?'}: {e}")
+                continue
+            receipt = data['receipt_number']
+            if not receipt:
+                continue
+            if receipt in seen:
+                job.duplicates += 1
+                continue
+            seen.add(receipt)
+            parsed.append(data)
+
+        existing = {
+            txn.receipt_number: txn for txn in PaybillTransaction.objects.filter(
+                receipt_number__in=[d['receipt_number'] for d in parsed]
+            )
+        }
+        retried = {txn.pk: txn for txn in existing.values() if txn.status == 'UNMATCHED'}
+        job.duplicates += len(existing) - len(retried)
+        parsed = [d for d in parsed if d['receipt_number'] not in existing]
+        txns = PaybillTransaction.objects.bulk_create([
+            PaybillTransaction(status='UNMATCHED', **d) for d in parsed
+        ]) if parsed else []
+        txns += retried.values()
+        if not txns:
+            return
+
+        loans = Loans.objects.select_related('user').in_bulk({
+            resolver.resolve(txn.account_ref, txn.sender_phone)[0] for txn in txns
+        } - {None})
+
+        counters = {'NATIONAL_ID': 'matched_national_id', 'PHONE': 'matched_phone', 'LOAN_ID': 'matched_loan_id'}
+        for txn in txns:
+            loan_id, method = resolver.resolve(txn.account_ref, txn.sender_phone)
+            if not loan_id:
+                job.unmatched += 1
+                continue
+            if loan_id not in loans:
+                # A loan closed earlier in this chunk; the customer's next one takes over.
+                loans[loan_id] = Loans.objects.select_related('user').get(pk=loan_id)
+            loan = loans[loan_id]
+            try:
+                with transaction.atomic():
+                    if txn.pk in retried and not PaybillTransaction.objects.select_for_update().filter(
+                        pk=txn.pk, status='UNMATCHED'
+                    ).exists():
+                        # Assigned by a Finance Officer since it was read
+                        job.duplicates += 1
+                        continue
+                    _record_repayment(txn, loan, loan.user, method, job.uploaded_by)
+            except Exception as e:
+                logger.error(f"[StatementImport] Failed to record {txn.receipt_number}: {e}")
+                StatementImportService._add_error(job, f"{txn.receipt_number}: {e}")
+                job.unmatched += 1
+                continue
+            setattr(job, counters[method], getattr(job, counters[method]) + 1)
+            if loan.status not in ACTIVE_LOAN_STATUSES:
+                resolver.discard(loan.id)
+
+
+class MpesaCallbackService:
+    """
+    Inbox for Daraja callbacks.
+
+    MpesaCallbackView only stores the raw payload under an idempotency key
+    (redeliveries hit the unique constraint and are dropped) and acks.
+    process() then applies a stored callback exactly once: the row is locked
+    and its status checked in the same transaction that does the matching,
+    ledger and schedule work, so the effects and the PROCESSED mark commit
+    or roll back together. MPESA_CALLBACK_PROCESSING picks who calls it:
+    "JOB" (an "mpesa.callback" background job, retried by run_jobs),
+    "WORKER" (only the process_mpesa_callbacks command) or "INLINE" (within
+    the request). "THREAD" is the former name of "JOB".
+    """
+
+    @staticmethod
+    def idempotency_key(payload):
+        """(kind, key) for a raw callback payload."""
+        import hashlib
+        import json
+
+        if 'Result' in payload:
+            result = payload.get('Result') or {}
+            ref = result.get('OriginatorConversationID') or result.get('ConversationID')
+            kind = 'B2C'
+        elif 'TransID' in payload:
+            ref, kind = payload.get('TransID'), 'C2B'
+        elif 'Body' in payload:
+            stk = (payload.get('Body') or {}).get('stkCallback') or {}
+            ref, kind = stk.get('CheckoutRequestID'), 'STK'
+        else:
+            ref, kind = None, 'UNKNOWN'
+        if not ref:
+            ref = hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+        return kind, f"{kind}:{ref}"[:150]
+
+    @staticmethod
+    def enqueue(payload):
+        """Stores the payload; returns (callback, created)."""
+        from django.db import IntegrityError
+        from .models import MpesaCallback
+
+        kind, key = MpesaCallbackService.idempotency_key(payload)
+        try:
+            with transaction.atomic():
+                return MpesaCallback.objects.create(idempotency_key=key, kind=kind, payload=payload), True
+        except IntegrityError:
+            return MpesaCallback.objects.get(idempotency_key=key), False
+
+    @staticmethod
+    def dispatch(callback):
+        from .utils.jobs import enqueue
+
+        mode = str(getattr(settings, 'MPESA_CALLBACK_PROCESSING', 'JOB')).upper()
+        if mode == 'INLINE':
+            MpesaCallbackService.process(callback.pk)
+        elif mode in ('JOB', 'THREAD'):
+            enqueue(
+                'mpesa.callback', {'callback_id': str(callback.pk)},
+                max_attempts=settings.MPESA_CALLBACK_MAX_ATTEMPTS,
+            )
+
+    @staticmethod
+    def apply(callback):
+        from .repayments.views import apply_b2c_result, apply_c2b_payment
+
+        if callback.kind == 'B2C':
+            apply_b2c_result(callback.payload)
+        elif callback.kind in ('C2B', 'STK'):
+            apply_c2b_payment(callback.payload)
+        else:
+            logger.warning(f"[M-Pesa Callback] Unrecognised payload structure: {list(callback.payload.keys())}")
+
+    @staticmethod
+    def process(callback_id, statuses=('RECEIVED', 'FAILED')):
+        """
+        Applies one callback if it is still in ``statuses``. Returns the
+        callback, or None when it was already handled or another worker
+        holds it.
+        """
+        from django.db import connection
+        from .models import MpesaCallback
+
+        lock = {'skip_locked': True} if connection.features.has_select_for_update_skip_locked else {}
+        with transaction.atomic():
+            callback = (
+                MpesaCallback.objects.select_for_update(**lock)
+                .filter(pk=callback_id, status__in=statuses).first()
+            )
+            if callback is None:
+                return None
+            callback.attempts += 1
+            try:
+                with transaction.atomic():
+                    MpesaCallbackService.apply(callback)
+            except Exception as e:
+                logger.exception(f"[M-Pesa Callback] {callback.idempotency_key} failed (attempt {callback.attempts})")
+                callback.status = 'FAILED'
+                callback.last_error = str(e)[:2000]
+            else:
+                callback.status = 'PROCESSED'
+                callback.last_error = None
+                callback.processed_at = timezone.now()
+            callback.save(update_fields=['status', 'attempts', 'last_error', 'processed_at'])
+            return callback
+
+    @staticmethod
+    def pending_ids(limit, max_attempts=None):
+        from django.db.models import Q
+        from .models import MpesaCallback
+
+        max_attempts = max_attempts or settings.MPESA_CALLBACK_MAX_ATTEMPTS
+        return list(
+            MpesaCallback.objects.filter(Q(status='RECEIVED') | Q(status='FAILED', attempts__lt=max_attempts))
+            .order_by('received_at').values_list('pk', flat=True)[:limit]
+        )
+
+    @staticmethod
+    def drain(workers=None, batch_size=500, max_attempts=None):
+        """Processes one batch of pending callbacks on a thread pool; returns (processed, failed)."""
+        from concurrent.futures import ThreadPoolExecutor
+
+        ids = MpesaCallbackService.pending_ids(batch_size, max_attempts)
+        if not ids:
+            return 0, 0
+
+        def _worker(callback_id):
+            from django.db import connection
+            try:
+                return MpesaCallbackService.process(callback_id)
+            finally:
+                connection.close()
+
+        workers = workers or settings.MPESA_CALLBACK_WORKERS
+        if workers <= 1:
+            results = [MpesaCallbackService.process(pk) for pk in ids]
+        else:
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="mpesa-callbacks") as pool:
+                results = list(pool.map(_worker, ids))
+        results = [cb for cb in results if cb is not None]
+        failed = sum(1 for cb in results if cb.status == 'FAILED')
+        return len(results) - failed, failed
+
+
+class SearchService:
+    """
+    Unified search over customers, loans and communication logs (SearchView).
+
+    Exact phone-variant and national ID matches rank first. Substring
+    matches on names, phones, IDs and log recipients use icontains, which
+    PostgreSQL serves from the pg_trgm GIN indexes created in migration
+    0061, and are ranked by trigram similarity. Loans match on an id
+    prefix, answered as a primary key range. Without pg_trgm (SQLite in
+    development) the same lookups run as plain scans, ranked prefix match
+    over substring match. Every section returns at most ``limit`` rows.
+    """
+    SCOPES = ('customers', 'loans', 'communications')
+    _trigram = {}
+
+    @staticmethod
+    def trigram_available():
+        from django.db import connection
+
+        if connection.vendor != 'postgresql':
+            return False
+        if connection.alias not in SearchService._trigram:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+                SearchService._trigram[connection.alias] = cursor.fetchone() is not None
+        return SearchService._trigram[connection.alias]
+
+    @staticmethod
+    def rank(query, *fields):
+        from django.db.models import Case, FloatField, Q, Value, When
+        from django.db.models.functions import Coalesce, Greatest
+
+        if SearchService.trigram_available():
+            from django.contrib.postgres.search import TrigramSimilarity
+            # NULL columns score 0 rather than sorting first
+            scores = [Coalesce(TrigramSimilarity(field, query), Value(0.0)) for field in fields]
+            return Greatest(*scores) if len(scores) > 1 else scores[0]
+        prefix = Q()
+        for field in fields:
+            prefix |= Q(**{f'{field}__istartswith': query})
+        return Case(When(prefix, then=Value(0.5)), default=Value(0.1), output_field=FloatField())
+
+    @staticmethod
+    def customers(user, query, limit):
+        from django.db.models import Case, FloatField, Q, Value, When
+        from .models import Users
+        from .utils.security import get_filtered_queryset
+
+        variants = phone_variants(query)
+        exact = Q(profile__national_id__iexact=query)
+        if variants:
+            exact |= Q(phone__in=variants)
+        matches = exact | Q(full_name__icontains=query) | Q(profile__national_id__icontains=query)
+        if variants and len(variants[0]) >= 3:
+            matches |= Q(phone__icontains=variants[0])
+        queryset = get_filtered_queryset(user, Users.objects.all(), 'profile__branch_fk').filter(matches).annotate(
+            score=Case(When(exact, then=Value(1.0)), default=SearchService.rank(query, 'full_name'), output_field=FloatField())
+        )
+        return [
+            {'id': str(pk), 'full_name': name, 'phone': phone, 'national_id': national_id, 'score': round(score, 3)}
+            for pk, name, phone, national_id, score in queryset.order_by('-score', 'full_name').values_list(
+                'id', 'full_name', 'phone', 'profile__national_id', 'score'
+            )[:limit]
+        ]
+
+    @staticmethod
+    def loans(user, query, limit):
+        import re
+        import uuid
+        from .utils.security import get_filtered_queryset
+
+        prefix = query.replace('-', '').lower()
+        if not re.fullmatch(r'[0-9a-f]{4,32}', prefix):
+            return []
+        low, high = uuid.UUID(prefix.ljust(32, '0')), uuid.UUID(prefix.ljust(32, 'f'))
+        queryset = get_filtered_queryset(user, Loans.objects.all(), 'user__profile__branch_fk').filter(id__gte=low, id__lte=high)
+        return [
+            {'id': str(pk), 'customer': name, 'status': status, 'principal_amount': amount, 'score': 1.0}
+            for pk, name, status, amount in queryset.order_by('id').values_list(
+                'id', 'user__full_name', 'status', 'principal_amount'
+            )[:limit]
+        ]
+
+    @staticmethod
+    def communications(user, query, limit):
+        from django.db.models import Q
+        from .models import EmailLog, SMSLog, Users
+
+        role = getattr(user, 'role', None)
+        if role == 'FIELD_OFFICER':
+            return []
+        results = []
+        variants = phone_variants(query)
+        sms_matches = Q(recipient_name__icontains=query)
+        if variants and len(variants[0]) >= 3:
+            sms_matches |= Q(recipient_phone__in=variants) | Q(recipient_phone__icontains=variants[0])
+        sms = SMSLog.objects.filter(sms_matches)
+        if role == 'MANAGER' and not (getattr(user, 'is_owner', False) or getattr(user, 'is_super_admin', False)):
+            # Managers see messages to their branch's customers only, as in SMSLogListView
+            sms = sms.filter(recipient_phone__in=Users.objects.filter(profile__branch_fk=user.branch_fk).values('phone'))
+        else:
+            emails = EmailLog.objects.filter(
+                Q(recipient_email__icontains=query) | Q(recipient_name__icontains=query) | Q(subject__icontains=query)
+            ).annotate(score=SearchService.rank(query, 'recipient_email', 'recipient_name', 'subject'))
+            results += [
+                {'kind': 'email', 'id': str(pk), 'recipient': email, 'recipient_name': name, 'summary': subject,
+                 'created_at': created_at, 'score': round(score, 3)}
+                for pk, email, name, subject, created_at, score in emails.order_by('-score', '-created_at').values_list(
+                    'id', 'recipient_email', 'recipient_name', 'subject', 'created_at', 'score'
+                )[:limit]
+            ]
+        sms = sms.annotate(score=SearchService.rank(query, 'recipient_name'))
+        results += [
+            {'kind': 'sms', 'id': str(pk), 'recipient': phone, 'recipient_name': name, 'summary': message[:120],
+             'created_at': created_at, 'score': round(score, 3)}
+            for pk, phone, name, message, created_at, score in sms.order_by('-score', '-created_at').values_list(
+                'id', 'recipient_phone', 'recipient_name', 'message', 'created_at', 'score'
+            )[:limit]
+        ]
+        results.sort(key=lambda r: (-r['score'], -r['created_at'].timestamp()))
+        return results[:limit]
+
+    @staticmethod
+    def search(user, query, scopes=None, limit=None):
+        limit = min(limit or settings.SEARCH_RESULT_LIMIT, settings.SEARCH_MAX_RESULT_LIMIT)
+        return {
+            scope: getattr(SearchService, scope)(user, query, limit)
+            for scope in (scopes or SearchService.SCOPES)
+        }
+
+STAFF_NOTIFICATION_DEDUPE_WINDOW = timedelta(hours=1)
+
 
 def create_staff_notification(recipient, notification_type, title, message, priority='MEDIUM', send_email=False, related_table=None, related_id=None):
     """
-    Create a staff notification. If send_email=True, also send via Brevo.
+    Create a staff notification. If send_email=True, also queue it for Brevo.
     Deduplicates: does not create if an identical unread notification 
     of the same type for the same recipient was created in the last 1 hour.
     """
     from .models import StaffNotification
-    from django.utils import timezone
-    from datetime import timedelta
 
-    one_hour_ago = timezone.now() - timedelta(hours=1)
     already_exists = StaffNotification.objects.filter(
         recipient=recipient,
         notification_type=notification_type,
         is_read=False,
-        created_at__gte=one_hour_ago
+        created_at__gte=timezone.now() - STAFF_NOTIFICATION_DEDUPE_WINDOW
     ).exists()
     if already_exists:
         return None
@@ -211,48 +1879,68 @@ def create_staff_notification(recipient, notification_type, title, message, prio
     )
 
     if send_email:
-        try:
-            import os, requests
-            brevo_api_key = os.getenv('BREVO_API_KEY')
-            from_email = os.getenv('FROM_EMAIL')
-            if brevo_api_key and from_email:
-                payload = {
-                    "sender": {"name": "Azariah Credit System", "email": from_email},
-                    "to": [{"email": recipient.email, "name": recipient.full_name}],
-                    "subject": f"[{priority}] {title}",
-                    "htmlContent": f"""
-                        <html><body>
-                        <h2 style="color:#1e293b">{title}</h2>
-                        <p style="color:#475569">{message}</p>
-                        <p style="font-size:12px;color:#94a3b8">This is an automated alert from Azariah Credit Ltd system. Do not reply to this email.</p>
-                        </body></html>
-                    """
-                }
-                res = requests.post(
-                    "https://api.brevo.com/v3/smtp/email",
-                    json=payload,
-                    headers={"api-key": brevo_api_key, "Content-Type": "application/json"},
-                    timeout=10
-                )
-                if res.status_code in [200, 201, 202]:
-                    notif.email_sent = True
-                    notif.save(update_fields=['email_sent'])
-
-                from .models import EmailLog
-                EmailLog.objects.create(
-                    recipient_email=recipient.email,
-                    recipient_name=recipient.full_name,
-                    subject=payload["subject"],
-                    message=f"Staff alert: {notification_type} — {title}",
-                    status="SENT" if res.status_code in [200, 201, 202] else "FAILED"
-                )
-        except Exception as e:
-            print(f"[StaffNotification] Email send failed: {e}")
+        from .utils.jobs import enqueue
+        enqueue('email.staff_notification', {'notification_id': str(notif.id)})
 
     return notif
 
 
-def notify_capital_low(balance, threshold_low, threshold_critical):
+class StaffNotificationBatch:
+    """
+    create_staff_notification() for sweeps that raise many alerts at once.
+    The dedupe window is loaded with one query up front and checked as a set
+    lookup, the notifications are written with a single bulk_create, and the
+    emails are handed to the "email.staff_notification" background job.
+    """
+
+    def __init__(self, now=None):
+        from .models import StaffNotification
+
+        self.now = now or timezone.now()
+        self.seen = set(
+            StaffNotification.objects.filter(
+                is_read=False, created_at__gte=self.now - STAFF_NOTIFICATION_DEDUPE_WINDOW
+            ).values_list('recipient_id', 'notification_type')
+        )
+        self.pending = []
+
+    def add(self, recipient, notification_type, title, message, priority='MEDIUM', send_email=False, related_table=None, related_id=None):
+        """Queues a notification unless one is already unread in the window; ``recipient`` may be an id."""
+        from .models import StaffNotification
+
+        recipient_id = getattr(recipient, 'pk', recipient)
+        if (recipient_id, notification_type) in self.seen:
+            return None
+        self.seen.add((recipient_id, notification_type))
+        notif = StaffNotification(
+            recipient_id=recipient_id,
+            notification_type=notification_type,
+            priority=priority,
+            title=title,
+            message=message,
+            send_email=send_email,
+            related_table=related_table,
+            related_id=related_id,
+            created_at=self.now,
+        )
+        self.pending.append(notif)
+        return notif
+
+    def save(self):
+        """Writes the queued notifications; returns how many were created."""
+        from .models import StaffNotification
+        from .utils.jobs import enqueue
+
+        pending, self.pending = self.pending, []
+        with transaction.atomic():
+            StaffNotification.objects.bulk_create(pending, batch_size=500)
+            for notif in pending:
+                if notif.send_email:
+                    enqueue('email.staff_notification', {'notification_id': str(notif.id)})
+        return len(pending)
+
+
+def notify_capital_low(balance, threshold_low, threshold_critical, batch=None):
     """Notify Owner and Finance Officers when capital is low."""
     from .models import Admins
     owners = Admins.objects.filter(is_owner=True, is_blocked=False)
@@ -267,8 +1955,12 @@ def notify_capital_low(balance, threshold_low, threshold_critical):
         f"System capital has dropped to KES {int(balance):,}. "
         f"{'This is critically low and disbursements may be blocked.' if is_critical else 'This is approaching the minimum threshold. Please arrange capital injection.'}"
     )
+    own_batch = batch is None
+    batch = batch or StaffNotificationBatch()
     for r in recipients:
-        create_staff_notification(r, notif_type, title, message, priority=priority, send_email=True)
+        batch.add(r, notif_type, title, message, priority=priority, send_email=True)
+    if own_batch:
+        batch.save()
 
 
 def notify_staff_joined(new_admin):
@@ -300,19 +1992,23 @@ def notify_loan_rejected(loan):
     create_staff_notification(officer, 'LOAN_REJECTED', title, message, priority='MEDIUM', send_email=False)
 
 
-def notify_customer_overdue(loan):
-    """Notify the field officer when their customer goes overdue."""
-    from .models import Admins
-    if not loan.created_by:
-        return
-    officer = loan.created_by
+def customer_overdue_message(loan):
+    """Title and body of the CUSTOMER_OVERDUE alert sent to a loan's officer."""
     customer_name = loan.user.full_name if loan.user else 'Unknown'
     title = f"Customer Overdue — {customer_name}"
     message = (
         f"{customer_name}'s loan of KES {int(loan.principal_amount):,} is now OVERDUE. "
         f"Please follow up with the customer."
     )
-    create_staff_notification(officer, 'CUSTOMER_OVERDUE', title, message, priority='HIGH', send_email=False)
+    return title, message
+
+
+def notify_customer_overdue(loan):
+    """Notify the field officer when their customer goes overdue."""
+    if not loan.created_by:
+        return
+    title, message = customer_overdue_message(loan)
+    create_staff_notification(loan.created_by, 'CUSTOMER_OVERDUE', title, message, priority='HIGH', send_email=False)
 
 
 def notify_deactivation_request(request_obj):
@@ -1,3 +1,52 @@
-# Signals removed — all logging handled in views
+# Audit signals removed — all logging handled in views
 # to prevent duplicate audit entries.
+#
+# The receivers below only invalidate cached analytics payloads, the
+# in-memory paybill match index and the authentication caches.
 
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .models import Admins, LedgerEntry, Repayments, SecureSettings, Users, UserProfiles
+
+
+@receiver(post_save, sender=LedgerEntry)
+@receiver(post_delete, sender=LedgerEntry)
+@receiver(post_save, sender=Repayments)
+def invalidate_analytics_cache(sender, **kwargs):
+    from .utils.cache import bump_analytics_generation
+    transaction.on_commit(bump_analytics_generation)
+
+
+@receiver(post_save, sender=Users)
+@receiver(post_save, sender=UserProfiles)
+@receiver(post_delete, sender=UserProfiles)
+def invalidate_match_index(sender, instance, **kwargs):
+    from .utils.cache import record_match_index_change
+    user_id = instance.pk if sender is Users else instance.user_id
+    transaction.on_commit(lambda: record_match_index_change(user_id))
+
+
+@receiver(post_save, sender=Admins)
+@receiver(post_delete, sender=Admins)
+def invalidate_principal_cache(sender, instance, **kwargs):
+    from .utils.cache import invalidate_principal
+    # Drop it now and again after commit, so a request that re-cached the
+    # old row in between does not keep it for the whole TTL.
+    invalidate_principal(instance.pk)
+    transaction.on_commit(lambda: invalidate_principal(instance.pk))
+
+
+@receiver(post_save, sender=SecureSettings)
+@receiver(post_delete, sender=SecureSettings)
+def invalidate_settings_cache(sender, instance, **kwargs):
+    from .utils.cache import bump_settings_version, invalidate_maintenance_state
+    # SecureSettingsView bumps the version itself; this covers saves made
+    # anywhere else (admin, shell, seed scripts). Bumped again after commit
+    # in case another process reloaded the old rows in between.
+    bump_settings_version()
+    transaction.on_commit(bump_settings_version)
+    if instance.key.startswith("maintenance_"):
+        invalidate_maintenance_state()
+        transaction.on_commit(invalidate_maintenance_state)
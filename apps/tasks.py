@@ -0,0 +1,125 @@
+"""
+Background job handlers, registered by name for apps.utils.jobs.enqueue().
+Each one receives the job payload as keyword arguments and raises to have
+the attempt retried.
+"""
+from .utils.jobs import task
+from .utils.sms import send_brevo_email, send_invite_email_sync, send_sms
+
+
+@task("sms.send")
+def sms_send(recipients, message):
+    send_sms(recipients, message)
+
+
+@task("email.verification")
+def email_verification(full_name, email, verification_code):
+    from .admins.auth_views import send_verification_email
+    send_verification_email(full_name, email, verification_code)
+
+
+@task("email.password_reset")
+def email_password_reset(full_name, email, reset_code):
+    from .admins.auth_views import send_password_reset_email
+    send_password_reset_email(full_name, email, reset_code)
+
+
+@task("email.new_device_login")
+def email_new_device_login(full_name, email, context):
+    from .admins.auth_views import send_new_device_login_alert
+    send_new_device_login_alert(full_name, email, context)
+
+
+@task("email.invite")
+def email_invite(email, token, role, invited_by_name, sender_id=None):
+    from .models import Admins
+    sender = Admins.objects.filter(pk=sender_id).first() if sender_id else None
+    success, error = send_invite_email_sync(email, token, role, invited_by_name, sender)
+    if not success:
+        raise RuntimeError(f"Invitation to {email} failed: {error}")
+
+
+@task("email.notification")
+def email_notification(admin_id, subject, message, sender_id=None):
+    """One SendEmailNotificationView recipient."""
+    import os
+    from .models import Admins
+
+    admin = Admins.objects.filter(pk=admin_id).first()
+    if admin is None:
+        return
+    sender = Admins.objects.filter(pk=sender_id).first() if sender_id else None
+    payload = {
+        "sender": {"name": os.getenv("SENDER_NAME", "Azariah Credit Ltd"), "email": os.getenv("FROM_EMAIL")},
+        "to": [{"email": admin.email}],
+        "subject": subject,
+        "htmlContent": f"<html><body>{message.replace(chr(10), '<br>')}</body></html>",
+    }
+    send_brevo_email(payload, sender=sender, recipient_name=admin.full_name, message=message)
+
+
+@task("email.staff_notification")
+def email_staff_notification(notification_id):
+    """Emails a StaffNotification created with send_email=True."""
+    import os
+    from .models import StaffNotification
+
+    notif = StaffNotification.objects.select_related("recipient").filter(pk=notification_id).first()
+    if notif is None or notif.email_sent:
+        return
+    from_email = os.getenv("FROM_EMAIL")
+    if not os.getenv("BREVO_API_KEY") or not from_email:
+        return
+    recipient = notif.recipient
+    payload = {
+        "sender": {"name": "Azariah Credit System", "email": from_email},
+        "to": [{"email": recipient.email, "name": recipient.full_name}],
+        "subject": f"[{notif.priority}] {notif.title}",
+        "htmlContent": f"""
+            <html><body>
+            <h2 style="color:#1e293b">{notif.title}</h2>
+            <p style="color:#475569">{notif.message}</p>
+            <p style="font-size:12px;color:#94a3b8">This is an automated alert from Azariah Credit Ltd system. Do not reply to this email.</p>
+            </body></html>
+        """
+    }
+    send_brevo_email(
+        payload,
+        recipient_name=recipient.full_name,
+        message=f"Staff alert: {notif.notification_type} — {notif.title}",
+    )
+    notif.email_sent = True
+    notif.save(update_fields=['email_sent'])
+
+
+@task("sms.broadcast")
+def sms_broadcast(broadcast_id):
+    from .services import SMSBroadcastService
+    SMSBroadcastService.run(broadcast_id)
+
+
+@task("export.build")
+def export_build(export_id):
+    from .services import DataExportService
+    DataExportService.run(export_id)
+
+
+@task("disbursement.batch")
+def disbursement_batch(batch_id):
+    from .services import DisbursementBatchService
+    DisbursementBatchService.run(batch_id)
+
+
+@task("statement_import.run")
+def statement_import_run(import_id):
+    from .services import StatementImportService
+    StatementImportService.run(import_id)
+
+
+@task("mpesa.callback")
+def mpesa_callback(callback_id):
+    """Applies a stored M-Pesa callback; a FAILED attempt is retried by the queue."""
+    from .services import MpesaCallbackService
+    callback = MpesaCallbackService.process(callback_id)
+    if callback is not None and callback.status == 'FAILED':
+        raise RuntimeError(callback.last_error)
@@ -1 +1,1581 @@
-from django.test import TestCase
+import base64
+import csv
+import datetime
+import gzip
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+from datetime import timedelta
+from decimal import Decimal
+
+from django.apps import apps as django_apps
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import DatabaseError, connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient, APIRequestFactory
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.tokens import AccessToken
+
+from .models import (
+    Admins, AuditLogs, BackgroundJob, Branch, DataExport, EmailLog, Guarantors, LedgerEntry, LoanActivity,
+    LoanDocuments, LoanProducts, Loans, MpesaCallback, PaybillTransaction, PortfolioDailySnapshot, Repayments,
+    RepaymentSchedule, SecureSettings, SMSLog, StatementImport, StaffNotification, SystemCapital, SystemSettings,
+    Users, UserProfiles,
+)
+from .authentication import CustomJWTAuthentication, get_maintenance_state
+from .exceptions import InsufficientCapitalError
+from .services import (
+    CapitalLedgerService, DataExportService, DisbursementBatchService, DisbursementService, PaymentMatchResolver,
+    PortfolioSnapshotService, StatementImportService, create_staff_notification,
+)
+from .utils import audit, encryption, jobs, partitions
+from .utils.sms import send_sms_async
+
+
+def make_portfolio(branches=1, officers_per_branch=1, loans_per_officer=2):
+    """Builds branches with a manager, officers, customers and loans for query-count tests."""
+    product = LoanProducts.objects.create(
+        name="Test Loan", min_amount=1000, max_amount=50000, interest_rate=25, duration_weeks=4
+    )
+    admin = Admins.objects.create(
+        full_name="Admin", email=f"admin{Admins.objects.count()}@test.local", role="ADMIN", password_hash="x"
+    )
+    for b in range(branches):
+        branch = Branch.objects.create(name=f"Branch {Branch.objects.count()}")
+        Admins.objects.create(
+            full_name=f"Manager {b}", email=f"mgr-{branch.id}@test.local", role="MANAGER",
+            password_hash="x", branch_fk=branch, invited_by=admin,
+        )
+        Admins.objects.create(
+            full_name=f"Finance {b}", email=f"fo-{branch.id}@test.local", role="FINANCIAL_OFFICER",
+            password_hash="x", branch_fk=branch,
+        )
+        for o in range(officers_per_branch):
+            officer = Admins.objects.create(
+                full_name=f"Officer {b}-{o}", email=f"off-{branch.id}-{o}@test.local",
+                role="FIELD_OFFICER", password_hash="x", branch_fk=branch, invited_by=admin,
+            )
+            for n in range(loans_per_officer):
+                customer = Users.objects.create(
+                    full_name=f"Customer {b}-{o}-{n}", phone=f"07{Users.objects.count():08d}", created_by=officer
+                )
+                UserProfiles.objects.create(
+                    user=customer, national_id=f"ID{Users.objects.count():06d}", branch_fk=branch
+                )
+                loan = Loans.objects.create(
+                    user=customer, loan_product=product, principal_amount=Decimal("5000"),
+                    interest_rate=25, duration_weeks=4, branch=branch, created_by=officer,
+                    status="OVERDUE" if n % 2 else "ACTIVE",
+                    disbursed_at=timezone.now() - timedelta(days=40),
+                )
+                Repayments.objects.create(
+                    loan=loan, amount_paid=Decimal("500"), payment_method="CASH",
+                    reference_code=f"REF{loan.id.hex[:12]}",
+                )
+                AuditLogs.objects.create(
+                    action="LOAN_DISBURSED", log_type="STATUS", table_name="loans",
+                    record_id=loan.id, new_data={"amount": 5000},
+                    admin=Admins.objects.get(email=f"fo-{branch.id}@test.local"),
+                )
+    return product
+
+
+class OwnerAnalyticsQueryCountTests(TestCase):
+    # Constant regardless of how many branches, staff or overdue loans exist.
+    EXPECTED_QUERIES = 20
+
+    def setUp(self):
+        self.owner = Admins.objects.create(
+            full_name="Owner", email="owner@test.local", role="SUPER_ADMIN", password_hash="x", is_owner=True
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.owner)
+
+    def _fetch(self):
+        cache.clear()
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get("/api/owner/analytics/")
+        self.assertEqual(response.status_code, 200)
+        return response, len(ctx.captured_queries)
+
+    def test_query_count_does_not_grow_with_branches_and_staff(self):
+        make_portfolio(branches=1, officers_per_branch=1)
+        _, small = self._fetch()
+
+        make_portfolio(branches=4, officers_per_branch=3)
+        response, large = self._fetch()
+
+        self.assertEqual(small, large)
+        self.assertEqual(large, self.EXPECTED_QUERIES)
+        self.assertEqual(len(response.data["branch_performance"]), 5)
+        self.assertEqual(len(response.data["field_officer_stats"]), 13)
+
+    def test_branch_and_overdue_figures(self):
+        make_portfolio(branches=1, officers_per_branch=1, loans_per_officer=2)
+        response, _ = self._fetch()
+
+        branch = response.data["branch_performance"][0]
+        self.assertEqual(branch["total_loans"], 2)
+        self.assertEqual(branch["principal_disbursed"], 10000.0)
+        self.assertEqual(branch["total_collected"], 1000.0)
+        self.assertEqual(branch["overdue_count"], 1)
+
+        officer = response.data["field_officer_stats"][0]
+        self.assertEqual(officer["customers_registered"], 2)
+        self.assertEqual(officer["overdue_loans"], 1)
+
+        finance = response.data["finance_officer_stats"][0]
+        self.assertEqual(finance["loans_disbursed"], 2)
+        self.assertEqual(finance["total_disbursed_amount"], 10000.0)
+
+        self.assertEqual(response.data["admin_stats"][0]["officers_invited"], 1)
+        self.assertEqual(response.data["overdue_tracker"][0]["last_payment_amount"], 500.0)
+
+
+class AnalyticsCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        make_portfolio(branches=1, officers_per_branch=1)
+        self.owner = Admins.objects.create(
+            full_name="Owner", email="owner@test.local", role="SUPER_ADMIN", password_hash="x", is_owner=True
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.owner)
+
+    def _query_count(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries)
+
+    def test_repeat_requests_are_served_from_cache(self):
+        self.assertGreater(self._query_count("/api/finance/analytics/"), 0)
+        self.assertEqual(self._query_count("/api/finance/analytics/"), 0)
+
+        stats = self.client.get("/api/analytics/cache-stats/").data
+        self.assertEqual(stats["hits"], 1)
+        self.assertEqual(stats["misses"], 1)
+
+    def test_startup_warns_when_workers_do_not_share_the_cache(self):
+        config = django_apps.get_app_config("apps")
+        with override_settings(WEB_CONCURRENCY=3), self.assertLogs("apps.apps", "WARNING"):
+            config.ready()
+        with override_settings(WEB_CONCURRENCY=1), self.assertNoLogs("apps.apps", "WARNING"):
+            config.ready()
+
+    def test_repayment_invalidates_cached_payloads(self):
+        self._query_count("/api/finance/analytics/")
+        loan = Loans.objects.first()
+        with self.captureOnCommitCallbacks(execute=True):
+            Repayments.objects.create(
+                loan=loan, amount_paid=Decimal("100"), payment_method="CASH", reference_code="CACHE-TEST"
+            )
+        self.assertGreater(self._query_count("/api/finance/analytics/"), 0)
+
+    def test_snapshot_split_uses_disbursement_day_and_overdue_loans(self):
+        url = "/api/finance/analytics/"
+        pending, overdue = Loans.objects.get(status="ACTIVE"), Loans.objects.get(status="OVERDUE")
+        Loans.objects.update(created_at=timezone.now() - timedelta(days=3))
+        Loans.objects.filter(pk=pending.pk).update(status="APPROVED", disbursed_at=None)
+        for loan in (pending, overdue):
+            RepaymentSchedule.objects.create(
+                loan=loan, installment_number=1, due_date=timezone.localdate() - timedelta(days=10),
+                amount_due=Decimal("1000"), is_paid=False,
+            )
+        self._query_count(url)
+        call_command("build_portfolio_snapshots", stdout=io.StringIO())
+        self.assertGreater(self._query_count(url), 0)
+        data = self.client.get(url).data
+        self.assertEqual((data["money_out"], data["aging_report"]["days_30"]), (5000.0, 1000.0))
+
+        # Created before the snapshot, disbursed after it
+        Loans.objects.filter(pk=pending.pk).update(status="ACTIVE", disbursed_at=timezone.now())
+        cache.clear()
+        self.assertEqual(self.client.get(url).data["money_out"], 10000.0)
+
+    def test_cache_is_scoped_per_caller(self):
+        self._query_count("/api/loans/stats/")
+        manager = Admins.objects.get(role="MANAGER")
+        self.client.force_authenticate(user=manager)
+        self.assertGreater(self._query_count("/api/loans/stats/"), 0)
+
+
+class PortfolioSnapshotTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.today = timezone.localdate()
+        self.product = LoanProducts.objects.create(
+            name="Test Loan", min_amount=1000, max_amount=50000, interest_rate=25, duration_weeks=4
+        )
+        self.branch = Branch.objects.create(name="North")
+        self.owner = Admins.objects.create(
+            full_name="Owner", email="owner@test.local", role="SUPER_ADMIN", password_hash="x", is_owner=True
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.owner)
+
+    def _at(self, days_ago, hour=12, minute=0):
+        day = self.today - timedelta(days=days_ago)
+        return timezone.make_aware(datetime.datetime.combine(day, datetime.time(hour, minute)))
+
+    def _loan(self, amount, created, disbursed=None, status="ACTIVE"):
+        customer = Users.objects.create(full_name="Customer", phone=f"07{Users.objects.count():08d}")
+        UserProfiles.objects.create(
+            user=customer, national_id=f"ID{Users.objects.count():06d}", branch="Legacy", branch_fk=self.branch
+        )
+        loan = Loans.objects.create(
+            user=customer, loan_product=self.product, principal_amount=Decimal(amount),
+            interest_rate=25, duration_weeks=4, status=status,
+        )
+        Loans.objects.filter(pk=loan.pk).update(created_at=created, disbursed_at=disbursed)
+        return loan
+
+    def _overdue_installment(self, loan, days_ago):
+        RepaymentSchedule.objects.create(
+            loan=loan, installment_number=1, due_date=self.today - timedelta(days=days_ago),
+            amount_due=Decimal("400"), is_paid=False,
+        )
+
+    def _build(self):
+        with mock.patch("apps.services.timezone.now", return_value=self._at(0, 0, 0)):
+            call_command("build_portfolio_snapshots", stdout=io.StringIO())
+        cache.clear()
+
+    def test_disbursements_are_keyed_on_the_disbursement_day(self):
+        self._loan("3000", created=self._at(5), disbursed=self._at(3))
+        self._build()
+
+        rows = {row.date: row for row in PortfolioDailySnapshot.objects.filter(branch=self.branch)}
+        created, disbursed = rows[self.today - timedelta(days=5)], rows[self.today - timedelta(days=3)]
+        self.assertEqual((created.applied_amount, created.disbursed_count), (Decimal("3000"), 0))
+        self.assertEqual((disbursed.applied_count, disbursed.disbursed_amount), (0, Decimal("3000")))
+
+        daily = self.client.get("/api/loans/analytics/").data["daily_disbursements"]
+        self.assertEqual(
+            [(d["date"], d["amount"]) for d in daily], [(str(self.today - timedelta(days=3)), 3000.0)]
+        )
+
+    def test_aging_counts_only_overdue_loans(self):
+        self._overdue_installment(self._loan("2000", created=self._at(20), status="OVERDUE"), days_ago=10)
+        self._overdue_installment(self._loan("2000", created=self._at(20)), days_ago=10)
+        self._build()
+
+        row = PortfolioDailySnapshot.objects.get(date=self.today - timedelta(days=10))
+        self.assertEqual((row.scheduled_count, row.overdue_count, row.overdue_amount), (2, 1, Decimal("400")))
+        aging = self.client.get("/api/finance/analytics/").data["aging_report"]
+        self.assertEqual(aging["days_30"], 400.0)
+
+    def test_days_before_the_cutoff_come_from_the_snapshot_and_later_ones_live(self):
+        self._loan("1000", created=self._at(2), disbursed=self._at(1, 23, 59))
+        self._build()
+        # Lands after the build: at midnight of the cutoff day, and on a day
+        # the snapshot already covers (it must wait for the next build)
+        self._loan("2000", created=self._at(0, 0, 0), disbursed=self._at(0, 0, 0))
+        self._loan("4000", created=self._at(1), disbursed=self._at(1))
+        cache.clear()
+
+        self.assertEqual(PortfolioSnapshotService.cutoff(), self.today)
+        self.assertEqual(self.client.get("/api/finance/analytics/").data["money_out"], 3000.0)
+        daily = self.client.get("/api/loans/analytics/").data["daily_disbursements"]
+        daily = {d["date"]: d["amount"] for d in daily}
+        self.assertEqual(daily, {str(self.today): 2000.0, str(self.today - timedelta(days=1)): 1000.0})
+
+        self._build()
+        self.assertEqual(self.client.get("/api/finance/analytics/").data["money_out"], 7000.0)
+
+    def test_branch_filter_uses_the_branch_fk_for_snapshot_and_live_rows(self):
+        # The customers' legacy text branch ("Legacy") differs from their FK branch
+        self._loan("1000", created=self._at(2), disbursed=self._at(1))
+        self._build()
+        self._loan("2000", created=self._at(0), disbursed=self._at(0))
+
+        for branch, expected in (("North", [2000.0, 1000.0]), ("Legacy", [])):
+            data = self.client.get("/api/loans/analytics/", {"branch": branch}).data
+            self.assertEqual([d["amount"] for d in data["daily_disbursements"]], expected, branch)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class StatementImportTests(TestCase):
+    def setUp(self):
+        make_portfolio(branches=1, officers_per_branch=1, loans_per_officer=2)
+        self.finance = Admins.objects.get(role="FINANCIAL_OFFICER")
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.finance)
+        PaybillTransaction.objects.create(
+            receipt_number="OLD1", sender_phone="0700000000", account_ref="X",
+            amount=Decimal("10"), transaction_date=timezone.now(),
+        )
+
+    def _upload(self, rows):
+        body = "Receipt No,Sender Phone,Account Number,Amount,Date\n" + "\n".join(rows) + "\n"
+        response = self.client.post(
+            "/api/repayments/upload-statement/",
+            {"statement": SimpleUploadedFile("statement.csv", body.encode(), content_type="text/csv")},
+        )
+        self.assertEqual(response.status_code, 202)
+        return self.client.get(f"/api/repayments/statement-imports/{response.data['id']}/").data
+
+    def test_import_matches_dedupes_and_reports_progress(self):
+        by_id, by_phone = Loans.objects.select_related("user__profile").order_by("created_at")
+        rows = [
+            f"R1,0799999999,{by_id.user.profile.national_id},\"1,000\",20260101120000",
+            f"R2,254{by_phone.user.phone[1:]},unknown,250,01/01/2026 12:00:00",
+            "R3,0711111111,nobody,300,",
+            "R1,0799999999,dup,1000,",
+            "OLD1,0700000000,X,10,",
+            "R4,0711111111,nobody,not-a-number,",
+        ]
+        job = self._upload(rows)
+
+        self.assertEqual(job["status"], "COMPLETED")
+        self.assertEqual(job["progress"], 100)
+        self.assertEqual(job["processed_rows"], 6)
+        results = job["results"]
+        self.assertEqual(results["matched_national_id"], 1)
+        # OLD1 was stored UNMATCHED before the upload and is matched again
+        self.assertEqual(results["matched_phone"], 2)
+        self.assertEqual(results["unmatched"], 1)
+        self.assertEqual(results["duplicates"], 1)
+        self.assertEqual(results["error_count"], 1)
+
+        self.assertEqual(PaybillTransaction.objects.get(receipt_number="R1").status, "MATCHED")
+        self.assertEqual(PaybillTransaction.objects.get(receipt_number="R2").match_method, "PHONE")
+        self.assertEqual(PaybillTransaction.objects.get(receipt_number="R3").status, "UNMATCHED")
+        self.assertEqual(PaybillTransaction.objects.get(receipt_number="OLD1").matched_loan, by_id)
+        by_id.refresh_from_db()
+        self.assertEqual(by_id.amount_paid, Decimal("1010"))
+        self.assertEqual(StatementImport.objects.get().uploaded_by, self.finance)
+
+        # Re-uploading once the customer is known matches the rows left UNMATCHED
+        UserProfiles.objects.filter(user=by_id.user).update(national_id="NOBODY")
+        PaymentMatchResolver._shared = None
+        again = self._upload(rows)["results"]
+        self.assertEqual((again["matched_national_id"], again["unmatched"], again["duplicates"]), (1, 0, 4))
+        self.assertEqual(PaybillTransaction.objects.get(receipt_number="R3").status, "MATCHED")
+        by_id.refresh_from_db()
+        self.assertEqual(by_id.amount_paid, Decimal("1310"))
+
+    @override_settings(BACKGROUND_JOB_PROCESSING="WORKER", BACKGROUND_JOB_RETRY_BACKOFF=0)
+    def test_retried_import_resumes_after_the_last_saved_chunk(self):
+        by_id = Loans.objects.select_related("user__profile").order_by("created_at").first()
+        national_id = by_id.user.profile.national_id
+        process_chunk = StatementImportService.process_chunk
+        calls = []
+
+        def flaky(job, chunk, seen, resolver):
+            calls.append(len(chunk))
+            if len(calls) == 2:
+                raise DatabaseError("connection lost")
+            process_chunk(job, chunk, seen, resolver)
+
+        with mock.patch.object(StatementImportService, "CHUNK_SIZE", 2), \
+                mock.patch.object(StatementImportService, "process_chunk", side_effect=flaky):
+            self._upload([f"S{n},0711111111,{national_id},100," for n in range(5)])
+            job = StatementImport.objects.get()
+            # The first attempt's worker dies on the second chunk
+            with self.assertRaises(DatabaseError):
+                StatementImportService.run(job.pk)
+            job.refresh_from_db()
+            self.assertEqual((job.status, job.processed_rows), ("FAILED", 2))
+            self.assertEqual(jobs.drain(workers=1), (1, 0))
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.processed_rows, job.matched_national_id), ("COMPLETED", 5, 5))
+        self.assertEqual(calls, [2, 2, 2, 1])
+        by_id.refresh_from_db()
+        self.assertEqual(by_id.amount_paid, Decimal("500"))
+
+
+class PaymentMatchResolverTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        PaymentMatchResolver._shared = None
+        make_portfolio(branches=1, officers_per_branch=1, loans_per_officer=2)
+        self.first, self.second = Loans.objects.select_related("user__profile").order_by("created_at")
+
+    def _callback(self, trans_id, bill_ref, msisdn="254700000000"):
+        response = APIClient().post("/api/payments/callback/", {
+            "TransID": trans_id, "BillRefNumber": bill_ref, "TransAmount": "100",
+            "MSISDN": msisdn, "TransTime": "20260101120000",
+        }, format="json")
+        self.assertEqual(response.status_code, 200)
+        return PaybillTransaction.objects.get(receipt_number=trans_id)
+
+    def test_resolves_loan_prefix_national_id_and_phone(self):
+        resolver = PaymentMatchResolver()
+        national_id = self.first.user.profile.national_id
+        self.assertEqual(resolver.resolve(self.second.id.hex[:10]), (self.second.id, "LOAN_ID"))
+        self.assertEqual(resolver.resolve(f" {national_id.lower()} "), (self.first.id, "NATIONAL_ID"))
+        self.assertEqual(
+            resolver.resolve("nobody", "+254" + self.second.user.phone[1:]), (self.second.id, "PHONE")
+        )
+        self.assertEqual(resolver.resolve("nobody", "0799999999"), (None, None))
+
+        resolver.discard(self.first.id)
+        self.assertEqual(resolver.resolve(national_id), (None, None))
+
+    def test_callback_matches_through_shared_index(self):
+        PaymentMatchResolver.shared()
+        with CaptureQueriesContext(connection) as ctx:
+            txn = self._callback("C2B1", self.first.user.profile.national_id.lower())
+        self.assertEqual((txn.status, txn.match_method, txn.matched_loan_id), ("MATCHED", "NATIONAL_ID", self.first.id))
+        self.assertFalse(any("UPPER" in q["sql"] for q in ctx.captured_queries))
+
+    def test_stale_index_falls_back_to_database(self):
+        PaymentMatchResolver.shared()
+        Loans.objects.filter(pk=self.first.pk).update(status="CLOSED")
+        txn = self._callback("C2B2", self.first.user.profile.national_id)
+        self.assertEqual(txn.status, "UNMATCHED")
+
+        # Changed behind the index's back: the miss is resolved through upper(national_id)
+        PaymentMatchResolver.shared()
+        UserProfiles.objects.filter(user=self.second.user).update(national_id="ab123")
+        with CaptureQueriesContext(connection) as ctx:
+            txn = self._callback("C2B3", "AB123")
+        self.assertEqual((txn.status, txn.match_method, txn.matched_loan_id), ("MATCHED", "NATIONAL_ID", self.second.id))
+        self.assertTrue(any("UPPER" in q["sql"] for q in ctx.captured_queries))
+
+        # A loan activated behind the index's back is found by its loan ID
+        Loans.objects.filter(pk=self.first.pk).update(status="ACTIVE")
+        txn = self._callback("C2B4", self.first.id.hex[:10])
+        self.assertEqual((txn.status, txn.match_method, txn.matched_loan_id), ("MATCHED", "LOAN_ID", self.first.id))
+
+    def test_database_fallback_matches_prefixes_past_the_first_hyphen(self):
+        with CaptureQueriesContext(connection) as ctx:
+            loan, method = PaymentMatchResolver._match_from_db(self.second.id.hex[:12].upper(), None)
+        self.assertEqual((loan, method), (self.second, "LOAN_ID"))
+        # The column itself is reduced to hex, not just the searched prefix
+        self.assertTrue(any('REPLACE(CAST("loans"."id"' in q["sql"] for q in ctx.captured_queries))
+
+    def test_changes_are_patched_into_the_shared_index(self):
+        index = PaymentMatchResolver.shared()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.first.status = "CLOSED"
+            self.first.save()
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertIs(PaymentMatchResolver.shared(), index)
+        # Only the closed loan's customer is re-read
+        self.assertEqual(sum("FROM \"loans\"" in q["sql"] for q in ctx.captured_queries), 1)
+        self.assertEqual(index.resolve(self.first.user.profile.national_id), (None, None))
+        self.assertEqual(index.resolve(self.second.id.hex), (self.second.id, "LOAN_ID"))
+
+
+class LoanListQueryCountTests(TestCase):
+    # count, loans (with the overdue annotation), documents, activities, guarantors
+    EXPECTED_QUERIES = 5
+
+    def setUp(self):
+        self.owner = Admins.objects.create(
+            full_name="Owner", email="owner@test.local", role="SUPER_ADMIN", password_hash="x", is_owner=True
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.owner)
+
+    def _decorate(self):
+        today = timezone.now().date()
+        for loan in Loans.objects.filter(documents__isnull=True).select_related("user"):
+            LoanDocuments.objects.create(loan=loan, name="ID", file_path="ids/x.png", doc_type="ID")
+            LoanActivity.objects.create(loan=loan, admin=self.owner, action="CREATED")
+            Guarantors.objects.create(user=loan.user, full_name="G", national_id="1", phone=f"G{loan.user.phone}")
+            RepaymentSchedule.objects.create(
+                loan=loan, installment_number=1, due_date=today - timedelta(days=3),
+                amount_due=Decimal("1250"), is_paid=False,
+            )
+
+    def _fetch(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get("/api/loans/", {"page_size": 50})
+        self.assertEqual(response.status_code, 200)
+        return response, len(ctx.captured_queries)
+
+    def test_query_count_is_fixed_per_page(self):
+        make_portfolio(branches=1, officers_per_branch=1, loans_per_officer=2)
+        self._decorate()
+        _, small = self._fetch()
+
+        make_portfolio(branches=3, officers_per_branch=2, loans_per_officer=3)
+        self._decorate()
+        response, large = self._fetch()
+
+        self.assertEqual(small, large)
+        self.assertEqual(large, self.EXPECTED_QUERIES)
+        self.assertEqual(len(response.data["results"]), 20)
+
+        row = response.data["results"][0]
+        loan = Loans.objects.get(pk=row["id"])
+        self.assertEqual(row["guarantor_phone"], loan.user.guarantors.first().phone)
+        self.assertEqual(row["overdue_duration"], loan.overdue_duration)
+        self.assertIsNotNone(row["overdue_duration"])
+        self.assertEqual(row["branch_name"], loan.user.profile.branch_fk.name)
+        self.assertEqual(row["activities"][0]["admin_name"], "Owner")
+
+
+class ManualRepaymentTests(TestCase):
+    def test_recording_a_repayment_updates_the_loan_and_schedule(self):
+        owner = Admins.objects.create(
+            full_name="Owner", email="owner@test.local", role="SUPER_ADMIN", password_hash="x", is_owner=True
+        )
+        make_portfolio(loans_per_officer=1)
+        loan = Loans.objects.get()
+        for n in (1, 2):
+            RepaymentSchedule.objects.create(
+                loan=loan, installment_number=n, due_date=timezone.now().date() + timedelta(weeks=n),
+                amount_due=Decimal("1000"), is_paid=False,
+            )
+        client = APIClient()
+        client.force_authenticate(user=owner)
+
+        response = client.post("/api/repayments/", {
+            "loan": str(loan.id), "amount_paid": "1000", "payment_method": "CASH", "reference_code": "MANUAL1",
+        }, format="json")
+
+        self.assertEqual(response.status_code, 201, response.data)
+        loan.refresh_from_db()
+        self.assertEqual(loan.amount_paid, Decimal("1000"))
+        self.assertEqual(
+            list(RepaymentSchedule.objects.filter(loan=loan).order_by("installment_number").values_list("is_paid", flat=True)),
+            [True, False],
+        )
+
+
+class CapitalLedgerTests(TestCase):
+    def setUp(self):
+        self.account, _ = SystemCapital.objects.update_or_create(
+            name="Simulation Capital", defaults={"balance": Decimal("1000")}
+        )
+
+    def _movements(self):
+        CapitalLedgerService.record_inflow(200, "REPAYMENT")
+        CapitalLedgerService.record_inflow(Decimal("50.50"), "REPAYMENT")
+        CapitalLedgerService.debit(300, note="Disbursement")
+        return CapitalLedgerService.available_balance()
+
+    def test_append_only_balance_matches_locked_mode(self):
+        with override_settings(CAPITAL_LEDGER_MODE="LOCKED"):
+            locked = self._movements()
+        LedgerEntry.objects.all().delete()
+        SystemCapital.objects.filter(pk=self.account.pk).update(balance=Decimal("1000"))
+
+        with override_settings(CAPITAL_LEDGER_MODE="APPEND_ONLY"):
+            append_only = self._movements()
+
+        self.assertEqual((locked, append_only), (Decimal("950.50"), Decimal("950.50")))
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.balance, Decimal("700"))
+        self.assertEqual(CapitalLedgerService.pending_total(self.account), Decimal("250.50"))
+
+    @override_settings(CAPITAL_LEDGER_MODE="APPEND_ONLY")
+    def test_debit_is_not_funded_by_pending_inflows(self):
+        CapitalLedgerService.record_inflow(500, "REPAYMENT")
+        self.assertEqual(CapitalLedgerService.available_balance(), Decimal("1500"))
+
+        with self.assertRaises(InsufficientCapitalError):
+            CapitalLedgerService.debit(1200)
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.balance, Decimal("1000"))
+        self.assertFalse(LedgerEntry.objects.filter(entry_type="DISBURSEMENT").exists())
+
+        CapitalLedgerService.compact()
+        self.assertEqual(CapitalLedgerService.debit(1200), Decimal("300"))
+
+    @override_settings(CAPITAL_LEDGER_MODE="APPEND_ONLY")
+    def test_compact_folds_only_the_entries_it_saw(self):
+        CapitalLedgerService.record_inflow(100, "REPAYMENT")
+        CapitalLedgerService.record_inflow(200, "REPAYMENT")
+        signed_total = CapitalLedgerService._signed_total
+
+        def late_commit(entries):
+            # Another repayment lands while compact() holds the row lock
+            CapitalLedgerService.record_inflow(70, "REPAYMENT")
+            return signed_total(entries)
+
+        with mock.patch.object(CapitalLedgerService, "_signed_total", side_effect=late_commit):
+            self.assertEqual(CapitalLedgerService.compact(), (2, Decimal("300")))
+
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.balance, Decimal("1300"))
+        self.assertEqual(
+            list(LedgerEntry.objects.filter(is_compacted=False).values_list("amount", flat=True)), [Decimal("70")]
+        )
+        self.assertEqual(CapitalLedgerService.available_balance(), Decimal("1370"))
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        self.owner = Admins.objects.create(
+            full_name="Owner", email="owner@test.local", role="SUPER_ADMIN", password_hash="x", is_owner=True
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.owner)
+        now = timezone.now()
+        # Ties on created_at must be broken by id without skipping rows
+        for n in range(25):
+            AuditLogs.objects.create(
+                action=f"log {n}", table_name="test", admin=self.owner, created_at=now - timedelta(minutes=n // 3)
+            )
+
+    def test_walks_every_row_once_in_order(self):
+        seen, url = [], "/api/audit-logs/?cursor=&page_size=10"
+        while url:
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertFalse(any("COUNT(" in q["sql"].upper() for q in ctx.captured_queries))
+            self.assertIsNone(response.data["count"])
+            seen.extend(response.data["results"])
+            url = response.data["links"]["next"]
+
+        expected = list(AuditLogs.objects.order_by("-created_at", "-id").values_list("id", flat=True))
+        self.assertEqual([row["id"] for row in seen], [str(i) for i in expected])
+
+    def test_previous_link_and_exact_count(self):
+        first = self.client.get("/api/audit-logs/", {"cursor": "", "page_size": 10, "count": "exact"}).data
+        self.assertEqual(first["count"], 25)
+        self.assertFalse(first["count_is_estimate"])
+        self.assertIsNone(first["links"]["previous"])
+
+        second = self.client.get(first["links"]["next"]).data
+        back = self.client.get(second["links"]["previous"]).data
+        self.assertEqual(back["results"], first["results"])
+        self.assertIsNone(back["links"]["previous"])
+
+        self.assertEqual(self.client.get("/api/audit-logs/", {"cursor": "garbage"}).status_code, 404)
+        tampered = base64.urlsafe_b64encode(json.dumps({"v": None, "id": "not-a-uuid"}).encode()).decode()
+        self.assertEqual(self.client.get("/api/audit-logs/", {"cursor": tampered}).status_code, 404)
+
+    def test_keyset_order_has_no_null_handling_on_not_null_columns(self):
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get("/api/audit-logs/", {"cursor": "", "page_size": 5})
+        page = next(q["sql"] for q in ctx.captured_queries if "audit_logs" in q["sql"] and "LIMIT" in q["sql"])
+        self.assertNotIn("IS NULL", page.upper())
+
+    def test_page_number_mode_is_unchanged(self):
+        response = self.client.get("/api/audit-logs/", {"page": 2})
+        self.assertEqual(response.data["count"], 25)
+        self.assertEqual(response.data["current_page"], 2)
+
+
+class AuditSinkTests(TestCase):
+    def setUp(self):
+        self.outbox = tempfile.mkdtemp()
+        overrides = override_settings(
+            AUDIT_LOG_MODE="STRICT", AUDIT_OUTBOX_DIR=self.outbox, AUDIT_FLUSH_INTERVAL=3600, AUDIT_BATCH_SIZE=1000
+        )
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        self.admin = Admins.objects.create(full_name="A", email="a@test.local", role="ADMIN", password_hash="x")
+
+    def test_strict_mode_batches_only_non_critical_entries(self):
+        audit.record_audit(admin=self.admin, action="status", log_type="STATUS", table_name="loans")
+        audit.record_audit(admin=self.admin, action="general", table_name="loans", new_data={"amount": Decimal("1.50")})
+        self.assertEqual(list(AuditLogs.objects.values_list("action", flat=True)), ["status"])
+
+        self.assertEqual(audit.audit_sink.flush(), 1)
+        log = AuditLogs.objects.get(action="general")
+        self.assertEqual((log.admin, log.log_type, log.new_data), (self.admin, "GENERAL", {"amount": "1.50"}))
+
+    def test_failed_flush_goes_to_outbox_and_replays_once(self):
+        audit.record_audit(sync=False, admin=None, action="threat", log_type="SECURITY", table_name="admins")
+        audit.record_audit(admin=self.admin, action="general", table_name="loans")
+        self.assertEqual([f.endswith(".open") for f in os.listdir(self.outbox)], [True])
+
+        with mock.patch.object(AuditLogs.objects, "bulk_create", side_effect=DatabaseError("down")):
+            self.assertEqual(audit.audit_sink.flush(), 0)
+        self.assertFalse(AuditLogs.objects.exists())
+        self.assertEqual([f.endswith(".pending") for f in os.listdir(self.outbox)], [True])
+
+        self.assertEqual(audit.replay_outbox(), (1, 2))
+        self.assertEqual(sorted(AuditLogs.objects.values_list("action", flat=True)), ["general", "threat"])
+        self.assertEqual(audit.replay_outbox(), (0, 0))
+
+    @override_settings(AUDIT_LOG_MODE="ASYNC", AUDIT_OUTBOX_DIR="")
+    def test_without_outbox_critical_entries_are_inline_and_failed_batches_retried(self):
+        audit.record_audit(admin=None, action="threat", log_type="SECURITY", table_name="admins")
+        audit.record_audit(admin=self.admin, action="general", table_name="loans")
+        self.assertEqual(list(AuditLogs.objects.values_list("action", flat=True)), ["threat"])
+
+        with mock.patch.object(AuditLogs.objects, "bulk_create", side_effect=DatabaseError("down")):
+            self.assertEqual(audit.audit_sink.flush(), 0)
+        self.assertEqual(os.listdir(self.outbox), [])
+        self.assertEqual(audit.audit_sink.flush(), 1)
+        self.assertEqual(sorted(AuditLogs.objects.values_list("action", flat=True)), ["general", "threat"])
+
+
+class LogRetentionTests(TestCase):
+    def test_month_arithmetic(self):
+        from datetime import date
+        self.assertEqual(partitions.add_months(date(2026, 11, 1), 3), date(2027, 2, 1))
+        self.assertEqual(partitions.add_months(date(2026, 1, 1), -1), date(2025, 12, 1))
+        self.assertEqual(partitions.partition_name("audit_logs", date(2026, 2, 1)), "audit_logs_p202602")
+
+    def test_purge_without_partitions_deletes_expired_rows(self):
+        now = timezone.now()
+        for action, age in (("SYSTEM_START", 40), ("LOGIN", 40), ("LOGIN", 100)):
+            AuditLogs.objects.create(action=action, table_name="system", created_at=now - timedelta(days=age))
+        SMSLog.objects.create(recipient_phone="0700000000", message="x", type="NOTICE", created_at=now - timedelta(days=100))
+        EmailLog.objects.create(recipient_email="a@test.local", subject="s", message="m", created_at=now - timedelta(days=5))
+
+        call_command("purge_old_logs", batch_size=1, stdout=io.StringIO())
+
+        self.assertEqual(list(AuditLogs.objects.values_list("action", flat=True)), ["LOGIN"])
+        self.assertFalse(SMSLog.objects.exists())
+        self.assertEqual(EmailLog.objects.count(), 1)
+
+    def test_audit_list_is_bounded_by_since(self):
+        owner = Admins.objects.create(
+            full_name="Owner", email="owner@test.local", role="SUPER_ADMIN", password_hash="x", is_owner=True
+        )
+        now = timezone.now()
+        for age in (1, 10, 200):
+            AuditLogs.objects.create(action=f"age {age}", table_name="system", admin=owner, created_at=now - timedelta(days=age))
+        client = APIClient()
+        client.force_authenticate(user=owner)
+        response = client.get("/api/audit-logs/", {"since": (now - timedelta(days=5)).date().isoformat()})
+        self.assertEqual([row["action"] for row in response.data["results"]], ["age 1"])
+        self.assertEqual(client.get("/api/audit-logs/").data["count"], 2)
+        self.assertEqual(client.get("/api/audit-logs/", {"since": "2026-02-30"}).status_code, 400)
+
+
+@unittest.skipUnless(connection.vendor == "postgresql", "log partitioning only applies to PostgreSQL")
+class PostgresPartitionTests(TransactionTestCase):
+    # Not TestCase: ATTACH/DETACH PARTITION refuse to run while the deferred
+    # foreign key checks of rows inserted in the same transaction are pending
+
+    def _count(self, table):
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT count(*) FROM "{table}"')
+            return cursor.fetchone()[0]
+
+    def _indexes(self, table):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT indexname, indexdef FROM pg_indexes WHERE tablename = %s", [table])
+            return dict(cursor.fetchall())
+
+    def _has_trigram(self, table):
+        return any("gin_trgm_ops" in definition for definition in self._indexes(table).values())
+
+    def _drop_probe(self):
+        with connection.cursor() as cursor:
+            cursor.execute("DROP TABLE IF EXISTS probe_logs CASCADE")
+
+    def test_migration_partitions_a_table_with_existing_rows(self):
+        self.addCleanup(self._drop_probe)
+        admin = Admins.objects.create(full_name="A", email="a@test.local", role="ADMIN", password_hash="x")
+        now = timezone.now()
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                "CREATE TABLE probe_logs (id uuid PRIMARY KEY, created_at timestamptz NULL, message text, "
+                "admin_id uuid NULL REFERENCES admins (id) DEFERRABLE INITIALLY DEFERRED)"
+            )
+            cursor.execute("CREATE INDEX probe_logs_message_idx ON probe_logs (message)")
+            for age in (0, 40, 400, None):
+                cursor.execute(
+                    "INSERT INTO probe_logs VALUES (%s, %s, %s, %s)",
+                    [uuid.uuid4(), None if age is None else now - timedelta(days=age), f"age {age}", admin.id],
+                )
+        with transaction.atomic(), connection.cursor() as cursor:
+            partitions.partition_existing_table(cursor, "probe_logs")
+            months = partitions.list_partitions(cursor, "probe_logs")
+
+        self.assertTrue(partitions.is_partitioned("probe_logs"))
+        self.assertEqual(self._count("probe_logs"), 4)
+        self.assertEqual(self._count("probe_logs_default"), 0)
+        oldest = partitions.month_start(now - timedelta(days=400))
+        self.assertEqual(min(months), oldest)
+        self.assertEqual(max(months), partitions.add_months(partitions.month_start(now), 3))
+        self.assertIn("probe_logs_message_idx", self._indexes("probe_logs"))
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT count(*) FROM pg_constraint WHERE conrelid = 'probe_logs'::regclass AND contype = 'f'")
+            self.assertEqual(cursor.fetchone()[0], 1)
+
+        retired = partitions.retire_partitions("probe_logs", now - timedelta(days=100))
+        self.assertIn(partitions.partition_name("probe_logs", oldest), retired)
+        self.assertEqual(self._count("probe_logs"), 3)
+
+    def test_log_tables_are_partitioned_with_their_search_indexes(self):
+        import importlib
+        trigram = importlib.import_module("apps.migrations.0061_search_trigram_indexes")
+        for table in partitions.PARTITIONED_TABLES:
+            self.assertTrue(partitions.is_partitioned(table), table)
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+            if cursor.fetchone() is None:
+                self.skipTest("pg_trgm is not installed")
+        for name, table, _ in trigram.TRIGRAM_INDEXES:
+            if table in partitions.PARTITIONED_TABLES:
+                self.assertIn(name, self._indexes(table))
+
+    def test_purge_retires_old_partitions_and_default_stragglers(self):
+        now = timezone.now()
+        old, recent = now - timedelta(days=400), now - timedelta(days=1)
+
+        def seed(created_at):
+            AuditLogs.objects.create(action="LOGIN", table_name="system", created_at=created_at)
+            SMSLog.objects.create(recipient_phone="0700000000", message="x", type="NOTICE", created_at=created_at)
+            EmailLog.objects.create(recipient_email="a@test.local", subject="s", message="m", created_at=created_at)
+
+        seed(old)
+        seed(recent)
+        for table in partitions.PARTITIONED_TABLES:
+            # The old rows landed in the default partition and move into their month
+            self.assertTrue(partitions.ensure_partitions(table, first_month=partitions.month_start(old)))
+            self.assertEqual(self._count(f"{table}_default"), 0)
+        old_partition = partitions.partition_name("email_logs", partitions.month_start(old))
+        self.assertEqual(self._count(old_partition), 1)
+
+        call_command("purge_old_logs", days=90, stdout=io.StringIO())
+
+        for model in (AuditLogs, SMSLog, EmailLog):
+            self.assertEqual(list(model.objects.values_list("created_at", flat=True)), [recent])
+        with connection.cursor() as cursor:
+            months = partitions.list_partitions(cursor, "email_logs")
+        self.assertNotIn(partitions.month_start(old), months)
+        # Attached by create_partition() above, so it has to inherit the 0061 search indexes
+        attached = months[partitions.add_months(partitions.month_start(now), -1)]
+        self.assertEqual(self._has_trigram(attached), self._has_trigram("email_logs"))
+
+        # Written after its month was dropped, so it sits in the default partition
+        seed(old)
+        self.assertEqual(self._count("audit_logs_default"), 1)
+        call_command("purge_old_logs", days=90, stdout=io.StringIO())
+        self.assertEqual(AuditLogs.objects.count(), 1)
+        self.assertEqual(self._count("audit_logs_default"), 0)
+
+
+@override_settings(AUTH_CACHE_PRINCIPALS="true")
+class PrincipalCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.owner = Admins.objects.create(
+            full_name="Owner", email="owner@test.local", role="SUPER_ADMIN", password_hash="x", is_owner=True
+        )
+        self.officer = Admins.objects.create(
+            full_name="Officer", email="officer@test.local", role="FIELD_OFFICER", password_hash="secret"
+        )
+        self.request = APIRequestFactory().get(
+            "/api/", HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(self.officer)}"
+        )
+
+    def test_warm_cache_authenticates_without_queries(self):
+        auth = CustomJWTAuthentication()
+        auth.authenticate(self.request)
+        with CaptureQueriesContext(connection) as ctx:
+            user, _ = auth.authenticate(self.request)
+        self.assertEqual(len(ctx.captured_queries), 0)
+        self.assertEqual((user.pk, user.role), (self.officer.pk, "FIELD_OFFICER"))
+        self.assertNotIn("secret", cache.get(f"auth:principal:{self.officer.pk}"))
+        self.assertEqual(user.password_hash, "secret")
+
+    @override_settings(AUTH_CACHE_PRINCIPALS="auto")
+    def test_process_local_cache_reads_the_principal_every_time(self):
+        auth = CustomJWTAuthentication()
+        auth.authenticate(self.request)
+        Admins.objects.filter(pk=self.officer.pk).update(is_blocked=True)
+        with mock.patch("apps.authentication.record_audit"), self.assertRaises(AuthenticationFailed):
+            auth.authenticate(self.request)
+        self.assertIsNone(cache.get(f"auth:principal:{self.officer.pk}"))
+
+    @override_settings(AUDIT_LOG_MODE="ASYNC", AUDIT_OUTBOX_DIR="")
+    def test_threat_log_is_inserted_inline_without_an_outbox(self):
+        Admins.objects.filter(pk=self.officer.pk).update(is_blocked=True)
+        with self.assertRaises(AuthenticationFailed):
+            CustomJWTAuthentication().authenticate(self.request)
+        threat = AuditLogs.objects.get(log_type="SECURITY")
+        self.assertEqual((threat.admin_id, threat.new_data["path"]), (self.officer.pk, "/api/"))
+
+    def test_suspend_invalidates_cached_principal(self):
+        auth = CustomJWTAuthentication()
+        auth.authenticate(self.request)
+        client = APIClient()
+        client.force_authenticate(user=self.owner)
+        response = client.post(f"/api/admins/{self.officer.pk}/suspend/", {"reason": "audit"})
+        self.assertEqual(response.status_code, 200)
+        with mock.patch("apps.authentication.record_audit") as threat_log, self.assertRaises(AuthenticationFailed):
+            auth.authenticate(self.request)
+        self.assertIn("Blocked user", threat_log.call_args.kwargs["action"])
+
+    def test_maintenance_schedule_is_cached_parsed(self):
+        from .models import SecureSettings
+        from .utils.encryption import encrypt_value
+        auth = CustomJWTAuthentication()
+        auth.authenticate(self.request)
+        SecureSettings.objects.create(key="maintenance_schedule_time", encrypted_value=encrypt_value("2020-01-01T08:00"))
+        SecureSettings.objects.create(key="maintenance_mode_active", encrypted_value=encrypt_value("true"))
+        active, scheduled_at = get_maintenance_state()
+        self.assertTrue(active and timezone.is_aware(scheduled_at))
+        with self.assertRaises(AuthenticationFailed):
+            auth.authenticate(self.request)
+
+
+class SecureSettingsCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        encryption.settings_provider.clear()
+        for key, value, group in (
+            ("mpesa_consumer_key", "ck", "MPESA"),
+            ("mpesa_shortcode", "600000", "MPESA"),
+            ("mpesa_callback_url", "https://cb.test", "SYSTEM"),
+        ):
+            SecureSettings.objects.create(key=key, encrypted_value=encryption.encrypt_value(value), setting_group=group)
+
+    def test_handler_settings_load_once_per_process(self):
+        from .utils.mpesa import MpesaHandler
+        with CaptureQueriesContext(connection) as ctx:
+            handler = MpesaHandler()
+        self.assertEqual(len(ctx.captured_queries), 2)  # the MPESA group, then every row for misfiled keys
+        self.assertEqual((handler.consumer_key, handler.shortcode, handler.callback_url), ("ck", "600000", "https://cb.test"))
+        with CaptureQueriesContext(connection) as ctx:
+            MpesaHandler()
+        self.assertEqual(len(ctx.captured_queries), 0)
+        self.assertIs(encryption.get_cipher(), encryption.get_cipher())
+
+    def test_settings_view_bumps_version(self):
+        owner = Admins.objects.create(
+            full_name="Owner", email="owner@test.local", role="SUPER_ADMIN", password_hash="x", is_owner=True
+        )
+        self.assertEqual(encryption.get_setting("mpesa_shortcode"), "600000")
+        client = APIClient()
+        client.force_authenticate(user=owner)
+        response = client.post("/api/settings/secure/", {"key": "mpesa_shortcode", "encrypted_value": "174379"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(encryption.get_setting("mpesa_shortcode", group="mpesa"), "174379")
+        self.assertEqual(encryption.get_setting("missing_key", "fallback"), "fallback")
+
+
+class StubDarajaHandler(BaseHTTPRequestHandler):
+    """Minimal Daraja API: OAuth, STK push and B2C, with scripted failures."""
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        server = self.server
+        server.calls.append(("GET", self.path.split("?")[0], self.client_address))
+        if server.failures.get("oauth"):
+            server.failures["oauth"] -= 1
+            return self._reply(503, {"errorMessage": "busy"})
+        server.tokens += 1
+        self._reply(200, {"access_token": f"token-{server.tokens}", "expires_in": "3599"})
+
+    def do_POST(self):
+        server = self.server
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        server.calls.append(("POST", self.path, self.client_address))
+        if self.headers["Authorization"] != f"Bearer token-{server.tokens}" or server.failures.get("expire"):
+            server.failures["expire"] = 0
+            return self._reply(401, {"errorMessage": "Invalid Access Token"})
+        if body.get("PartyB") in server.failures.get("reject_phones", ()):
+            return self._reply(500, {"errorMessage": "Internal Server Error"})
+        if body.get("PartyB") in server.failures.get("slow_phones", ()):
+            # Accepted, but the answer arrives after the client gave up
+            time.sleep(server.failures["delay"])
+            self.close_connection = True
+            return
+        self._reply(200, {
+            "ResponseCode": "0", "OriginatorConversationID": body.get("OriginatorConversationID", "AG_1"),
+            "CheckoutRequestID": "ws_1",
+        })
+
+
+def start_stub_daraja(testcase):
+    """Serves StubDarajaHandler on a free local port and points MPESA_BASE_URL at it."""
+    encryption.settings_provider.clear()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubDarajaHandler)
+    server.calls, server.failures, server.tokens = [], {}, 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    testcase.addCleanup(server.server_close)
+    testcase.addCleanup(server.shutdown)
+    patcher = override_settings(MPESA_BASE_URL=f"http://127.0.0.1:{server.server_address[1]}")
+    patcher.enable()
+    testcase.addCleanup(patcher.disable)
+    return server
+
+
+@override_settings(MPESA_RETRY_BACKOFF=0, MPESA_SHORTCODE="174379", MPESA_PASSKEY="passkey")
+class DarajaClientTests(TestCase):
+    def setUp(self):
+        self.server = start_stub_daraja(self)
+
+    def test_token_is_fetched_once_over_pooled_connection(self):
+        from .utils.mpesa import MpesaHandler
+        self.assertEqual(MpesaHandler().b2c_disburse("0712345678", 1000)["ResponseCode"], "0")
+        self.assertEqual(MpesaHandler().b2c_disburse("0712345679", 1000)["ResponseCode"], "0")
+        self.assertEqual(MpesaHandler().stk_push("0712345678", 500, "ACC", "Repayment")["ResponseCode"], "0")
+        self.assertEqual([c[:2] for c in self.server.calls].count(("GET", "/oauth/v1/generate")), 1)
+        self.assertEqual(len({c[2] for c in self.server.calls}), 1)
+
+    def test_retries_oauth_and_refreshes_rejected_token(self):
+        from .utils.mpesa import MpesaHandler
+        self.server.failures.update(oauth=2, expire=1)
+        self.assertEqual(MpesaHandler().b2c_disburse("0712345678", 1000)["ResponseCode"], "0")
+        self.assertEqual([c[:2] for c in self.server.calls], [
+            ("GET", "/oauth/v1/generate"), ("GET", "/oauth/v1/generate"), ("GET", "/oauth/v1/generate"),
+            ("POST", "/mpesa/b2c/v3/paymentrequest"),
+            ("GET", "/oauth/v1/generate"), ("POST", "/mpesa/b2c/v3/paymentrequest"),
+        ])
+
+
+@override_settings(
+    DISBURSEMENT_MODE="LIVE", DISBURSEMENT_BATCH_WORKERS=1, DISBURSEMENT_BATCH_RATE=0, MPESA_RETRY_BACKOFF=0,
+    BACKGROUND_JOB_PROCESSING="WORKER",
+)
+class DisbursementBatchTests(TestCase):
+    def setUp(self):
+        self.server = start_stub_daraja(self)
+        self.capital, _ = SystemCapital.objects.update_or_create(
+            name="Simulation Capital", defaults={"balance": Decimal("100000")}
+        )
+        SystemSettings.objects.update_or_create(key="DAILY_OFFICER_DISBURSEMENT_LIMIT", defaults={"value": 12000})
+        self.finance = Admins.objects.create(
+            full_name="Finance", email="fo@test.local", role="FINANCIAL_OFFICER", password_hash="x"
+        )
+        product = LoanProducts.objects.create(
+            name="Test Loan", min_amount=1000, max_amount=50000, interest_rate=25, duration_weeks=4
+        )
+        self.loans = []
+        for n in range(3):
+            customer = Users.objects.create(full_name=f"Customer {n}", phone=f"07{n:08d}")
+            self.loans.append(Loans.objects.create(
+                user=customer, loan_product=product, principal_amount=Decimal("5000"),
+                interest_rate=25, duration_weeks=4, status="APPROVED",
+                created_at=timezone.now() - timedelta(minutes=10 - n),
+            ))
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.finance)
+
+    def test_bulk_reserves_capital_and_respects_daily_limit(self):
+        self.server.failures["reject_phones"] = ["254700000001"]
+        response = self.client.post("/api/payments/disburse/", {"mode": "bulk"}, format="json")
+        self.assertEqual(response.status_code, 202)
+        batch_id = response.data["batch_id"]
+        self.capital.refresh_from_db()
+        self.assertEqual(self.capital.balance, Decimal("90000"))
+        self.assertEqual(response.data["skipped"], 1)
+
+        self.assertEqual(jobs.drain(workers=1), (1, 0))
+
+        data = self.client.get(f"/api/payments/disburse/batches/{batch_id}/").data
+        self.assertEqual((data["status"], data["succeeded"], data["failed"], data["skipped"]), ("COMPLETED", 1, 1, 1))
+        self.assertEqual([r["status"] for r in data["results"]], ["success", "failed", "skipped"])
+        first, second, third = (Loans.objects.get(pk=loan.pk) for loan in self.loans)
+        self.assertEqual((first.status, first.mpesa_disbursement_status), ("DISBURSED", "PENDING"))
+        self.assertEqual((second.status, second.mpesa_disbursement_status), ("APPROVED", "FAILED"))
+        self.assertEqual((third.status, third.mpesa_disbursement_status), ("APPROVED", None))
+        self.capital.refresh_from_db()
+        self.assertEqual(self.capital.balance, Decimal("95000"))
+        self.assertEqual(DisbursementService.disbursed_today(self.finance), 5000)
+        self.assertEqual(
+            [c[1] for c in self.server.calls].count("/mpesa/b2c/v3/paymentrequest"), 2
+        )
+
+    def test_lost_worker_never_resubmits_and_batch_can_be_released(self):
+        from .models import DisbursementBatch
+        batch = DisbursementBatchService.create(self.finance, self.loans[:2])
+        sending, reserved = batch.items.order_by("loan__created_at")
+        # The worker died after marking the first loan SENDING
+        sending.status = "SENDING"
+        sending.save()
+        DisbursementBatch.objects.filter(pk=batch.pk).update(status="RUNNING", created_at=timezone.now() - timedelta(hours=1))
+        BackgroundJob.objects.all().delete()
+
+        call_command("release_disbursement_batches", stdout=io.StringIO())
+        jobs.drain(workers=1)
+        self.assertEqual([c[1] for c in self.server.calls].count("/mpesa/b2c/v3/paymentrequest"), 1)
+        batch.refresh_from_db()
+        self.assertEqual((batch.status, batch.succeeded), ("FAILED", 1))
+
+        call_command(
+            "release_disbursement_batches", batch=[str(batch.pk)], release=True, include_unconfirmed=True,
+            stdout=io.StringIO(),
+        )
+        sending.refresh_from_db()
+        self.assertEqual(sending.status, "FAILED")
+        self.assertEqual(Loans.objects.get(pk=sending.loan_id).mpesa_disbursement_status, "FAILED")
+        self.capital.refresh_from_db()
+        self.assertEqual(self.capital.balance, Decimal("95000"))
+
+    @override_settings(MPESA_READ_TIMEOUT=0.2)
+    def test_unanswered_request_keeps_the_reservation_and_claim(self):
+        self.server.failures.update(slow_phones=["254700000001"], delay=0.5)
+        batch = DisbursementBatchService.create(self.finance, self.loans[:2])
+        DisbursementBatchService.run(batch.pk)
+
+        batch.refresh_from_db()
+        self.assertEqual((batch.status, batch.succeeded, batch.failed), ("FAILED", 1, 0))
+        unanswered = batch.items.get(loan=self.loans[1])
+        self.assertEqual(
+            (unanswered.status, unanswered.error), ("SENDING", DisbursementBatchService.UNCONFIRMED_NO_ANSWER)
+        )
+        self.assertEqual(Loans.objects.get(pk=self.loans[1].pk).mpesa_disbursement_status, "QUEUED")
+        self.capital.refresh_from_db()
+        self.assertEqual(self.capital.balance, Decimal("90000"))
+
+        # Neither a retried job nor another batch submits the loan again
+        DisbursementBatchService.process_item(unanswered.pk)
+        retry = DisbursementBatchService.create(self.finance, [self.loans[1]])
+        self.assertEqual(retry.items.get().error, DisbursementBatchService.SKIP_NOT_APPROVED)
+        self.assertEqual([c[1] for c in self.server.calls].count("/mpesa/b2c/v3/paymentrequest"), 2)
+
+
+class MpesaCallbackInboxTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        PaymentMatchResolver._shared = None
+        make_portfolio(branches=1, officers_per_branch=1, loans_per_officer=1)
+        self.loan = Loans.objects.select_related("user__profile").get()
+        self.payload = {
+            "TransID": "QGH1", "BillRefNumber": self.loan.user.profile.national_id, "TransAmount": "100",
+            "MSISDN": "254700000000", "TransTime": "20260101120000",
+        }
+
+    def _post(self, payload):
+        response = APIClient().post("/api/payments/callback/", payload, format="json")
+        self.assertEqual(response.data, {"ResultCode": 0, "ResultDesc": "Accepted"})
+
+    def test_redelivered_callback_is_applied_once(self):
+        self._post(self.payload)
+        self._post(self.payload)
+        self.assertEqual(MpesaCallback.objects.get().status, "PROCESSED")
+        self.assertEqual(Repayments.objects.filter(reference_code="QGH1").count(), 1)
+
+    @override_settings(MPESA_CALLBACK_PROCESSING="WORKER")
+    def test_worker_drains_and_replay_retries_failures(self):
+        self._post(self.payload)
+        self.assertFalse(PaybillTransaction.objects.exists())
+        with mock.patch("apps.repayments.views.normalize_phone", side_effect=DatabaseError("down")):
+            call_command("process_mpesa_callbacks", workers=1, stdout=io.StringIO())
+        callback = MpesaCallback.objects.get()
+        self.assertEqual((callback.status, callback.attempts, callback.last_error), ("FAILED", 1, "down"))
+        self.assertFalse(PaybillTransaction.objects.exists())
+
+        call_command("replay_mpesa_callbacks", stdout=io.StringIO())
+        callback.refresh_from_db()
+        self.assertEqual((callback.status, callback.attempts), ("PROCESSED", 2))
+        self.assertEqual(PaybillTransaction.objects.get().status, "MATCHED")
+        with self.assertRaises(CommandError):
+            call_command("replay_mpesa_callbacks", "C2B:QGH1", stdout=io.StringIO())
+
+    @override_settings(MPESA_CALLBACK_PROCESSING="JOB", BACKGROUND_JOB_PROCESSING="WORKER", BACKGROUND_JOB_RETRY_BACKOFF=0)
+    def test_job_mode_applies_and_retries_on_the_job_queue(self):
+        self._post(self.payload)
+        job = BackgroundJob.objects.get(task="mpesa.callback")
+        with mock.patch("apps.repayments.views.normalize_phone", side_effect=DatabaseError("down")):
+            self.assertEqual(jobs.drain(workers=1), (0, 1))
+        self.assertEqual(jobs.drain(workers=1), (1, 0))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ("SUCCEEDED", 2))
+        self.assertEqual(MpesaCallback.objects.get().status, "PROCESSED")
+        self.assertEqual(PaybillTransaction.objects.get().status, "MATCHED")
+
+    def test_matching_error_fails_the_callback_instead_of_queueing_unmatched(self):
+        with mock.patch.object(PaymentMatchResolver, "match_loan", side_effect=DatabaseError("down")):
+            self._post(self.payload)
+        self.assertEqual(MpesaCallback.objects.get().status, "FAILED")
+        self.assertFalse(PaybillTransaction.objects.exists())
+
+        call_command("replay_mpesa_callbacks", stdout=io.StringIO())
+        self.assertEqual(PaybillTransaction.objects.get().status, "MATCHED")
+
+    def test_replayed_b2c_failure_reverses_capital_once(self):
+        capital, _ = SystemCapital.objects.update_or_create(name="Simulation Capital", defaults={"balance": Decimal("1000")})
+        Loans.objects.filter(pk=self.loan.pk).update(
+            status="DISBURSED", mpesa_disbursement_status="PENDING", mpesa_originator_id="OR1"
+        )
+        payload = {"Result": {"ResultCode": 2001, "ResultDesc": "Declined", "OriginatorConversationID": "OR1"}}
+        self._post(payload)
+        # A concurrent replay that looked the loan up before it was released
+        Loans.objects.filter(pk=self.loan.pk).update(mpesa_originator_id="OR1")
+        call_command("replay_mpesa_callbacks", "B2C:OR1", force=True, stdout=io.StringIO())
+
+        capital.refresh_from_db()
+        self.assertEqual(capital.balance, Decimal("1000") + self.loan.principal_amount)
+        self.assertEqual(LoanActivity.objects.filter(loan=self.loan, action="DISBURSEMENT_FAILED").count(), 1)
+
+
+class BackgroundJobTests(TestCase):
+    def setUp(self):
+        self.calls = []
+
+        def flaky(n):
+            self.calls.append(n)
+            raise RuntimeError("provider down")
+
+        jobs.TASKS["tests.flaky"] = flaky
+        self.addCleanup(jobs.TASKS.pop, "tests.flaky")
+
+    @override_settings(BACKGROUND_JOB_PROCESSING="WORKER", BACKGROUND_JOB_RETRY_BACKOFF=30)
+    def test_failures_back_off_then_dead_letter(self):
+        job = jobs.enqueue("tests.flaky", {"n": 1}, max_attempts=2)
+        self.assertEqual(self.calls, [])
+
+        self.assertEqual(jobs.drain(workers=1), (0, 1))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ("RETRY", 1))
+        self.assertGreater(job.run_at, timezone.now() + timedelta(seconds=25))
+        self.assertEqual(jobs.drain(workers=1), (0, 0))
+
+        BackgroundJob.objects.filter(pk=job.pk).update(run_at=timezone.now())
+        jobs.drain(workers=1)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts, self.calls), ("DEAD", 2, [1, 1]))
+        self.assertEqual(
+            list(job.runs.order_by("attempt").values_list("outcome", flat=True)), ["FAILED", "DEAD"]
+        )
+
+        call_command("run_jobs", retry_dead=True, stdout=io.StringIO())
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ("RETRY", 0))
+
+    def test_stale_running_job_is_requeued(self):
+        job = BackgroundJob.objects.create(
+            task="sms.send", status="RUNNING", locked_at=timezone.now() - timedelta(hours=1)
+        )
+        self.assertEqual(jobs.requeue_stale(), 1)
+        job.refresh_from_db()
+        self.assertEqual(job.status, "RETRY")
+
+    def test_side_effects_run_as_jobs(self):
+        with mock.patch("apps.utils.sms.SMSHandler.send_sms", return_value={"status": "success"}) as send:
+            send_sms_async("+254700000000", "Hello")
+        send.assert_called_once_with(["+254700000000"], "Hello")
+
+        admin = Admins.objects.create(full_name="Owner", email="owner@test.local", role="ADMIN", password_hash="x")
+        env = {"BREVO_API_KEY": "key", "FROM_EMAIL": "noreply@test.local"}
+        with mock.patch.dict(os.environ, env), mock.patch("apps.utils.sms.requests.post") as post:
+            post.return_value.status_code = 201
+            notif = create_staff_notification(admin, "CAPITAL_LOW", "Capital low", "Top up", send_email=True)
+        notif.refresh_from_db()
+        self.assertTrue(notif.email_sent)
+        self.assertEqual(EmailLog.objects.get().status, "SENT")
+        self.assertEqual(
+            sorted(BackgroundJob.objects.values_list("task", "status")),
+            [("email.staff_notification", "SUCCEEDED"), ("sms.send", "SUCCEEDED")],
+        )
+
+
+@override_settings(SMS_BROADCAST_BATCH_SIZE=2, SMS_BROADCAST_RATE=0)
+class SMSBroadcastTests(TestCase):
+    def setUp(self):
+        make_portfolio(branches=1, officers_per_branch=1, loans_per_officer=4)
+        Users.objects.create(full_name="No Phone", phone="")
+        self.admin = Admins.objects.get(role="ADMIN")
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.admin)
+        self.sent = []
+
+        def send_sms(recipients, message):
+            self.sent.append((recipients, message))
+            if recipients[0] == "0700000002":
+                return {"status": "error", "message": "Provider Error"}
+            return {"status": "success"}
+
+        patcher = mock.patch("apps.utils.sms.SMSHandler.send_sms", side_effect=send_sms)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_notice_is_batched_and_logged(self):
+        response = self.client.post("/api/loans/bulk-sms-defaulters/", {"type": "NOTICE", "message": "Office closed"}, format="json")
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(sorted(len(r) for r, _ in self.sent), [2, 2])
+
+        data = self.client.get(f"/api/loans/bulk-sms-defaulters/{response.data['broadcast_id']}/").data
+        self.assertEqual(
+            (data["broadcast_status"], data["total_recipients"], data["sent"], data["failed"], data["batches"], data["progress"]),
+            ("COMPLETED", 4, 2, 2, 2, 100),
+        )
+        self.assertEqual(SMSLog.objects.filter(type="NOTICE", status="FAILED").count(), 2)
+
+    def test_provider_numbers_are_matched_to_stored_phones(self):
+        def send_sms(recipients, message):
+            return {"SMSMessageData": {"Recipients": [
+                {"number": "+254" + phone[-9:], "status": "Success" if phone.endswith("1") else "InvalidPhoneNumber"}
+                for phone in recipients
+            ]}}
+
+        with mock.patch("apps.utils.sms.SMSHandler.send_sms", side_effect=send_sms):
+            response = self.client.post(
+                "/api/loans/bulk-sms-defaulters/", {"type": "NOTICE", "message": "Office closed"}, format="json"
+            )
+        data = self.client.get(f"/api/loans/bulk-sms-defaulters/{response.data['broadcast_id']}/").data
+        self.assertEqual((data["sent"], data["failed"]), (1, 3))
+        self.assertEqual(
+            list(SMSLog.objects.filter(type="NOTICE", status="SENT").values_list("recipient_phone", flat=True)),
+            ["0700000001"],
+        )
+
+    def test_defaulter_messages_are_personalised(self):
+        response = self.client.post("/api/loans/bulk-sms-defaulters/", {"type": "DEFAULTERS"}, format="json")
+        self.assertEqual(response.data["sent"], 2)
+        self.assertEqual([len(r) for r, _ in self.sent], [1, 1])
+        self.assertTrue(all("KES 5,000.00 is OVERDUE" in text for _, text in self.sent))
+        self.assertEqual(SMSLog.objects.filter(type="DEFAULTER").count(), 2)
+
+
+class CheckOverdueBulkTests(TestCase):
+    def setUp(self):
+        SystemSettings.objects.update_or_create(key="OVERDUE_PENALTY_RATE", defaults={"value": "5"})
+        self.officer = Admins.objects.create(
+            full_name="Officer", email="off@test.local", role="FIELD_OFFICER", password_hash="x"
+        )
+        self.product = LoanProducts.objects.create(
+            name="Test Loan", min_amount=1000, max_amount=50000, interest_rate=25, duration_weeks=4
+        )
+
+    def _loan(self, status, disbursed_days_ago, due_in_days=None):
+        customer = Users.objects.create(full_name="Customer", phone=f"07{Users.objects.count():08d}")
+        loan = Loans.objects.create(
+            user=customer, loan_product=self.product, principal_amount=Decimal("5000"), interest_rate=25,
+            duration_weeks=4, status=status, created_by=self.officer,
+            disbursed_at=timezone.now() - timedelta(days=disbursed_days_ago),
+        )
+        if due_in_days is not None:
+            RepaymentSchedule.objects.create(
+                loan=loan, installment_number=1, due_date=timezone.localdate() + timedelta(days=due_in_days),
+                amount_due=Decimal("1250"), is_paid=False,
+            )
+        return loan
+
+    def _run(self):
+        call_command("check_overdue", "--bulk", "--chunk-size", "2", stdout=io.StringIO())
+
+    def _status(self, loan):
+        loan.refresh_from_db()
+        return loan.status
+
+    def test_marks_due_loans_once_and_notifies_each_officer_once(self):
+        missed_installment = self._loan("ACTIVE", disbursed_days_ago=10, due_in_days=-3)
+        tenure_over = self._loan("DISBURSED", disbursed_days_ago=40)
+        not_due = self._loan("ACTIVE", disbursed_days_ago=10, due_in_days=4)
+        already = self._loan("OVERDUE", disbursed_days_ago=40, due_in_days=-12)
+
+        self._run()
+
+        self.assertEqual(
+            [self._status(loan) for loan in (missed_installment, tenure_over, not_due, already)],
+            ["OVERDUE", "OVERDUE", "ACTIVE", "OVERDUE"],
+        )
+        self.assertEqual(
+            (missed_installment.base_interest_rate, missed_installment.interest_rate), (Decimal("25"), Decimal("30"))
+        )
+        marked = AuditLogs.objects.filter(action__endswith="automatically marked OVERDUE")
+        self.assertEqual(set(marked.values_list("record_id", flat=True)), {missed_installment.id, tenure_over.id})
+        self.assertEqual(StaffNotification.objects.filter(notification_type="CUSTOMER_OVERDUE").count(), 1)
+
+        # The next run picks up a newly due loan without alerting the officer again
+        RepaymentSchedule.objects.filter(loan=not_due).update(due_date=timezone.localdate() - timedelta(days=1))
+        self._run()
+        self.assertEqual(self._status(not_due), "OVERDUE")
+        self.assertEqual(marked.count(), 3)
+        self.assertEqual(StaffNotification.objects.filter(notification_type="CUSTOMER_OVERDUE").count(), 1)
+
+
+class GenerateNotificationsTests(TestCase):
+    def setUp(self):
+        SystemCapital.objects.update_or_create(name="Simulation Capital", defaults={"balance": Decimal("1000000")})
+
+    def _sweep(self):
+        with CaptureQueriesContext(connection) as ctx:
+            call_command("generate_notifications", stdout=io.StringIO())
+        return len(ctx.captured_queries)
+
+    def test_sweep_is_set_based_and_deduplicated(self):
+        make_portfolio(branches=1, officers_per_branch=1, loans_per_officer=10)
+        small = self._sweep()
+        StaffNotification.objects.all().delete()
+        make_portfolio(branches=3, officers_per_branch=2, loans_per_officer=10)
+        idle = Admins.objects.create(
+            full_name="Idle Officer", email="idle@test.local", role="FIELD_OFFICER", password_hash="x",
+            branch_fk=Branch.objects.order_by("name").first(),
+        )
+        self.assertEqual(self._sweep(), small)
+
+        spikes = StaffNotification.objects.filter(notification_type="OVERDUE_SPIKE")
+        self.assertEqual(spikes.count(), 4)
+        inactive = StaffNotification.objects.get(notification_type="OFFICER_INACTIVE")
+        self.assertEqual((inactive.recipient.branch_fk_id, inactive.title), (idle.branch_fk_id, "Field Officer Inactive — Idle Officer"))
+
+        total = StaffNotification.objects.count()
+        self._sweep()
+        self.assertEqual(StaffNotification.objects.count(), total)
+
+
+class ApiBenchmarkTests(TestCase):
+    def test_reports_every_endpoint_and_rolls_back(self):
+        out = io.StringIO()
+        call_command("benchmark", "api", customers=12, audit_logs=20, iterations=2, stdout=out)
+        report = json.loads(out.getvalue())["results"]
+        self.assertEqual(report["dataset"]["customers"], 12)
+        for name, result in report["endpoints"].items():
+            self.assertEqual(result.get("status"), 200, name)
+            self.assertIn("p95_ms", result["latency"])
+            self.assertGreater(result["queries_cold"], 0)
+        self.assertFalse(Users.objects.filter(full_name__startswith="bench").exists())
+
+        with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False) as fh:
+            report["endpoints"]["loans"]["queries"] -= 1
+            json.dump(report, fh)
+        self.addCleanup(os.remove, fh.name)
+        out = io.StringIO()
+        call_command("benchmark", "api", customers=12, audit_logs=20, iterations=1, endpoints="loans", baseline=fh.name, stdout=out)
+        self.assertEqual(json.loads(out.getvalue())["results"]["regressions"], ["loans"])
+
+
+@override_settings(REQUEST_PROFILING=True, REQUEST_PROFILING_SAMPLE_RATE=1.0)
+class RequestProfilingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        make_portfolio(branches=1, officers_per_branch=1)
+        self.owner = Admins.objects.create(
+            full_name="Owner", email="owner@test.local", role="SUPER_ADMIN", password_hash="x", is_owner=True
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.owner)
+
+    def test_sampled_requests_feed_server_timing_and_endpoint_stats(self):
+        for _ in range(2):
+            response = self.client.get("/api/loans/")
+            self.assertEqual(response.status_code, 200)
+            self.assertRegex(response["Server-Timing"], r'db;dur=[\d.]+;desc="\d+ queries", ser;dur=')
+
+        stats = self.client.get("/api/analytics/request-profile/").data
+        loans = next(e for e in stats["endpoints"] if e["endpoint"] == "GET /api/loans/")
+        self.assertEqual(loans["sampled_requests"], 2)
+        self.assertGreater(loans["avg_queries"], 0)
+        self.assertGreater(loans["avg_bytes"], 0)
+        self.assertEqual(sum(loans["histogram"].values()), 2)
+
+        manager = Admins.objects.get(role="MANAGER")
+        self.client.force_authenticate(user=manager)
+        self.assertEqual(self.client.get("/api/analytics/request-profile/").status_code, 403)
+
+    @override_settings(REQUEST_PROFILING_REPEAT_THRESHOLD=2)
+    def test_repeated_statements_are_reported(self):
+        from .utils import profiling
+
+        self.assertEqual(
+            profiling.fingerprint("SELECT * FROM loans WHERE id IN (%s, %s, %s) AND amount > 10"),
+            profiling.fingerprint("SELECT * FROM loans WHERE id IN (%s, %s) AND amount > 20"),
+        )
+        profile = profiling.RequestProfile()
+        with connection.execute_wrapper(profile):
+            for loan in Loans.objects.all():
+                loan.user.full_name
+        self.assertEqual(profile.repeated()[0][1], Loans.objects.count())
+
+    @override_settings(REQUEST_PROFILING_SAMPLE_RATE=0.0)
+    def test_unsampled_requests_are_untouched(self):
+        response = self.client.get("/api/loans/")
+        self.assertNotIn("Server-Timing", response)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), EXPORT_ROOT=tempfile.mkdtemp(), EXPORT_CHUNK_SIZE=2)
+class OwnerExportTests(TestCase):
+    def setUp(self):
+        make_portfolio(branches=1, officers_per_branch=1, loans_per_officer=3)
+        self.owner = Admins.objects.create(
+            full_name="Owner", email="owner@test.local", role="SUPER_ADMIN", password_hash="x", is_owner=True
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.owner)
+
+    def test_streamed_csv_uses_a_constant_number_of_queries(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get("/api/export/", {"resource": "loans"})
+            rows = list(csv.reader(io.StringIO(b"".join(response.streaming_content).decode())))
+        self.assertEqual(rows[0], ["ID", "Customer", "Amount", "Status", "Product", "Created At"])
+        self.assertEqual(len(rows) - 1, Loans.objects.count())
+        # Every loan has a customer and product, yet no per-row lookups
+        self.assertLessEqual(len(ctx.captured_queries), 5)
+
+        response = self.client.get("/api/export/", {"resource": "customers", "date_from": "2026-13-01"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_background_export_writes_gzip_and_links_it(self):
+        AuditLogs.objects.create(admin=None, action="Failed login", log_type="SECURITY")
+        expected_rows = AuditLogs.objects.count()
+        response = self.client.post("/api/export/", {"resource": "audit_logs"}, format="json")
+        self.assertEqual(response.status_code, 202)
+        status = self.client.get(f"/api/export/{response.data['export_id']}/").data
+        self.assertEqual(status["export_status"], "COMPLETED")
+        self.assertEqual(status["rows"], expected_rows)
+        self.assertTrue(status["download_url"].endswith("/download/"))
+
+        download = self.client.get(f"/api/export/{response.data['export_id']}/download/")
+        with gzip.open(io.BytesIO(b"".join(download.streaming_content)), "rt", newline="") as fh:
+            rows = list(csv.reader(fh))
+        self.assertIn(["System", "Failed login"], [row[1:3] for row in rows])
+
+        export = DataExport.objects.get()
+        self.assertTrue(export.file.path.startswith(settings.EXPORT_ROOT))
+        self.assertEqual(self.client.get(f"/media/{export.file.name}").status_code, 404)
+
+    def test_retry_takes_over_an_export_whose_worker_died(self):
+        export = DataExport.objects.create(requested_by=self.owner, resource="loans", status="RUNNING")
+        DataExport.objects.filter(pk=export.pk).update(started_at=timezone.now() - timedelta(minutes=5))
+        with override_settings(BACKGROUND_JOB_LOCK_TIMEOUT=600):
+            self.assertIsNone(DataExportService.run(export.pk))
+        with override_settings(BACKGROUND_JOB_LOCK_TIMEOUT=60):
+            self.assertEqual(DataExportService.run(export.pk).status, "COMPLETED")
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        make_portfolio(branches=2, officers_per_branch=1)
+        self.owner = Admins.objects.create(
+            full_name="Owner", email="owner@test.local", role="SUPER_ADMIN", password_hash="x", is_owner=True
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.owner)
+
+    def test_ranks_exact_phone_and_id_matches_first(self):
+        customer = Users.objects.order_by("phone").first()
+        data = self.client.get("/api/search/", {"q": "254" + customer.phone[1:], "scope": "customers"}).data
+        self.assertEqual(data["customers"][0]["id"], str(customer.id))
+        self.assertEqual(data["customers"][0]["score"], 1.0)
+        self.assertNotIn("loans", data)
+
+        data = self.client.get("/api/search/", {"q": customer.profile.national_id.lower()}).data
+        self.assertEqual(data["customers"][0]["id"], str(customer.id))
+
+        loan = Loans.objects.first()
+        data = self.client.get("/api/search/", {"q": str(loan.id)[:8]}).data
+        self.assertIn(str(loan.id), [l["id"] for l in data["loans"]])
+
+    def test_results_are_scoped_and_capped(self):
+        SMSLog.objects.create(recipient_phone="0700000001", recipient_name="Customer 1-0-0", message="Hi", type="NOTICE")
+        EmailLog.objects.create(recipient_email="customer@test.local", subject="Customer statement", message="Hi")
+        data = self.client.get("/api/search/", {"q": "Customer", "limit": 2}).data
+        self.assertEqual(len(data["customers"]), 2)
+        self.assertEqual({r["kind"] for r in data["communications"]}, {"sms", "email"})
+
+        officer = Admins.objects.filter(role="FIELD_OFFICER").order_by("branch_fk__name").first()
+        self.client.force_authenticate(user=officer)
+        data = self.client.get("/api/search/", {"q": "Customer"}).data
+        self.assertEqual(data["communications"], [])
+        own = set(Users.objects.filter(profile__branch_fk=officer.branch_fk).values_list("id", flat=True))
+        self.assertTrue(data["customers"])
+        self.assertTrue(all(UserProfiles.objects.get(user_id=c["id"]).user_id in own for c in data["customers"]))
+
+        self.assertEqual(self.client.get("/api/search/", {"q": "ab"}).status_code, 400)
+        self.assertEqual(self.client.get("/api/search/", {"q": "Customer", "limit": -5}).status_code, 400)
@@ -8,6 +8,7 @@ from .views import (
     UserListCreateView,
     UserDetailView,
     CheckUserView,
+    SearchView,
     LoanListCreateView,
     LoanDetailView,
     LoanProductListCreateView,
@@ -39,15 +40,20 @@ from .views import (
     LoanStatsView,
     FinanceAnalyticsView,
     OwnerAnalyticsView,
+    AnalyticsCacheStatsView,
+    RequestProfileStatsView,
     MpesaRepaymentView,
     MpesaDisbursementView,
+    DisbursementBatchStatusView,
     MpesaCallbackView,
     MpesaValidationView,
     BulkSMSView,
+    SMSBroadcastStatusView,
     DirectSMSView,
     SMSLogListView,
     AdminInviteView,
     StatementUploadView,
+    StatementImportStatusView,
     AssignTransactionView,
     UnmatchedTransactionsView,
     SendEmailNotificationView,
@@ -72,6 +78,8 @@ from .views import (
     SecurityThreatsView,
     SystemHealthView,
     OwnerExportView,
+    DataExportStatusView,
+    DataExportDownloadView,
     HierarchicalSecurityAlertsView,
 )
 
@@ -83,6 +91,8 @@ from .management.staff_notification_views import (
 urlpatterns = [
     path("team-security-alerts/", HierarchicalSecurityAlertsView.as_view(), name="team-security-alerts"),
     path("export/", OwnerExportView.as_view(), name="owner-export"),
+    path("export/<str:pk>/", DataExportStatusView.as_view(), name="owner-export-status"),
+    path("export/<str:pk>/download/", DataExportDownloadView.as_view(), name="owner-export-download"),
     path("health/", SystemHealthView.as_view(), name="system-health"),
     path("auth/logout/", LogoutView.as_view(), name="logout"),
     path("auth/owner-exists/", OwnerExistsView.as_view(), name="owner-exists"),
@@ -127,9 +137,13 @@ urlpatterns = [
     path(
         "payments/disburse/", MpesaDisbursementView.as_view(), name="mpesa-disbursement"
     ),
+    path(
+        "payments/disburse/batches/<str:pk>/", DisbursementBatchStatusView.as_view(), name="disbursement-batch"
+    ),
     path("payments/callback/", MpesaCallbackView.as_view(), name="mpesa-callback"),
     path("payments/validation/", MpesaValidationView.as_view(), name="mpesa-validation"),
     path("loans/bulk-sms-defaulters/", BulkSMSView.as_view(), name="bulk-sms"),
+    path("loans/bulk-sms-defaulters/<str:pk>/", SMSBroadcastStatusView.as_view(), name="bulk-sms-status"),
     path("loans/direct-sms/", DirectSMSView.as_view(), name="direct-sms"),
     path("notifications/", NotificationListView.as_view(), name="notifications"),
     path(
@@ -142,6 +156,8 @@ urlpatterns = [
         "finance/analytics/", FinanceAnalyticsView.as_view(), name="finance-analytics"
     ),
     path('owner/analytics/', OwnerAnalyticsView.as_view(), name='owner-analytics'),
+    path('analytics/cache-stats/', AnalyticsCacheStatsView.as_view(), name='analytics-cache-stats'),
+    path('analytics/request-profile/', RequestProfileStatsView.as_view(), name='analytics-request-profile'),
     path("auth/login/", LoginView.as_view(), name="login"),
     path("security-threats/", SecurityThreatsView.as_view(), name="security-threats"),
     path("auth/register/", RegisterAdminView.as_view(), name="register"),
@@ -163,6 +179,7 @@ urlpatterns = [
     path("settings/test-sms/", TestSMSSendView.as_view(), name="test-sms"),
     path("admins/invite/", AdminInviteView.as_view(), name="invite-admin"),
     path('repayments/upload-statement/', StatementUploadView.as_view()),
+    path('repayments/statement-imports/<str:pk>/', StatementImportStatusView.as_view()),
     path('repayments/assign-transaction/', AssignTransactionView.as_view()),
     path('repayments/unmatched/', UnmatchedTransactionsView.as_view()),
     path("admins/", AdminListCreateView.as_view(), name="admins"),
@@ -176,6 +193,7 @@ urlpatterns = [
     ),
     path("users/", UserListCreateView.as_view(), name="users"),
     path("users/check/", CheckUserView.as_view(), name="check-user"),
+    path("search/", SearchView.as_view(), name="search"),
     path("users/drafts/", CustomerDraftListCreateView.as_view(), name="customer-drafts"),
     path("users/drafts/<str:pk>/", CustomerDraftDetailView.as_view(), name="customer-draft-detail"),
     path("users/<str:pk>/", UserDetailView.as_view(), name="user-detail"),
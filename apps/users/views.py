@@ -14,6 +14,7 @@ from ..serializers import (
     LoanSerializer,
     CustomerDraftSerializer
 )
+from ..utils.audit import record_audit
 from ..utils.security import log_action, get_client_ip, get_filtered_queryset
 
 def _get_field_value(instance, field):
@@ -102,7 +103,7 @@ class UserDetailView(generics.RetrieveUpdateDestroyAPIView):
         instance.save()
         if self.request.user and self.request.user.is_authenticated:
             ip = get_client_ip(self.request)
-            AuditLogs.objects.create(admin=self.request.user, action="LOCKED_CUSTOMER", log_type="MANAGEMENT", table_name="users", record_id=instance.id, new_data={"is_locked": True}, ip_address=ip)
+            record_audit(admin=self.request.user, action="LOCKED_CUSTOMER", log_type="MANAGEMENT", table_name="users", record_id=instance.id, new_data={"is_locked": True}, ip_address=ip)
 
     def perform_update(self, serializer):
         user = getattr(self.request, "user", None)
@@ -139,7 +140,7 @@ class UserDetailView(generics.RetrieveUpdateDestroyAPIView):
                 changed[field] = str(new_val)
         
         if changed:
-            AuditLogs.objects.create(
+            record_audit(
                 admin=user, 
                 action="CUSTOMER_SIGNIFICANT_UPDATE", 
                 log_type="MANAGEMENT", 
@@ -157,18 +158,10 @@ class CheckUserView(views.APIView):
         query = request.query_params.get("q")
         if not query:
             return Response({"error": "Query parameter 'q' (ID or Phone) is required"}, status=400)
-        import re
+        from ..services import phone_variants
         user = None
-        clean_q = re.sub(r"\D", "", query)
-        if clean_q:
-            variants = [clean_q]
-            if clean_q.startswith("254") and len(clean_q) > 10:
-                variants.append("0" + clean_q[3:])
-            elif clean_q.startswith("0") and len(clean_q) == 10:
-                variants.append("254" + clean_q[1:])
-            elif (clean_q.startswith("7") or clean_q.startswith("1")) and len(clean_q) == 9:
-                variants.append("0" + clean_q)
-                variants.append("254" + clean_q)
+        variants = phone_variants(query)
+        if variants:
             user = Users.objects.filter(phone__in=variants).first() or Users.objects.filter(profile__national_id=query).first()
         else:
             user = Users.objects.filter(profile__national_id=query).first()
@@ -177,6 +170,31 @@ class CheckUserView(views.APIView):
         outstanding_loan = Loans.objects.filter(user=user, status__in=["UNVERIFIED", "VERIFIED", "PENDING", "AWARDED", "ACTIVE", "OVERDUE"]).last()
         return Response({"found": True, "user": UserSerializer(user).data, "has_outstanding_loan": outstanding_loan is not None, "outstanding_loan": (LoanSerializer(outstanding_loan).data if outstanding_loan else None)})
 
+class SearchView(views.APIView):
+    """
+    Unified search: GET /api/search/?q=<text>[&scope=customers,loans,communications][&limit=N].
+    Customers by name, phone or national ID, loans by id prefix, and SMS /
+    email logs by recipient or subject, each ranked and capped at ``limit``.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        from django.conf import settings
+        from ..services import SearchService
+        query = (request.query_params.get("q") or "").strip()
+        if len(query) < settings.SEARCH_MIN_QUERY_LENGTH:
+            return Response({"error": f"Query parameter 'q' needs at least {settings.SEARCH_MIN_QUERY_LENGTH} characters"}, status=400)
+        scopes = [s.strip() for s in request.query_params.get("scope", "").split(",") if s.strip()] or None
+        if scopes and set(scopes) - set(SearchService.SCOPES):
+            return Response({"error": f"scope must be a subset of {', '.join(SearchService.SCOPES)}"}, status=400)
+        try:
+            limit = int(request.query_params["limit"]) if "limit" in request.query_params else None
+        except ValueError:
+            return Response({"error": "limit must be an integer"}, status=400)
+        if limit is not None and limit < 1:
+            return Response({"error": "limit must be at least 1"}, status=400)
+        return Response({"query": query, **SearchService.search(request.user, query, scopes, limit)})
+
 class UserProfileListCreateView(generics.ListCreateAPIView):
     queryset = UserProfiles.objects.all()
     serializer_class = UserProfileSerializer
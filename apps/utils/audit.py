@@ -0,0 +1,187 @@
+"""
+Audit log sink.
+
+record_audit() takes the same keyword arguments as AuditLogs.objects.create().
+Depending on settings.AUDIT_LOG_MODE an entry is either inserted inline or
+buffered in-process and written with bulk_create by a background thread
+once AUDIT_BATCH_SIZE entries are queued or AUDIT_FLUSH_INTERVAL seconds pass.
+
+- "SYNC": every entry is inserted inline.
+- "STRICT" (default): STATUS and SECURITY entries are inserted inline so they
+  commit or roll back with the surrounding business transaction; the rest
+  are buffered.
+- "ASYNC": everything is buffered unless the caller passes sync=True.
+
+AUDIT_OUTBOX_DIR should point at a persistent disk. When it is set, buffered
+STATUS/SECURITY entries are also appended to a per-process outbox file there
+as they are queued, and a batch that fails to insert is written there in
+full; `python manage.py replay_audit_outbox` loads whatever a failed flush or
+a dead process left behind. Without it, STATUS/SECURITY entries are always
+inserted inline and a failed batch goes back into the buffer (up to
+MAX_RETAINED_BATCHES batches) for the next flush.
+"""
+import atexit
+import glob
+import json
+import logging
+import os
+import threading
+import uuid
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+STRICT_LOG_TYPES = ("STATUS", "SECURITY")
+# Without an outbox, failed batches kept in memory beyond this many are dropped
+MAX_RETAINED_BATCHES = 10
+
+
+class AuditSink:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pid = None
+
+    def _start(self):
+        # Called under the lock the first time this process (or a forked
+        # worker, which inherits a stale copy) queues an entry.
+        self.pid = os.getpid()
+        self.buffer = []
+        self.segment = None
+        self.wakeup = threading.Event()
+        threading.Thread(target=self._run, name="audit-sink", daemon=True).start()
+
+    def _run(self):
+        from django.db import connection
+        while True:
+            self.wakeup.wait(settings.AUDIT_FLUSH_INTERVAL)
+            self.wakeup.clear()
+            if self.flush():
+                connection.close()
+
+    def _outbox_path(self, suffix):
+        os.makedirs(settings.AUDIT_OUTBOX_DIR, exist_ok=True)
+        return os.path.join(settings.AUDIT_OUTBOX_DIR, f"audit-{os.getpid()}-{uuid.uuid4().hex[:8]}.{suffix}")
+
+    @staticmethod
+    def _append(path, entries):
+        with open(path, "a", encoding="utf-8") as fh:
+            for entry in entries:
+                fh.write(json.dumps(entry, cls=DjangoJSONEncoder) + "\n")
+            fh.flush()
+            os.fsync(fh.fileno())
+
+    def add(self, entry):
+        with self.lock:
+            if self.pid != os.getpid():
+                self._start()
+            if entry["log_type"] in STRICT_LOG_TYPES and settings.AUDIT_OUTBOX_DIR:
+                if self.segment is None:
+                    self.segment = self._outbox_path("open")
+                self._append(self.segment, [entry])
+            self.buffer.append(entry)
+            full = len(self.buffer) >= settings.AUDIT_BATCH_SIZE
+        if full:
+            self.wakeup.set()
+
+    def flush(self):
+        """Writes the buffered entries; returns how many were inserted."""
+        from ..models import AuditLogs
+
+        with self.lock:
+            if self.pid != os.getpid() or not self.buffer:
+                return 0
+            batch, self.buffer = self.buffer, []
+            segment, self.segment = self.segment, None
+        try:
+            AuditLogs.objects.bulk_create([AuditLogs(**entry) for entry in batch], batch_size=500)
+        except Exception:
+            if not settings.AUDIT_OUTBOX_DIR:
+                logger.exception(f"[AuditSink] Flush of {len(batch)} entries failed; retrying on the next flush")
+                self._retain(batch)
+                return 0
+            logger.exception(f"[AuditSink] Flush of {len(batch)} entries failed; writing them to the outbox")
+            pending = self._outbox_path("pending")
+            self._append(pending, [e for e in batch if e["log_type"] not in STRICT_LOG_TYPES])
+            if segment:
+                with open(segment, encoding="utf-8") as src, open(pending, "a", encoding="utf-8") as dst:
+                    dst.write(src.read())
+                os.remove(segment)
+            return 0
+        if segment:
+            os.remove(segment)
+        return len(batch)
+
+    def _retain(self, batch):
+        with self.lock:
+            self.buffer[:0] = batch
+            limit = settings.AUDIT_BATCH_SIZE * MAX_RETAINED_BATCHES
+            if len(self.buffer) > limit:
+                dropped = len(self.buffer) - limit
+                del self.buffer[:dropped]
+                logger.error(f"[AuditSink] Dropped {dropped} audit entries that could not be inserted")
+
+
+audit_sink = AuditSink()
+atexit.register(audit_sink.flush)
+
+
+def record_audit(sync=None, **fields):
+    """
+    Drop-in replacement for AuditLogs.objects.create() on request paths.
+    Returns the saved row when written inline, None when buffered.
+    """
+    from ..models import AuditLogs
+
+    fields.setdefault("log_type", "GENERAL")
+    if sync is None:
+        mode = settings.AUDIT_LOG_MODE
+        critical = fields["log_type"] in STRICT_LOG_TYPES
+        sync = mode == "SYNC" or (critical and (mode == "STRICT" or not settings.AUDIT_OUTBOX_DIR))
+    if sync:
+        return AuditLogs.objects.create(**fields)
+
+    if "admin" in fields:
+        admin = fields.pop("admin")
+        fields["admin_id"] = admin.pk if admin is not None else None
+    fields.setdefault("id", uuid.uuid4())
+    # Stamp the event time now rather than at flush time
+    fields.setdefault("created_at", timezone.now())
+    audit_sink.add(fields)
+    return None
+
+
+def _owner_alive(path):
+    try:
+        os.kill(int(os.path.basename(path).split("-")[1]), 0)
+    except (IndexError, ValueError, ProcessLookupError):
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def replay_outbox():
+    """
+    Inserts entries from failed flushes (*.pending) and from outbox files
+    left open by processes that have exited. Safe to re-run: entries keep
+    the id assigned when they were queued.
+    """
+    from ..models import AuditLogs
+
+    if not settings.AUDIT_OUTBOX_DIR:
+        return 0, 0
+    paths = glob.glob(os.path.join(settings.AUDIT_OUTBOX_DIR, "*.pending"))
+    paths += [p for p in glob.glob(os.path.join(settings.AUDIT_OUTBOX_DIR, "*.open")) if not _owner_alive(p)]
+    replayed = 0
+    for path in sorted(paths):
+        with open(path, encoding="utf-8") as fh:
+            entries = [json.loads(line) for line in fh if line.strip()]
+        AuditLogs.objects.bulk_create(
+            [AuditLogs(**entry) for entry in entries], batch_size=500, ignore_conflicts=True
+        )
+        os.remove(path)
+        replayed += len(entries)
+    return len(paths), replayed
@@ -0,0 +1,159 @@
+import functools
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+from rest_framework.response import Response
+
+GENERATION_KEY = "analytics:generation"
+MATCH_INDEX_SEQ_KEY = "matching:seq"
+MATCH_INDEX_CHANGE_KEY = "matching:change:{}"
+# How long a logged match-index change is kept for processes to patch in
+MATCH_INDEX_CHANGE_TTL = 3600
+SETTINGS_VERSION_KEY = "secure_settings:version"
+PRINCIPAL_KEY = "auth:principal:{}"
+MAINTENANCE_KEY = "auth:maintenance"
+STATS_KEYS = {
+    "hits": "analytics:stats:hits",
+    "misses": "analytics:stats:misses",
+    "rebuild_ms": "analytics:stats:rebuild_ms",
+}
+
+
+# Backends whose entries live in (or never leave) a single process
+PROCESS_LOCAL_CACHE_BACKENDS = (
+    "django.core.cache.backends.locmem.LocMemCache",
+    "django.core.cache.backends.dummy.DummyCache",
+)
+
+
+def cache_is_shared():
+    """True when every worker process reads and invalidates the same cache (e.g. Redis)."""
+    return settings.CACHES["default"]["BACKEND"] not in PROCESS_LOCAL_CACHE_BACKENDS
+
+
+def _incr(key, delta=1):
+    cache.add(key, 0, None)
+    try:
+        return cache.incr(key, delta)
+    except ValueError:
+        # Evicted between add() and incr()
+        cache.set(key, delta, None)
+        return delta
+
+
+def get_analytics_generation():
+    cache.add(GENERATION_KEY, 1, None)
+    return cache.get(GENERATION_KEY) or 1
+
+
+def bump_analytics_generation():
+    """Invalidates every cached analytics payload."""
+    return _incr(GENERATION_KEY)
+
+
+def get_match_index_seq():
+    cache.add(MATCH_INDEX_SEQ_KEY, 0, None)
+    return cache.get(MATCH_INDEX_SEQ_KEY) or 0
+
+
+def record_match_index_change(user_id):
+    """Logs a customer whose loans, phone or national ID changed, for PaymentMatchResolver to re-read."""
+    seq = _incr(MATCH_INDEX_SEQ_KEY)
+    cache.set(MATCH_INDEX_CHANGE_KEY.format(seq), str(user_id), MATCH_INDEX_CHANGE_TTL)
+    return seq
+
+
+def match_index_changes(after, upto):
+    """Customer ids logged in (after, upto], or None when part of the log is gone."""
+    keys = [MATCH_INDEX_CHANGE_KEY.format(seq) for seq in range(after + 1, upto + 1)]
+    found = cache.get_many(keys)
+    if len(found) != len(keys):
+        return None
+    return set(found.values())
+
+
+def get_settings_version():
+    cache.add(SETTINGS_VERSION_KEY, 1, None)
+    return cache.get(SETTINGS_VERSION_KEY) or 1
+
+
+def bump_settings_version():
+    """Makes every process reload its decrypted SecureSettings."""
+    return _incr(SETTINGS_VERSION_KEY)
+
+
+def invalidate_principal(admin_id):
+    """Drops the cached authentication principal for one admin."""
+    cache.delete(PRINCIPAL_KEY.format(admin_id))
+
+
+def invalidate_maintenance_state():
+    cache.delete(MAINTENANCE_KEY)
+
+
+def analytics_cache_key(endpoint, request):
+    """
+    Keyed by endpoint, data generation, today's date, the caller's scope
+    (role, owner/super flags, branch, and the user itself for field
+    officers whose data is limited to their own loans) and query params.
+    """
+    user = request.user
+    role = getattr(user, "role", "")
+    scope = [
+        role,
+        "owner" if getattr(user, "is_owner", False) else "",
+        "super" if getattr(user, "is_super_admin", False) else "",
+        str(getattr(user, "branch_fk_id", "") or ""),
+        str(user.pk) if role == "FIELD_OFFICER" else "",
+    ]
+    params = "&".join(
+        f"{k}={','.join(sorted(request.query_params.getlist(k)))}"
+        for k in sorted(request.query_params.keys())
+    )
+    digest = hashlib.md5(f"{':'.join(scope)}?{params}".encode()).hexdigest()
+    return (
+        f"analytics:{endpoint}:g{get_analytics_generation()}:"
+        f"{timezone.localdate().isoformat()}:{digest}"
+    )
+
+
+def cached_analytics(endpoint):
+    """
+    Caches a view's successful GET payload until the analytics generation is
+    bumped (ledger, repayment or loan status writes) or the timeout passes.
+    """
+    def decorator(view_method):
+        @functools.wraps(view_method)
+        def wrapper(self, request, *args, **kwargs):
+            key = analytics_cache_key(endpoint, request)
+            data = cache.get(key)
+            if data is not None:
+                _incr(STATS_KEYS["hits"])
+                return Response(data)
+
+            _incr(STATS_KEYS["misses"])
+            started = time.monotonic()
+            response = view_method(self, request, *args, **kwargs)
+            if response.status_code == 200:
+                _incr(STATS_KEYS["rebuild_ms"], int((time.monotonic() - started) * 1000))
+                cache.set(key, response.data, getattr(settings, "ANALYTICS_CACHE_TIMEOUT", 300))
+            return response
+        return wrapper
+    return decorator
+
+
+def analytics_cache_stats():
+    hits = cache.get(STATS_KEYS["hits"]) or 0
+    misses = cache.get(STATS_KEYS["misses"]) or 0
+    rebuild_ms = cache.get(STATS_KEYS["rebuild_ms"]) or 0
+    return {
+        "generation": get_analytics_generation(),
+        "hits": hits,
+        "misses": misses,
+        "hit_rate": round(hits / (hits + misses) * 100, 1) if hits + misses else 0,
+        "rebuild_ms_total": rebuild_ms,
+        "avg_rebuild_ms": round(rebuild_ms / misses, 1) if misses else 0,
+    }
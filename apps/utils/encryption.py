@@ -1,7 +1,15 @@
+from collections import OrderedDict
 from cryptography.fernet import Fernet
 from django.conf import settings
 import base64
+import functools
 import os
+import threading
+import time
+
+@functools.lru_cache(maxsize=4)
+def _fernet(key: bytes):
+    return Fernet(key)
 
 def get_cipher():
     # Use the key from settings.py
@@ -17,7 +25,8 @@ def get_cipher():
     
     if isinstance(key, str):
         key = key.encode()
-    return Fernet(key)
+    # One Fernet per key; building it derives the signing/encryption keys
+    return _fernet(key)
 
 def encrypt_value(plain_text: str) -> str:
     if not plain_text:
@@ -35,23 +44,77 @@ def decrypt_value(encrypted_text: str) -> str:
         # If decryption fails (e.g. wrong key or not encrypted), return as is or empty
         return encrypted_text
 
-def get_setting(key: str, default=None):
-    try:
+class SettingsProvider:
+    """
+    Process-local cache of decrypted SecureSettings.
+
+    A group (setting_group, case-insensitive; None for every row) is loaded
+    with one query and decrypted once, then served from an LRU of
+    MAX_GROUPS entries for SECURE_SETTINGS_CACHE_TIMEOUT seconds. Every
+    process drops its copy as soon as the shared settings version moves,
+    see bump_settings_version().
+    """
+    MAX_GROUPS = 16
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.groups = OrderedDict()
+
+    def get_group(self, group=None):
+        from .cache import get_settings_version
+
+        name = group.upper() if group else None
+        version = get_settings_version()
+        with self.lock:
+            entry = self.groups.get(name)
+            if entry and entry[0] == version and time.monotonic() - entry[1] < settings.SECURE_SETTINGS_CACHE_TIMEOUT:
+                self.groups.move_to_end(name)
+                return entry[2]
+        values = self._load(name)
+        with self.lock:
+            self.groups[name] = (version, time.monotonic(), values)
+            self.groups.move_to_end(name)
+            while len(self.groups) > self.MAX_GROUPS:
+                self.groups.popitem(last=False)
+        return values
+
+    @staticmethod
+    def _load(group):
         from apps.models import SecureSettings
-        from django.core.cache import cache
-        
-        # Try cache first
-        cache_key = f"secure_setting_{key}"
-        cached_val = cache.get(cache_key)
-        if cached_val is not None:
-            return cached_val
-            
-        obj = SecureSettings.objects.get(key=key)
-        val = decrypt_value(obj.encrypted_value)
-        
-        # Cache for 5 minutes
-        cache.set(cache_key, val, 300)
-        return val
+
+        rows = SecureSettings.objects.all()
+        if group:
+            rows = rows.filter(setting_group__iexact=group)
+        return {key: decrypt_value(value) for key, value in rows.values_list("key", "encrypted_value")}
+
+    def clear(self):
+        with self.lock:
+            self.groups.clear()
+
+
+settings_provider = SettingsProvider()
+
+
+def get_settings(group=None):
+    """Decrypted {key: value} for one setting group, or every setting when group is None."""
+    return settings_provider.get_group(group)
+
+
+def get_setting(key: str, default=None, group=None):
+    """
+    Decrypted value of a SecureSettings row. When ``group`` is given that
+    group is checked first; otherwise (or if the key is filed elsewhere)
+    the full settings snapshot is used. Falls back to the environment.
+    """
+    try:
+        if group:
+            values = settings_provider.get_group(group)
+            if key in values:
+                return values[key]
+        values = settings_provider.get_group()
+        if key in values:
+            return values[key]
     except Exception:
-        # Fallback to environment variable if provided as default or directly
-        return os.getenv(key.upper(), default)
+        pass
+    # Fallback to environment variable if provided as default or directly
+    return os.getenv(key.upper(), default)
@@ -0,0 +1,216 @@
+"""
+Database-backed background jobs.
+
+enqueue() stores a BackgroundJob row in the caller's transaction, so a job
+only exists if the work that asked for it committed, and survives restarts
+until it has run. Task functions are registered by name with @task (see
+apps/tasks.py) and receive the job payload as keyword arguments; raising
+marks the attempt as failed. This is the one background mechanism: SMS and
+email sends, SMS broadcasts, owner exports, disbursement batches, statement
+imports and M-Pesa callbacks all run as jobs.
+
+settings.BACKGROUND_JOB_PROCESSING decides who runs a new job:
+
+- "THREAD" (default): after commit, on a per-process pool of
+  BACKGROUND_JOB_WORKERS threads. Retries are left to the run_jobs command.
+- "WORKER": only `python manage.py run_jobs`.
+- "INLINE": immediately, in the caller (tests).
+
+Every attempt is recorded in BackgroundJobRun with its queue latency,
+duration and outcome. A failed job is retried with exponential backoff;
+after max_attempts it becomes DEAD.
+"""
+import contextlib
+import logging
+import os
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+TASKS = {}
+
+
+def task(name):
+    """Registers the decorated function as the handler for jobs named ``name``."""
+    def decorator(func):
+        TASKS[name] = func
+        return func
+    return decorator
+
+
+def get_task(name):
+    from .. import tasks  # noqa: F401  (registers the handlers)
+    return TASKS[name]
+
+
+def backoff(attempts):
+    """Seconds to wait before retrying a job that has failed ``attempts`` times."""
+    delay = settings.BACKGROUND_JOB_RETRY_BACKOFF * 2 ** max(attempts - 1, 0)
+    return min(delay, settings.BACKGROUND_JOB_MAX_BACKOFF)
+
+
+class _Pool:
+    # One bounded executor per process; forked workers build their own.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pid = None
+        self.executor = None
+
+    def submit(self, job_id):
+        from concurrent.futures import ThreadPoolExecutor
+
+        with self.lock:
+            if self.pid != os.getpid():
+                self.pid = os.getpid()
+                self.executor = ThreadPoolExecutor(
+                    max_workers=settings.BACKGROUND_JOB_WORKERS, thread_name_prefix="background-jobs"
+                )
+            self.executor.submit(_run_and_close, job_id)
+
+
+pool = _Pool()
+
+
+def _run_and_close(job_id):
+    try:
+        run_job(job_id)
+    except Exception:
+        logger.exception(f"[Jobs] Job {job_id} could not be run")
+    finally:
+        connection.close()
+
+
+def enqueue(name, payload=None, delay=0, max_attempts=None):
+    """Queues task ``name`` with ``payload`` (JSON-serialisable kwargs); returns the job."""
+    from ..models import BackgroundJob
+
+    job = BackgroundJob.objects.create(
+        task=name,
+        payload=payload or {},
+        run_at=timezone.now() + timedelta(seconds=delay),
+        max_attempts=max_attempts or settings.BACKGROUND_JOB_MAX_ATTEMPTS,
+    )
+    mode = str(settings.BACKGROUND_JOB_PROCESSING).upper()
+    if mode == "INLINE" and not delay:
+        run_job(job.pk)
+    elif mode == "THREAD" and not delay:
+        transaction.on_commit(lambda: pool.submit(job.pk))
+    return job
+
+
+def _claim(job_id):
+    from ..models import BackgroundJob
+
+    lock = {"skip_locked": True} if connection.features.has_select_for_update_skip_locked else {}
+    now = timezone.now()
+    with transaction.atomic():
+        job = (
+            BackgroundJob.objects.select_for_update(**lock)
+            .filter(pk=job_id, status__in=("QUEUED", "RETRY"), run_at__lte=now).first()
+        )
+        if job is None:
+            return None
+        job.status, job.locked_at, job.attempts = "RUNNING", now, job.attempts + 1
+        job.save(update_fields=["status", "locked_at", "attempts"])
+    return job
+
+
+def run_job(job_id):
+    """
+    Claims and runs one due job. The task runs outside any transaction so a
+    slow provider call holds no locks. Returns the job, or None when it was
+    not due or another worker has it.
+    """
+    from ..models import BackgroundJobRun
+
+    job = _claim(job_id)
+    if job is None:
+        return None
+
+    due, started = job.run_at, timezone.now()
+    clock = time.monotonic()
+    error = None
+    # INLINE jobs run inside the caller's transaction; keep a failure there
+    # from breaking it
+    guard = transaction.atomic() if connection.in_atomic_block else contextlib.nullcontext()
+    try:
+        with guard:
+            get_task(job.task)(**job.payload)
+    except Exception as e:
+        logger.warning(f"[Jobs] {job.task} attempt {job.attempts} failed: {e}")
+        error = f"{type(e).__name__}: {e}"
+    duration_ms = int((time.monotonic() - clock) * 1000)
+
+    job.locked_at = None
+    job.last_error = error
+    if error is None:
+        job.status, job.finished_at = "SUCCEEDED", timezone.now()
+    elif job.attempts >= job.max_attempts:
+        job.status, job.finished_at = "DEAD", timezone.now()
+    else:
+        job.status = "RETRY"
+        job.run_at = timezone.now() + timedelta(seconds=backoff(job.attempts))
+    job.save(update_fields=["status", "locked_at", "last_error", "finished_at", "run_at"])
+
+    BackgroundJobRun.objects.create(
+        job=job,
+        task=job.task,
+        attempt=job.attempts,
+        outcome="FAILED" if job.status == "RETRY" else job.status,
+        queue_latency_ms=max(int((started - due).total_seconds() * 1000), 0),
+        duration_ms=duration_ms,
+        error=error,
+        started_at=started,
+    )
+    return job
+
+
+def requeue_stale():
+    """Puts RUNNING jobs whose process died back in line; returns how many."""
+    from ..models import BackgroundJob
+
+    cutoff = timezone.now() - timedelta(seconds=settings.BACKGROUND_JOB_LOCK_TIMEOUT)
+    return BackgroundJob.objects.filter(status="RUNNING", locked_at__lt=cutoff).update(
+        status="RETRY", locked_at=None, run_at=timezone.now(), last_error="Worker lost while running"
+    )
+
+
+def due_ids(limit):
+    from ..models import BackgroundJob
+
+    return list(
+        BackgroundJob.objects.filter(status__in=("QUEUED", "RETRY"), run_at__lte=timezone.now())
+        .order_by("run_at").values_list("pk", flat=True)[:limit]
+    )
+
+
+def drain(workers=None, batch_size=500):
+    """Runs one batch of due jobs on a thread pool; returns (succeeded, failed)."""
+    from concurrent.futures import ThreadPoolExecutor
+
+    requeue_stale()
+    ids = due_ids(batch_size)
+    if not ids:
+        return 0, 0
+
+    def _worker(job_id):
+        try:
+            return run_job(job_id)
+        finally:
+            connection.close()
+
+    workers = workers or settings.BACKGROUND_JOB_WORKERS
+    if workers <= 1:
+        results = [run_job(pk) for pk in ids]
+    else:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="background-jobs") as executor:
+            results = list(executor.map(_worker, ids))
+    results = [job for job in results if job is not None]
+    succeeded = sum(1 for job in results if job.status == "SUCCEEDED")
+    return succeeded, len(results) - succeeded
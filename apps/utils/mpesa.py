@@ -1,46 +1,132 @@
 import requests
 import base64
+import functools
+import threading
+import time
 from django.utils import timezone
 import json
 import os
 from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from .encryption import get_setting
 
 
+class DarajaClient:
+    """
+    Shared HTTP client for one Daraja app (base URL + consumer credentials).
+
+    Requests go through a keep-alive requests.Session, so a bulk run reuses
+    pooled TLS connections instead of handshaking per call. The OAuth token
+    is cached until MPESA_TOKEN_REFRESH_MARGIN seconds before it expires;
+    concurrent callers wait on one refresh rather than each fetching a token.
+
+    Connection failures are retried for every request. Read timeouts and
+    5xx responses are only retried for GETs (the OAuth call), because a
+    payment POST may already have been accepted.
+    """
+    _clients = {}
+    _registry_lock = threading.Lock()
+
+    def __init__(self, base_url, consumer_key, consumer_secret):
+        self.base_url = base_url
+        self.consumer_key = consumer_key
+        self.consumer_secret = consumer_secret
+        self.timeout = (settings.MPESA_CONNECT_TIMEOUT, settings.MPESA_READ_TIMEOUT)
+        self.token = None
+        self.token_expires_at = 0
+        self.token_lock = threading.Lock()
+
+        retries = Retry(
+            total=settings.MPESA_MAX_RETRIES,
+            backoff_factor=settings.MPESA_RETRY_BACKOFF,
+            status_forcelist=(500, 502, 503, 504),
+            allowed_methods=frozenset({"GET"}),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=settings.MPESA_POOL_SIZE, max_retries=retries)
+        self.session = requests.Session()
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    @classmethod
+    def shared(cls, base_url, consumer_key, consumer_secret):
+        """One client per process and credential set; new credentials get a new client."""
+        key = (base_url, consumer_key, consumer_secret)
+        with cls._registry_lock:
+            client = cls._clients.get(key)
+            if client is None:
+                client = cls._clients[key] = cls(base_url, consumer_key, consumer_secret)
+            return client
+
+    def get_token(self, force_refresh=False):
+        if not force_refresh and self.token and time.monotonic() < self.token_expires_at:
+            return self.token
+        stale = self.token
+        with self.token_lock:
+            # Another thread may have refreshed while we waited
+            fresh = self.token and time.monotonic() < self.token_expires_at
+            if fresh and (not force_refresh or self.token != stale):
+                return self.token
+            encoded_auth = base64.b64encode(f"{self.consumer_key}:{self.consumer_secret}".encode()).decode()
+            response = self.session.get(
+                f"{self.base_url}/oauth/v1/generate",
+                params={"grant_type": "client_credentials"},
+                headers={"Authorization": f"Basic {encoded_auth}"},
+                timeout=self.timeout,
+            )
+            response.raise_for_status()
+            data = response.json()
+            self.token = data.get("access_token")
+            lifetime = int(data.get("expires_in") or 3599)
+            self.token_expires_at = time.monotonic() + max(lifetime - settings.MPESA_TOKEN_REFRESH_MARGIN, 0)
+            return self.token
+
+    def post(self, path, payload):
+        """POSTs JSON with a bearer token; a 401 refreshes the token and retries once."""
+        for attempt in range(2):
+            token = self.get_token(force_refresh=attempt > 0)
+            response = self.session.post(
+                f"{self.base_url}{path}",
+                json=payload,
+                headers={"Authorization": f"Bearer {token}", "Content-Type": "application/json"},
+                timeout=self.timeout,
+            )
+            if response.status_code != 401:
+                break
+        return response
+
+
 class MpesaHandler:
     def __init__(self):
+        # The MPESA group is loaded and decrypted once per process (see SettingsProvider)
+        setting = functools.partial(get_setting, group="MPESA")
         # Keys are stored in lowercase in DB (from seed/frontend), so we check lowercase first
-        self.consumer_key = get_setting("mpesa_consumer_key", get_setting("MPESA_CONSUMER_KEY", getattr(settings, "MPESA_CONSUMER_KEY", "")))
-        self.consumer_secret = get_setting("mpesa_consumer_secret", get_setting("MPESA_CONSUMER_SECRET", getattr(settings, "MPESA_CONSUMER_SECRET", "")))
-        self.shortcode = get_setting("mpesa_shortcode", get_setting("MPESA_SHORTCODE", getattr(settings, "MPESA_SHORTCODE", "")))
-        self.passkey = get_setting("mpesa_passkey", get_setting("MPESA_PASSKEY", getattr(settings, "MPESA_PASSKEY", "")))
-        self.b2c_shortcode = get_setting(
+        self.consumer_key = setting("mpesa_consumer_key", setting("MPESA_CONSUMER_KEY", getattr(settings, "MPESA_CONSUMER_KEY", "")))
+        self.consumer_secret = setting("mpesa_consumer_secret", setting("MPESA_CONSUMER_SECRET", getattr(settings, "MPESA_CONSUMER_SECRET", "")))
+        self.shortcode = setting("mpesa_shortcode", setting("MPESA_SHORTCODE", getattr(settings, "MPESA_SHORTCODE", "")))
+        self.passkey = setting("mpesa_passkey", setting("MPESA_PASSKEY", getattr(settings, "MPESA_PASSKEY", "")))
+        self.b2c_shortcode = setting(
             "mpesa_b2c_shortcode", 
             os.getenv('MPESA_B2C_SHORTCODE', '600996')
         )
-        self.initiator_name = get_setting("mpesa_initiator_name", get_setting("MPESA_INITIATOR_NAME", getattr(settings, "MPESA_INITIATOR_NAME", "testapi")))
-        self.initiator_password = get_setting(
-             "mpesa_initiator_password", get_setting("MPESA_INITIATOR_PASSWORD", getattr(settings, "MPESA_INITIATOR_PASSWORD", "Safaricom007*"))
+        self.initiator_name = setting("mpesa_initiator_name", setting("MPESA_INITIATOR_NAME", getattr(settings, "MPESA_INITIATOR_NAME", "testapi")))
+        self.initiator_password = setting(
+             "mpesa_initiator_password", setting("MPESA_INITIATOR_PASSWORD", getattr(settings, "MPESA_INITIATOR_PASSWORD", "Safaricom007*"))
         )
-        self.callback_url = get_setting("mpesa_callback_url", get_setting("MPESA_CALLBACK_URL", getattr(settings, "MPESA_CALLBACK_URL", "")))
+        self.callback_url = setting("mpesa_callback_url", setting("MPESA_CALLBACK_URL", getattr(settings, "MPESA_CALLBACK_URL", "")))
 
-        env = get_setting("mpesa_environment", get_setting("MPESA_ENVIRONMENT", getattr(settings, "MPESA_ENVIRONMENT", "sandbox")))
-        self.base_url = (
+        env = setting("mpesa_environment", setting("MPESA_ENVIRONMENT", getattr(settings, "MPESA_ENVIRONMENT", "sandbox")))
+        self.base_url = settings.MPESA_BASE_URL or (
             "https://sandbox.safaricom.co.ke"
             if env == "sandbox"
             else "https://api.safaricom.co.ke"
         )
+        self.client = DarajaClient.shared(self.base_url, self.consumer_key, self.consumer_secret)
 
-    def get_access_token(self):
-        url = f"{self.base_url}/oauth/v1/generate?grant_type=client_credentials"
+    def get_access_token(self, force_refresh=False):
         try:
-            auth_string = f"{self.consumer_key}:{self.consumer_secret}"
-            encoded_auth = base64.b64encode(auth_string.encode()).decode()
-
-            headers = {"Authorization": f"Basic {encoded_auth}"}
-            response = requests.get(url, headers=headers)
-            response.raise_for_status()
-            return response.json().get("access_token")
+            return self.client.get_token(force_refresh=force_refresh)
         except Exception as e:
             print(f"Error getting access token: {str(e)}")
             return None
@@ -57,20 +143,13 @@ class MpesaHandler:
         return phone
 
     def stk_push(self, phone_number, amount, account_reference, transaction_desc):
-        access_token = self.get_access_token()
-        if not access_token:
+        if not self.get_access_token():
             return {"error": "Failed to get access token"}
 
         timestamp = timezone.now().strftime("%Y%m%d%H%M%S")
         password_str = self.shortcode + self.passkey + timestamp
         password = base64.b64encode(password_str.encode()).decode()
 
-        url = f"{self.base_url}/mpesa/stkpush/v1/processrequest"
-        headers = {
-            "Authorization": f"Bearer {access_token}",
-            "Content-Type": "application/json",
-        }
-
         phone_number = self.format_phone(phone_number)
 
         payload = {
@@ -88,7 +167,7 @@ class MpesaHandler:
         }
 
         try:
-            response = requests.post(url, json=payload, headers=headers)
+            response = self.client.post("/mpesa/stkpush/v1/processrequest", payload)
             return response.json()
         except Exception as e:
             return {"error": str(e)}
@@ -102,20 +181,17 @@ class MpesaHandler:
     ):
         """
         Pay out money to a customer (B2C)
+
+        A timeout or dropped connection on the payment request is raised
+        rather than returned: Safaricom may already have accepted it, so the
+        caller must not treat it as a rejection.
         """
-        access_token = self.get_access_token()
-        if not access_token:
+        if not self.get_access_token():
             return {
                 "ResponseCode": "999",
                 "ResponseDescription": "M-Pesa Authentication Failed. Check your Consumer Key/Secret.",
             }
 
-        url = f"{self.base_url}/mpesa/b2c/v3/paymentrequest"
-        headers = {
-            "Authorization": f"Bearer {access_token}",
-            "Content-Type": "application/json",
-        }
-
         phone_number = self.format_phone(phone_number)
 
         # Generate a unique OriginatorConversationID (Required by Safaricom for tracking)
@@ -138,7 +214,7 @@ class MpesaHandler:
         }
 
         try:
-            response = requests.post(url, json=payload, headers=headers, timeout=15)
+            response = self.client.post("/mpesa/b2c/v3/paymentrequest", payload)
             if response.status_code != 200:
                 print(f"Safaricom Error {response.status_code}: {response.text}")
                 return {
@@ -151,6 +227,8 @@ class MpesaHandler:
                     ),
                 }
             return response.json()
+        except (requests.Timeout, requests.ConnectionError):
+            raise
         except Exception as e:
             print(f"B2C Execution Error: {str(e)}")
             return {
@@ -0,0 +1,230 @@
+"""
+Monthly range partitions on created_at for the append-heavy log tables.
+
+On PostgreSQL, migration 0055 turns the tables in PARTITIONED_TABLES into
+partitioned tables with one partition per month (``<table>_pYYYYMM``) and a
+``<table>_default`` catch-all. purge_old_logs keeps future partitions
+created and retires old months by detaching/dropping whole partitions.
+Other database backends keep plain tables and every helper here is a no-op.
+"""
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+PARTITIONED_TABLES = ("audit_logs", "sms_logs", "email_logs")
+
+
+def month_start(value):
+    return date(value.year, value.month, 1)
+
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(table, month):
+    return f"{table}_p{month:%Y%m}"
+
+
+def _bound(month):
+    return datetime(month.year, month.month, 1, tzinfo=dt_timezone.utc).isoformat()
+
+
+def is_partitioned(table, using=None):
+    conn = using or connection
+    if conn.vendor != "postgresql":
+        return False
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s)", [table])
+        return cursor.fetchone() is not None
+
+
+def list_partitions(cursor, table):
+    """Monthly partitions of ``table`` as {month: name}; the default partition is left out."""
+    cursor.execute(
+        """
+        SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = to_regclass(%s)
+        """,
+        [table],
+    )
+    partitions = {}
+    prefix = f"{table}_p"
+    for (name,) in cursor.fetchall():
+        suffix = name[len(prefix):]
+        if name.startswith(prefix) and len(suffix) == 6 and suffix.isdigit():
+            partitions[date(int(suffix[:4]), int(suffix[4:]), 1)] = name
+    return partitions
+
+
+def create_partition(cursor, table, month):
+    """
+    Adds the partition for ``month``. Rows that already landed in the default
+    partition for that month are moved into it first, since PostgreSQL
+    refuses to attach a range the default partition still holds.
+    """
+    name, lower, upper = partition_name(table, month), _bound(month), _bound(add_months(month, 1))
+    cursor.execute(f'CREATE TABLE "{name}" (LIKE "{table}" INCLUDING DEFAULTS)')
+    cursor.execute(
+        f"""
+        WITH moved AS (
+            DELETE FROM "{table}_default" WHERE created_at >= %s AND created_at < %s RETURNING *
+        )
+        INSERT INTO "{name}" SELECT * FROM moved
+        """,
+        [lower, upper],
+    )
+    cursor.execute(f"ALTER TABLE \"{table}\" ATTACH PARTITION \"{name}\" FOR VALUES FROM ('{lower}') TO ('{upper}')")
+    return name
+
+
+def ensure_partitions(table, months_ahead=3, first_month=None):
+    """Creates any missing monthly partitions from ``first_month`` (default: this month) onwards."""
+    if not is_partitioned(table):
+        return []
+    month = first_month or month_start(timezone.now())
+    last = add_months(month_start(timezone.now()), months_ahead)
+    created = []
+    with transaction.atomic(), connection.cursor() as cursor:
+        existing = list_partitions(cursor, table)
+        while month <= last:
+            if month not in existing:
+                created.append(create_partition(cursor, table, month))
+            month = add_months(month, 1)
+    return created
+
+
+def retire_partitions(table, before, archive=False):
+    """
+    Detaches every monthly partition that ends on or before ``before`` and
+    drops it, or keeps it as a standalone table when ``archive`` is set.
+    Returns the affected partition names.
+    """
+    if not is_partitioned(table):
+        return []
+    cutoff = month_start(before)
+    retired = []
+    with transaction.atomic(), connection.cursor() as cursor:
+        for month, name in sorted(list_partitions(cursor, table).items()):
+            if add_months(month, 1) > cutoff:
+                continue
+            cursor.execute(f'ALTER TABLE "{table}" DETACH PARTITION "{name}"')
+            if not archive:
+                cursor.execute(f'DROP TABLE "{name}"')
+            retired.append(name)
+    return retired
+
+
+def purge_default_partition(table, before):
+    """
+    Deletes rows older than ``before`` from the default partition: back-dated
+    rows that had no monthly partition when they were written, which
+    retire_partitions() never reaches. Returns the number of rows deleted.
+    """
+    if not is_partitioned(table):
+        return 0
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM "{table}_default" WHERE created_at < %s', [before])
+        return cursor.rowcount
+
+
+def retention_floor():
+    """Oldest created_at still retained; a lower bound that lets PostgreSQL prune partitions."""
+    return timezone.now() - timedelta(days=settings.AUDIT_RETENTION_DAYS)
+
+
+def _parse_bound(params, name):
+    """The ``name`` query param as an aware datetime, None when absent; 400 when it is not a valid date."""
+    from rest_framework.exceptions import ValidationError
+
+    value = params.get(name) or ""
+    if not value:
+        return None
+    try:
+        # Well-formed but impossible values (2026-02-30) raise ValueError
+        parsed = parse_datetime(value) or (parse_date(value) and datetime.combine(parse_date(value), datetime.min.time()))
+    except ValueError:
+        parsed = None
+    if not parsed:
+        raise ValidationError({"error": f"{name} must be a valid ISO date or datetime"})
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+def within_retention(queryset, request=None):
+    """
+    Bounds a log queryset on created_at so PostgreSQL only scans the
+    partitions involved: never older than the retention window, narrowed by
+    optional ``?since=`` / ``?until=`` (ISO date or datetime) query params;
+    an invalid bound is rejected with a 400.
+    """
+    since = retention_floor()
+    params = request.query_params if request is not None else {}
+    requested = _parse_bound(params, "since")
+    if requested and requested > since:
+        since = requested
+    queryset = queryset.filter(created_at__gte=since)
+    until = _parse_bound(params, "until")
+    if until:
+        queryset = queryset.filter(created_at__lt=until)
+    return queryset
+
+
+def partition_existing_table(cursor, table, months_ahead=3):
+    """
+    Rebuilds a plain table as a monthly-partitioned one with the same
+    columns, indexes and foreign keys, copying its rows across. Used by
+    migration 0055; PostgreSQL only.
+    """
+    cursor.execute("SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s)", [table])
+    if cursor.fetchone():
+        return
+    legacy = f"{table}_legacy"
+    cursor.execute(
+        "SELECT indexname, indexdef FROM pg_indexes WHERE schemaname = current_schema() AND tablename = %s",
+        [table],
+    )
+    indexes = [(name, definition) for name, definition in cursor.fetchall() if " UNIQUE " not in definition]
+    cursor.execute(
+        "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint WHERE conrelid = to_regclass(%s) AND contype = 'f'",
+        [table],
+    )
+    foreign_keys = cursor.fetchall()
+
+    cursor.execute("SELECT conname FROM pg_constraint WHERE conrelid = to_regclass(%s) AND contype = 'p'", [table])
+    (primary_key,) = cursor.fetchone()
+
+    cursor.execute(f'ALTER TABLE "{table}" RENAME TO "{legacy}"')
+    cursor.execute(f'ALTER TABLE "{legacy}" RENAME CONSTRAINT "{primary_key}" TO "{legacy}_pkey"')
+    for name, _ in indexes:
+        cursor.execute(f'DROP INDEX "{name}"')
+
+    # The partition key has to be part of the primary key
+    cursor.execute(f'UPDATE "{legacy}" SET created_at = now() WHERE created_at IS NULL')
+    cursor.execute(f'CREATE TABLE "{table}" (LIKE "{legacy}" INCLUDING DEFAULTS) PARTITION BY RANGE (created_at)')
+    cursor.execute(f'ALTER TABLE "{table}" ADD CONSTRAINT "{table}_pkey" PRIMARY KEY (id, created_at)')
+    for _, definition in indexes:
+        cursor.execute(definition)
+    for name, definition in foreign_keys:
+        cursor.execute(f'ALTER TABLE "{table}" ADD CONSTRAINT "{name}" {definition}')
+    cursor.execute(f'CREATE TABLE "{table}_default" PARTITION OF "{table}" DEFAULT')
+
+    cursor.execute(f'SELECT min(created_at) FROM "{legacy}"')
+    oldest = cursor.fetchone()[0]
+    month = month_start(oldest or timezone.now())
+    last = add_months(month_start(timezone.now()), months_ahead)
+    while month <= last:
+        lower, upper = _bound(month), _bound(add_months(month, 1))
+        cursor.execute(
+            f"CREATE TABLE \"{partition_name(table, month)}\" PARTITION OF \"{table}\" "
+            f"FOR VALUES FROM ('{lower}') TO ('{upper}')"
+        )
+        month = add_months(month, 1)
+
+    cursor.execute(f'INSERT INTO "{table}" SELECT * FROM "{legacy}"')
+    cursor.execute(f'DROP TABLE "{legacy}"')
@@ -0,0 +1,220 @@
+"""
+Sampled per-request profiling for RequestProfilingMiddleware.
+
+A sampled request gets a RequestProfile that wraps the default database
+connection (query count, DB time, repeated statements) and the outermost
+DRF serializer .data access (serializer time). record() folds the result
+into per-endpoint counters in the cache, bucketed into windows of
+REQUEST_PROFILING_WINDOW seconds; endpoint_stats() reads the last few
+windows back. Workers only contribute to the same rolling histograms when
+the cache is shared (REDIS_URL). With the local memory cache each worker
+keeps its own counters, and the stats endpoint reports only the worker that
+served it. Unsampled requests pay for one random() call.
+"""
+import hashlib
+import re
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .cache import _incr
+
+# Upper bounds (ms) of the latency histogram buckets; the last one is open
+LATENCY_BUCKETS_MS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+PROFILE_KEY = "profiling:{window}:{endpoint}:{metric}"
+INDEX_KEY = "profiling:{window}:endpoints"
+SUM_METRICS = ("count", "total_us", "db_us", "queries", "serializer_us", "bytes", "repeated")
+
+_local = threading.local()
+
+_PLACEHOLDER_LIST = re.compile(r"\((?:\s*%s\s*,)+\s*%s\s*\)")
+_LITERAL = re.compile(r"'(?:[^']|'')*'|\b\d+\b")
+
+
+def fingerprint(sql):
+    """SQL with literals and IN-lists collapsed, so one statement per N+1 loop maps to one key."""
+    return _LITERAL.sub("?", _PLACEHOLDER_LIST.sub("(%s, ...)", sql)).strip()
+
+
+class RequestProfile:
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.serializer_time = 0.0
+        self.serializer_depth = 0
+        self.statements = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        # connection.execute_wrapper hook
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - started
+            self.queries += 1
+            key = fingerprint(sql)
+            self.statements[key] = self.statements.get(key, 0) + 1
+
+    def repeated(self):
+        """Statements run at least REQUEST_PROFILING_REPEAT_THRESHOLD times, most frequent first."""
+        threshold = settings.REQUEST_PROFILING_REPEAT_THRESHOLD
+        return sorted(
+            ((sql, n) for sql, n in self.statements.items() if n >= threshold), key=lambda item: -item[1]
+        )
+
+
+def current_profile():
+    return getattr(_local, "profile", None)
+
+
+def start_profile():
+    _local.profile = RequestProfile()
+    return _local.profile
+
+
+def stop_profile():
+    _local.profile = None
+
+
+def _timed_data(prop):
+    def data(self):
+        profile = current_profile()
+        if profile is None or profile.serializer_depth:
+            return prop.fget(self)
+        profile.serializer_depth += 1
+        started = time.perf_counter()
+        try:
+            return prop.fget(self)
+        finally:
+            profile.serializer_time += time.perf_counter() - started
+            profile.serializer_depth -= 1
+    return property(data)
+
+
+_installed = False
+
+
+def install_serializer_timing():
+    """Times the outermost Serializer/ListSerializer .data access of profiled requests."""
+    global _installed
+    if _installed:
+        return
+    from rest_framework import serializers
+
+    for cls in (serializers.BaseSerializer, serializers.Serializer, serializers.ListSerializer):
+        if "data" in cls.__dict__:
+            setattr(cls, "data", _timed_data(cls.__dict__["data"]))
+    _installed = True
+
+
+def _window(now=None):
+    return int((now or time.time()) // settings.REQUEST_PROFILING_WINDOW)
+
+
+def _endpoint_id(endpoint):
+    return hashlib.md5(endpoint.encode()).hexdigest()[:16]
+
+
+def record(endpoint, view, profile, total_seconds, size):
+    window = _window()
+    endpoint_id = _endpoint_id(endpoint)
+    ttl = settings.REQUEST_PROFILING_WINDOW * (settings.REQUEST_PROFILING_WINDOWS + 1)
+
+    index_key = INDEX_KEY.format(window=window)
+    index = cache.get(index_key) or {}
+    if endpoint_id not in index:
+        # get/set can lose a concurrent addition; the endpoint is re-added
+        # by its next sampled request
+        index[endpoint_id] = {"endpoint": endpoint, "view": view}
+        cache.set(index_key, index, ttl)
+
+    def key(metric):
+        return PROFILE_KEY.format(window=window, endpoint=endpoint_id, metric=metric)
+
+    total_ms = total_seconds * 1000
+    bucket = next((i for i, bound in enumerate(LATENCY_BUCKETS_MS) if total_ms <= bound), len(LATENCY_BUCKETS_MS))
+    repeated = profile.repeated()
+    increments = {
+        "count": 1,
+        "total_us": int(total_seconds * 1e6),
+        "db_us": int(profile.db_time * 1e6),
+        "queries": profile.queries,
+        "serializer_us": int(profile.serializer_time * 1e6),
+        "bytes": size,
+        "repeated": 1 if repeated else 0,
+        f"bucket{bucket}": 1,
+    }
+    for metric, delta in increments.items():
+        if delta:
+            cache.add(key(metric), 0, ttl)
+            _incr(key(metric), delta)
+    if repeated:
+        cache.set(key("top_repeated"), [[sql[:500], n] for sql, n in repeated[:5]], ttl)
+
+
+def _percentile(buckets, count, fraction):
+    target, seen = count * fraction, 0
+    for i, n in enumerate(buckets):
+        seen += n
+        if n and seen >= target:
+            return LATENCY_BUCKETS_MS[i] if i < len(LATENCY_BUCKETS_MS) else None
+    return None
+
+
+def endpoint_stats(windows=None):
+    """Per-endpoint aggregates over the last ``windows`` windows, slowest p95 first."""
+    windows = min(windows or settings.REQUEST_PROFILING_WINDOWS, settings.REQUEST_PROFILING_WINDOWS)
+    current = _window()
+    bucket_metrics = [f"bucket{i}" for i in range(len(LATENCY_BUCKETS_MS) + 1)]
+    totals = {}
+    for window in range(current - windows + 1, current + 1):
+        index = cache.get(INDEX_KEY.format(window=window)) or {}
+        if not index:
+            continue
+        keys = [
+            PROFILE_KEY.format(window=window, endpoint=endpoint_id, metric=metric)
+            for endpoint_id in index
+            for metric in SUM_METRICS + tuple(bucket_metrics) + ("top_repeated",)
+        ]
+        values = cache.get_many(keys)
+        for endpoint_id, meta in index.items():
+            entry = totals.setdefault(endpoint_id, {
+                **meta, **dict.fromkeys(SUM_METRICS, 0), "buckets": [0] * len(bucket_metrics), "top_repeated": [],
+            })
+            for metric in SUM_METRICS:
+                entry[metric] += values.get(PROFILE_KEY.format(window=window, endpoint=endpoint_id, metric=metric), 0)
+            for i, metric in enumerate(bucket_metrics):
+                entry["buckets"][i] += values.get(PROFILE_KEY.format(window=window, endpoint=endpoint_id, metric=metric), 0)
+            top = values.get(PROFILE_KEY.format(window=window, endpoint=endpoint_id, metric="top_repeated"))
+            if top:
+                entry["top_repeated"] = top
+
+    results = []
+    for entry in totals.values():
+        count = entry["count"]
+        if not count:
+            continue
+        results.append({
+            "endpoint": entry["endpoint"],
+            "view": entry["view"],
+            "sampled_requests": count,
+            "avg_ms": round(entry["total_us"] / count / 1000, 2),
+            "p50_ms_le": _percentile(entry["buckets"], count, 0.5),
+            "p95_ms_le": _percentile(entry["buckets"], count, 0.95),
+            "avg_db_ms": round(entry["db_us"] / count / 1000, 2),
+            "avg_queries": round(entry["queries"] / count, 1),
+            "avg_serializer_ms": round(entry["serializer_us"] / count / 1000, 2),
+            "avg_bytes": int(entry["bytes"] / count),
+            "repeated_query_rate": round(entry["repeated"] * 100 / count, 1),
+            "top_repeated_queries": entry["top_repeated"],
+            "histogram": dict(zip([f"le_{b}" for b in LATENCY_BUCKETS_MS] + ["gt_max"], entry["buckets"])),
+        })
+    results.sort(key=lambda r: (-(r["p95_ms_le"] or float("inf")), -r["avg_ms"]))
+    return {
+        "window_seconds": settings.REQUEST_PROFILING_WINDOW,
+        "windows": windows,
+        "sample_rate": settings.REQUEST_PROFILING_SAMPLE_RATE,
+        "endpoints": results,
+    }
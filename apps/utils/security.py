@@ -1,5 +1,5 @@
-from ..models import AuditLogs
 from django.utils import timezone
+from .audit import record_audit
 
 
 def log_action(
@@ -15,34 +15,20 @@ def log_action(
 ):
     """
     Utility function to log actions in the system.
+    Written through record_audit(), so it may be batched; see utils/audit.py.
     """
-
-    def prepare_json_data(data):
-        if data is None:
-            return None
-        import json
-        from django.core.serializers.json import DjangoJSONEncoder
-
-        # Use Django's encoder to handle UUIDs, Decimals, etc.
-        return json.loads(json.dumps(data, cls=DjangoJSONEncoder))
-
     # Protect Owner identity if God Mode is active
     if god_mode_active and admin:
-        user_email = admin.email
+        new_data = {**(new_data or {}), "performed_by_email": admin.email}
         admin = None  # Never link the log to the owner account
         action = f"[GOD MODE] {action}"
-        prepared_new_data = prepare_json_data(new_data) or {}
-        prepared_new_data["performed_by_email"] = user_email
-        new_data = prepared_new_data
-    else:
-        new_data = prepare_json_data(new_data)
 
-    AuditLogs.objects.create(
+    record_audit(
         admin=admin,
         action=action,
         table_name=table_name,
         record_id=record_id,
-        old_data=prepare_json_data(old_data),
+        old_data=old_data,
         new_data=new_data,
         log_type=log_type,
         ip_address=ip_address,
@@ -90,8 +76,7 @@ def get_filtered_queryset(user, queryset, branch_field='branch_fk', request=None
         filtered_qs = queryset  # Finance sees all branches
     else:
         # No valid role — log and deny
-        from ..models import AuditLogs
-        AuditLogs.objects.create(
+        record_audit(
             admin=user,
             action=f"SECURITY: User {user.email} attempted data access with no valid role",
             log_type="SECURITY",
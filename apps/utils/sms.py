@@ -1,6 +1,5 @@
 import requests
 import os
-import threading
 from django.conf import settings
 from .encryption import get_setting
 
@@ -147,8 +146,55 @@ def send_invite_email_sync(email, token, role, invited_by_name="System Admin", s
         return False, str(e)
 
 
+BREVO_URL = "https://api.brevo.com/v3/smtp/email"
+
+
+def send_brevo_email(payload, log=True, **log_fields):
+    """
+    Posts a Brevo transactional email and, unless ``log`` is False, records
+    it in EmailLog (``log_fields`` override the logged columns). Raises when
+    Brevo cannot be reached or rejects the email, so the job is retried.
+    """
+    headers = {
+        "accept": "application/json",
+        "api-key": os.getenv("BREVO_API_KEY"),
+        "content-type": "application/json",
+    }
+    error = None
+    try:
+        res = requests.post(BREVO_URL, json=payload, headers=headers, timeout=15)
+        if res.status_code not in [200, 201, 202]:
+            error = res.text
+    except requests.RequestException as e:
+        error = str(e)
+
+    if log:
+        from ..models import EmailLog
+        fields = {
+            "recipient_email": payload["to"][0]["email"],
+            "subject": payload["subject"],
+            "message": payload["htmlContent"],
+            "status": "FAILED" if error else "SENT",
+            "error_details": error,
+        }
+        fields.update(log_fields)
+        EmailLog.objects.create(**fields)
+    if error:
+        raise RuntimeError(f"Brevo rejected the email: {error}")
+
+
+def send_sms(recipients, message):
+    """Background job "sms.send"; raises on a provider error so it is retried."""
+    result = SMSHandler().send_sms(recipients, message)
+    if isinstance(result, dict) and result.get("status") == "error":
+        raise RuntimeError(result.get("message"))
+    return result
+
+
 def send_sms_async(recipients, message):
-    """Utility to send SMS in background so it doesn't slow down the request"""
-    handler = SMSHandler()
-    thread = threading.Thread(target=handler.send_sms, args=(recipients, message))
-    thread.start()
+    """Queues an SMS as a background job so it doesn't slow down the request"""
+    from .jobs import enqueue
+
+    if isinstance(recipients, str):
+        recipients = [recipients]
+    return enqueue("sms.send", {"recipients": list(recipients), "message": message})
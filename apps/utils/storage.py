@@ -0,0 +1,31 @@
+"""
+File storage for generated files that must not be publicly reachable.
+
+MEDIA_ROOT is served as-is by loan_system_project/urls.py, so owner exports
+live under EXPORT_ROOT instead and are only handed out by
+DataExportDownloadView.
+"""
+import os
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+
+@deconstructible
+class PrivateExportStorage(FileSystemStorage):
+    """FileSystemStorage rooted at settings.EXPORT_ROOT, without a public URL."""
+
+    # Read on every access so override_settings(EXPORT_ROOT=...) applies
+    @property
+    def base_location(self):
+        return settings.EXPORT_ROOT
+
+    @property
+    def location(self):
+        return os.path.abspath(self.base_location)
+
+    @property
+    def base_url(self):
+        # FileSystemStorage.url() raises ValueError when there is no base URL
+        return None
@@ -255,8 +255,12 @@ export const loanService = {
     const res = await api.post('/notifications/send-email/', data);
     return res.data;
   },
-  sendBulkSMS: async (data) => {
-    const res = await api.post('/loans/bulk-sms-defaulters/', data);
+  sendBulkSMS: async (type, message) => {
+    const res = await api.post('/loans/bulk-sms-defaulters/', { type, message });
+    return res.data;
+  },
+  getBulkSMSStatus: async (broadcastId) => {
+    const res = await api.get(`/loans/bulk-sms-defaulters/${broadcastId}/`);
     return res.data;
   },
   sendDirectSMS: async (data) => {
@@ -274,6 +278,19 @@ export const loanService = {
     });
     return res.data;
   },
+  // Large exports: queued as a background job, polled until download_url is set
+  startExport: async (data = {}) => {
+    const res = await api.post('/export/', data);
+    return res.data;
+  },
+  getExportStatus: async (exportId) => {
+    const res = await api.get(`/export/${exportId}/`);
+    return res.data;
+  },
+  downloadExport: async (exportId) => {
+    const res = await api.get(`/export/${exportId}/download/`, { responseType: 'blob' });
+    return res.data;
+  },
   // Mapping branch methods into loanService for backward compatibility with old components
   getBranches: branchService.getBranches,
   createBranch: branchService.createBranch,
@@ -1,10 +1,51 @@
-import React, { useState } from 'react';
+import React, { useEffect, useRef, useState } from 'react';
 import { Download, Loader2 } from 'lucide-react';
 import { loanService } from '../../api/api';
 import toast from 'react-hot-toast';
 
-const ExportButton = ({ resource, dateRange, filename }) => {
+// Too large to stream in one request: built as a background job and polled
+const BACKGROUND_RESOURCES = ['audit_logs', 'security_logs'];
+const POLL_INTERVAL_MS = 2000;
+
+const sleep = (ms) => new Promise((resolve) => setTimeout(resolve, ms));
+
+const saveBlob = (blob, name) => {
+  const url = window.URL.createObjectURL(new Blob([blob]));
+  const link = document.createElement('a');
+  link.href = url;
+  link.setAttribute('download', name);
+  document.body.appendChild(link);
+  link.click();
+  link.parentNode.removeChild(link);
+  window.URL.revokeObjectURL(url);
+};
+
+const ExportButton = ({ resource, dateRange, filename, background }) => {
   const [exporting, setExporting] = useState(false);
+  const [queued, setQueued] = useState(false);
+  const mounted = useRef(true);
+
+  useEffect(() => () => { mounted.current = false; }, []);
+
+  const defaultName = `${resource}_export_${new Date().toISOString().split('T')[0]}.csv`;
+
+  const runBackgroundExport = async (params) => {
+    const { export_id: exportId } = await loanService.startExport(params);
+    setQueued(true);
+    let job = await loanService.getExportStatus(exportId);
+    while (!['COMPLETED', 'FAILED'].includes(job.export_status)) {
+      await sleep(POLL_INTERVAL_MS);
+      // Stop polling once the page is left; the export stays available
+      if (!mounted.current) return false;
+      job = await loanService.getExportStatus(exportId);
+    }
+    if (job.export_status === 'FAILED') {
+      throw new Error(job.error || 'Export failed');
+    }
+    const blob = await loanService.downloadExport(exportId);
+    saveBlob(blob, `${filename || defaultName}.gz`);
+    return true;
+  };
 
   const handleExport = async () => {
     try {
@@ -15,22 +56,22 @@ const ExportButton = ({ resource, dateRange, filename }) => {
         date_to: dateRange?.to || undefined
       };
 
-      const blob = await loanService.exportData(params);
-      
-      const url = window.URL.createObjectURL(new Blob([blob]));
-      const link = document.createElement('a');
-      link.href = url;
-      link.setAttribute('download', filename || `${resource}_export_${new Date().toISOString().split('T')[0]}.csv`);
-      document.body.appendChild(link);
-      link.click();
-      link.parentNode.removeChild(link);
-      
+      if (background ?? BACKGROUND_RESOURCES.includes(resource)) {
+        if (!(await runBackgroundExport(params))) return;
+      } else {
+        const blob = await loanService.exportData(params);
+        saveBlob(blob, filename || defaultName);
+      }
+
       toast.success('Export completed successfully');
     } catch (error) {
       console.error('Export failed:', error);
       toast.error('Failed to export data');
     } finally {
-      setExporting(false);
+      if (mounted.current) {
+        setExporting(false);
+        setQueued(false);
+      }
     }
   };
 
@@ -45,7 +86,7 @@ const ExportButton = ({ resource, dateRange, filename }) => {
       ) : (
         <Download className="w-4 h-4" />
       )}
-      {exporting ? 'EXPORTING...' : 'EXPORT CSV'}
+      {exporting ? (queued ? 'PREPARING...' : 'EXPORTING...') : 'EXPORT CSV'}
     </button>
   );
 };
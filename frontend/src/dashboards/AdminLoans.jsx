@@ -293,11 +293,15 @@ const AdminLoans = () => {
     
     setLoading(true);
     try {
-      const response = await loanService.api.post('/payments/disburse/', { mode: 'bulk' });
-      const successCount = response.data.results?.filter(r => r.status === 'success').length || 0;
-      const failCount = (response.data.results?.length || 0) - successCount;
-      
-      alert(`Bulk Disbursement Complete!\nSuccessful: ${successCount}\nFailed: ${failCount}`);
+      const response = await loanService.api.post('/payments/disburse/', { mode: 'bulk', limit: 20 });
+      // The batch runs in the background; poll it until it finishes
+      let batch = response.data;
+      while (batch.status === 'PENDING' || batch.status === 'RUNNING') {
+        await new Promise(resolve => setTimeout(resolve, 2000));
+        batch = (await loanService.api.get(`/payments/disburse/batches/${response.data.batch_id}/`)).data;
+      }
+
+      alert(`Bulk Disbursement Complete!\nSuccessful: ${batch.succeeded}\nFailed: ${batch.failed}\nSkipped: ${batch.skipped}`);
       invalidateLoans();
     } catch (err) {
       alert("Bulk Disbursement Error: " + (err.response?.data?.error || err.message));
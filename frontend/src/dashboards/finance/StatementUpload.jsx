@@ -12,6 +12,7 @@ const StatementUpload = () => {
   const [loading, setLoading] = useState(false);
   const [message, setMessage] = useState(null);
   const [summary, setSummary] = useState(null);
+  const [progress, setProgress] = useState(0);
 
   const handleFileChange = (e) => {
     setFile(e.target.files[0]);
@@ -19,14 +20,29 @@ const StatementUpload = () => {
     setSummary(null);
   };
 
+  const pollImport = async (importId) => {
+    const headers = { 'Authorization': `Bearer ${localStorage.getItem('access_token')}` };
+    // Large statements are processed in the background; poll until done.
+    for (;;) {
+      const response = await fetch(`/api/repayments/statement-imports/${importId}/`, { headers });
+      const data = await response.json();
+      if (!response.ok) throw new Error(data.error || 'Could not load import status');
+      setProgress(data.progress);
+      if (data.status === 'COMPLETED' || data.status === 'FAILED') return data;
+      await new Promise((resolve) => setTimeout(resolve, 2000));
+    }
+  };
+
   const handleUpload = async (e) => {
     e.preventDefault();
     if (!file) return;
+    const form = e.target;
 
     setLoading(true);
     setMessage(null);
+    setProgress(0);
     const formData = new FormData();
-    formData.append('file', file);
+    formData.append('statement', file);
 
     try {
       const response = await fetch('/api/repayments/upload-statement/', {
@@ -38,18 +54,23 @@ const StatementUpload = () => {
       });
 
       const data = await response.json();
-      
+
       if (response.ok) {
-        setMessage({ type: 'success', text: 'Statement processed successfully!' });
-        setSummary(data);
+        const job = await pollImport(data.id);
+        if (job.status === 'COMPLETED') {
+          setMessage({ type: 'success', text: 'Statement processed successfully!' });
+        } else {
+          setMessage({ type: 'error', text: job.results.errors[job.results.errors.length - 1] || 'Import failed' });
+        }
+        setSummary(job.results);
         setFile(null);
         // Reset file input
-        e.target.reset();
+        form.reset();
       } else {
         setMessage({ type: 'error', text: data.error || 'Upload failed' });
       }
     } catch (err) {
-      setMessage({ type: 'error', text: 'Network error occurred' });
+      setMessage({ type: 'error', text: err.message || 'Network error occurred' });
     } finally {
       setLoading(false);
     }
@@ -103,7 +124,7 @@ const StatementUpload = () => {
               {loading ? (
                 <>
                   <RefreshCw className="h-5 w-5 mr-2 animate-spin" />
-                  Processing Statement...
+                  Processing Statement... {progress}%
                 </>
               ) : (
                 'Process Statement'
@@ -144,7 +165,7 @@ const StatementUpload = () => {
           </div>
           <div className="bg-white dark:bg-slate-900 p-4 rounded-xl border border-gray-100 shadow-sm">
             <p className="text-xs text-red-500 uppercase font-semibold">Duplicates/Errors</p>
-            <p className="text-2xl font-bold text-red-600">{summary.duplicates || 0}</p>
+            <p className="text-2xl font-bold text-red-600">{(summary.duplicates || 0) + (summary.error_count || 0)}</p>
           </div>
         </div>
       )}
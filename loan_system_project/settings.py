@@ -34,6 +34,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     "corsheaders.middleware.CorsMiddleware",
+    "apps.middleware.RequestProfilingMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "whitenoise.middleware.WhiteNoiseMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
@@ -92,6 +93,11 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = "loan_system_project.wsgi.application"
+# gunicorn worker processes (gunicorn reads the same variable; see Procfile)
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+
+# `manage.py test` runs jobs, M-Pesa callbacks and audit writes inline
+TEST_RUNNER = "loan_system_project.test_runner.TestRunner"
 
 DATABASES = {
     "default": dj_database_url.config(
@@ -196,3 +202,123 @@ SESSION_COOKIE_AGE = 600  # 10 minutes in seconds
 
 # Disbursement Mode
 DISBURSEMENT_MODE = os.getenv("DISBURSEMENT_MODE", "SIMULATION")
+# Bulk disbursement batches: concurrent B2C submissions, requests per second
+# across the batch, and the most loans one batch may take.
+DISBURSEMENT_BATCH_WORKERS = int(os.getenv("DISBURSEMENT_BATCH_WORKERS", "4"))
+DISBURSEMENT_BATCH_RATE = float(os.getenv("DISBURSEMENT_BATCH_RATE", "5"))
+DISBURSEMENT_BATCH_MAX_SIZE = int(os.getenv("DISBURSEMENT_BATCH_MAX_SIZE", "100"))
+
+# Bulk SMS broadcasts: recipients per Africa's Talking request (identical
+# texts only), concurrent requests, and requests per second.
+SMS_BROADCAST_BATCH_SIZE = int(os.getenv("SMS_BROADCAST_BATCH_SIZE", "500"))
+SMS_BROADCAST_WORKERS = int(os.getenv("SMS_BROADCAST_WORKERS", "4"))
+SMS_BROADCAST_RATE = float(os.getenv("SMS_BROADCAST_RATE", "5"))
+
+# M-Pesa callbacks are stored, acked, then applied by MpesaCallbackService:
+# "JOB" (an "mpesa.callback" background job, run and retried like every
+# other job), "WORKER" (only the process_mpesa_callbacks command) or
+# "INLINE" (within the request). "THREAD" is accepted as the old name of
+# "JOB".
+MPESA_CALLBACK_PROCESSING = os.getenv("MPESA_CALLBACK_PROCESSING", "JOB")
+MPESA_CALLBACK_WORKERS = int(os.getenv("MPESA_CALLBACK_WORKERS", "4"))
+MPESA_CALLBACK_MAX_ATTEMPTS = int(os.getenv("MPESA_CALLBACK_MAX_ATTEMPTS", "5"))
+
+# Background jobs (SMS, emails, broadcasts, exports, disbursement batches,
+# statement imports, M-Pesa callbacks) are stored in background_jobs and run by
+# apps.utils.jobs: "THREAD" (a bounded per-process pool after commit, with
+# the run_jobs command retrying failures), "WORKER" (only run_jobs) or
+# "INLINE" (within the caller).
+BACKGROUND_JOB_PROCESSING = os.getenv("BACKGROUND_JOB_PROCESSING", "THREAD")
+BACKGROUND_JOB_WORKERS = int(os.getenv("BACKGROUND_JOB_WORKERS", "4"))
+BACKGROUND_JOB_MAX_ATTEMPTS = int(os.getenv("BACKGROUND_JOB_MAX_ATTEMPTS", "5"))
+# Retry n waits BACKGROUND_JOB_RETRY_BACKOFF * 2**(n-1) seconds, capped
+BACKGROUND_JOB_RETRY_BACKOFF = float(os.getenv("BACKGROUND_JOB_RETRY_BACKOFF", "30"))
+BACKGROUND_JOB_MAX_BACKOFF = float(os.getenv("BACKGROUND_JOB_MAX_BACKOFF", "3600"))
+# RUNNING jobs locked longer than this are assumed orphaned by a dead process
+BACKGROUND_JOB_LOCK_TIMEOUT = int(os.getenv("BACKGROUND_JOB_LOCK_TIMEOUT", "600"))
+
+# Cache
+# Set REDIS_URL in production so the analytics response cache and the
+# generation counter that invalidates it are shared by every gunicorn worker.
+# The fallback local memory cache is per process: a write handled by one
+# worker leaves the others serving stale analytics for up to
+# ANALYTICS_CACHE_TIMEOUT, so AppsConfig.ready() warns when it is used with
+# WEB_CONCURRENCY > 1.
+if os.getenv("REDIS_URL"):
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": os.getenv("REDIS_URL"),
+        }
+    }
+
+# Analytics response cache (seconds). Entries are also invalidated as soon as
+# loans, repayments or the capital ledger change.
+ANALYTICS_CACHE_TIMEOUT = int(os.getenv("ANALYTICS_CACHE_TIMEOUT", "300"))
+
+# Owner exports: rows fetched per database round trip while streaming a CSV
+# or building a background export, and days a finished export file is kept.
+# Export files are written to EXPORT_ROOT, which must stay outside
+# MEDIA_ROOT: media/ is served publicly, exports only through their
+# owner-only download endpoint.
+EXPORT_ROOT = os.getenv("EXPORT_ROOT", os.path.join(BASE_DIR, "private", "exports"))
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", "2000"))
+EXPORT_RETENTION_DAYS = int(os.getenv("EXPORT_RETENTION_DAYS", "7"))
+
+# Unified search (/api/search/): rows per section by default and at most,
+# and the shortest query accepted (pg_trgm indexes need 3 characters).
+SEARCH_RESULT_LIMIT = int(os.getenv("SEARCH_RESULT_LIMIT", "10"))
+SEARCH_MAX_RESULT_LIMIT = int(os.getenv("SEARCH_MAX_RESULT_LIMIT", "50"))
+SEARCH_MIN_QUERY_LENGTH = int(os.getenv("SEARCH_MIN_QUERY_LENGTH", "3"))
+
+# Sampled request profiling (apps.middleware.RequestProfilingMiddleware).
+# Off by default; when on, REQUEST_PROFILING_SAMPLE_RATE of requests get a
+# Server-Timing header and feed per-endpoint histograms kept in the cache for
+# REQUEST_PROFILING_WINDOWS windows of REQUEST_PROFILING_WINDOW seconds. A
+# statement run REQUEST_PROFILING_REPEAT_THRESHOLD times in one request is
+# reported as a repeated (likely N+1) query.
+REQUEST_PROFILING = os.getenv("REQUEST_PROFILING", "False") == "True"
+REQUEST_PROFILING_SAMPLE_RATE = float(os.getenv("REQUEST_PROFILING_SAMPLE_RATE", "0.05"))
+REQUEST_PROFILING_WINDOW = int(os.getenv("REQUEST_PROFILING_WINDOW", "300"))
+REQUEST_PROFILING_WINDOWS = int(os.getenv("REQUEST_PROFILING_WINDOWS", "12"))
+REQUEST_PROFILING_REPEAT_THRESHOLD = int(os.getenv("REQUEST_PROFILING_REPEAT_THRESHOLD", "5"))
+
+# Authenticated admin and parsed maintenance state cached by
+# CustomJWTAuthentication (seconds). Admin saves and settings updates
+# invalidate them immediately; the TTL bounds anything missed.
+AUTH_CACHE_TIMEOUT = int(os.getenv("AUTH_CACHE_TIMEOUT", "60"))
+# Admin invalidation only reaches other workers through a shared cache, so
+# "auto" caches principals only when REDIS_URL is set; "true"/"false" force it.
+AUTH_CACHE_PRINCIPALS = os.getenv("AUTH_CACHE_PRINCIPALS", "auto")
+
+# Decrypted SecureSettings held per process (seconds); saving a setting
+# bumps a shared version so every process reloads straight away.
+SECURE_SETTINGS_CACHE_TIMEOUT = int(os.getenv("SECURE_SETTINGS_CACHE_TIMEOUT", "300"))
+
+# Daraja HTTP client. MPESA_BASE_URL overrides the sandbox/production URL
+# picked from mpesa_environment (e.g. to point at a local stub server).
+MPESA_BASE_URL = os.getenv("MPESA_BASE_URL", "")
+MPESA_CONNECT_TIMEOUT = float(os.getenv("MPESA_CONNECT_TIMEOUT", "5"))
+MPESA_READ_TIMEOUT = float(os.getenv("MPESA_READ_TIMEOUT", "30"))
+MPESA_MAX_RETRIES = int(os.getenv("MPESA_MAX_RETRIES", "3"))
+MPESA_RETRY_BACKOFF = float(os.getenv("MPESA_RETRY_BACKOFF", "0.5"))
+MPESA_POOL_SIZE = int(os.getenv("MPESA_POOL_SIZE", "10"))
+MPESA_TOKEN_REFRESH_MARGIN = int(os.getenv("MPESA_TOKEN_REFRESH_MARGIN", "60"))
+
+# Capital ledger: "LOCKED" updates the capital row on every movement;
+# "APPEND_ONLY" lets repayments only append ledger entries, folded into the
+# balance by `python manage.py compact_capital_ledger`.
+CAPITAL_LEDGER_MODE = os.getenv("CAPITAL_LEDGER_MODE", "LOCKED")
+
+# Audit log writes (see apps/utils/audit.py): "SYNC", "STRICT" (STATUS and
+# SECURITY entries inline, the rest batched) or "ASYNC".
+AUDIT_LOG_MODE = os.getenv("AUDIT_LOG_MODE", "STRICT")
+AUDIT_BATCH_SIZE = int(os.getenv("AUDIT_BATCH_SIZE", "200"))
+AUDIT_FLUSH_INTERVAL = float(os.getenv("AUDIT_FLUSH_INTERVAL", "2"))
+# Outbox for buffered entries that could not be inserted. Must be a
+# persistent disk (e.g. a Render disk mount) shared with the process that
+# runs replay_audit_outbox. Left empty, STATUS/SECURITY entries are always
+# written inline and a failed batch is kept in memory for the next flush.
+AUDIT_OUTBOX_DIR = os.getenv("AUDIT_OUTBOX_DIR", "")
+# Audit/SMS/email log retention, enforced by `python manage.py purge_old_logs`
+AUDIT_RETENTION_DAYS = int(os.getenv("AUDIT_RETENTION_DAYS", "90"))
@@ -0,0 +1,22 @@
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+# Run background work within the test's transaction; tests that exercise the
+# queued paths opt back in with override_settings
+TEST_SETTINGS = {
+    "BACKGROUND_JOB_PROCESSING": "INLINE",
+    "MPESA_CALLBACK_PROCESSING": "INLINE",
+    "AUDIT_LOG_MODE": "SYNC",
+    "AUDIT_OUTBOX_DIR": "",
+}
+
+
+class TestRunner(DiscoverRunner):
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.test_settings = override_settings(**TEST_SETTINGS)
+        self.test_settings.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.test_settings.disable()
+        super().teardown_test_environment(**kwargs)
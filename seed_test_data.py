@@ -2,31 +2,18 @@
 Run with: python seed_test_data.py
 Creates test accounts for simulation testing
 """
-import os, django, uuid, bcrypt
+import os, django
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'loan_system_project.settings')
 django.setup()
 
-from apps.models import Admins, Branch, SystemCapital
-from django.utils import timezone
-
-def hash_password(pw):
-    return bcrypt.hashpw(pw.encode(), bcrypt.gensalt()).decode()
+from apps.benchmarks.seed import ensure_branch, ensure_capital, ensure_staff
 
 # Ensure capital exists
-cap, _ = SystemCapital.objects.get_or_create(
-    name="Simulation Capital",
-    defaults={"id": uuid.uuid4(), "balance": 500000.00}
-)
-if cap.balance < 10000:
-    cap.balance = 500000.00
-    cap.save()
+cap = ensure_capital()
 print(f"✅ Capital: KES {cap.balance:,.2f}")
 
 # Ensure branch exists
-branch, _ = Branch.objects.get_or_create(
-    name="Kagio",
-    defaults={"is_active": True}
-)
+branch = ensure_branch("Kagio")
 print(f"✅ Branch: {branch.name}")
 
 # Create test accounts
@@ -37,19 +24,7 @@ test_accounts = [
     {"full_name": "Test Admin", "email": "admin@test.com", "role": "ADMIN"},
 ]
 
-for acc in test_accounts:
-    obj, created = Admins.objects.get_or_create(
-        email=acc["email"],
-        defaults={
-            "id": uuid.uuid4(),
-            "full_name": acc["full_name"],
-            "role": acc["role"],
-            "password_hash": hash_password("Test1234!"),
-            "is_verified": True,
-            "branch_fk": acc.get("branch_fk"),
-            "branch": branch.name if acc.get("branch_fk") else None,
-        }
-    )
+for acc, (obj, created) in zip(test_accounts, ensure_staff(test_accounts, "Test1234!")):
     status = "created" if created else "already exists"
     print(f"{'✅' if created else '⚠️'} {acc['role']} ({acc['email']}) — {status}")
 